@@ -1,7 +1,6 @@
 import os
 import logging
 from pathlib import Path
-import sys
 
 from flask import Flask, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
@@ -36,133 +35,225 @@ class Base(DeclarativeBase):
 # Initialize SQLAlchemy with the base class
 db = SQLAlchemy(model_class=Base)
 
-# Create Flask application
-app = Flask(__name__)
-
-# Configure application secret key
-app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
-
-# Configure database URI
-database_url = os.environ.get("DATABASE_URL", "sqlite:///evorouter.db")
-# Fix PostgreSQL connection string for SQLAlchemy if needed
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Configure JWT
-app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", app.secret_key)
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = 3600  # 1 hour
-jwt = JWTManager(app)
-
-# Initialize SQLAlchemy with the app
-db.init_app(app)
-
-# Initialize Login Manager
+# Estensioni condivise: i moduli importano "from app import db" senza creare l'applicazione
+jwt = JWTManager()
+
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "auth.login"
 login_manager.login_message = "Effettua l'accesso per visualizzare questa pagina."
 
-# Initialize CSRF protection
 csrf = CSRFProtect()
-csrf.init_app(app)
-
-# Import and register blueprints
-from routes.dashboard import dashboard_bp
-from routes.network import network_bp
-from routes.system import system_bp
-from routes.auth import auth_bp
-from routes.api import api_bp
-from routes.freeswitch import freeswitch_bp
-from routes.freeswitch_install import freeswitch_install_bp
-from routes.vpn import vpn
-from routes.upnp import upnp_bp
-from routes.firewall import firewall
-from routes.qos import qos
-from routes.payments import payments_bp
-from routes.speed_test import speed_test_bp
-
-app.register_blueprint(dashboard_bp, url_prefix='/dashboard')
-app.register_blueprint(network_bp, url_prefix='/network')
-app.register_blueprint(system_bp, url_prefix='/system')
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(api_bp, url_prefix='/api')
-app.register_blueprint(freeswitch_bp, url_prefix='/freeswitch')
-app.register_blueprint(freeswitch_install_bp, url_prefix='/freeswitch')
-app.register_blueprint(vpn, url_prefix='/vpn')
-app.register_blueprint(firewall, url_prefix='/firewall')
-app.register_blueprint(upnp_bp, url_prefix='/firewall/upnp')
-app.register_blueprint(qos, url_prefix='/qos')
-app.register_blueprint(payments_bp, url_prefix='/payments')
-app.register_blueprint(speed_test_bp, url_prefix='/speed-test')
-
-# Import user loader
-from models import User
+
+# Blueprint registrati da create_app: (modulo, attributo, prefisso URL).
+# I moduli vengono importati solo quando si crea l'applicazione; quelli usati di
+# rado (pagamenti, installazione FreeSWITCH, speed test) importano le loro
+# dipendenze pesanti al primo utilizzo.
+BLUEPRINTS = [
+    ("routes.dashboard", "dashboard_bp", "/dashboard"),
+    ("routes.network", "network_bp", "/network"),
+    ("routes.system", "system_bp", "/system"),
+    ("routes.auth", "auth_bp", "/auth"),
+    ("routes.api", "api_bp", "/api"),
+    ("routes.freeswitch", "freeswitch_bp", "/freeswitch"),
+    ("routes.freeswitch_install", "freeswitch_install_bp", "/freeswitch"),
+    ("routes.vpn", "vpn", "/vpn"),
+    ("routes.firewall", "firewall", "/firewall"),
+    ("routes.upnp", "upnp_bp", "/firewall/upnp"),
+    ("routes.qos", "qos", "/qos"),
+    ("routes.payments", "payments_bp", "/payments"),
+    ("routes.speed_test", "speed_test_bp", "/speed-test"),
+]
+
+def env_flag(name, default):
+    """Legge un flag booleano dall'ambiente ("1", "true", "yes")"""
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
 
 @login_manager.user_loader
 def load_user(user_id):
+    from models import User
     return db.session.get(User, int(user_id))
 
-# Create database tables with proper error handling
-try:
+def create_base_app(config=None):
+    """
+    Crea l'applicazione con configurazione ed estensioni, senza blueprint né job
+
+    Basta per lavorare sul database (inizializzazione dello schema, script di
+    amministrazione) senza importare le pagine.
+
+    Args:
+        config: Valori che sovrascrivono la configurazione predefinita
+
+    Returns:
+        Flask: Applicazione
+    """
+    app = Flask(__name__)
+
+    # Configure application secret key
+    app.secret_key = os.environ.get("SESSION_SECRET", "default_secret_key_for_development")
+
+    # Configure database URI
+    database_url = os.environ.get("DATABASE_URL", "sqlite:///evorouter.db")
+    # Fix PostgreSQL connection string for SQLAlchemy if needed
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Configure JWT
+    app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY", app.secret_key)
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = 3600  # 1 hour
+
+    # Creazione dello schema all'avvio (disattivata nei worker se l'ha già fatta il master gunicorn)
+    app.config["DB_INIT_ON_STARTUP"] = env_flag("DB_INIT_ON_STARTUP", "1")
+    app.config["START_BACKGROUND_JOBS"] = True
+
+    if config:
+        app.config.update(config)
+
+    # SQLite: niente pre-ping, timeout sui lock (i PRAGMA sono applicati dopo init_app)
+    from utils.database import engine_options, install_sqlite_pragmas
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                          engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+
+    # Initialize extensions with the app
+    jwt.init_app(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    csrf.init_app(app)
+
+    # WAL, synchronous=NORMAL, mmap, busy_timeout e cache su ogni connessione SQLite
     with app.app_context():
-        # Verifica che il percorso del database SQLite esista e sia scrivibile
-        if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite:///"):
-            import os
-            from urllib.parse import urlparse
-            
-            # Estrai il percorso dal URI
-            path = app.config["SQLALCHEMY_DATABASE_URI"].replace("sqlite:///", "")
-            
-            # Se è un percorso relativo, aggiungi il percorso dell'app
-            if not path.startswith("/"):
-                path = os.path.join(app.instance_path, path)
+        install_sqlite_pragmas(db.engine)
+
+    return app
+
+def create_app(config=None):
+    """
+    Crea l'applicazione completa: blueprint, profiler SQL e job in background
+
+    Lo schema del database viene creato qui solo se DB_INIT_ON_STARTUP è attivo;
+    altrimenti va inizializzato con "flask --app app init-db" o dall'hook
+    on_starting di gunicorn (gunicorn.conf.py).
+
+    Args:
+        config: Valori che sovrascrivono la configurazione predefinita
+
+    Returns:
+        Flask: Applicazione
+    """
+    app = create_base_app(config)
+
+    # Import and register blueprints
+    for module_name, attribute, url_prefix in BLUEPRINTS:
+        # __import__ (a differenza di importlib.import_module) compare in "python -X importtime"
+        blueprint = getattr(__import__(module_name, fromlist=[attribute]), attribute)
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
+
+    # Profilazione SQL per richiesta (opzionale, SQL_PROFILER=1)
+    from config import SQL_PROFILER_ENABLED
+    if SQL_PROFILER_ENABLED:
+        from utils.sql_profiler import SQLProfiler
+        with app.app_context():
+            SQLProfiler(app, db.engine)
+        logger.info("SQL profiler enabled")
+
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Crea le tabelle, applica le migrazioni e crea l'utente admin"""
+        init_database(app)
+
+    # Add a route for the root URL that redirects to the dashboard
+    @app.route('/')
+    def index():
+        return redirect(url_for('dashboard.index'))
+
+    if app.config["DB_INIT_ON_STARTUP"]:
+        init_database(app)
+
+    logger.info("Application initialized")
+
+    # Avvia il job di retention e il demone di acquisizione dei log del firewall
+    if app.config["START_BACKGROUND_JOBS"]:
+        from utils.firewall_log import start_log_retention
+        from utils.firewall_ingest import start_log_ingestion
+        start_log_retention(app)
+        start_log_ingestion(app)
+
+    return app
+
+def init_database(app):
+    """
+    Prepara il database: file SQLite, tabelle, migrazioni e utente admin predefinito
+
+    Gli errori vengono registrati ma non sollevati, per permettere l'esecuzione
+    dell'app (e il debugging) anche con un database non utilizzabile.
+    """
+    from models import User
+
+    try:
+        with app.app_context():
+            # Verifica che il percorso del database SQLite esista e sia scrivibile
+            if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite:///"):
+                # Estrai il percorso dal URI
+                path = app.config["SQLALCHEMY_DATABASE_URI"].replace("sqlite:///", "")
+                
+                # Se è un percorso relativo, aggiungi il percorso dell'app
+                if not path.startswith("/"):
+                    path = os.path.join(app.instance_path, path)
+                
+                # Assicurati che la directory esista
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                
+                # Verifica i permessi
+                dir_path = os.path.dirname(path)
+                if not os.access(dir_path, os.W_OK):
+                    logger.warning(f"La directory {dir_path} non è scrivibile! Tentativo di correzione...")
+                    os.chmod(dir_path, 0o777)
+                
+                # Tocca il file del database se non esiste
+                if not os.path.exists(path):
+                    logger.info(f"Creazione del file di database SQLite: {path}")
+                    with open(path, 'w'):
+                        pass
+                    os.chmod(path, 0o666)
             
-            # Assicurati che la directory esista
-            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Crea le tabelle
+            logger.info("Creazione delle tabelle del database...")
+            db.create_all()
             
-            # Verifica i permessi
-            dir_path = os.path.dirname(path)
-            if not os.access(dir_path, os.W_OK):
-                logger.warning(f"La directory {dir_path} non è scrivibile! Tentativo di correzione...")
-                os.chmod(dir_path, 0o777)
+            # create_all non aggiunge gli indici alle tabelle già esistenti
+            from utils.migrations import run_migrations
+            run_migrations(db.engine, db.metadata)
             
-            # Tocca il file del database se non esiste
-            if not os.path.exists(path):
-                logger.info(f"Creazione del file di database SQLite: {path}")
-                with open(path, 'w'):
-                    pass
-                os.chmod(path, 0o666)
-        
-        # Crea le tabelle
-        logger.info("Creazione delle tabelle del database...")
-        db.create_all()
-        
-        # Create default admin user if no users exist
-        if not User.query.first():
-            from werkzeug.security import generate_password_hash
-            default_admin = User(
-                username="admin",
-                email="admin@localhost",
-                password_hash=generate_password_hash("admin123"),
-                is_admin=True
-            )
-            db.session.add(default_admin)
-            db.session.commit()
-            logger.info("Created default admin user")
-except Exception as e:
-    logger.error(f"Errore durante l'inizializzazione del database: {str(e)}")
-    # Non solleviamo nuovamente l'eccezione qui per permettere l'esecuzione
-    # dell'app anche in caso di errore, per permettere il debugging
-
-logger.info("Application initialized")
-
-# Add a route for the root URL that redirects to the dashboard
-@app.route('/')
-def index():
-    return redirect(url_for('dashboard.index'))
+            # Create default admin user if no users exist
+            if not User.query.first():
+                from werkzeug.security import generate_password_hash
+                default_admin = User(
+                    username="admin",
+                    email="admin@localhost",
+                    password_hash=generate_password_hash("admin123"),
+                    is_admin=True
+                )
+                db.session.add(default_admin)
+                db.session.commit()
+                logger.info("Created default admin user")
+    except Exception as e:
+        logger.error(f"Errore durante l'inizializzazione del database: {str(e)}")
+        # Non solleviamo nuovamente l'eccezione qui per permettere l'esecuzione
+        # dell'app anche in caso di errore, per permettere il debugging
+
+_app = None
+
+def __getattr__(name):
+    """
+    "from app import app" crea l'applicazione al primo accesso
+
+    Importare il modulo (ad es. "from app import db" nei modelli) non importa
+    i blueprint e non tocca il database.
+    """
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -31,6 +31,10 @@ SYSTEM_LOG_PATH = "/var/log/bpir4"
 NETWORK_CONFIG_PATH = "/etc/network/interfaces.d"
 DHCP_CONFIG_PATH = "/etc/dhcp"
 DNS_CONFIG_PATH = "/etc/resolv.conf"
+DNSMASQ_CONFIG_PATH = "/etc/dnsmasq.d"
+DNSMASQ_SERVICE = "dnsmasq"
+DNS_UPSTREAM_PATH = "/etc/evorouter/resolv.upstream"  # Upstream servers, polled by dnsmasq
+PPPOE_PEERS_PATH = "/etc/ppp/peers"  # pppd options (and credentials) of the PPPoE connections
 
 # Web interface settings
 SESSION_TIMEOUT = 3600  # 1 hour
@@ -50,6 +54,61 @@ BANDWIDTH_HISTORY_DAYS = 7
 CPU_HISTORY_HOURS = 24
 TEMPERATURE_WARNING = 70  # Celsius
 TEMPERATURE_CRITICAL = 80  # Celsius
+METRICS_SAMPLE_INTERVAL = 2  # Seconds between background metric samples
+BANDWIDTH_HISTORY_PATH = "instance/bandwidth_history"
+BANDWIDTH_HISTORY_FLUSH_INTERVAL = 300  # Seconds between writes to disk
+BANDWIDTH_HISTORY_MAX_INTERFACES = 16
+STREAM_HEARTBEAT_INTERVAL = 15  # Seconds between SSE keep-alive comments
+WEB_WORKER_THREADS = 16  # Request threads per gunicorn worker (each open SSE stream holds one)
+FREESWITCH_STATUS_INTERVAL = 30  # Seconds between FreeSWITCH status checks in the dashboard stream
+INTERFACE_STATUS_INTERVAL = 4  # Seconds between interface state refreshes (sysfs + addresses)
+
+# Connected devices inventory
+DEVICE_INVENTORY_INTERVAL = 10  # Seconds between neighbour table refreshes
+DEVICE_INVENTORY_PUBLISH_INTERVAL = 60  # Republish unchanged devices at least this often (last_seen)
+DEVICE_FORGET_AFTER = 7 * 24 * 60 * 60  # Drop offline devices without a lease after this many seconds
+DHCP_LEASE_FILES = ["/var/lib/misc/dnsmasq.leases", "/var/lib/dhcp/dhcpd.leases"]  # dnsmasq or ISC, detected from the content
+DEVICE_ACCOUNTING_ENABLED = True  # Install the nftables per-host accounting table on first use
+DEVICE_TRAFFIC_INTERVAL = 5  # Seconds between per-device counter reads
+DEVICE_TRAFFIC_HISTORY = 3600  # Seconds of top-talker history kept in memory
+DEVICE_TOP_TALKERS = 10  # Devices kept per history sample
+DEVICE_ACCOUNTING_SET_SIZE = 4096  # Max hosts tracked per direction and address family
+DEVICE_ACCOUNTING_TIMEOUT = 3600  # Seconds before an idle host leaves the accounting sets
+
+# SQLite tuning (applied on every connection)
+SQLITE_JOURNAL_MODE = "WAL"  # Readers do not wait for the writer
+SQLITE_SYNCHRONOUS = "NORMAL"  # Safe with WAL; fsync only at checkpoints
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024  # Bytes of the database file read through mmap
+SQLITE_BUSY_TIMEOUT = 5000  # Milliseconds to wait for a lock before "database is locked"
+SQLITE_CACHE_SIZE = -16000  # Page cache size (negative: KiB, i.e. 16 MB)
+
+# SQL profiling (opt-in: set SQL_PROFILER=1 in the environment)
+SQL_PROFILER_ENABLED = os.environ.get("SQL_PROFILER", "0").lower() in ("1", "true", "yes")
+SQL_SLOW_QUERY_MS = 100  # Statements slower than this are written to the slow-query log
+SQL_SLOW_QUERY_LOG = "instance/slow_queries.log"
+SQL_PROFILER_TOP_STATEMENTS = 5  # Slowest statements kept per endpoint
+
+# Firewall settings
+FIREWALL_STATE_PATH = "instance/firewall_state.json"  # Last applied nftables ruleset
+FIREWALL_LOG_RETENTION_DAYS = 7  # Older log rows are rolled up into hourly aggregates
+FIREWALL_LOG_RETENTION_INTERVAL = 3600  # Seconds between retention runs
+FIREWALL_LOG_AGGREGATE_DAYS = 365  # Hourly aggregates older than this are deleted
+FIREWALL_LOG_RETENTION_LOCK = "instance/locks/firewall_log_retention.lock"  # Only its holder runs the retention
+FIREWALL_LOG_SOURCE = "/var/log/kern.log"  # Kernel log followed by the ingestion daemon
+FIREWALL_LOG_BATCH_SIZE = 500  # Distinct rows written per transaction
+FIREWALL_LOG_BATCH_INTERVAL = 1  # Seconds before a partial batch is written
+FIREWALL_LOG_INGESTION_LOCK = "instance/locks/firewall_log_ingestion.lock"  # Only its holder follows the log
+FIREWALL_LOG_LOCK_RETRY_INTERVAL = 10  # Seconds between attempts to take over the ingestion
+FIREWALL_COUNTERS_CACHE_TTL = 5  # Seconds between reads of the per-rule counters
+
+# QoS settings
+QOS_STATE_PATH = "instance/qos_state.json"  # Last applied tc batch, restored if a new one fails
+QOS_STATS_INTERVAL = 5  # Seconds between reads of the per-class tc counters
+QOS_STATS_HISTORY = 3600  # Seconds of per-class throughput kept for the QoS page chart
+QOS_CALIBRATION_TARGET_MS = 15  # Latency allowed under load on top of the idle latency
+QOS_CALIBRATION_STEPS = 6  # Bisection steps per direction (resolution: 1/128 of the capacity)
+QOS_CALIBRATION_MIN_FRACTION = 0.5  # Lowest shaper rate tried, as a fraction of the measured capacity
+QOS_CALIBRATION_PING_HOST = "8.8.8.8"  # Host pinged to measure latency
 
 # Default diagnostic tools
 DIAGNOSTIC_TOOLS = {
@@ -11,7 +11,7 @@ mkdir -p $TEMP_DIR
 
 # Copia i file necessari
 echo "Copiando i file essenziali..."
-cp -r app.py main.py models.py config.py create_admin.py reset_admin_password.py $TEMP_DIR/
+cp -r app.py main.py models.py config.py gunicorn.conf.py create_admin.py reset_admin_password.py $TEMP_DIR/
 cp -r routes/ forms/ utils/ static/ templates/ $TEMP_DIR/
 cp -r instance/ $TEMP_DIR/
 mkdir -p $TEMP_DIR/logs
@@ -64,7 +64,7 @@ pip install -r requirements.txt
 
 # Copia i file nell'ubicazione di installazione
 echo "Copiando i file nell'ubicazione di installazione..."
-cp -r app.py main.py models.py config.py create_admin.py $TEMP_DIR/
+cp -r app.py main.py models.py config.py gunicorn.conf.py create_admin.py $TEMP_DIR/
 cp -r routes/ forms/ utils/ static/ templates/ \$INSTALL_DIR/
 cp -r instance/ \$INSTALL_DIR/
 mkdir -p \$INSTALL_DIR/logs
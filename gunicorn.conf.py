@@ -0,0 +1,26 @@
+"""
+Configurazione di gunicorn (letta automaticamente dalla directory di lavoro)
+
+Lo schema del database viene preparato una sola volta nel processo master,
+prima di avviare i worker: ogni worker crea solo l'applicazione, senza
+create_all, migrazioni e controllo dell'utente admin.
+
+I worker sono a thread (gthread): uno stream SSE della dashboard o della QoS
+occupa un thread per tutta la durata della connessione, non un intero worker,
+e il timeout controlla solo il battito del worker, non la durata delle
+richieste. Le opzioni passate da riga di comando (--workers, --timeout)
+restano valide e si sommano a queste.
+"""
+import os
+
+from config import WEB_WORKER_THREADS
+
+worker_class = "gthread"
+threads = WEB_WORKER_THREADS
+
+def on_starting(server):
+    from app import create_base_app, init_database
+
+    init_database(create_base_app())
+    # I worker ereditano l'ambiente del master
+    os.environ["DB_INIT_ON_STARTUP"] = "0"
@@ -21,7 +21,7 @@ class NetworkConfig(db.Model):
     
     # IPv4 settings
     ipv4_enabled = db.Column(db.Boolean, default=True)
-    ipv4_mode = db.Column(db.String(8), default='dhcp')  # dhcp, static
+    ipv4_mode = db.Column(db.String(8), default='dhcp')  # dhcp, static, pppoe
     ipv4_address = db.Column(db.String(15))
     ipv4_subnet_mask = db.Column(db.String(15))
     ipv4_gateway = db.Column(db.String(15))
@@ -81,6 +81,11 @@ class UPnPPortMapping(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Ricerca del mapping per porta esterna e protocollo (sincronizzazione UPnP)
+    __table_args__ = (
+        db.Index('ix_upnp_port_mapping_external_port_protocol', 'external_port', 'protocol'),
+    )
+
     def __repr__(self):
         return f'<UPnPPortMapping {self.external_port}->{self.internal_client}:{self.internal_port} ({self.protocol})>'
 
@@ -151,6 +156,12 @@ class SystemLog(db.Model):
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Log per tipo in ordine cronologico e filtri per intervallo di tempo
+    __table_args__ = (
+        db.Index('ix_system_log_log_type_timestamp', 'log_type', 'timestamp'),
+        db.Index('ix_system_log_timestamp', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<SystemLog {self.id} {self.log_type}>'
 
@@ -268,6 +279,11 @@ class InboundRoute(db.Model):
     # Relazione opzionale al trunk
     trunk = db.relationship('SipTrunk')
     
+    # Instradamento della chiamata in ingresso per DID
+    __table_args__ = (
+        db.Index('ix_inbound_route_did_number', 'did_number'),
+    )
+    
     def __repr__(self):
         return f'<InboundRoute {self.name} ({self.did_number})>'
 
@@ -287,6 +303,11 @@ class OutboundRoute(db.Model):
     # Relazione al trunk
     trunk = db.relationship('SipTrunk')
     
+    # Rotte abilitate in ordine di priorità
+    __table_args__ = (
+        db.Index('ix_outbound_route_enabled_priority', 'enabled', 'priority'),
+    )
+    
     def __repr__(self):
         return f'<OutboundRoute {self.name} ({self.pattern}) -> Trunk {self.trunk_id}>'
 
@@ -307,6 +328,13 @@ class CallRecording(db.Model):
     # Relazione opzionale al trunk
     trunk = db.relationship('SipTrunk')
     
+    # Registrazioni per periodo e per numero chiamante/chiamato
+    __table_args__ = (
+        db.Index('ix_call_recording_start_time', 'start_time'),
+        db.Index('ix_call_recording_caller_start_time', 'caller', 'start_time'),
+        db.Index('ix_call_recording_callee_start_time', 'callee', 'start_time'),
+    )
+    
     def __repr__(self):
         return f'<CallRecording {self.call_id}>'
 
@@ -334,6 +362,12 @@ class VoicemailMessage(db.Model):
     # Relazione alla extension (con gestione sovrapposizioni)
     extension = db.relationship('SipExtension', overlaps="mailbox,voicemail_messages")
     
+    # Casella vocale di un interno (messaggi non ascoltati, in ordine di arrivo)
+    __table_args__ = (
+        db.Index('ix_voicemail_message_extension_id_listened_received_at',
+                 'extension_id', 'listened', 'received_at'),
+    )
+    
     def __repr__(self):
         return f'<VoicemailMessage {self.id} for {self.extension_id}>'
 
@@ -522,6 +556,11 @@ class QoSRule(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Regole di una classe in ordine di priorità
+    __table_args__ = (
+        db.Index('ix_qos_rule_class_id_priority', 'class_id', 'priority'),
+    )
+    
     def __repr__(self):
         return f'<QoSRule {self.name}>'
 
@@ -610,5 +649,36 @@ class FirewallLog(db.Model):
     packets = db.Column(db.Integer, default=1)
     bytes = db.Column(db.Integer, default=0)
     
+    # Indici per la paginazione keyset (timestamp, id) e per i filtri più usati
+    __table_args__ = (
+        db.Index('ix_firewall_log_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_firewall_log_source_ip_timestamp', 'source_ip', 'timestamp'),
+        db.Index('ix_firewall_log_destination_ip_timestamp', 'destination_ip', 'timestamp'),
+        db.Index('ix_firewall_log_destination_port_timestamp', 'destination_port', 'timestamp'),
+        db.Index('ix_firewall_log_action_timestamp', 'action', 'timestamp'),
+        db.Index('ix_firewall_log_rule_id_timestamp', 'rule_id', 'timestamp'),
+    )
+    
+    def __repr__(self):
+        return f'<FirewallLog {self.id}>'
+
+class FirewallLogHourly(db.Model):
+    """Aggregati orari dei log firewall oltre il periodo di retention"""
+    __tablename__ = 'firewall_log_hourly'
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)  # Inizio dell'ora
+    source_ip = db.Column(db.String(45))
+    destination_port = db.Column(db.Integer)
+    protocol = db.Column(db.String(8))
+    action = db.Column(db.String(16))
+    rule_id = db.Column(db.Integer)
+    events = db.Column(db.Integer, default=0)  # Numero di righe aggregate
+    packets = db.Column(db.Integer, default=0)
+    bytes = db.Column(db.Integer, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_firewall_log_hourly_hour', 'hour'),
+    )
+    
     def __repr__(self):
-        return f'<FirewallLog {self.id}>'
\ No newline at end of file
+        return f'<FirewallLogHourly {self.hour} {self.action}>'
@@ -6,7 +6,7 @@ from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identi
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 from models import User, ApiToken, NetworkConfig, PbxConfig, SipExtension, SipTrunk
-from utils.network import get_interfaces_status, configure_interface, restart_network
+from utils.network import get_interfaces_status, configure_interface
 from utils.system import get_system_stats, reboot_system
 from utils.freeswitch import get_extensions, add_extension, update_extension, delete_extension, check_freeswitch_status
 
@@ -120,9 +120,7 @@ def api_configure_interface(interface_name):
             dns_servers=data.get('dns_servers')
         )
         
-        if result:
-            # Apply network changes
-            restart_network()
+        if result["success"]:
             return jsonify({
                 "status": "success",
                 "message": f"Interface {interface_name} configured successfully"
@@ -1,8 +1,13 @@
 import logging
-from flask import Blueprint, render_template, jsonify
+import threading
+import time
+from flask import Blueprint, render_template, jsonify, request, Response
 from flask_login import login_required
+from config import DEFAULT_WAN_INTERFACE, FREESWITCH_STATUS_INTERVAL
 from utils.system import get_system_stats, get_network_usage
-from utils.network import get_interfaces_status
+from utils.network import get_interfaces_status, get_bandwidth_usage
+from utils.freeswitch import check_freeswitch_status
+from utils.streaming import get_broadcaster
 
 # Create logger
 logger = logging.getLogger(__name__)
@@ -10,6 +15,41 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# FreeSWITCH status is expensive (several subprocesses): it is refreshed slowly
+# on its own thread, so the sampler thread never waits for it
+_freeswitch_status = {'data': None}
+_freeswitch_thread = None
+_freeswitch_lock = threading.Lock()
+
+def _refresh_freeswitch_status():
+    """Refresh the FreeSWITCH status every FREESWITCH_STATUS_INTERVAL while the dashboard is streamed"""
+    while True:
+        if _freeswitch_status['data'] is None or _dashboard_broadcaster().subscriber_count:
+            try:
+                _freeswitch_status['data'] = check_freeswitch_status()
+            except Exception as e:
+                logger.error(f"Error checking FreeSWITCH status: {str(e)}")
+        time.sleep(FREESWITCH_STATUS_INTERVAL)
+
+def _start_freeswitch_refresh():
+    global _freeswitch_thread
+    with _freeswitch_lock:
+        if _freeswitch_thread is None:
+            _freeswitch_thread = threading.Thread(target=_refresh_freeswitch_status,
+                                                  name='freeswitch-status', daemon=True)
+            _freeswitch_thread.start()
+
+def _dashboard_snapshot():
+    """Build the snapshot pushed to /dashboard/stream subscribers"""
+    return {
+        'system': get_system_stats(),
+        'network': get_network_usage(),
+        'freeswitch': _freeswitch_status['data']
+    }
+
+def _dashboard_broadcaster():
+    return get_broadcaster('dashboard', _dashboard_snapshot)
+
 @dashboard_bp.route('/')
 @login_required
 def index():
@@ -38,20 +78,29 @@ def get_stats():
         logger.error(f"Error getting stats: {str(e)}")
         return jsonify({'error': 'Si è verificato un errore nel recupero delle statistiche'}), 500
 
+@dashboard_bp.route('/stream')
+@login_required
+def stream():
+    """Server-Sent Events stream with live system, network and FreeSWITCH stats"""
+    _start_freeswitch_refresh()
+    return Response(_dashboard_broadcaster().stream(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @dashboard_bp.route('/api/network_usage_history')
 @login_required
 def get_network_history():
     """API endpoint to get network usage history for charts"""
     try:
-        # This would normally retrieve historical data from a database or log files
-        # For now, we'll return example data for demonstration
+        period = request.args.get('period', '24h')
+        usage = get_bandwidth_usage(DEFAULT_WAN_INTERFACE, period)
+        if 'error' in usage:
+            raise ValueError(usage['error'])
+        
         data = {
-            'timestamps': ['00:00', '01:00', '02:00', '03:00', '04:00', '05:00', 
-                          '06:00', '07:00', '08:00', '09:00', '10:00', '11:00',
-                          '12:00', '13:00', '14:00', '15:00', '16:00', '17:00',
-                          '18:00', '19:00', '20:00', '21:00', '22:00', '23:00'],
-            'wan_download': [5, 7, 2, 3, 2, 1, 1, 3, 8, 12, 15, 14, 13, 14, 16, 17, 16, 14, 12, 10, 8, 6, 5, 4],
-            'wan_upload': [2, 3, 1, 1, 1, 0.5, 0.5, 1, 4, 6, 7, 6, 6, 7, 8, 8, 7, 6, 5, 4, 3, 2, 2, 1]
+            'timestamps': usage['timestamps'],
+            'wan_download': usage['download'],
+            'wan_upload': usage['upload']
         }
         return jsonify(data)
     except Exception as e:
@@ -5,22 +5,29 @@ import json
 import logging
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import desc
+from sqlalchemy import func, select
 
 from app import db
-from models import FirewallZone, FirewallRule, FirewallPortForwarding, FirewallIPSet, FirewallServiceGroup, FirewallLog
+from models import FirewallZone, FirewallRule, FirewallPortForwarding, FirewallIPSet, FirewallServiceGroup
 from forms.firewall import (FirewallZoneForm, FirewallRuleForm, FirewallPortForwardingForm, 
                           FirewallIPSetForm, FirewallServiceGroupForm)
-from utils.firewall import (get_firewall_status, get_active_connections, apply_zone_config, apply_rule, 
-                           apply_port_forwarding, get_firewall_rules, get_port_forwardings, 
-                           flush_all_rules, save_firewall_config, load_firewall_config,
-                           create_ipset, add_to_ipset)
+from utils.firewall import (get_firewall_status, apply_firewall_config, is_valid_ip,
+                           get_rule_counters, flush_all_rules, save_firewall_config, load_firewall_config)
+from utils.nftables import iter_json_strings, iter_lines
+from utils.conntrack import iter_connections, query_connections
+from utils.firewall_log import get_logs_page, log_to_dict
+from utils.firewall_analyzer import analyze_rules
 
 # Configurazione del logger
 logger = logging.getLogger(__name__)
 
 firewall = Blueprint('firewall', __name__)
 
+def reload_firewall():
+    """Applica l'intera configurazione del firewall e avvisa l'utente in caso di errore"""
+    if not apply_firewall_config():
+        flash('Configurazione salvata ma errore durante l\'applicazione del firewall.', 'warning')
+
 @firewall.route('/')
 @login_required
 def index():
@@ -32,14 +39,14 @@ def index():
         # Ottieni le zone di firewall
         zones = FirewallZone.query.all()
         
-        # Ottieni le statistiche di base
-        rules_count = FirewallRule.query.count()
-        forwards_count = FirewallPortForwarding.query.count()
-        ipsets_count = FirewallIPSet.query.count()
-        service_groups_count = FirewallServiceGroup.query.count()
+        # Ottieni le statistiche di base (tutti i conteggi in un'unica query)
+        rules_count, forwards_count, ipsets_count, service_groups_count = db.session.query(
+            *(select(func.count()).select_from(model).scalar_subquery()
+              for model in (FirewallRule, FirewallPortForwarding, FirewallIPSet, FirewallServiceGroup))
+        ).one()
         
-        # Ottieni le connessioni attive (limitato a 10 per performance)
-        active_connections = get_active_connections()[:10]
+        # Ottieni le 10 connessioni attive con più traffico (una sola passata sulla tabella)
+        active_connections = query_connections(iter_connections(), sort='bytes', limit=10)['connections']
         
         return render_template('firewall/index.html', 
                              firewall_status=firewall_status,
@@ -58,7 +65,10 @@ def index():
 def zones():
     """Gestione delle zone di firewall"""
     zones = FirewallZone.query.order_by(FirewallZone.priority).all()
-    return render_template('firewall/zones.html', zones=zones)
+    # Regole per zona con una sola query (GROUP BY)
+    rule_counts = dict(db.session.query(FirewallRule.zone_id, func.count(FirewallRule.id))
+                       .group_by(FirewallRule.zone_id).all())
+    return render_template('firewall/zones.html', zones=zones, rule_counts=rule_counts)
 
 @firewall.route('/zones/new', methods=['GET', 'POST'])
 @login_required
@@ -81,13 +91,7 @@ def new_zone():
             db.session.commit()
             
             # Applica la configurazione al firewall
-            interfaces = form.interfaces.data.split(',')
-            apply_zone_config(
-                zone.id, 
-                interfaces, 
-                form.default_policy.data, 
-                form.masquerade.data
-            )
+            reload_firewall()
             
             flash(f'Zona di firewall "{form.name.data}" creata con successo!', 'success')
             return redirect(url_for('firewall.zones'))
@@ -112,13 +116,7 @@ def edit_zone(zone_id):
             db.session.commit()
             
             # Applica la configurazione aggiornata
-            interfaces = form.interfaces.data.split(',')
-            apply_zone_config(
-                zone.id, 
-                interfaces, 
-                form.default_policy.data, 
-                form.masquerade.data
-            )
+            reload_firewall()
             
             flash(f'Zona di firewall "{zone.name}" aggiornata con successo!', 'success')
             return redirect(url_for('firewall.zones'))
@@ -145,6 +143,7 @@ def delete_zone(zone_id):
         # Rimuovi la zona
         db.session.delete(zone)
         db.session.commit()
+        reload_firewall()
         flash(f'Zona di firewall "{zone.name}" eliminata con successo!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -164,7 +163,83 @@ def rules():
     zones = FirewallZone.query.all()
     zones_dict = {zone.id: zone for zone in zones}
     
-    return render_template('firewall/rules.html', rules=rules, zones=zones_dict)
+    # Contatori per regola (letti al massimo ogni pochi secondi)
+    hits = get_rule_counters()
+    
+    return render_template('firewall/rules.html', rules=rules, zones=zones_dict, hits=hits)
+
+@firewall.route('/api/rules')
+@login_required
+def api_rules():
+    """API per ottenere le regole con contatori e tasso di hit (sort=hits per le più usate)"""
+    rules = FirewallRule.query.order_by(FirewallRule.zone_id, FirewallRule.priority).all()
+    hits = get_rule_counters()
+    
+    result = []
+    for rule in rules:
+        stats = hits.get(rule.id, {})
+        result.append({
+            'id': rule.id,
+            'zone_id': rule.zone_id,
+            'name': rule.name,
+            'priority': rule.priority,
+            'action': rule.action,
+            'enabled': rule.enabled,
+            'packets': stats.get('packets'),
+            'bytes': stats.get('bytes'),
+            'pps': stats.get('pps'),
+            'bps': stats.get('bps')
+        })
+    
+    if request.args.get('sort') == 'hits':
+        # Prima le regole con più pacchetti al secondo (o in totale alla prima lettura)
+        result.sort(key=lambda r: (r['pps'] or 0, r['packets'] or 0), reverse=True)
+    
+    return jsonify({'rules': result})
+
+def _analyze_rules(rules):
+    """Analizza le regole usando i contatori per l'ordinamento ottimizzato"""
+    return analyze_rules(rules, FirewallIPSet.query.all(), get_rule_counters())
+
+@firewall.route('/rules/analysis')
+@login_required
+def rules_analysis():
+    """Regole oscurate, ridondanti e accorpabili"""
+    rules = {rule.id: rule for rule in FirewallRule.query.all()}
+    zones = {zone.id: zone for zone in FirewallZone.query.all()}
+    analysis = _analyze_rules(rules.values())
+    
+    return render_template('firewall/rule_analysis.html', analysis=analysis, rules=rules,
+                           zones=zones, active_page='firewall')
+
+@firewall.route('/api/rules/analysis')
+@login_required
+def api_rules_analysis():
+    """API con il risultato dell'analisi delle regole"""
+    analysis = _analyze_rules(FirewallRule.query.all())
+    # Le chiavi JSON devono essere stringhe
+    analysis['order'] = {str(zone_id): order for zone_id, order in analysis['order'].items()}
+    return jsonify(analysis)
+
+@firewall.route('/rules/optimize', methods=['POST'])
+@login_required
+def optimize_rules():
+    """Riassegna le priorità secondo l'ordinamento ottimizzato (regole più usate per prime)"""
+    rules = {rule.id: rule for rule in FirewallRule.query.all()}
+    analysis = _analyze_rules(rules.values())
+    unused = {item['rule_id'] for item in analysis['shadowed'] + analysis['redundant']}
+    
+    for zone_id, order in analysis['order'].items():
+        # Le regole che non corrispondono mai vanno in fondo, dopo quella che le contiene
+        tail = [rule.id for rule in sorted(rules.values(), key=lambda r: (r.priority or 0, r.id))
+                if rule.zone_id == zone_id and rule.id in unused]
+        for position, rule_id in enumerate(order + tail, start=1):
+            rules[rule_id].priority = position * 10
+    
+    db.session.commit()
+    reload_firewall()
+    flash('Ordine delle regole ottimizzato.', 'success')
+    return redirect(url_for('firewall.rules_analysis'))
 
 @firewall.route('/rules/new', methods=['GET', 'POST'])
 @login_required
@@ -195,19 +270,8 @@ def new_rule():
             db.session.add(rule)
             db.session.commit()
             
-            # Applica la regola se è abilitata
-            if rule.enabled:
-                zone = FirewallZone.query.get(rule.zone_id)
-                apply_rule(
-                    rule.id, 
-                    zone.name, 
-                    rule.source, 
-                    rule.destination, 
-                    rule.protocol, 
-                    rule.src_port, 
-                    rule.dst_port, 
-                    rule.action
-                )
+            # Applica la configurazione aggiornata
+            reload_firewall()
             
             flash(f'Regola di firewall "{form.name.data}" creata con successo!', 'success')
             return redirect(url_for('firewall.rules'))
@@ -235,19 +299,8 @@ def edit_rule(rule_id):
             form.populate_obj(rule)
             db.session.commit()
             
-            # Applica la regola aggiornata se abilitata
-            if rule.enabled:
-                zone = FirewallZone.query.get(rule.zone_id)
-                apply_rule(
-                    rule.id, 
-                    zone.name, 
-                    rule.source, 
-                    rule.destination, 
-                    rule.protocol, 
-                    rule.src_port, 
-                    rule.dst_port, 
-                    rule.action
-                )
+            # Applica la configurazione aggiornata
+            reload_firewall()
             
             flash(f'Regola di firewall "{rule.name}" aggiornata con successo!', 'success')
             return redirect(url_for('firewall.rules'))
@@ -269,9 +322,8 @@ def delete_rule(rule_id):
         db.session.delete(rule)
         db.session.commit()
         
-        # Ricrea tutte le regole (semplificazione, in produzione potrebbe essere più efficiente)
-        # flush_all_rules()
-        # recreate_all_rules()
+        # Ricrea il ruleset senza la regola eliminata
+        reload_firewall()
         
         flash(f'Regola di firewall "{rule.name}" eliminata con successo!', 'success')
     except Exception as e:
@@ -311,16 +363,8 @@ def add_port_forwarding():
             db.session.add(forward)
             db.session.commit()
             
-            # Applica il port forwarding se abilitato
-            if forward.enabled:
-                apply_port_forwarding(
-                    forward.id,
-                    forward.source_zone,
-                    forward.protocol,
-                    forward.src_port,
-                    forward.dest_ip,
-                    forward.dest_port
-                )
+            # Applica la configurazione aggiornata
+            reload_firewall()
             
             flash(f'Port forwarding "{form.name.data}" creato con successo!', 'success')
             return redirect(url_for('firewall.port_forwarding'))
@@ -344,16 +388,8 @@ def edit_port_forwarding(forward_id):
             form.populate_obj(forward)
             db.session.commit()
             
-            # Applica il port forwarding aggiornato se abilitato
-            if forward.enabled:
-                apply_port_forwarding(
-                    forward.id,
-                    forward.source_zone,
-                    forward.protocol,
-                    forward.src_port,
-                    forward.dest_ip,
-                    forward.dest_port
-                )
+            # Applica la configurazione aggiornata
+            reload_firewall()
             
             flash(f'Port forwarding "{forward.name}" aggiornato con successo!', 'success')
             return redirect(url_for('firewall.port_forwarding'))
@@ -375,20 +411,11 @@ def toggle_port_forwarding(forward_id):
         forward.enabled = not forward.enabled
         db.session.commit()
         
+        reload_firewall()
+        
         if forward.enabled:
-            # Applica il port forwarding
-            apply_port_forwarding(
-                forward.id,
-                forward.source_zone,
-                forward.protocol,
-                forward.src_port,
-                forward.dest_ip,
-                forward.dest_port
-            )
             flash(f'Port forwarding "{forward.name}" attivato con successo!', 'success')
         else:
-            # Rimuovi il port forwarding
-            # delete_port_forwarding_rule(forward.id)
             flash(f'Port forwarding "{forward.name}" disattivato con successo!', 'warning')
     except Exception as e:
         db.session.rollback()
@@ -408,9 +435,8 @@ def delete_port_forwarding(forward_id):
         db.session.delete(forward)
         db.session.commit()
         
-        # Ricrea tutti i port forwarding (semplificazione)
-        # flush_all_rules()
-        # recreate_all_port_forwardings()
+        # Ricrea il ruleset senza il port forwarding eliminato
+        reload_firewall()
         
         flash(f'Port forwarding "{forward.name}" eliminato con successo!', 'success')
     except Exception as e:
@@ -436,7 +462,7 @@ def new_ipset():
     if form.validate_on_submit():
         try:
             # Verifica gli indirizzi
-            addresses_list = [addr.strip() for addr in form.addresses.data.split('\n') if addr.strip()]
+            addresses_list = list(iter_lines(form.addresses.data))
             
             ipset = FirewallIPSet(
                 name=form.name.data,
@@ -447,12 +473,8 @@ def new_ipset():
             db.session.add(ipset)
             db.session.commit()
             
-            # Crea l'ipset nel sistema
-            create_ipset(ipset.name, ipset.type)
-            
-            # Aggiungi gli indirizzi
-            for addr in addresses_list:
-                add_to_ipset(ipset.name, addr)
+            # Crea il set nel sistema
+            reload_firewall()
             
             flash(f'IP set "{form.name.data}" creato con successo!', 'success')
             return redirect(url_for('firewall.ipsets'))
@@ -470,8 +492,7 @@ def edit_ipset(ipset_id):
     ipset = FirewallIPSet.query.get_or_404(ipset_id)
     
     # Converti l'elenco JSON in stringa per il form
-    addresses_list = json.loads(ipset.addresses) if ipset.addresses else []
-    addresses_str = '\n'.join(addresses_list)
+    addresses_str = '\n'.join(iter_json_strings(ipset.addresses))
     
     form = FirewallIPSetForm(obj=ipset)
     form.addresses.data = addresses_str
@@ -484,16 +505,13 @@ def edit_ipset(ipset_id):
             ipset.type = form.type.data
             
             # Aggiorna gli indirizzi
-            addresses_list = [addr.strip() for addr in form.addresses.data.split('\n') if addr.strip()]
+            addresses_list = list(iter_lines(form.addresses.data))
             ipset.addresses = json.dumps(addresses_list)
             
             db.session.commit()
             
-            # Ricrea l'ipset nel sistema
-            # In una implementazione reale potrebbe essere più efficiente aggiornare incrementalmente
-            create_ipset(ipset.name, ipset.type)
-            for addr in addresses_list:
-                add_to_ipset(ipset.name, addr)
+            # Ricrea il set nel sistema
+            reload_firewall()
             
             flash(f'IP set "{ipset.name}" aggiornato con successo!', 'success')
             return redirect(url_for('firewall.ipsets'))
@@ -515,8 +533,8 @@ def delete_ipset(ipset_id):
         db.session.delete(ipset)
         db.session.commit()
         
-        # Rimuovi l'ipset dal sistema
-        # execute_command(["ipset", "destroy", ipset.name])
+        # Rimuovi il set dal sistema
+        reload_firewall()
         
         flash(f'IP set "{ipset.name}" eliminato con successo!', 'success')
     except Exception as e:
@@ -551,6 +569,7 @@ def new_service_group():
             )
             db.session.add(group)
             db.session.commit()
+            reload_firewall()
             
             flash(f'Gruppo di servizi "{form.name.data}" creato con successo!', 'success')
             return redirect(url_for('firewall.service_groups'))
@@ -585,6 +604,7 @@ def edit_service_group(group_id):
             group.services = json.dumps(services_list)
             
             db.session.commit()
+            reload_firewall()
             
             flash(f'Gruppo di servizi "{group.name}" aggiornato con successo!', 'success')
             return redirect(url_for('firewall.service_groups'))
@@ -605,6 +625,7 @@ def delete_service_group(group_id):
         # Rimuovi il gruppo
         db.session.delete(group)
         db.session.commit()
+        reload_firewall()
         
         flash(f'Gruppo di servizi "{group.name}" eliminato con successo!', 'success')
     except Exception as e:
@@ -614,47 +635,79 @@ def delete_service_group(group_id):
     
     return redirect(url_for('firewall.service_groups'))
 
+def _log_filters():
+    """Filtri dei log letti dalla query string"""
+    return {
+        'ip': request.args.get('ip') or None,
+        'port': request.args.get('port', type=int),
+        'action': request.args.get('action') or None,
+        'rule_id': request.args.get('rule_id', type=int)
+    }
+
 @firewall.route('/logs')
 @login_required
 def logs():
     """Visualizza i log del firewall"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 100, type=int)
+    filters = _log_filters()
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 500)
     
-    logs_query = FirewallLog.query.order_by(desc(FirewallLog.timestamp))
-    logs_pagination = logs_query.paginate(page=page, per_page=per_page)
+    try:
+        page = get_logs_page(before=request.args.get('before'), limit=per_page, **filters)
+    except ValueError:
+        flash('Cursore di paginazione non valido.', 'warning')
+        page = get_logs_page(limit=per_page, **filters)
     
-    return render_template('firewall/logs.html', logs=logs_pagination)
+    return render_template('firewall/logs.html', logs=page['logs'],
+                           next_cursor=page['next_cursor'], filters=filters)
 
 @firewall.route('/api/logs')
 @login_required
 def api_logs():
     """API per ottenere i log del firewall (per aggiornamenti AJAX)"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 100, type=int)
-    
-    logs_query = FirewallLog.query.order_by(desc(FirewallLog.timestamp))
-    logs_pagination = logs_query.paginate(page=page, per_page=per_page)
-    
-    logs_data = [{
-        'id': log.id,
-        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        'source_ip': log.source_ip,
-        'destination_ip': log.destination_ip,
-        'source_port': log.source_port,
-        'destination_port': log.destination_port,
-        'protocol': log.protocol,
-        'action': log.action,
-        'interface': log.interface,
-        'packets': log.packets,
-        'bytes': log.bytes
-    } for log in logs_pagination.items]
+    filters = _log_filters()
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 500)
+    
+    try:
+        page = get_logs_page(before=request.args.get('before'), limit=per_page, **filters)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    return jsonify({
+        'logs': [log_to_dict(log) for log in page['logs']],
+        'next_cursor': page['next_cursor']
+    })
+
+@firewall.route('/api/connections')
+@login_required
+def api_connections():
+    """API per ottenere le connessioni attive, filtrate e paginate"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    sort = request.args.get('sort')
+    address = request.args.get('address', '').strip() or None
+    if address and not is_valid_ip(address):
+        return jsonify({'error': 'Invalid address'}), 400
+    
+    try:
+        result = query_connections(
+            iter_connections(),
+            protocol=request.args.get('protocol'),
+            address=address,
+            port=request.args.get('port', type=int),
+            state=request.args.get('state'),
+            sort='bytes' if sort == 'bytes' else None,
+            offset=(page - 1) * per_page,
+            limit=per_page
+        )
+    except Exception as e:
+        logger.error(f"Error reading active connections: {str(e)}")
+        return jsonify({'error': str(e)}), 500
     
     return jsonify({
-        'logs': logs_data,
-        'total': logs_pagination.total,
-        'pages': logs_pagination.pages,
-        'current_page': logs_pagination.page
+        'connections': [conn._asdict() for conn in result['connections']],
+        'total': result['total'],
+        'pages': (result['total'] + per_page - 1) // per_page,
+        'current_page': page
     })
 
 @firewall.route('/save-config', methods=['POST'])
@@ -59,10 +59,9 @@ def configure_interface_route(interface_name):
                 pppoe_service_name=form.pppoe_service_name.data if form.ip_mode.data == 'pppoe' else None
             )
             
-            if result:
+            if result["success"]:
+                # Changes are already applied, to this interface only
                 flash(f"Configurazione dell'interfaccia {interface_name} aggiornata con successo.", "success")
-                # Apply network changes
-                restart_network()
                 return redirect(url_for('network.index'))
             else:
                 flash(f"Errore nell'aggiornamento della configurazione per {interface_name}.", "danger")
@@ -110,10 +109,8 @@ def dhcp_config():
                 lease_time=form.lease_time.data
             )
             
-            if result:
+            if result["success"]:
                 flash("Configurazione DHCP aggiornata con successo.", "success")
-                # Apply DHCP changes
-                restart_network()
                 return redirect(url_for('network.index'))
             else:
                 flash("Errore nell'aggiornamento della configurazione DHCP.", "danger")
@@ -157,7 +154,7 @@ def dns_config():
                 secondary_dns=form.secondary_dns.data
             )
             
-            if result:
+            if result["success"]:
                 flash("Configurazione DNS aggiornata con successo.", "success")
                 return redirect(url_for('network.index'))
             else:
@@ -221,9 +218,7 @@ def wizard():
                 lease_time=int(wizard_data.get('dhcp_lease', '24'))
             )
             
-            if wan_result and lan_result and dhcp_result:
-                # Apply all network changes
-                restart_network()
+            if wan_result["success"] and lan_result["success"] and dhcp_result["success"]:
                 flash("Configurazione di rete completata con successo!", "success")
                 return redirect(url_for('network.index'))
             else:
@@ -242,7 +237,7 @@ def restart_network_service():
     """Restart networking services"""
     try:
         result = restart_network()
-        if result:
+        if result["success"]:
             return jsonify({'success': True, 'message': 'Servizi di rete riavviati con successo.'})
         else:
             return jsonify({'success': False, 'message': 'Errore nel riavvio dei servizi di rete.'}), 500
@@ -1,5 +1,4 @@
 import os
-import stripe
 from flask import Blueprint, jsonify, request, redirect, url_for, flash, render_template
 from flask_login import current_user, login_required
 
@@ -7,7 +6,11 @@ from flask_login import current_user, login_required
 payments_bp = Blueprint('payments', __name__, url_prefix='/payments')
 
 # Initialize Stripe (solo per dimostrazione)
-stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+def get_stripe():
+    """Importa e configura Stripe al primo uso: il modulo è pesante e serve solo ai pagamenti"""
+    import stripe
+    stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+    return stripe
 
 # Ottieni il dominio per la redirezione
 def get_domain():
@@ -30,10 +33,11 @@ def create_checkout_session():
     Questa funzione non viene mai utilizzata nel sistema reale
     """
     # Verifica se Stripe è configurato
-    if not stripe.api_key:
+    if not os.environ.get('STRIPE_SECRET_KEY'):
         return jsonify({
             'error': 'Stripe non è configurato. Questa è solo una dimostrazione.'
         }), 400
+    stripe = get_stripe()
 
     try:
         # Ottenere il dominio per la redirezione
@@ -96,6 +100,7 @@ def webhook():
     if not webhook_secret:
         return jsonify({'status': 'success', 'message': 'Dimostrazione webhook'})
     
+    stripe = get_stripe()
     try:
         event = None
         payload = request.data
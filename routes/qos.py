@@ -3,23 +3,41 @@ Routes per la gestione del Quality of Service (QoS).
 """
 import json
 import logging
+import threading
+from datetime import datetime
 from typing import List, Dict, Any, Optional
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import desc
+from sqlalchemy import desc, func
+from sqlalchemy.orm import joinedload
 
 from app import db
 from models import QoSConfig, QoSClass, QoSRule, NetworkConfig
 from forms.qos import QoSConfigForm, QoSClassForm, QoSRuleForm
-from utils.qos import (setup_qos, add_qos_class, add_qos_rule, remove_qos_rule,
-                     remove_qos_class, disable_qos, get_qos_status, get_bandwidth_usage,
-                     get_interfaces, apply_all_qos_rules)
+from utils.qos import (apply_qos_config, disable_qos, teardown_interface, get_qos_status, get_bandwidth_usage,
+                     get_bandwidth_history, get_interfaces, apply_all_qos_rules, watch_qos_config)
+from utils.qos_calibration import SpeedTestProbe, calibrate
+from utils.streaming import get_broadcaster
 
 # Configurazione del logger
 logger = logging.getLogger(__name__)
 
 qos = Blueprint('qos', __name__)
 
+def get_rule_counts(config_id: int) -> Dict[int, int]:
+    """Numero di regole per classe di una configurazione, con una sola query (GROUP BY)"""
+    return dict(db.session.query(QoSRule.class_id, func.count(QoSRule.id))
+                .join(QoSClass).filter(QoSClass.config_id == config_id)
+                .group_by(QoSRule.class_id).all())
+
+def get_rule_or_404(rule_id: int) -> QoSRule:
+    """Regola QoS con classe e configurazione caricate nella stessa query"""
+    return QoSRule.query.options(
+        joinedload(QoSRule.traffic_class).joinedload(QoSClass.config)).get_or_404(rule_id)
+
+# Calibrazioni della banda in corso e loro stato
+active_calibrations = {}
+
 @qos.route('/')
 @login_required
 def index():
@@ -82,7 +100,7 @@ def index():
     
     # Ottenere tutte le classi e regole
     classes = QoSClass.query.filter_by(config_id=qos_config.id).order_by(QoSClass.priority).all()
-    class_counts = {c.id: QoSRule.query.filter_by(class_id=c.id).count() for c in classes}
+    class_counts = get_rule_counts(qos_config.id)
     
     # Ottenere lo stato attuale
     qos_status = get_qos_status(qos_config.id) if qos_config.enabled else None
@@ -127,20 +145,15 @@ def config():
             
             db.session.commit()
             
-            # Se il QoS è stato abilitato o è cambiata l'interfaccia, configurare il sistema
-            if qos_config.enabled and (not old_enabled or old_interface != qos_config.interface):
-                success = setup_qos(
-                    qos_config.id,
-                    qos_config.interface,
-                    qos_config.download_bandwidth,
-                    qos_config.upload_bandwidth,
-                    qos_config.default_class,
-                    qos_config.hierarchical
-                )
+            # Se l'interfaccia è cambiata, la vecchia perde shaping, redirect in ingresso e IFB
+            if old_enabled and old_interface != qos_config.interface:
+                teardown_interface(old_interface)
+            
+            # Se il QoS è abilitato, riapplicare la configurazione (bande e classi possono essere cambiate)
+            if qos_config.enabled:
+                success = apply_qos_config(qos_config)
                 
                 if success:
-                    # Applicare tutte le regole
-                    apply_all_qos_rules()
                     flash("Configurazione QoS salvata e applicata con successo!", "success")
                 else:
                     flash("Configurazione QoS salvata ma errore durante l'applicazione.", "warning")
@@ -176,7 +189,7 @@ def classes():
     qos_classes = QoSClass.query.filter_by(config_id=qos_config.id).order_by(QoSClass.priority).all()
     
     # Contare le regole per ogni classe
-    class_counts = {c.id: QoSRule.query.filter_by(class_id=c.id).count() for c in qos_classes}
+    class_counts = get_rule_counts(qos_config.id)
     
     return render_template('qos/classes.html', 
                           qos_config=qos_config,
@@ -211,14 +224,7 @@ def new_class():
             
             # Se il QoS è abilitato, applicare la classe
             if qos_config.enabled:
-                success = add_qos_class(
-                    qos_config.id,
-                    qos_class.id,
-                    qos_class.name,
-                    qos_class.priority,
-                    qos_class.min_bandwidth,
-                    qos_class.max_bandwidth
-                )
+                success = apply_qos_config(qos_config)
                 
                 if success:
                     flash(f"Classe '{qos_class.name}' creata e applicata con successo!", "success")
@@ -239,8 +245,8 @@ def new_class():
 @login_required
 def edit_class(class_id):
     """Modifica di una classe di traffico QoS"""
-    qos_class = QoSClass.query.get_or_404(class_id)
-    qos_config = QoSConfig.query.get(qos_class.config_id)
+    qos_class = QoSClass.query.options(joinedload(QoSClass.config)).get_or_404(class_id)
+    qos_config = qos_class.config
     
     form = QoSClassForm(obj=qos_class)
     
@@ -257,16 +263,7 @@ def edit_class(class_id):
             
             # Se il QoS è abilitato, aggiornare la classe
             if qos_config.enabled:
-                # Rimuovere e ricreare la classe
-                remove_qos_class(qos_class.id)
-                success = add_qos_class(
-                    qos_config.id,
-                    qos_class.id,
-                    qos_class.name,
-                    qos_class.priority,
-                    qos_class.min_bandwidth,
-                    qos_class.max_bandwidth
-                )
+                success = apply_qos_config(qos_config)
                 
                 if success:
                     flash(f"Classe '{qos_class.name}' aggiornata e applicata con successo!", "success")
@@ -288,8 +285,8 @@ def edit_class(class_id):
 @login_required
 def delete_class(class_id):
     """Eliminazione di una classe di traffico QoS"""
-    qos_class = QoSClass.query.get_or_404(class_id)
-    qos_config = QoSConfig.query.get(qos_class.config_id)
+    qos_class = QoSClass.query.options(joinedload(QoSClass.config)).get_or_404(class_id)
+    qos_config = qos_class.config
     
     try:
         # Controllo se è la classe predefinita
@@ -297,15 +294,15 @@ def delete_class(class_id):
             flash("Non è possibile eliminare la classe predefinita.", "danger")
             return redirect(url_for('qos.classes'))
         
-        # Se il QoS è abilitato, rimuovere la classe
-        if qos_config.enabled:
-            remove_qos_class(qos_class.id)
-        
         # Eliminare la classe
         class_name = qos_class.name
         db.session.delete(qos_class)
         db.session.commit()
         
+        # Se il QoS è abilitato, riapplicare la configurazione senza la classe
+        if qos_config.enabled and not apply_qos_config(qos_config):
+            flash("Errore durante l'applicazione della configurazione QoS.", "warning")
+        
         flash(f"Classe '{class_name}' eliminata con successo!", "success")
     except Exception as e:
         db.session.rollback()
@@ -374,17 +371,7 @@ def new_rule():
             
             # Se il QoS è abilitato e la regola è abilitata, applicare la regola
             if qos_config.enabled and rule.enabled:
-                success = add_qos_rule(
-                    rule.id,
-                    rule.class_id,
-                    rule.source,
-                    rule.destination,
-                    rule.protocol,
-                    rule.src_port,
-                    rule.dst_port,
-                    rule.dscp,
-                    rule.direction
-                )
+                success = apply_qos_config(qos_config)
                 
                 if success:
                     flash(f"Regola '{rule.name}' creata e applicata con successo!", "success")
@@ -405,9 +392,9 @@ def new_rule():
 @login_required
 def edit_rule(rule_id):
     """Modifica di una regola QoS"""
-    rule = QoSRule.query.get_or_404(rule_id)
-    qos_class = QoSClass.query.get(rule.class_id)
-    qos_config = QoSConfig.query.get(qos_class.config_id)
+    rule = get_rule_or_404(rule_id)
+    qos_class = rule.traffic_class
+    qos_config = qos_class.config
     
     form = QoSRuleForm(obj=rule)
     
@@ -418,8 +405,6 @@ def edit_rule(rule_id):
     if form.validate_on_submit():
         try:
             # Aggiornamento della regola
-            old_enabled = rule.enabled
-            
             rule.class_id = form.class_id.data
             rule.name = form.name.data
             rule.description = form.description.data
@@ -437,30 +422,17 @@ def edit_rule(rule_id):
             
             # Se il QoS è abilitato, aggiornare la regola
             if qos_config.enabled:
-                # Se la regola era abilitata, rimuoverla
-                if old_enabled:
-                    remove_qos_rule(rule.id)
+                success = apply_qos_config(qos_config)
                 
-                # Se la regola è abilitata, applicarla
                 if rule.enabled:
-                    success = add_qos_rule(
-                        rule.id,
-                        rule.class_id,
-                        rule.source,
-                        rule.destination,
-                        rule.protocol,
-                        rule.src_port,
-                        rule.dst_port,
-                        rule.dscp,
-                        rule.direction
-                    )
-                    
                     if success:
                         flash(f"Regola '{rule.name}' aggiornata e applicata con successo!", "success")
                     else:
                         flash(f"Regola '{rule.name}' aggiornata ma errore durante l'applicazione.", "warning")
-                else:
+                elif success:
                     flash(f"Regola '{rule.name}' aggiornata e disabilitata con successo!", "success")
+                else:
+                    flash(f"Regola '{rule.name}' aggiornata ma errore durante l'applicazione.", "warning")
             else:
                 flash(f"Regola '{rule.name}' aggiornata con successo! Abilitare il QoS per applicarla.", "success")
             
@@ -477,20 +449,21 @@ def edit_rule(rule_id):
 @login_required
 def delete_rule(rule_id):
     """Eliminazione di una regola QoS"""
-    rule = QoSRule.query.get_or_404(rule_id)
-    qos_class = QoSClass.query.get(rule.class_id)
-    qos_config = QoSConfig.query.get(qos_class.config_id)
+    rule = get_rule_or_404(rule_id)
+    qos_class = rule.traffic_class
+    qos_config = qos_class.config
     
     try:
-        # Se il QoS è abilitato e la regola è abilitata, rimuovere la regola
-        if qos_config.enabled and rule.enabled:
-            remove_qos_rule(rule.id)
-        
         # Eliminare la regola
         rule_name = rule.name
+        rule_enabled = rule.enabled
         db.session.delete(rule)
         db.session.commit()
         
+        # Se il QoS è abilitato e la regola era attiva, riapplicare la configurazione
+        if qos_config.enabled and rule_enabled and not apply_qos_config(qos_config):
+            flash("Errore durante l'applicazione della configurazione QoS.", "warning")
+        
         flash(f"Regola '{rule_name}' eliminata con successo!", "success")
     except Exception as e:
         db.session.rollback()
@@ -503,9 +476,9 @@ def delete_rule(rule_id):
 @login_required
 def toggle_rule(rule_id):
     """Attivazione/disattivazione di una regola QoS"""
-    rule = QoSRule.query.get_or_404(rule_id)
-    qos_class = QoSClass.query.get(rule.class_id)
-    qos_config = QoSConfig.query.get(qos_class.config_id)
+    rule = get_rule_or_404(rule_id)
+    qos_class = rule.traffic_class
+    qos_config = qos_class.config
     
     try:
         # Cambiare lo stato della regola
@@ -515,24 +488,14 @@ def toggle_rule(rule_id):
         # Se il QoS è abilitato, applicare o rimuovere la regola
         if qos_config.enabled:
             if rule.enabled:
-                success = add_qos_rule(
-                    rule.id,
-                    rule.class_id,
-                    rule.source,
-                    rule.destination,
-                    rule.protocol,
-                    rule.src_port,
-                    rule.dst_port,
-                    rule.dscp,
-                    rule.direction
-                )
+                success = apply_qos_config(qos_config)
                 
                 if success:
                     flash(f"Regola '{rule.name}' attivata con successo!", "success")
                 else:
                     flash(f"Errore durante l'attivazione della regola '{rule.name}'.", "warning")
             else:
-                success = remove_qos_rule(rule.id)
+                success = apply_qos_config(qos_config)
                 
                 if success:
                     flash(f"Regola '{rule.name}' disattivata con successo!", "success")
@@ -585,8 +548,113 @@ def api_stats():
         return jsonify({"error": "QoS not enabled"}), 400
     
     try:
+        watch_qos_config(qos_config)
         bandwidth_usage = get_bandwidth_usage(qos_config.interface)
         return jsonify(bandwidth_usage)
     except Exception as e:
         logger.error(f"Errore durante l'ottenimento delle statistiche QoS: {str(e)}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@qos.route('/api/history')
+@login_required
+def api_history():
+    """API con la banda totale e per classe dell'ultima ora"""
+    qos_config = QoSConfig.query.first()
+    
+    if not qos_config or not qos_config.enabled:
+        return jsonify({"error": "QoS not enabled"}), 400
+    
+    watch_qos_config(qos_config)
+    return jsonify(get_bandwidth_history())
+
+@qos.route('/stream')
+@login_required
+def stream():
+    """Stream Server-Sent Events con le statistiche QoS in tempo reale"""
+    qos_config = QoSConfig.query.first()
+    
+    if not qos_config or not qos_config.enabled:
+        return jsonify({"error": "QoS not enabled"}), 400
+    
+    watch_qos_config(qos_config)
+    interface = qos_config.interface
+    broadcaster = get_broadcaster(f"qos:{interface}", lambda: get_bandwidth_usage(interface))
+    return Response(broadcaster.stream(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@qos.route('/calibrate', methods=['POST'])
+@login_required
+def calibrate_bandwidth():
+    """Avvia in background la calibrazione automatica delle bande dello shaper"""
+    qos_config = QoSConfig.query.first()
+    
+    if not qos_config:
+        return jsonify({"error": "QoS not configured"}), 400
+    if any(job["status"] == "running" for job in active_calibrations.values()):
+        return jsonify({"error": "Calibrazione già in corso"}), 409
+    
+    job_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    active_calibrations[job_id] = {"status": "running", "progress": 0}
+    app = current_app._get_current_object()
+    config_id = qos_config.id
+    
+    def background_task():
+        job = active_calibrations[job_id]
+        
+        def progress(value, message):
+            job["progress"] = value
+            job["status_message"] = message
+        
+        with app.app_context():
+            qos_config = QoSConfig.query.get(config_id)
+            try:
+                result = calibrate(SpeedTestProbe(qos_config), progress=progress)
+                qos_config.upload_bandwidth = result["upload"]["rate"]
+                qos_config.download_bandwidth = result["download"]["rate"]
+                db.session.commit()
+                
+                job["status"] = "completed"
+                job["progress"] = 100
+                job["status_message"] = (f"Calibrazione completata: download {qos_config.download_bandwidth} kbps, "
+                                         f"upload {qos_config.upload_bandwidth} kbps")
+                job["result"] = result
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Errore durante la calibrazione QoS: {str(e)}")
+                job["status"] = "error"
+                job["status_message"] = f"Errore: {str(e)}"
+            finally:
+                # Lo shaper di prova viene sostituito da quello salvato (o rimosso se il QoS è disabilitato)
+                if qos_config.enabled:
+                    apply_qos_config(qos_config)
+                else:
+                    disable_qos(qos_config.id)
+    
+    thread = threading.Thread(target=background_task)
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({
+        "job_id": job_id,
+        "status": "started"
+    })
+
+@qos.route('/calibrate/status/<job_id>')
+@login_required
+def calibration_status(job_id):
+    """Stato di una calibrazione della banda"""
+    if job_id not in active_calibrations:
+        return jsonify({
+            "status": "not_found",
+            "message": "Calibrazione non trovata"
+        }), 404
+    
+    job = active_calibrations[job_id]
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job["progress"],
+        "status_message": job.get("status_message", ""),
+        "result": job.get("result") if job["status"] in ["completed", "error"] else None
+    })
@@ -1,11 +1,12 @@
 import logging
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
-from flask_login import login_required
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app
+from flask_login import login_required, current_user
 from utils.system import (
     get_system_stats, reboot_system, shutdown_system,
     get_system_logs, clear_logs, run_diagnostic,
     get_installed_packages, check_for_updates, install_update
 )
+from utils.sql_profiler import get_sql_profiler
 import io
 
 # Create logger
@@ -282,6 +283,40 @@ def get_connected_devices():
         logger.error(f"Error getting connected devices: {str(e)}")
         return jsonify({'success': False, 'message': f'Errore nel recupero dei dispositivi connessi: {str(e)}'}), 500
 
+@system_bp.route('/network/top-talkers', methods=['GET'])
+@login_required
+def get_top_talkers():
+    """Dispositivi con più traffico verso la WAN (Mbps) e storico recente"""
+    try:
+        from utils.devices import get_device_inventory
+        from utils.device_traffic import get_device_traffic
+
+        traffic = get_device_traffic()
+        inventory = get_device_inventory()
+        history = traffic.history()
+
+        # Nome e IP dei soli dispositivi presenti nello storico (al più top per campione)
+        devices = {}
+        for sample in history:
+            for entry in sample['devices']:
+                if entry['key'] not in devices:
+                    device = inventory.device(entry['key'])
+                    devices[entry['key']] = {
+                        'name': device['name'] if device else entry['key'],
+                        'ipv4_address': device['ipv4_address'] if device else None
+                    }
+
+        return jsonify({
+            'success': True,
+            'top_talkers': [dict(entry, **devices.get(entry['key'], {'name': entry['key']}))
+                            for entry in traffic.top_talkers()],
+            'history': history,
+            'devices': devices
+        })
+    except Exception as e:
+        logger.error(f"Error getting top talkers: {str(e)}")
+        return jsonify({'success': False, 'message': f'Errore nel recupero del traffico per dispositivo: {str(e)}'}), 500
+
 @system_bp.route('/network/interfaces', methods=['GET'])
 @login_required
 def get_network_interfaces():
@@ -300,32 +335,16 @@ def get_network_interfaces():
 def get_bandwidth_usage():
     """Get bandwidth usage data"""
     try:
+        from utils.network import get_bandwidth_usage
+        
         interface = request.args.get('interface', 'all')
         period = request.args.get('period', '1h')
         
-        # Simula dati di utilizzo della larghezza di banda
-        import random
-        import time
-        from datetime import datetime, timedelta
-        
-        # Genera 30 punti dati
-        now = datetime.now()
-        timestamps = [(now - timedelta(minutes=i)).strftime('%H:%M:%S') for i in range(30, 0, -1)]
-        
-        download = [round(random.uniform(5, 50), 1) for _ in range(30)]
-        upload = [round(random.uniform(1, 15), 1) for _ in range(30)]
+        data = get_bandwidth_usage(interface, period)
+        if 'error' in data:
+            return jsonify({'success': False, 'message': data['error']}), 400
         
-        return jsonify({
-            'success': True, 
-            'data': {
-                'timestamps': timestamps,
-                'download': download,
-                'upload': upload,
-                'current_download': download[-1],
-                'current_upload': upload[-1],
-                'interface': interface
-            }
-        })
+        return jsonify({'success': True, 'data': data})
     except Exception as e:
         logger.error(f"Error getting bandwidth usage: {str(e)}")
         return jsonify({'success': False, 'message': f'Errore nel recupero dell\'utilizzo della banda: {str(e)}'}), 500
@@ -351,6 +370,33 @@ def get_service_for_port(port):
     
     return services.get(port, 'Sconosciuto')
 
+@system_bp.route('/sql-profile', methods=['GET'])
+@login_required
+def sql_profile():
+    """Per-endpoint SQL statistics collected by the profiler (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Accesso riservato agli amministratori'}), 403
+    
+    profiler = get_sql_profiler(current_app)
+    if profiler is None:
+        return jsonify({'success': False, 'message': 'Profilazione SQL non attiva (impostare SQL_PROFILER=1)'}), 404
+    
+    return jsonify({'success': True, 'data': profiler.snapshot()})
+
+@system_bp.route('/sql-profile/reset', methods=['POST'])
+@login_required
+def reset_sql_profile():
+    """Discard the collected SQL statistics (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Accesso riservato agli amministratori'}), 403
+    
+    profiler = get_sql_profiler(current_app)
+    if profiler is None:
+        return jsonify({'success': False, 'message': 'Profilazione SQL non attiva (impostare SQL_PROFILER=1)'}), 404
+    
+    profiler.reset()
+    return jsonify({'success': True})
+
 @system_bp.route('/updates')
 @login_required
 def updates():
@@ -10,9 +10,6 @@ document.addEventListener('DOMContentLoaded', function() {
     feather.replace();
   }
   
-  // Check FreeSWITCH status
-  checkFreeswitchStatus();
-  
   // Initialize CPU usage chart
   const cpuCtx = document.getElementById('cpuChart');
   if (cpuCtx) {
@@ -165,7 +162,50 @@ document.addEventListener('DOMContentLoaded', function() {
     fetchNetworkHistoryData(networkChart);
   }
   
-  // Set up periodic data refresh
+  // Live updates: one server-sent event stream replaces the polling loops
+  if (window.EventSource) {
+    startDashboardStream();
+  } else {
+    startDashboardPolling();
+  }
+});
+
+// Minimum interval between two points of the CPU chart
+const CPU_CHART_INTERVAL = 10000;
+let lastCpuChartUpdate = 0;
+
+/**
+ * Subscribe to /dashboard/stream and render every update
+ *
+ * The first event carries the full snapshot, the following ones only the
+ * changed fields (removed keys are listed under "__removed__").
+ */
+function startDashboardStream() {
+  const state = {};
+  const source = new EventSource('/dashboard/stream');
+  
+  source.onmessage = function(event) {
+    mergeDelta(state, JSON.parse(event.data));
+    renderDashboardData(state);
+    renderSidebarStats(state);
+    if (state.freeswitch) {
+      renderFreeswitchStatus({status: 'success', data: state.freeswitch});
+    }
+  };
+  
+  source.onerror = function() {
+    // Server does not support streaming (e.g. behind a buffering proxy)
+    if (source.readyState === EventSource.CLOSED) {
+      startDashboardPolling();
+    }
+  };
+}
+
+/**
+ * Fallback: periodically poll the JSON APIs
+ */
+function startDashboardPolling() {
+  checkFreeswitchStatus();
   setInterval(refreshDashboardData, 10000); // Refresh every 10 seconds
   
   // Update sidebar stats if available
@@ -174,7 +214,30 @@ document.addEventListener('DOMContentLoaded', function() {
   
   // Check FreeSWITCH status periodically
   setInterval(checkFreeswitchStatus, 30000); // Check every 30 seconds
-});
+}
+
+/**
+ * Apply a stream delta to the local state in place
+ * @param {Object} target - Local state
+ * @param {Object} delta - Changed fields, removed keys under "__removed__"
+ */
+function mergeDelta(target, delta) {
+  for (const key of delta.__removed__ || []) {
+    delete target[key];
+  }
+  for (const [key, value] of Object.entries(delta)) {
+    if (key === '__removed__') {
+      continue;
+    }
+    if (value !== null && typeof value === 'object' && !Array.isArray(value) &&
+        typeof target[key] === 'object' && target[key] !== null) {
+      mergeDelta(target[key], value);
+    } else {
+      target[key] = value;
+    }
+  }
+  return target;
+}
 
 /**
  * Fetch network traffic history data
@@ -200,58 +263,69 @@ function fetchNetworkHistoryData(chart) {
 function refreshDashboardData() {
   fetch('/dashboard/api/stats')
     .then(response => response.json())
-    .then(data => {
-      // Update CPU info
-      if (data.system && data.system.cpu) {
-        const cpuUsage = data.system.cpu.usage;
-        document.getElementById('cpuUsageValue').textContent = cpuUsage + '%';
-        
-        // Update CPU chart if exists
-        const cpuChart = Chart.getChart('cpuChart');
-        if (cpuChart) {
-          if (cpuChart.data.datasets[0].data.length >= 24) {
-            cpuChart.data.datasets[0].data.shift();
-          }
-          cpuChart.data.datasets[0].data.push(cpuUsage);
-          cpuChart.update();
-        }
-      }
-      
-      // Update memory info
-      if (data.system && data.system.memory) {
-        const memUsage = data.system.memory.percent;
-        const memUsed = formatBytes(data.system.memory.used);
-        const memTotal = formatBytes(data.system.memory.total);
-        
-        document.getElementById('memoryUsageValue').textContent = memUsage + '%';
-        document.getElementById('memoryDetails').textContent = `${memUsed} / ${memTotal}`;
-        
-        // Update memory chart if exists
-        const memoryChart = Chart.getChart('memoryChart');
-        if (memoryChart) {
-          memoryChart.data.datasets[0].data = [memUsage, 100 - memUsage];
-          memoryChart.update();
-        }
-      }
-      
-      // Update network info
-      if (data.network) {
-        for (const [interface, stats] of Object.entries(data.network)) {
-          if (interface === 'total') continue;
-          
-          const downloadEl = document.getElementById(`${interface}Download`);
-          const uploadEl = document.getElementById(`${interface}Upload`);
-          
-          if (downloadEl) downloadEl.textContent = formatBitrate(stats.mbits_recv);
-          if (uploadEl) uploadEl.textContent = formatBitrate(stats.mbits_sent);
-        }
-      }
-    })
+    .then(data => renderDashboardData(data))
     .catch(error => {
       console.error('Error refreshing dashboard data:', error);
     });
 }
 
+/**
+ * Render system and network stats into the dashboard widgets
+ * @param {Object} data - Object with system and network stats
+ */
+function renderDashboardData(data) {
+  // Update CPU info
+  if (data.system && data.system.cpu) {
+    const cpuUsage = data.system.cpu.usage;
+    const cpuUsageEl = document.getElementById('cpuUsageValue');
+    if (cpuUsageEl) cpuUsageEl.textContent = cpuUsage + '%';
+    
+    // Update CPU chart if exists
+    const cpuChart = Chart.getChart('cpuChart');
+    const now = Date.now();
+    if (cpuChart && now - lastCpuChartUpdate >= CPU_CHART_INTERVAL) {
+      lastCpuChartUpdate = now;
+      if (cpuChart.data.datasets[0].data.length >= 24) {
+        cpuChart.data.datasets[0].data.shift();
+      }
+      cpuChart.data.datasets[0].data.push(cpuUsage);
+      cpuChart.update();
+    }
+  }
+  
+  // Update memory info
+  if (data.system && data.system.memory) {
+    const memUsage = data.system.memory.percent;
+    const memUsed = formatBytes(data.system.memory.used);
+    const memTotal = formatBytes(data.system.memory.total);
+    
+    const memUsageEl = document.getElementById('memoryUsageValue');
+    const memDetailsEl = document.getElementById('memoryDetails');
+    if (memUsageEl) memUsageEl.textContent = memUsage + '%';
+    if (memDetailsEl) memDetailsEl.textContent = `${memUsed} / ${memTotal}`;
+    
+    // Update memory chart if exists
+    const memoryChart = Chart.getChart('memoryChart');
+    if (memoryChart) {
+      memoryChart.data.datasets[0].data = [memUsage, 100 - memUsage];
+      memoryChart.update();
+    }
+  }
+  
+  // Update network info
+  if (data.network) {
+    for (const [interface, stats] of Object.entries(data.network)) {
+      if (interface === 'total') continue;
+      
+      const downloadEl = document.getElementById(`${interface}Download`);
+      const uploadEl = document.getElementById(`${interface}Upload`);
+      
+      if (downloadEl) downloadEl.textContent = formatBitrate(stats.mbits_recv);
+      if (uploadEl) uploadEl.textContent = formatBitrate(stats.mbits_sent);
+    }
+  }
+}
+
 /**
  * Format bytes to human-readable string
  * @param {number} bytes - Bytes to format
@@ -299,27 +373,37 @@ function updateSidebarStats() {
   // Fetch system stats
   fetch('/dashboard/api/stats')
     .then(response => response.json())
-    .then(data => {
-      // Update CPU usage
-      if (cpuStat && data.system && data.system.cpu) {
-        cpuStat.textContent = data.system.cpu.usage + '%';
-      }
-      
-      // Update memory usage
-      if (memStat && data.system && data.system.memory) {
-        memStat.textContent = data.system.memory.percent + '%';
-      }
-      
-      // Update uptime
-      if (uptimeStat && data.system && data.system.uptime) {
-        uptimeStat.textContent = formatUptime(data.system.uptime);
-      }
-    })
+    .then(data => renderSidebarStats(data))
     .catch(error => {
       console.error('Error updating sidebar stats:', error);
     });
 }
 
+/**
+ * Render system stats into the sidebar widgets
+ * @param {Object} data - Object with system stats
+ */
+function renderSidebarStats(data) {
+  const cpuStat = document.getElementById('sidebar-cpu-usage');
+  const memStat = document.getElementById('sidebar-memory-usage');
+  const uptimeStat = document.getElementById('sidebar-uptime');
+  
+  // Update CPU usage
+  if (cpuStat && data.system && data.system.cpu) {
+    cpuStat.textContent = data.system.cpu.usage + '%';
+  }
+  
+  // Update memory usage
+  if (memStat && data.system && data.system.memory) {
+    memStat.textContent = data.system.memory.percent + '%';
+  }
+  
+  // Update uptime
+  if (uptimeStat && data.system && data.system.uptime) {
+    uptimeStat.textContent = formatUptime(data.system.uptime);
+  }
+}
+
 /**
  * Format uptime seconds to human-readable string
  * @param {number} seconds - Uptime in seconds
@@ -349,33 +433,7 @@ function checkFreeswitchStatus() {
   
   fetch('/api/freeswitch/status')
     .then(response => response.json())
-    .then(data => {
-      // Update FreeSWITCH status in UI
-      if (data.status === 'success' && data.data) {
-        const status = data.data;
-        
-        // Update status icon and text
-        if (status.installed) {
-          if (status.running) {
-            fsStatusEl.innerHTML = '<span class="badge bg-success">Attivo</span>';
-          } else {
-            fsStatusEl.innerHTML = '<span class="badge bg-warning">Installato (non attivo)</span>';
-          }
-        } else {
-          fsStatusEl.innerHTML = '<span class="badge bg-danger">Non installato</span>';
-        }
-        
-        // Update version if available
-        const fsVersionEl = document.getElementById('freeswitchVersion');
-        if (fsVersionEl && status.version) {
-          fsVersionEl.textContent = status.version;
-        } else if (fsVersionEl) {
-          fsVersionEl.textContent = 'N/A';
-        }
-      } else {
-        fsStatusEl.innerHTML = '<span class="badge bg-secondary">Stato sconosciuto</span>';
-      }
-    })
+    .then(data => renderFreeswitchStatus(data))
     .catch(error => {
       console.error('Error checking FreeSWITCH status:', error);
       if (fsStatusEl) {
@@ -383,3 +441,37 @@ function checkFreeswitchStatus() {
       }
     });
 }
+
+/**
+ * Render FreeSWITCH status into the UI
+ * @param {Object} data - Object with status and data (FreeSWITCH status)
+ */
+function renderFreeswitchStatus(data) {
+  const fsStatusEl = document.getElementById('freeswitchStatus');
+  if (!fsStatusEl) return;
+  
+  if (data.status === 'success' && data.data) {
+    const status = data.data;
+    
+    // Update status icon and text
+    if (status.installed) {
+      if (status.running) {
+        fsStatusEl.innerHTML = '<span class="badge bg-success">Attivo</span>';
+      } else {
+        fsStatusEl.innerHTML = '<span class="badge bg-warning">Installato (non attivo)</span>';
+      }
+    } else {
+      fsStatusEl.innerHTML = '<span class="badge bg-danger">Non installato</span>';
+    }
+    
+    // Update version if available
+    const fsVersionEl = document.getElementById('freeswitchVersion');
+    if (fsVersionEl && status.version) {
+      fsVersionEl.textContent = status.version;
+    } else if (fsVersionEl) {
+      fsVersionEl.textContent = 'N/A';
+    }
+  } else {
+    fsStatusEl.innerHTML = '<span class="badge bg-secondary">Stato sconosciuto</span>';
+  }
+}
@@ -1 +1,5 @@
-# File di inizializzazione del package tests
\ No newline at end of file
+# File di inizializzazione del package tests
+import os
+
+# I test usano un database in memoria, mai quello dell'istanza
+os.environ.setdefault("DATABASE_URL", "sqlite://")
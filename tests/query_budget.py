@@ -0,0 +1,40 @@
+"""
+Conteggio delle query SQL eseguite durante un test.
+Le pagine devono eseguire un numero di query indipendente dal numero di
+righe mostrate: assertQueryBudget fallisce (elencando le query) se il
+blocco ne esegue più del budget.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import app, db
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Raccoglie le istruzioni SQL eseguite sul motore nel blocco"""
+    if engine is None:
+        with app.app_context():
+            engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+class QueryBudgetMixin:
+    """Mixin per unittest.TestCase con l'asserzione sul numero di query"""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, engine=None):
+        with count_queries(engine) as statements:
+            yield statements
+        if len(statements) > budget:
+            self.fail(f"{len(statements)} queries executed, budget is {budget}:\n" + "\n".join(statements))
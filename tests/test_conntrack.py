@@ -0,0 +1,57 @@
+import unittest
+
+from app import app
+from utils.conntrack import Connection, iter_connections, parse_conntrack_line, query_connections
+
+CONNTRACK_OUTPUT = """\
+tcp      6 431999 ESTABLISHED src=192.168.1.10 dst=93.184.216.34 sport=51514 dport=443 packets=12 bytes=1800 src=93.184.216.34 dst=203.0.113.5 sport=443 dport=51514 packets=10 bytes=9000 [ASSURED] mark=0 use=1
+udp      17 29 src=192.168.1.11 dst=1.1.1.1 sport=40000 dport=53 packets=1 bytes=60 [UNREPLIED] src=1.1.1.1 dst=203.0.113.5 sport=53 dport=40000 packets=0 bytes=0 mark=0 use=1
+icmp     1 29 src=192.168.1.12 dst=8.8.8.8 type=8 code=0 id=7 src=8.8.8.8 dst=203.0.113.5 type=0 code=0 id=7 mark=0 use=1
+conntrack v1.4.7 (conntrack-tools): 3 flow entries have been shown.
+"""
+
+PROC_LINE = ("ipv6     10 tcp      6 117 TIME_WAIT src=2001:0db8:0000:0000:0000:0000:0000:0001 "
+             "dst=2001:0db8:0000:0000:0000:0000:0000:0002 sport=5000 dport=22 "
+             "src=2001:0db8:0000:0000:0000:0000:0000:0002 dst=2001:0db8:0000:0000:0000:0000:0000:0001 "
+             "sport=22 dport=5000 [ASSURED] mark=0 zone=0 use=2")
+
+class ConntrackParserTestCase(unittest.TestCase):
+    def test_conntrack_tool_output(self):
+        connections = list(iter_connections(CONNTRACK_OUTPUT.splitlines()))
+        self.assertEqual(connections, [
+            Connection('tcp', '192.168.1.10', 51514, '93.184.216.34', 443, 'ESTABLISHED', 22, 10800),
+            Connection('udp', '192.168.1.11', 40000, '1.1.1.1', 53, 'UNREPLIED', 1, 60),
+            Connection('icmp', '192.168.1.12', 0, '8.8.8.8', 0, '', 0, 0),
+        ])
+
+    def test_proc_ipv6_line(self):
+        connection = parse_conntrack_line(PROC_LINE)
+        self.assertEqual(connection[:6], ('tcp', '2001:db8::1', 5000, '2001:db8::2', 22, 'TIME_WAIT'))
+
+class ConntrackQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connections = [Connection('tcp', f'10.0.0.{i}', 1000 + i, '10.0.1.1', 80 if i % 2 else 443,
+                                       'ESTABLISHED', i, i * 100) for i in range(1, 21)]
+
+    def test_filter_and_paginate(self):
+        result = query_connections(iter(self.connections), port=80, offset=2, limit=3)
+        self.assertEqual(result['total'], 10)
+        self.assertEqual([c.source for c in result['connections']], ['10.0.0.5', '10.0.0.7', '10.0.0.9'])
+
+    def test_top_by_bytes(self):
+        result = query_connections(iter(self.connections), sort='bytes', offset=1, limit=2)
+        self.assertEqual(result['total'], 20)
+        self.assertEqual([c.bytes for c in result['connections']], [1900, 1800])
+
+class ConnectionsApiTestCase(unittest.TestCase):
+    def test_invalid_address_is_rejected(self):
+        app.config['TESTING'] = True
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = '1'
+            session['_fresh'] = True
+        response = client.get('/firewall/api/connections?address=10.0.0.256')
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
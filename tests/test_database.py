@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from config import SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE
+from utils.database import benchmark_concurrency, create_benchmark_engine, engine_options
+
+class SQLiteTuningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'tuned.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_engine_options(self):
+        self.assertFalse(engine_options('sqlite:///evorouter.db')['pool_pre_ping'])
+        self.assertEqual(engine_options('postgresql://router@db/evorouter'),
+                         {'pool_recycle': 300, 'pool_pre_ping': True})
+
+    def test_pragmas_applied_on_connect(self):
+        engine = create_benchmark_engine(self.path, tuned=True)
+        with engine.connect() as conn:
+            pragma = lambda name: conn.execute(text(f'PRAGMA {name}')).scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+            self.assertEqual(pragma('busy_timeout'), SQLITE_BUSY_TIMEOUT)
+            self.assertEqual(pragma('cache_size'), SQLITE_CACHE_SIZE)
+        engine.dispose()
+
+    def test_concurrent_benchmark_without_lock_errors(self):
+        result = benchmark_concurrency(self.path, tuned=True, writers=2, readers=2, duration=0.3)
+        self.assertEqual(result['journal_mode'], 'wal')
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['writes'], 0)
+        self.assertGreater(result['reads'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
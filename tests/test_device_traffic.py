@@ -0,0 +1,114 @@
+import json
+import unittest
+
+from flask import Flask
+
+from app import db
+from models import FirewallZone, NetworkConfig
+from utils.device_traffic import DeviceTrafficCollector, accounting_interfaces
+from utils.devices import DeviceInventory
+from utils.nftables import compile_accounting, parse_accounting
+
+def nft_set(name, elements):
+    return {"set": {"family": "inet", "name": name, "table": "evorouter_acct", "type": "ipv4_addr",
+                    "elem": [{"elem": {"val": ip, "counter": {"packets": 1, "bytes": nbytes}}}
+                             for ip, nbytes in elements]}}
+
+class DeviceTrafficTestCase(unittest.TestCase):
+    def test_accounting_table(self):
+        script = compile_accounting(['eth0', 'wlan0'], ['eth1'])
+        self.assertIn('table inet evorouter_acct {', script)
+        self.assertIn('iifname { "eth0", "wlan0" } oifname "eth1" update @acct_tx4 { ip saddr counter }', script)
+        self.assertIn('iifname "eth1" oifname { "eth0", "wlan0" } update @acct_rx6 { ip6 daddr counter }', script)
+
+        output = json.dumps({"nftables": [
+            {"metainfo": {"json_schema_version": 1}},
+            nft_set("acct_rx4", [("192.168.1.10", 5000), ("192.168.1.11", 700)]),
+            nft_set("acct_tx4", [("192.168.1.10", 300)]),
+        ]})
+        self.assertEqual(parse_accounting(output), {"192.168.1.10": (5000, 300), "192.168.1.11": (700, 0)})
+
+    def test_rates_top_talkers_and_history(self):
+        samples = [
+            {"192.168.1.10": (0, 0), "2001:db8::10": (0, 0), "192.168.1.11": (0, 0)},
+            {"192.168.1.10": (5_000_000, 250_000), "2001:db8::10": (1_250_000, 0), "192.168.1.11": (125_000, 0),
+             "192.168.1.12": (0, 1_250_000)},
+            # Il .10 è uscito dal set ed è rientrato: il contatore riparte da zero
+            {"192.168.1.10": (100, 0), "2001:db8::10": (1_250_000, 0), "192.168.1.11": (125_000, 0),
+             "192.168.1.12": (0, 1_250_000)},
+        ]
+        reads = []
+        now = [0.0]
+
+        def reader():
+            reads.append(now[0])
+            return samples[len(reads) - 1]
+
+        lookup = {"192.168.1.10": "AA:00:00:00:00:10", "2001:db8::10": "AA:00:00:00:00:10"}
+        collector = DeviceTrafficCollector(interval=5, history=10, top=2, reader=reader,
+                                           resolve=lookup.get, clock=lambda: now[0], wallclock=lambda: 1000 + now[0])
+        self.assertFalse(collector.maybe_sample())
+        now[0] = 2
+        self.assertFalse(collector.maybe_sample())
+        self.assertEqual(len(reads), 1)
+
+        now[0] = 10
+        self.assertTrue(collector.maybe_sample())
+        rates = collector.rates()
+        # (5 MB + 1.25 MB) in 10 s = 5 Mbps, IPv4 e IPv6 dello stesso dispositivo sommati
+        self.assertEqual(rates["AA:00:00:00:00:10"], {"download": 5.0, "upload": 0.2})
+        self.assertEqual(rates["192.168.1.12"], {"download": 0.0, "upload": 1.0})
+        self.assertEqual([t["key"] for t in collector.top_talkers()], ["AA:00:00:00:00:10", "192.168.1.12"])
+
+        for step in (20, 30, 40):
+            now[0] = step
+            samples.append(samples[-1])
+            collector.maybe_sample()
+        self.assertEqual(collector.rates().get("AA:00:00:00:00:10"), None)
+        history = collector.history()
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[-1]["timestamp"], 1040)
+
+    def test_rates_are_published_in_the_device_list(self):
+        arp = [{"ip": "192.168.1.10", "mac": "AA:00:00:00:00:10", "interface": "br-lan"}]
+        inventory = DeviceInventory(arp_reader=lambda: arp, neigh_reader=list, lease_reader=list)
+        inventory.refresh()
+        inventory.set_traffic({"AA:00:00:00:00:10": {"download": 12.5, "upload": 1.5}})
+        device = inventory.snapshot()[0]
+        self.assertEqual((device["download"], device["upload"]), (12.5, 1.5))
+        self.assertIs(inventory.device("AA:00:00:00:00:10"), device)
+
+class AccountingInterfacesTestCase(unittest.TestCase):
+    def setUp(self):
+        # Database in memoria dedicato, indipendente da quello dell'applicazione
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_interfaces_follow_the_firewall_zones(self):
+        db.session.add_all([
+            FirewallZone(name='wan', interfaces='eth1,wwan0', masquerade=True, priority=1),
+            FirewallZone(name='lan', interfaces='br-lan', priority=2),
+            FirewallZone(name='guest', interfaces='wlan1', priority=3),
+        ])
+        db.session.commit()
+        self.assertEqual(accounting_interfaces(), (['br-lan', 'wlan1'], ['eth1', 'wwan0']))
+
+    def test_network_config_without_zones(self):
+        db.session.add_all([
+            NetworkConfig(interface_name='br0', interface_type='lan'),
+            NetworkConfig(interface_name='eth0', interface_type='wan'),
+        ])
+        db.session.commit()
+        self.assertEqual(accounting_interfaces(), (['br0'], ['eth0']))
+
+if __name__ == '__main__':
+    unittest.main()
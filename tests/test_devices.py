@@ -0,0 +1,97 @@
+import json
+import unittest
+
+from utils.dhcp_leases import parse_dnsmasq_leases
+from utils.devices import DeviceInventory, parse_ip_neigh, parse_proc_arp
+
+ARP = """IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.10     0x1         0x2         aa:bb:cc:00:00:01     *        br-lan
+192.168.1.11     0x1         0x0         00:00:00:00:00:00     *        br-lan
+192.168.1.12     0x1         0x2         aa:bb:cc:00:00:02     *        wlan0
+203.0.113.1      0x1         0x2         aa:bb:cc:00:00:ff     *        eth1
+"""
+
+NEIGH = json.dumps([
+    {"dst": "fe80::1", "dev": "br-lan", "lladdr": "aa:bb:cc:00:00:01", "state": ["STALE"]},
+    {"dst": "2001:db8::10", "dev": "br-lan", "lladdr": "aa:bb:cc:00:00:01", "state": ["REACHABLE"]},
+    {"dst": "2001:db8::99", "dev": "br-lan", "state": ["FAILED"]},
+])
+
+LEASES = """1900000000 aa:bb:cc:00:00:01 192.168.1.10 desktop-pc 01:aa:bb:cc:00:00:01
+1900000000 aa:bb:cc:00:00:03 192.168.1.13 * *
+duid 00:01:00:01:2c:1f:2a:3b:aa:bb:cc:dd:ee:ff
+"""
+
+class DeviceParsersTestCase(unittest.TestCase):
+    def test_parsers(self):
+        arp = parse_proc_arp(ARP)
+        self.assertEqual([n['ip'] for n in arp], ['192.168.1.10', '192.168.1.12', '203.0.113.1'])
+        self.assertEqual(arp[0]['mac'], 'AA:BB:CC:00:00:01')
+
+        self.assertEqual([n['ip'] for n in parse_ip_neigh(NEIGH)], ['fe80::1', '2001:db8::10'])
+
+        leases = parse_dnsmasq_leases(LEASES)
+        self.assertEqual(len(leases), 2)
+        self.assertEqual(leases[0]['hostname'], 'desktop-pc')
+        self.assertIsNone(leases[1]['hostname'])
+
+class DeviceInventoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = [1800000000.0]
+        self.arp = ARP
+        self.inventory = DeviceInventory(
+            arp_reader=lambda: parse_proc_arp(self.arp),
+            neigh_reader=lambda: parse_ip_neigh(NEIGH),
+            lease_reader=lambda: parse_dnsmasq_leases(LEASES),
+            interval=10, publish_interval=60, forget_after=3600,
+            exclude_interfaces=('eth1',), clock=lambda: self.now[0])
+
+    def devices(self):
+        return {device['mac']: device for device in self.inventory.snapshot()}
+
+    def test_sources_are_merged_by_mac(self):
+        self.inventory.refresh()
+        devices = self.devices()
+        self.assertEqual(sorted(devices), ['AA:BB:CC:00:00:01', 'AA:BB:CC:00:00:02', 'AA:BB:CC:00:00:03'])
+
+        desktop = devices['AA:BB:CC:00:00:01']
+        self.assertEqual((desktop['name'], desktop['ipv4_address'], desktop['ipv6_address']),
+                         ('desktop-pc', '192.168.1.10', '2001:db8::10'))
+        self.assertEqual(desktop['status'], 'Online')
+        self.assertEqual(devices['AA:BB:CC:00:00:02']['connection'], 'Wireless')
+        # Lease attiva ma assente dalle tabelle dei vicini
+        self.assertEqual(devices['AA:BB:CC:00:00:03']['status'], 'Offline')
+        self.assertEqual(self.inventory.lookup_ip('2001:db8::10'), 'AA:BB:CC:00:00:01')
+
+    def test_snapshot_is_republished_only_on_changes(self):
+        self.inventory.refresh()
+        snapshot = self.inventory.snapshot()
+
+        self.now[0] += 10
+        self.assertFalse(self.inventory.refresh())
+        self.assertIs(self.inventory.snapshot(), snapshot)
+
+        # Il dispositivo wireless esce dalla tabella ARP
+        self.arp = '\n'.join(line for line in ARP.splitlines() if 'aa:bb:cc:00:00:02' not in line)
+        self.now[0] += 10
+        self.assertTrue(self.inventory.refresh())
+        self.assertEqual(self.devices()['AA:BB:CC:00:00:02']['status'], 'Offline')
+
+        # Senza lease viene dimenticato dopo forget_after
+        self.now[0] += 3600
+        self.inventory.refresh()
+        self.assertNotIn('AA:BB:CC:00:00:02', self.devices())
+        self.assertIn('AA:BB:CC:00:00:03', self.devices())
+
+    def test_large_lan(self):
+        arp = ARP.splitlines()[0] + '\n' + '\n'.join(
+            f'10.0.{i // 250}.{i % 250 + 1} 0x1 0x2 02:00:00:00:{i // 256:02x}:{i % 256:02x} * br-lan'
+            for i in range(600))
+        inventory = DeviceInventory(arp_reader=lambda: parse_proc_arp(arp), neigh_reader=list,
+                                    lease_reader=list, clock=lambda: self.now[0])
+        inventory.refresh()
+        self.assertEqual(len(inventory.snapshot()), 600)
+        self.assertIs(inventory.snapshot(), inventory.snapshot())
+
+if __name__ == '__main__':
+    unittest.main()
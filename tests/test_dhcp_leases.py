@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+
+from utils.dhcp_leases import LeaseDatabase, parse_isc_leases
+
+ISC_HEADER = b"""# The format of this file is documented in the dhcpd.leases(5) manual page.
+authoring-byte-order little-endian;
+server-duid "\\000\\001\\000\\001";
+
+"""
+
+def isc_lease(ip, mac, hostname, state="active", ends="4 2030/01/01 00:00:00"):
+    return (f'lease {ip} {{\n'
+            f'  starts 3 2026/10/14 08:00:00;\n'
+            f'  ends {ends};\n'
+            f'  binding state {state};\n'
+            f'  next binding state free;\n'
+            f'  hardware ethernet {mac};\n'
+            f'  client-hostname "{hostname}";\n'
+            f'}}\n').encode()
+
+IA_NA = b"""ia-na "\\001\\000" {
+  cltt 3 2026/10/14 08:00:00;
+  iaaddr 2001:db8::10 {
+    binding state active;
+  }
+}
+"""
+
+class IscParserTestCase(unittest.TestCase):
+    def test_parse(self):
+        data = ISC_HEADER + isc_lease("192.168.1.10", "aa:bb:cc:00:00:01", "desktop-pc") + IA_NA
+        leases, consumed = parse_isc_leases(data)
+        self.assertEqual(consumed, len(data))
+        self.assertEqual(len(leases), 1)
+        self.assertEqual(leases[0]['mac'], 'AA:BB:CC:00:00:01')
+        self.assertEqual(leases[0]['hostname'], 'desktop-pc')
+        self.assertEqual(leases[0]['state'], 'active')
+        self.assertEqual(leases[0]['expiry'], 1893456000)
+
+        # Un blocco incompleto resta per la lettura successiva
+        partial = isc_lease("192.168.1.11", "aa:bb:cc:00:00:02", "laptop")[:40]
+        leases, consumed = parse_isc_leases(data + partial)
+        self.assertEqual((len(leases), consumed), (1, len(data)))
+
+class LeaseDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.isc = os.path.join(self.tmp.name, "dhcpd.leases")
+        self.dnsmasq = os.path.join(self.tmp.name, "dnsmasq.leases")
+        self.now = [1800000000.0]
+        with open(self.isc, "wb") as f:
+            f.write(ISC_HEADER + isc_lease("192.168.1.10", "aa:bb:cc:00:00:01", "desktop-pc"))
+        with open(self.dnsmasq, "w") as f:
+            f.write("1800000100 aa:bb:cc:00:00:09 192.168.2.50 printer *\n")
+        self.database = LeaseDatabase([self.isc, self.dnsmasq], clock=lambda: self.now[0])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def append(self, data):
+        with open(self.isc, "ab") as f:
+            f.write(data)
+
+    def test_indexes_and_expiry(self):
+        active = self.database.active()
+        self.assertEqual([lease['ip'] for lease in active], ['192.168.1.10', '192.168.2.50'])
+        self.assertEqual(self.database.lookup_mac('aa:bb:cc:00:00:01')['ip'], '192.168.1.10')
+        self.assertEqual(self.database.lookup_ip('192.168.2.50')['hostname'], 'printer')
+        self.assertEqual(self.database.lookup_hostname('Desktop-PC')['mac'], 'AA:BB:CC:00:00:01')
+
+        # Nessuna modifica: stessa lista pubblicata
+        self.assertIs(self.database.active(), active)
+
+        # Il lease dnsmasq scade: la lista viene ripubblicata senza rileggere i file
+        self.now[0] += 200
+        self.assertEqual([lease['ip'] for lease in self.database.active()], ['192.168.1.10'])
+        self.assertIsNone(self.database.lookup_hostname('printer'))
+
+    def test_incremental_isc(self):
+        self.database.active()
+        isc_file = self.database.files[0]
+        offset = isc_file._offset
+
+        # Il nuovo blocco di un indirizzo sostituisce il precedente; viene letto solo il nuovo contenuto
+        self.append(isc_lease("192.168.1.10", "aa:bb:cc:00:00:01", "desktop-pc", state="free"))
+        self.append(isc_lease("192.168.1.11", "aa:bb:cc:00:00:02", "laptop"))
+        self.assertEqual([lease['ip'] for lease in self.database.active()], ['192.168.1.11', '192.168.2.50'])
+        self.assertGreater(isc_file._offset, offset)
+        self.assertIsNone(self.database.lookup_mac('AA:BB:CC:00:00:01'))
+
+        # File riscritto (nuovo inode): rilettura completa
+        replacement = self.isc + ".new"
+        with open(replacement, "wb") as f:
+            f.write(ISC_HEADER + isc_lease("192.168.1.12", "aa:bb:cc:00:00:03", "phone"))
+        os.replace(replacement, self.isc)
+        self.assertEqual([lease['ip'] for lease in self.database.active()], ['192.168.1.12', '192.168.2.50'])
+
+if __name__ == '__main__':
+    unittest.main()
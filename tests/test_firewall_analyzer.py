@@ -0,0 +1,75 @@
+import json
+import time
+import unittest
+from types import SimpleNamespace
+
+from utils.firewall_analyzer import analyze_rules, intervals_cover, merge_intervals
+
+def make_rule(rule_id, priority, action='accept', protocol='tcp', source=None, destination=None,
+              dst_port=None, zone_id=1, log=False):
+    return SimpleNamespace(id=rule_id, zone_id=zone_id, priority=priority, action=action,
+                           protocol=protocol, source=source, destination=destination,
+                           src_port=None, dst_port=dst_port, log=log, enabled=True)
+
+class IntervalsTestCase(unittest.TestCase):
+    def test_merge_and_cover(self):
+        self.assertEqual(merge_intervals([(80, 80), (1000, 2000), (81, 90), (1500, 3000)]),
+                         ((80, 90), (1000, 3000)))
+        self.assertTrue(intervals_cover(((80, 90), (1000, 3000)), ((85, 85), (2000, 2500))))
+        self.assertFalse(intervals_cover(((80, 90),), ((85, 95),)))
+
+class RuleAnalyzerTestCase(unittest.TestCase):
+    def test_shadowed_redundant_and_mergeable(self):
+        ipsets = [SimpleNamespace(name='office', type='hash:net',
+                                  addresses=json.dumps(['10.0.0.0/24', '10.0.1.0/24']))]
+        rules = [
+            make_rule(1, 10, action='drop', source='@office', dst_port='1-1024'),
+            make_rule(2, 20, action='accept', source='10.0.1.5', dst_port='22'),
+            make_rule(3, 30, action='drop', source='10.0.0.0/23', dst_port='80,443'),
+            make_rule(4, 40, action='accept', dst_port='8080'),
+            make_rule(5, 50, action='accept', dst_port='8443'),
+            make_rule(6, 60, action='accept', source='10.0.2.1', dst_port='22'),
+            # Senza protocollo le porte sono ignorate come nel compilatore
+            make_rule(7, 5, action='accept', protocol='all', dst_port='22', zone_id=2),
+            make_rule(8, 6, action='drop', protocol='udp', zone_id=2),
+        ]
+        result = analyze_rules(rules, ipsets)
+
+        self.assertEqual([(r['rule_id'], r['by']) for r in result['shadowed']], [(2, 1), (8, 7)])
+        self.assertEqual([(r['rule_id'], r['by']) for r in result['redundant']], [(3, 1)])
+        self.assertEqual([(r['rule_id'], r['with'], r['field']) for r in result['mergeable']],
+                         [(5, 4, 'dport')])
+        self.assertEqual(result['order'], {1: [1, 4, 5, 6], 2: [7]})
+
+    def test_order_puts_hot_rules_first_without_crossing_conflicts(self):
+        rules = [
+            make_rule(1, 10, action='drop', source='203.0.113.0/24', dst_port='22'),
+            make_rule(2, 20, action='accept', dst_port='22'),
+            make_rule(3, 30, action='accept', dst_port='443'),
+        ]
+        hits = {2: {'packets': 500, 'pps': 5.0}, 3: {'packets': 9000, 'pps': 90.0}}
+        # La 2 deve restare dopo la 1 (si sovrappongono con azione diversa)
+        self.assertEqual(analyze_rules(rules, hits=hits)['order'], {1: [3, 1, 2]})
+
+    def test_large_rule_set_is_near_linear(self):
+        rules = [make_rule(i, i, action='accept' if i % 2 else 'drop', source=f'10.{i // 250}.{i % 250}.1',
+                           dst_port=str(1000 + i % 5000)) for i in range(1, 20001)]
+        started = time.perf_counter()
+        result = analyze_rules(rules)
+        self.assertLess(time.perf_counter() - started, 10)
+        self.assertEqual(result['shadowed'], [])
+
+    def test_large_portless_rule_set_is_near_linear(self):
+        # Regole per host senza porte (protocollo 'all'), più una regola jolly finale
+        rules = [make_rule(i, i, action='accept' if i % 2 else 'drop', protocol='all',
+                           source=f'10.{i // 250}.{i % 250}.1') for i in range(1, 20001)]
+        rules.append(make_rule(20001, 20001, action='drop', protocol='all', destination='192.0.2.0/24'))
+        started = time.perf_counter()
+        result = analyze_rules(rules)
+        self.assertLess(time.perf_counter() - started, 10)
+        self.assertEqual(result['shadowed'], [])
+        # La regola finale interseca tutte le accept e resta dopo di esse
+        self.assertEqual(result['order'][1][-1], 20001)
+
+if __name__ == '__main__':
+    unittest.main()
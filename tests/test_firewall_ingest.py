@@ -0,0 +1,150 @@
+import fcntl
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from models import FirewallLog
+from utils.firewall_ingest import (LogIngestionJob, LogIngestor, parse_log_line, parse_log_timestamp,
+                                   replay_log_file)
+from utils.process_lock import release_lock
+
+LINE = ("Oct 18 10:00:01 evorouter kernel: [1234.5678] evorouter rule=12 drop IN=eth1 OUT= "
+        "MAC=00:11:22:33:44:55:66:77:88:99:aa:bb:08:00 SRC=203.0.113.9 DST=192.168.1.10 "
+        "LEN=60 TOS=0x00 PREC=0x00 TTL=52 ID=0 DF PROTO=TCP SPT={sport} DPT=22 WINDOW=64240 "
+        "RES=0x00 SYN URGP=0\n")
+
+class ParseLogLineTestCase(unittest.TestCase):
+    def test_parse_kernel_line(self):
+        event = parse_log_line(LINE.format(sport=40000))
+        self.assertEqual((event.rule_id, event.action, event.interface, event.protocol),
+                         (12, 'drop', 'eth1', 'tcp'))
+        self.assertEqual((event.source_ip, event.source_port, event.destination_port, event.length),
+                         ('203.0.113.9', 40000, 22, 60))
+
+    def test_ignore_unrelated_lines(self):
+        self.assertIsNone(parse_log_line("Oct 18 10:00:01 evorouter kernel: eth0: link up\n"))
+        self.assertIsNone(parse_log_line("evorouter rule=abc drop SRC=1.2.3.4 DST=5.6.7.8\n"))
+
+    def test_parse_syslog_timestamp(self):
+        # Formato tradizionale: ora locale, anno dedotto da now
+        now = datetime(2026, 10, 18, 12, 0).timestamp()
+        local = datetime(2026, 10, 18, 10, 0, 1).timestamp()
+        self.assertEqual(parse_log_timestamp(LINE, now),
+                         datetime.fromtimestamp(local, timezone.utc).replace(tzinfo=None))
+        # Una data nel futuro appartiene all'anno precedente
+        self.assertEqual(parse_log_timestamp(LINE, datetime(2027, 1, 2).timestamp()).year, 2026)
+        self.assertEqual(parse_log_timestamp("2026-10-18T10:00:01.250000+02:00 evorouter kernel: x"),
+                         datetime(2026, 10, 18, 8, 0, 1, 250000))
+        self.assertIsNone(parse_log_timestamp("evorouter rule=12 drop SRC=1.2.3.4 DST=5.6.7.8"))
+
+class LogIngestionTestCase(unittest.TestCase):
+    def setUp(self):
+        # Database in memoria dedicato, indipendente da quello dell'applicazione
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_batches_flush_on_size_and_interval(self):
+        now = [0.0]
+        ingestor = LogIngestor(batch_size=2, interval=1, clock=lambda: now[0])
+        ingestor.feed(parse_log_line(LINE.format(sport=1)))
+        ingestor.feed(parse_log_line(LINE.format(sport=1)))
+        self.assertEqual(FirewallLog.query.count(), 0)
+        ingestor.feed(parse_log_line(LINE.format(sport=2)))
+        self.assertEqual(FirewallLog.query.count(), 2)
+        ingestor.feed(parse_log_line(LINE.format(sport=3)))
+        now[0] = 1.5
+        self.assertTrue(ingestor.flush_due())
+        self.assertEqual(FirewallLog.query.count(), 3)
+
+    def test_replay_coalesces_repeated_flows(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            for i in range(3000):
+                f.write(LINE.format(sport=40000 + i % 100))
+                f.write("Oct 18 10:00:01 evorouter kernel: unrelated message\n")
+        try:
+            stats = replay_log_file(f.name, batch_size=500)
+        finally:
+            os.unlink(f.name)
+
+        self.assertEqual((stats['lines'], stats['events']), (6000, 3000))
+        self.assertGreater(stats['rate'], 0)
+        self.assertEqual(stats['rows'], FirewallLog.query.count())
+        self.assertEqual(db.session.query(db.func.sum(FirewallLog.packets)).scalar(), 3000)
+        self.assertEqual(db.session.query(db.func.sum(FirewallLog.bytes)).scalar(), 3000 * 60)
+        self.assertLessEqual(stats['rows'], 100)
+
+    def test_replay_keeps_log_time_and_splits_hours(self):
+        line = LINE.split(' evorouter kernel: ', 1)[1].format(sport=40000)
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as f:
+            for stamp in ('2026-10-18T10:00:01Z', '2026-10-18T10:59:00Z', '2026-10-18T11:00:30Z'):
+                f.write(f"{stamp} evorouter kernel: {line}")
+        try:
+            replay_log_file(f.name)
+        finally:
+            os.unlink(f.name)
+
+        rows = FirewallLog.query.order_by(FirewallLog.timestamp).all()
+        self.assertEqual([(row.timestamp, row.packets) for row in rows],
+                         [(datetime(2026, 10, 18, 10, 0, 1), 2), (datetime(2026, 10, 18, 11, 0, 30), 1)])
+
+    def test_failed_flush_keeps_the_batch(self):
+        ingestor = LogIngestor()
+        ingestor.feed(parse_log_line(LINE.format(sport=1)))
+        busy = OperationalError('INSERT', {}, Exception('database is locked'))
+        with mock.patch.object(db.session, 'execute', side_effect=busy):
+            with self.assertRaises(OperationalError):
+                ingestor.flush()
+        self.assertEqual(ingestor.flush(), 1)
+        self.assertEqual(FirewallLog.query.count(), 1)
+
+    def wait_for_rows(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while FirewallLog.query.count() < count and time.monotonic() < deadline:
+            db.session.remove()
+            time.sleep(0.05)
+        return FirewallLog.query.count()
+
+    def test_only_lock_holder_ingests(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = os.path.join(tmpdir, 'kern.log')
+            lock_path = os.path.join(tmpdir, 'ingest.lock')
+            open(source, 'w').close()
+            job = LogIngestionJob(self.app, path=source, lock_path=lock_path, retry_interval=0.05)
+            try:
+                # Un altro worker (simulato da un secondo descrittore) segue già il log
+                with open(lock_path, 'a') as owner:
+                    fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    job.start()
+                    time.sleep(0.2)
+                    with open(source, 'a') as f:
+                        f.write(LINE.format(sport=40000))
+                    time.sleep(1.5)
+                    self.assertEqual(FirewallLog.query.count(), 0)
+                # Il detentore termina: questo processo subentra dalla fine del file
+                time.sleep(0.3)
+                with open(source, 'a') as f:
+                    f.write(LINE.format(sport=40001))
+                self.assertEqual(self.wait_for_rows(1), 1)
+                self.assertEqual(FirewallLog.query.one().source_port, 40001)
+            finally:
+                job.stop()
+                release_lock(lock_path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from app import db
+from models import FirewallLog, FirewallLogHourly
+from utils.firewall_log import apply_log_retention, get_logs_page
+
+class FirewallLogTestCase(unittest.TestCase):
+    def setUp(self):
+        # Database in memoria dedicato, indipendente da quello dell'applicazione
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.now = datetime(2024, 5, 10, 12, 30)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_log(self, minutes_ago, **fields):
+        values = dict(source_ip='203.0.113.9', destination_ip='192.168.1.10', destination_port=22,
+                      protocol='tcp', action='drop', packets=1, bytes=60)
+        values.update(fields)
+        db.session.add(FirewallLog(timestamp=self.now - timedelta(minutes=minutes_ago), **values))
+
+    def test_keyset_pages_are_stable_and_filtered(self):
+        for i in range(5):
+            self.add_log(i, action='drop' if i % 2 else 'accept')
+        # Stesso timestamp: l'ordine deve usare anche l'id
+        self.add_log(1, action='drop', destination_port=443)
+        db.session.commit()
+
+        first = get_logs_page(action='drop', limit=2)
+        self.assertEqual([log.id for log in first['logs']], [6, 2])
+        second = get_logs_page(action='drop', before=first['next_cursor'], limit=2)
+        self.assertEqual([log.id for log in second['logs']], [4])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual([log.id for log in get_logs_page(port=443)['logs']], [6])
+
+    def test_old_rows_are_rolled_up_per_hour(self):
+        days = 7 * 24 * 60
+        self.add_log(days + 60, bytes=100)
+        self.add_log(days + 70, bytes=50)
+        self.add_log(days + 70, action='accept')
+        self.add_log(days + 10)  # ora a cavallo del limite: resta nei log
+        self.add_log(5)
+        db.session.commit()
+
+        self.assertEqual(apply_log_retention(retention_days=7, now=self.now), 3)
+        self.assertEqual(FirewallLog.query.count(), 2)
+        drops = FirewallLogHourly.query.filter_by(action='drop').one()
+        self.assertEqual((drops.hour, drops.events, drops.bytes), (datetime(2024, 5, 3, 11), 2, 150))
+        self.assertEqual(FirewallLogHourly.query.count(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from utils.interfaces import InterfaceMonitor, read_sysfs_interfaces
+
+
+def write_interface(root, name, operstate, address, speed=None, type_=1, wireless=False, rx_bytes=0, tx_bytes=0):
+    path = os.path.join(root, name)
+    os.makedirs(os.path.join(path, "statistics"), exist_ok=True)
+    attributes = {"operstate": operstate, "address": address, "type": str(type_)}
+    if speed is not None:
+        attributes["speed"] = str(speed)
+    for attribute, value in attributes.items():
+        with open(os.path.join(path, attribute), "w") as f:
+            f.write(value + "\n")
+    for counter, value in (("rx_bytes", rx_bytes), ("tx_bytes", tx_bytes), ("rx_packets", 10)):
+        with open(os.path.join(path, "statistics", counter), "w") as f:
+            f.write(f"{value}\n")
+    if wireless:
+        os.makedirs(os.path.join(path, "wireless"), exist_ok=True)
+
+
+class InterfaceMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        write_interface(self.root, "lo", "unknown", "00:00:00:00:00:00", type_=772)
+        write_interface(self.root, "eth0", "up", "aa:bb:cc:11:22:33", speed=1000, rx_bytes=5000, tx_bytes=700)
+        write_interface(self.root, "eth1", "down", "aa:bb:cc:11:22:34", speed=-1)
+        write_interface(self.root, "wlan0", "up", "aa:bb:cc:11:22:35", wireless=True)
+        self.addresses = {
+            "eth0": {"ipv4": [("192.168.1.1", "255.255.255.0")],
+                     "ipv6": [("fe80::1", 64), ("fd00::1", 64)]},
+        }
+        self.monitor = InterfaceMonitor(sysfs_reader=lambda: read_sysfs_interfaces(self.root),
+                                        address_reader=lambda: self.addresses,
+                                        interval=5, wan_interface="eth1", clock=lambda: 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_sysfs(self):
+        interfaces = read_sysfs_interfaces(self.root)
+        self.assertEqual(sorted(interfaces), ["eth0", "eth1", "lo", "wlan0"])
+        self.assertEqual(interfaces["eth0"]["speed"], 1000)
+        self.assertIsNone(interfaces["eth1"]["speed"])
+        self.assertIsNone(interfaces["wlan0"]["speed"])
+        self.assertEqual(interfaces["eth0"]["mac"], "AA:BB:CC:11:22:33")
+        self.assertEqual(interfaces["eth0"]["rx_bytes"], 5000)
+        self.assertEqual(interfaces["eth0"]["tx_errors"], 0)
+        self.assertTrue(interfaces["lo"]["loopback"])
+        self.assertTrue(interfaces["wlan0"]["wireless"])
+
+    def test_status_views(self):
+        self.assertTrue(self.monitor.refresh())
+        status = {interface["name"]: interface for interface in self.monitor.status()}
+        self.assertEqual(sorted(status), ["eth0", "eth1", "wlan0"])
+        eth0 = status["eth0"]
+        self.assertEqual((eth0["type"], eth0["state"], eth0["status"], eth0["speed"]), ("LAN", "UP", "up", "1 Gbps"))
+        self.assertEqual((eth0["ipv4_address"], eth0["ipv4_subnet"]), ("192.168.1.1", "255.255.255.0"))
+        # L'indirizzo globale precede quello link-local
+        self.assertEqual((eth0["ipv6_address"], eth0["ipv6_prefix"]), ("fd00::1", "64"))
+        self.assertEqual(eth0["rx_bytes"], 5000)
+        self.assertEqual((status["eth1"]["type"], status["eth1"]["status"]), ("WAN", "down"))
+        self.assertFalse(status["eth1"]["ipv4_enabled"])
+        self.assertEqual(status["wlan0"]["type"], "WiFi")
+
+        speed_test = {interface["name"]: interface for interface in self.monitor.speed_test_interfaces()}
+        self.assertNotIn("lo", speed_test)
+        self.assertEqual(speed_test["eth0"]["stats"]["bytes_recv"], 5000)
+        self.assertEqual(speed_test["eth0"]["addresses"][0],
+                         {"type": "ipv4", "address": "192.168.1.1", "netmask": "255.255.255.0"})
+
+    def test_change_detection(self):
+        self.monitor.refresh()
+        published = self.monitor.status()
+        # Nessuna modifica: la vista pubblicata resta la stessa
+        self.assertFalse(self.monitor.refresh())
+        self.assertIs(self.monitor.status(), published)
+
+        # Solo i contatori cambiano: nessun cambiamento di stato, ma contatori aggiornati
+        write_interface(self.root, "eth0", "up", "aa:bb:cc:11:22:33", speed=1000, rx_bytes=9000, tx_bytes=800)
+        self.assertFalse(self.monitor.refresh())
+        self.assertEqual(self.monitor.counters()["eth0"]["rx_bytes"], 9000)
+        eth0 = next(interface for interface in self.monitor.status() if interface["name"] == "eth0")
+        self.assertEqual((eth0["rx_bytes"], eth0["tx_bytes"]), (9000, 800))
+        speed_test = next(interface for interface in self.monitor.speed_test_interfaces() if interface["name"] == "eth0")
+        self.assertEqual(speed_test["stats"]["bytes_recv"], 9000)
+        published = self.monitor.status()
+
+        write_interface(self.root, "eth1", "up", "aa:bb:cc:11:22:34", speed=100, rx_bytes=10)
+        self.assertTrue(self.monitor.refresh())
+        self.assertIsNot(self.monitor.status(), published)
+        eth1 = next(interface for interface in self.monitor.status() if interface["name"] == "eth1")
+        self.assertEqual((eth1["status"], eth1["speed"], eth1["rx_bytes"]), ("up", "100 Mbps", 10))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from utils.metrics import MetricsSampler
+
+Counters = namedtuple('Counters', ['bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv',
+                                   'errin', 'errout', 'dropin', 'dropout'])
+
+class MetricsSamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sampler = MetricsSampler(interval=60)
+
+    def tearDown(self):
+        self.sampler.stop()
+
+    def test_start_publishes_snapshot(self):
+        self.sampler.start()
+        stats = self.sampler.get_stats()
+        self.assertIn('cpu', stats)
+        self.assertIn('memory', stats)
+        self.assertIn('hostname', stats['system'])
+        self.assertTrue(self.sampler.running)
+
+    def test_network_rates_from_counter_delta(self):
+        first = {'eth0': Counters(1000, 2000, 0, 0, 0, 0, 0, 0)}
+        second = {'eth0': Counters(3000, 6000, 0, 0, 0, 0, 0, 0)}
+        with mock.patch('utils.metrics.psutil.net_io_counters', side_effect=[first, second]), \
+             mock.patch('utils.metrics.time.monotonic', side_effect=[10.0, 12.0]):
+            self.sampler.sample()
+            self.assertEqual(self.sampler.get_network_usage(), {})
+            self.sampler.sample()
+
+        usage = self.sampler.get_network_usage()['eth0']
+        self.assertEqual(usage['bytes_sent'], 1000)
+        self.assertEqual(usage['bytes_recv'], 2000)
+        self.assertAlmostEqual(usage['mbits_recv'], 0.016)
+
+if __name__ == '__main__':
+    unittest.main()
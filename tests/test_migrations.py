@@ -0,0 +1,73 @@
+import unittest
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.schema import CreateTable
+
+from app import db
+from models import (CallRecording, InboundRoute, OutboundRoute, QoSRule, SystemLog,
+                    UPnPPortMapping, VoicemailMessage)
+from utils.migrations import MIGRATIONS, run_migrations
+
+class MigrationsTestCase(unittest.TestCase):
+    def setUp(self):
+        # Database "vecchio": tabelle create senza nessuno degli indici dichiarati
+        self.engine = create_engine('sqlite://')
+        with self.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                conn.execute(CreateTable(table))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def query_plan(self, statement):
+        sql = str(statement.compile(dialect=self.engine.dialect, compile_kwargs={'literal_binds': True}))
+        with self.engine.connect() as conn:
+            return ' | '.join(row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+
+    def test_migrations_are_applied_once(self):
+        self.assertEqual(inspect(self.engine).get_indexes('system_log'), [])
+        self.assertEqual(run_migrations(self.engine, db.metadata), [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(run_migrations(self.engine, db.metadata), [])
+
+        names = {index['name'] for index in inspect(self.engine).get_indexes('firewall_log')}
+        self.assertIn('ix_firewall_log_timestamp_id', names)
+
+    def test_hot_queries_use_indexes(self):
+        run_migrations(self.engine, db.metadata)
+        since = datetime(2025, 1, 1)
+        queries = {
+            'ix_system_log_log_type_timestamp':
+                select(SystemLog).where(SystemLog.log_type == 'security')
+                .order_by(SystemLog.timestamp.desc()).limit(50),
+            'ix_system_log_timestamp':
+                select(func.count()).select_from(SystemLog).where(SystemLog.timestamp < since),
+            'ix_call_recording_start_time':
+                select(CallRecording).where(CallRecording.start_time >= since),
+            'ix_call_recording_caller_start_time':
+                select(CallRecording).where(CallRecording.caller == '1001')
+                .order_by(CallRecording.start_time.desc()),
+            'ix_call_recording_callee_start_time':
+                select(CallRecording).where(CallRecording.callee == '1002')
+                .order_by(CallRecording.start_time.desc()),
+            'ix_voicemail_message_extension_id_listened_received_at':
+                select(func.count()).select_from(VoicemailMessage)
+                .where(VoicemailMessage.extension_id == 1, VoicemailMessage.listened.is_(False)),
+            'ix_inbound_route_did_number':
+                select(InboundRoute).where(InboundRoute.did_number == '0612345678'),
+            'ix_outbound_route_enabled_priority':
+                select(OutboundRoute).where(OutboundRoute.enabled.is_(True)).order_by(OutboundRoute.priority),
+            'ix_upnp_port_mapping_external_port_protocol':
+                select(UPnPPortMapping).where(UPnPPortMapping.external_port == 8080,
+                                              UPnPPortMapping.protocol == 'TCP'),
+            'ix_qos_rule_class_id_priority':
+                select(QoSRule).where(QoSRule.class_id == 1).order_by(QoSRule.priority),
+        }
+        for index, statement in queries.items():
+            with self.subTest(index=index):
+                plan = self.query_plan(statement)
+                self.assertIn(index, plan)
+                self.assertNotIn('USE TEMP B-TREE', plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import json
+import subprocess
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils.netconfig import (applied_steps, compile_pppoe_peer, interface_state, parse_default_routes, parse_links,
+                             plan_network, render_batch, render_rollback)
+from utils.network import apply_network_steps
+
+ADDRESSES = json.dumps([
+    {"ifname": "lo", "flags": ["LOOPBACK", "UP"], "addr_info": [
+        {"family": "inet", "local": "127.0.0.1", "prefixlen": 8, "scope": "host"}]},
+    {"ifname": "eth0", "flags": ["BROADCAST", "UP"], "addr_info": [
+        {"family": "inet", "local": "192.168.1.1", "prefixlen": 24, "scope": "global"},
+        {"family": "inet6", "local": "fd00::1", "prefixlen": 64, "scope": "global"},
+        {"family": "inet6", "local": "2001:db8::aa", "prefixlen": 64, "scope": "global", "dynamic": True},
+        {"family": "inet6", "local": "fe80::1", "prefixlen": 64, "scope": "link"}]},
+    {"ifname": "eth1", "flags": ["BROADCAST", "UP"], "addr_info": [
+        {"family": "inet", "local": "203.0.113.2", "prefixlen": 24, "scope": "global", "dynamic": True}]},
+    {"ifname": "eth2", "flags": ["BROADCAST"], "addr_info": []},
+])
+
+ROUTES = json.dumps([{"dst": "default", "gateway": "203.0.113.1", "dev": "eth1", "protocol": "dhcp"}])
+
+# IPv6 statico di eth0, invariato quando cambia solo l'IPv4
+ETH0_IPV6 = dict(ipv6_enabled=True, ipv6_mode='static', ipv6_address='fd00::1')
+
+def make_config(name, **fields):
+    values = dict(interface_name=name, is_active=True, ipv4_enabled=True, ipv4_mode='static',
+                  ipv4_address=None, ipv4_subnet_mask=None, ipv4_gateway=None,
+                  ipv6_enabled=False, ipv6_mode='auto', ipv6_address=None, ipv6_prefix_length=64, ipv6_gateway=None)
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+def live_state():
+    links = parse_links(ADDRESSES)
+    parse_default_routes(ROUTES, "4", links)
+    return links
+
+class NetworkPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.desired = {
+            'eth0': interface_state(make_config('eth0', ipv4_address='192.168.1.1', ipv4_subnet_mask='255.255.255.0',
+                                                **dict(ETH0_IPV6, ipv6_address='fd00:0::1'))),
+            'eth1': interface_state(make_config('eth1', ipv4_mode='dhcp')),
+        }
+
+    def test_live_state(self):
+        links = live_state()
+        self.assertEqual(links['eth0']['addresses'], {'4': {'192.168.1.1/24'}, '6': {'fd00::1/64'}})
+        self.assertEqual(links['eth1']['addresses']['4'], set())
+        self.assertEqual(links['eth1']['gateways'], {'4': '203.0.113.1'})
+        self.assertFalse(links['eth2']['up'])
+
+    def test_unchanged_configuration_has_no_commands(self):
+        self.assertEqual(plan_network(self.desired, live_state()), [])
+
+    def test_only_the_changed_interface_is_touched(self):
+        self.desired['eth0'] = interface_state(make_config('eth0', ipv4_address='10.0.0.1',
+                                                           ipv4_subnet_mask='255.255.0.0', ipv4_gateway='10.0.0.254',
+                                                           **ETH0_IPV6))
+        steps = plan_network(self.desired, live_state())
+        self.assertEqual(render_batch(steps).splitlines(), [
+            'address del 192.168.1.1/24 dev eth0',
+            'address add 10.0.0.1/16 dev eth0',
+            'route replace default via 10.0.0.254 dev eth0 proto static',
+        ])
+        # L'IPv6 invariato e la WAN in DHCP non vengono toccati
+        self.assertNotIn('eth1', render_batch(steps))
+
+        # Limitando il piano a un'altra interfaccia non c'è nulla da fare
+        self.assertEqual(plan_network(self.desired, live_state(), ['eth1']), [])
+
+    def test_rollback_of_applied_steps(self):
+        self.desired['eth0'] = interface_state(make_config('eth0', ipv4_address='10.0.0.1', **ETH0_IPV6))
+        self.desired['eth2'] = interface_state(make_config('eth2', ipv4_address='10.1.0.1'))
+        steps = plan_network(self.desired, live_state())
+        self.assertEqual(len(steps), 4)
+
+        # Il terzo comando fallisce: si annullano i primi due, dall'ultimo
+        self.assertEqual(applied_steps(steps, 'RTNETLINK answers: File exists\nCommand failed -:3'), 2)
+        self.assertEqual(render_rollback(steps, 2).splitlines(), [
+            'address del 10.0.0.1/24 dev eth0',
+            'address add 192.168.1.1/24 dev eth0',
+        ])
+
+    def test_leaving_static_mode_removes_static_address_and_route(self):
+        links = live_state()
+        links['eth0']['gateways']['4'] = links['eth0']['static_gateways']['4'] = '192.168.1.254'
+        self.desired['eth0'] = interface_state(make_config('eth0', ipv4_mode='dhcp', ipv6_enabled=True,
+                                                           ipv6_mode='slaac'))
+        steps = plan_network(self.desired, links)
+        # Gli indirizzi dinamici e la route del client DHCP della WAN restano
+        self.assertEqual(render_batch(steps).splitlines(), [
+            'route del default via 192.168.1.254 dev eth0',
+            'address del 192.168.1.1/24 dev eth0',
+            'address del fd00::1/64 dev eth0',
+        ])
+        self.assertEqual(render_rollback(steps, 1),
+                         'route replace default via 192.168.1.254 dev eth0 proto static\n')
+
+    def test_disabled_ipv6_removes_static_address_and_route(self):
+        links = live_state()
+        links['eth0']['gateways']['6'] = links['eth0']['static_gateways']['6'] = 'fd00::fe'
+        self.desired['eth0'] = interface_state(make_config('eth0', ipv4_address='192.168.1.1', ipv6_enabled=False))
+        # L'indirizzo dinamico (SLAAC) resta
+        self.assertEqual(render_batch(plan_network(self.desired, links)).splitlines(), [
+            'route del default via fd00::fe dev eth0',
+            'address del fd00::1/64 dev eth0',
+        ])
+
+    def test_pppoe_peer_keeps_the_credentials(self):
+        peer = compile_pppoe_peer('eth1', 'user@isp.it', 'pa"ss', 'fibra')
+        self.assertIn('nic-eth1\n', peer)
+        self.assertIn('rp_pppoe_service "fibra"\n', peer)
+        self.assertIn('user "user@isp.it"\npassword "pa\\"ss"\n', peer)
+
+    def test_missing_interface(self):
+        self.desired['eth9'] = interface_state(make_config('eth9', ipv4_address='10.0.0.1'))
+        with self.assertRaises(ValueError):
+            plan_network(self.desired, live_state())
+
+    def test_failed_batch_is_rolled_back(self):
+        self.desired['eth0'] = interface_state(make_config('eth0', ipv4_address='10.0.0.1', **ETH0_IPV6))
+        steps = plan_network(self.desired, live_state())
+        failed = subprocess.CompletedProcess([], 2, '', 'RTNETLINK answers: Invalid argument\nCommand failed -:2')
+        rolled_back = subprocess.CompletedProcess([], 0, '', '')
+        with mock.patch('utils.network._run_command', side_effect=[failed, rolled_back]) as run:
+            success, error = apply_network_steps(steps)
+        self.assertFalse(success)
+        self.assertIn('Invalid argument', error)
+        self.assertEqual(run.call_args_list[1], mock.call(['ip', '-force', '-batch', '-'],
+                                                          'address add 192.168.1.1/24 dev eth0\n'))
+
+if __name__ == '__main__':
+    unittest.main()
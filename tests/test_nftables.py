@@ -0,0 +1,138 @@
+import json
+import unittest
+from types import SimpleNamespace
+
+from utils.nftables import (build_ruleset, compile_ruleset, compile_rule, compile_port_forwarding,
+                            collapse_networks, diff_chain, diff_ruleset, iter_json_strings)
+
+def zone(id, name, interfaces, policy='drop', masquerade=False, mss_clamping=False, priority=0):
+    return SimpleNamespace(id=id, name=name, interfaces=interfaces, default_policy=policy,
+                           masquerade=masquerade, mss_clamping=mss_clamping, priority=priority)
+
+def rule(id, zone_id, **fields):
+    values = dict(source='any', destination='any', protocol='all', src_port='any', dst_port='any',
+                  action='accept', log=False, enabled=True, priority=0)
+    values.update(fields)
+    return SimpleNamespace(id=id, zone_id=zone_id, **values)
+
+class NftablesCompilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.zones = [zone(1, 'wan', 'eth1,wwan0', masquerade=True), zone(2, 'lan', 'br0', policy='accept')]
+
+    def test_rule_matches(self):
+        compiled = compile_rule(rule(7, 1, source='10.0.0.0/8', protocol='tcp', dst_port='80,443',
+                                     action='drop', log=True), {}, {})
+        self.assertEqual(compiled, 'ip saddr 10.0.0.0/8 tcp dport { 80, 443 } '
+                                   'counter log prefix "evorouter rule=7 drop " drop comment "rule:7"')
+        compiled = compile_rule(rule(8, 1, destination='2001:db8::1', protocol='tcp,udp',
+                                     dst_port='1000-2000'), {}, {})
+        self.assertEqual(compiled, 'ip6 daddr 2001:db8::1 meta l4proto { tcp, udp } '
+                                   'th dport 1000-2000 counter accept comment "rule:8"')
+
+    def test_port_forwarding(self):
+        forward = SimpleNamespace(id=3, source_zone='wan', protocol='tcp', src_dip=None,
+                                  src_port='8080', dest_ip='192.168.1.10', dest_port='80', enabled=True)
+        dnat, accept = compile_port_forwarding(forward, {z.name: z for z in self.zones})
+        self.assertEqual(dnat, 'iifname { "eth1", "wwan0" } tcp dport 8080 '
+                               'dnat ip to 192.168.1.10:80 comment "forward:3"')
+        self.assertEqual(accept, 'ip daddr 192.168.1.10 tcp dport 80 ct status dnat accept comment "forward:3"')
+
+    def test_ruleset_is_one_atomic_script_in_priority_order(self):
+        rules = [rule(1, 1, priority=5, action='drop', source='@blocklist'),
+                 rule(2, 1, priority=1, protocol='tcp', dst_port='@web'),
+                 rule(3, 1, enabled=False)]
+        ipsets = [SimpleNamespace(name='blocklist', type='hash:net',
+                                  addresses=json.dumps(['203.0.113.0/24', '198.51.100.7', 'bogus']))]
+        groups = [SimpleNamespace(name='web', services=json.dumps(['tcp:80', 'tcp:443']))]
+
+        script = compile_ruleset(self.zones, rules, [], ipsets, groups)
+        lines = script.splitlines()
+
+        self.assertEqual(lines[:3], ['table inet evorouter', 'delete table inet evorouter',
+                                     'table inet evorouter {'])
+        self.assertIn('\t\telements = { 198.51.100.7, 203.0.113.0/24 }', lines)
+        self.assertIn('\t\telements = { tcp . 80, tcp . 443 }', lines)
+        forward_wan = lines[lines.index('\tchain forward_wan {') + 1:]
+        self.assertEqual(forward_wan[:3], [
+            '\t\tmeta l4proto tcp meta l4proto . th dport @svc_web counter accept comment "rule:2"',
+            '\t\tip saddr @blocklist counter drop comment "rule:1"',
+            '\t\tdrop',
+        ])
+        self.assertNotIn('rule:3', script)
+        self.assertIn('\t\tiifname "br0" jump forward_lan', lines)
+        self.assertIn('\t\toifname { "eth1", "wwan0" } masquerade comment "zone:1"', lines)
+
+class IPSetLoadingTestCase(unittest.TestCase):
+    def test_adjacent_networks_are_collapsed(self):
+        entries = iter_json_strings(json.dumps(['10.0.0.0/25', ' 10.0.0.128/25', '10.0.0.7', '10.0.1.1']))
+        self.assertEqual(collapse_networks(entries), ('ip', ['10.0.0.0/24', '10.0.1.1']))
+
+    def test_malformed_list_is_ignored(self):
+        # Un elenco troncato non deve caricare metà degli indirizzi
+        self.assertEqual(list(iter_json_strings('["10.0.0.1", "10.0.0.2"')), [])
+        self.assertEqual(list(iter_json_strings('"10.0.0.1"')), [])
+
+    def test_changed_set_is_reloaded_in_bulk(self):
+        zones = [zone(1, 'wan', 'eth1')]
+        ipset = SimpleNamespace(name='blocklist', type='hash:ip', addresses=json.dumps(['192.0.2.1']))
+        state = build_ruleset(zones, [], [], [ipset]).to_state()
+        ipset.addresses = json.dumps([f'198.51.100.{i}' for i in (1, 3, 5, 7)] + ['192.0.2.1'])
+
+        commands = diff_ruleset(state, build_ruleset(zones, [], [], [ipset]), {})
+        self.assertEqual(commands, [
+            'flush set inet evorouter blocklist',
+            'add element inet evorouter blocklist { 192.0.2.1, 198.51.100.1, 198.51.100.3, '
+            '198.51.100.5, 198.51.100.7 }',
+        ])
+
+class NftablesDiffTestCase(unittest.TestCase):
+    def setUp(self):
+        self.zones = [zone(1, 'wan', 'eth1')]
+        self.rules = [rule(i, 1, priority=i, dst_port=str(1000 + i), protocol='tcp') for i in range(1, 4)]
+        self.state = build_ruleset(self.zones, self.rules, []).to_state()
+        # Handle fittizi come restituiti da "nft -a -j list table"
+        self.handles = {name: [(100 * n + i, rule_text.split('comment "')[-1].rstrip('"')
+                                if 'comment' in rule_text else None)
+                               for i, rule_text in enumerate(rules)]
+                        for n, (name, rules) in enumerate(self.state['chains'].items())}
+        self.forward_handles = [h for h, _ in self.handles['forward_wan']]
+
+    def diff(self, rules, zones=None):
+        return diff_ruleset(self.state, build_ruleset(zones or self.zones, rules, []), self.handles)
+
+    def test_unchanged_ruleset_needs_no_commands(self):
+        self.assertEqual(self.diff(self.rules), [])
+
+    def test_edit_replaces_only_that_rule(self):
+        self.rules[1].dst_port = '22'
+        commands = self.diff(self.rules)
+        self.assertEqual(commands, [f'replace rule inet evorouter forward_wan handle {self.forward_handles[1]} '
+                                    'tcp dport 22 counter accept comment "rule:2"'])
+
+    def test_insert_and_delete_by_handle(self):
+        rules = [self.rules[0], rule(9, 1, priority=2, action='drop'), self.rules[2]]
+        commands = self.diff(rules)
+        self.assertEqual(commands, [
+            f'delete rule inet evorouter forward_wan handle {self.forward_handles[1]}',
+            f'insert rule inet evorouter forward_wan position {self.forward_handles[2]} counter drop comment "rule:9"',
+        ])
+
+    def test_moved_rule_is_reinserted(self):
+        self.rules[0].priority = 10
+        commands = diff_chain('forward_wan', self.state['chains']['forward_wan'],
+                              build_ruleset(self.zones, self.rules, []).chains['forward_wan']['rules'],
+                              self.forward_handles)
+        self.assertEqual(commands, [
+            f'delete rule inet evorouter forward_wan handle {self.forward_handles[0]}',
+            f'insert rule inet evorouter forward_wan position {self.forward_handles[3]} '
+            'tcp dport 1001 counter accept comment "rule:1"',
+        ])
+
+    def test_new_chain_or_stale_state_requires_full_apply(self):
+        self.assertIsNone(self.diff(self.rules, self.zones + [zone(2, 'lan', 'br0')]))
+        self.handles['forward_wan'][0] = (1, 'rule:42')
+        self.rules[1].dst_port = '22'
+        self.assertIsNone(self.diff(self.rules))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils import qos
+
+def compiled(batch):
+    return {"devices": ["eth1"], "ifb": None, "batch": batch, "ruleset": "table inet evorouter_qos {}\n"}
+
+class QoSApplyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmpdir.name, 'qos_state.json')
+        self.qos_config = SimpleNamespace(interface='eth1', download_bandwidth=0, upload_bandwidth=1000)
+        self.batches = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def apply(self, batch, failing=()):
+        def execute(command, input_data=None, quiet=False):
+            if command[:2] == [qos.TC_PATH, '-batch']:
+                self.batches.append(input_data)
+                return input_data not in failing, ''
+            return True, ''
+
+        with mock.patch.object(qos, 'QOS_STATE_PATH', self.state_path), \
+                mock.patch.object(qos, 'compile_qos_config', return_value=compiled(batch)), \
+                mock.patch.object(qos, 'configure_stats_collector'), \
+                mock.patch.object(qos, 'execute_command', side_effect=execute):
+            return qos.apply_qos_config(self.qos_config)
+
+    def test_failed_batch_restores_previous_shaper(self):
+        self.assertTrue(self.apply('qdisc add dev eth1 root cake bandwidth 1000kbit\n'))
+        # Il batch nuovo fallisce a metà: si riapplica quello precedente
+        new = 'qdisc add dev eth1 root cake bandwidth 2000kbit\n'
+        self.assertFalse(self.apply(new, failing=(new,)))
+        self.assertEqual(self.batches[-2:], [new, 'qdisc add dev eth1 root cake bandwidth 1000kbit\n'])
+        self.assertEqual(qos.load_applied_state(self.state_path)['batch'],
+                         'qdisc add dev eth1 root cake bandwidth 1000kbit\n')
+
+    def test_teardown_removes_the_ifb_device(self):
+        commands = []
+
+        def execute(command, input_data=None, quiet=False):
+            commands.append(command)
+            return True, ''
+
+        with mock.patch.object(qos, 'execute_command', side_effect=execute), \
+                mock.patch.object(qos.os.path, 'exists', return_value=True):
+            qos.teardown_interface('eth1')
+        ifb = qos.ifb_device('eth1')
+        self.assertIn([qos.TC_PATH, 'qdisc', 'del', 'dev', 'eth1', 'ingress'], commands)
+        self.assertEqual(commands[-1], [qos.IP_PATH, 'link', 'del', 'dev', ifb])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from utils.qos_calibration import bisect_rate, calibrate
+
+class SimulatedLink:
+    """
+    Collegamento con un buffer sovradimensionato nel modem
+
+    Finché lo shaper resta sotto ``usable`` della capacità la coda si forma
+    nel router (fq_codel la tiene a pochi ms); oltre, il buffer del modem si
+    riempie e la latenza cresce con il tempo di svuotamento del buffer.
+    """
+
+    def __init__(self, capacities, rtt=20.0, buffer_ms=250.0, usable=0.92):
+        self.capacities = capacities
+        self.rtt = rtt
+        self.buffer_ms = buffer_ms
+        self.usable = usable
+
+    def idle_latency(self):
+        return self.rtt
+
+    def capacity(self, direction):
+        return self.capacities[direction]
+
+    def loaded_latency(self, direction, rate):
+        capacity = self.capacities[direction]
+        limit = capacity * self.usable
+        if rate <= limit:
+            return self.rtt + 5.0
+        overload = min((rate - limit) / (capacity - limit), 1.0)
+        return self.rtt + 5.0 + self.buffer_ms * overload
+
+class QoSCalibrationTestCase(unittest.TestCase):
+    def test_calibration_finds_highest_rate_within_target(self):
+        probe = SimulatedLink({"upload": 20000, "download": 100000})
+        progress = []
+        result = calibrate(probe, target=15, steps=6, progress=lambda value, message: progress.append(value))
+
+        self.assertEqual(result["baseline"], 20.0)
+        for direction, capacity in (("upload", 20000), ("download", 100000)):
+            calibrated = result[direction]
+            self.assertTrue(calibrated["within_target"])
+            self.assertLessEqual(calibrated["latency"] - 20.0, 15)
+            # Entro la risoluzione della bisezione dal punto in cui il modem inizia ad accodare
+            self.assertGreaterEqual(calibrated["rate"], capacity * 0.92)
+            self.assertLessEqual(calibrated["rate"], capacity * 0.92 + capacity / 2 ** 7 + capacity * 0.08 * 15 / 250)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 100)
+
+    def test_link_without_bufferbloat_is_not_reduced(self):
+        measured = []
+        result = bisect_rate(lambda rate: measured.append(rate) or 25.0, 50000, baseline=20.0, target=15)
+        self.assertEqual(result["rate"], 50000)
+        self.assertEqual(measured, [50000])
+
+    def test_lower_bound_proposed_when_target_unreachable(self):
+        result = bisect_rate(lambda rate: 300.0, 10000, baseline=20.0, target=15, steps=3, min_fraction=0.5)
+        self.assertFalse(result["within_target"])
+        self.assertEqual(result["rate"], 5000)
+        self.assertEqual(len(result["measurements"]), 5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import unittest
+
+from utils.qos import QoSStatsCollector
+from utils.tc import parse_class_stats
+
+def htb_class(handle, nbytes, drops=0, overlimits=0, backlog=0):
+    return {"class": "htb", "handle": handle, "parent": "1:1", "prio": 0,
+            "rate": 1000000, "ceil": 1000000, "bytes": nbytes, "packets": nbytes // 1000,
+            "drops": drops, "overlimits": overlimits, "requeues": 0, "backlog": backlog, "qlen": 0}
+
+def counters(nbytes, drops=0, overlimits=0, backlog=0):
+    return {"bytes": nbytes, "packets": nbytes // 1000, "drops": drops,
+            "overlimits": overlimits, "backlog": backlog, "qlen": 0}
+
+class QoSStatsTestCase(unittest.TestCase):
+    def test_parse_htb_classes_and_cake_root(self):
+        output = json.dumps([
+            htb_class("1:1", 9000),
+            htb_class("1:101", 6000, drops=2, backlog=1514),
+            htb_class("1:103", 3000),
+            htb_class("101:1", 7),
+        ])
+        stats = parse_class_stats(output)
+        self.assertEqual(sorted(stats, key=str), [1, 3, "total"])
+        self.assertEqual(stats[1]["drops"], 2)
+        self.assertEqual(stats[1]["backlog"], 1514)
+        self.assertEqual(stats["total"]["bytes"], 9000)
+
+        cake = json.dumps([{"kind": "cake", "handle": "8001:", "root": True, "bytes": 500,
+                            "packets": 5, "drops": 1, "overlimits": 3, "backlog": 0, "qlen": 0}])
+        self.assertEqual(parse_class_stats(cake)["total"]["overlimits"], 3)
+
+    def test_collector_reads_once_per_interval_and_keeps_history(self):
+        samples = {
+            "eth0": [{"total": counters(0), 1: counters(0)},
+                     {"total": counters(50000), 1: counters(50000, drops=10)},
+                     {"total": counters(100), 1: counters(100)}],
+            "ifb4eth0": [{"total": counters(0), 1: counters(0)},
+                         {"total": counters(250000), 1: counters(250000, backlog=3000)},
+                         {"total": counters(250000), 1: counters(250000)}],
+        }
+        reads = []
+        now = [0.0]
+
+        def reader(device, hierarchical):
+            reads.append(device)
+            return samples[device][reads.count(device) - 1]
+
+        collector = QoSStatsCollector(interval=5, history=3600, reader=reader,
+                                      clock=lambda: now[0], wallclock=lambda: 1000 + now[0])
+        self.assertIsNone(collector.get())
+        collector.configure("eth0", "ifb4eth0", True, {1: "high"})
+
+        self.assertEqual(collector.get()["upload"]["current"], 0)
+        now[0] = 2
+        collector.get()
+        self.assertEqual(len(reads), 2)
+
+        now[0] = 10
+        usage = collector.get()
+        self.assertEqual(usage["status"], "running")
+        self.assertEqual(usage["upload"]["current"], 40)
+        self.assertEqual(usage["download"]["current"], 200)
+        self.assertEqual(usage["classes"]["high"],
+                         {"download": 200, "upload": 40, "backlog": 3000, "drops": 1.0, "overlimits": 0.0})
+
+        # Classi ricreate: i contatori ripartono da zero, il picco resta nello storico
+        now[0] = 20
+        usage = collector.get()
+        self.assertEqual(usage["upload"]["current"], 0)
+        self.assertEqual(usage["upload"]["peak"], 40)
+
+        history = collector.history()
+        self.assertEqual(history["timestamps"], [1010, 1020])
+        self.assertEqual(history["download"], [200, 0])
+        self.assertEqual(history["classes"]["high"]["upload"], [40, 0])
+
+    def test_collector_reports_missing_shaper(self):
+        collector = QoSStatsCollector(interval=5, reader=lambda device, hierarchical: None)
+        collector.configure("eth0", None, False, {})
+        self.assertEqual(collector.get()["status"], "error")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from app import app, db
+from models import FirewallRule, FirewallZone, QoSClass, QoSConfig, QoSRule
+from tests.query_budget import QueryBudgetMixin
+
+class QueryBudgetTestCase(QueryBudgetMixin, unittest.TestCase):
+    """Le pagine elenco eseguono lo stesso numero di query con 1 o 100 righe"""
+
+    # Dimensioni dei dati: 1 o 10 classi/zone con 1 o 10 regole ciascuna (fino a 100 righe)
+    SIZES = (1, 10)
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = '1'
+            session['_fresh'] = True
+
+    def tearDown(self):
+        self.clear()
+
+    def populate(self, size):
+        with app.app_context():
+            config = QoSConfig(enabled=False, interface='eth0', download_bandwidth=10000,
+                               upload_bandwidth=1000, default_class='class0', hierarchical=True)
+            db.session.add(config)
+            for i in range(size):
+                qos_class = QoSClass(config=config, name=f'class{i}', priority=i + 1,
+                                     min_bandwidth=10, max_bandwidth=100)
+                db.session.add(qos_class)
+                for j in range(size):
+                    db.session.add(QoSRule(traffic_class=qos_class, name=f'rule{i}-{j}', protocol='tcp',
+                                           dst_port=str(1000 + j), priority=j, direction='both'))
+            for i in range(size):
+                zone = FirewallZone(name=f'zone{i}', interfaces='eth0', default_policy='drop', priority=1)
+                db.session.add(zone)
+                for j in range(size):
+                    db.session.add(FirewallRule(zone=zone, name=f'zone{i}-{j}', action='accept',
+                                                protocol='tcp', dst_port=str(j + 1), priority=j))
+            db.session.commit()
+            return {'class_id': QoSClass.query.first().id, 'rule_id': QoSRule.query.first().id}
+
+    def clear(self):
+        with app.app_context():
+            for model in (QoSRule, QoSClass, QoSConfig, FirewallRule, FirewallZone):
+                model.query.delete()
+            db.session.commit()
+
+    def assertPageBudgets(self, pages):
+        """
+        Rende ogni pagina con entrambe le dimensioni dei dati: il numero di
+        query deve restare nel budget ed essere lo stesso (niente N+1)
+        """
+        counts = {}
+        for size in self.SIZES:
+            ids = self.populate(size)
+            for url, budget in pages:
+                with self.assertQueryBudget(budget) as statements:
+                    response = self.client.get(url.format(**ids))
+                self.assertEqual(response.status_code, 200, url)
+                counts.setdefault(url, []).append(len(statements))
+            self.clear()
+        for url, sizes in counts.items():
+            self.assertEqual(len(set(sizes)), 1, f"{url}: {sizes} queries with {self.SIZES} rows")
+
+    def test_qos_pages(self):
+        self.assertPageBudgets([
+            ('/qos/', 5),
+            ('/qos/classes', 4),
+            ('/qos/rules', 4),
+            ('/qos/classes/{class_id}/edit', 2),
+            ('/qos/rules/{rule_id}/edit', 3),
+        ])
+
+    def test_firewall_pages(self):
+        self.assertPageBudgets([
+            ('/firewall/', 3),
+            ('/firewall/zones', 3),
+            ('/firewall/rules', 3),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import unittest
+
+from utils.firewall import RuleCounterCache
+from utils.nftables import parse_rule_counters
+
+def rule(comment, packets, nbytes):
+    return {"rule": {"family": "inet", "table": "evorouter", "chain": "forward_wan", "handle": 5,
+                     "comment": comment,
+                     "expr": [{"match": {"op": "==", "left": {"payload": {"protocol": "tcp", "field": "dport"}},
+                                         "right": 22}},
+                              {"counter": {"packets": packets, "bytes": nbytes}},
+                              {"drop": None}]}}
+
+class RuleCountersTestCase(unittest.TestCase):
+    def test_parse_counters_by_rule_id(self):
+        output = json.dumps({"nftables": [
+            {"metainfo": {"json_schema_version": 1}},
+            {"chain": {"family": "inet", "table": "evorouter", "name": "forward_wan"}},
+            rule("rule:3", 10, 600),
+            rule("forward:1", 99, 9900),
+            rule(None, 1, 1),
+        ]})
+        self.assertEqual(parse_rule_counters(output), {3: (10, 600)})
+
+    def test_cache_reads_once_per_ttl_and_computes_rates(self):
+        samples = [{1: (100, 1000)}, {1: (300, 5000)}, {1: (10, 100)}]
+        reads = []
+        now = [0.0]
+
+        def reader():
+            reads.append(now[0])
+            return samples[len(reads) - 1]
+
+        cache = RuleCounterCache(ttl=5, reader=reader, clock=lambda: now[0])
+        self.assertIsNone(cache.get()[1]['pps'])
+        now[0] = 2
+        cache.get()
+        self.assertEqual(len(reads), 1)
+
+        now[0] = 10
+        stats = cache.get()[1]
+        self.assertEqual((stats['packets'], stats['pps'], stats['bps']), (300, 20.0, 400.0))
+
+        # Regola sostituita: i contatori ripartono da zero
+        now[0] = 20
+        self.assertEqual(cache.get()[1]['pps'], 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from utils.sql_profiler import BACKGROUND_ENDPOINT, SQLProfiler
+
+class SQLProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.app = Flask(__name__)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmpdir.name, 'slow.log')
+
+        # Ogni chiamata al clock avanza di 10 ms, la query "lenta" di 300 ms
+        self.now = [0.0]
+        self.step = [0.01]
+
+        def clock():
+            self.now[0] += self.step[0]
+            return self.now[0]
+
+        self.profiler = SQLProfiler(self.app, self.engine, slow_query_ms=100,
+                                    slow_query_log=self.log_path, top=2, clock=clock)
+
+        @self.app.route('/three')
+        def three():
+            with self.engine.connect() as conn:
+                for _ in range(3):
+                    conn.execute(text('SELECT 1'))
+            return 'ok'
+
+        @self.app.route('/slow')
+        def slow():
+            with self.engine.connect() as conn:
+                self.step[0] = 0.3
+                conn.execute(text('SELECT 2'))
+                self.step[0] = 0.01
+            return 'ok'
+
+    def tearDown(self):
+        for handler in list(self.profiler.slow_log.handlers):
+            if getattr(handler, 'baseFilename', None) == os.path.abspath(self.log_path):
+                self.profiler.slow_log.removeHandler(handler)
+                handler.close()
+        self.tmpdir.cleanup()
+
+    def test_statements_are_attributed_to_endpoints(self):
+        client = self.app.test_client()
+        response = client.get('/three')
+        self.assertIn('3 queries', response.headers['Server-Timing'])
+        client.get('/three')
+        client.get('/slow')
+        with self.engine.connect() as conn:
+            conn.execute(text('SELECT 3'))
+
+        endpoints = {e['endpoint']: e for e in self.profiler.snapshot()['endpoints']}
+        self.assertEqual(list(endpoints)[0], 'slow')
+        self.assertEqual((endpoints['three']['requests'], endpoints['three']['queries'],
+                          endpoints['three']['max_queries']), (2, 6, 3))
+        self.assertEqual(len(endpoints['three']['slowest']), 2)
+        self.assertEqual(endpoints['slow']['slowest'][0]['statement'], 'SELECT 2')
+        self.assertEqual(endpoints[BACKGROUND_ENDPOINT]['queries'], 1)
+
+        with open(self.log_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('endpoint=slow SELECT 2', lines[0])
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.snapshot()['endpoints'], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from sqlalchemy import inspect
+
+from app import create_app, db, init_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduli pesanti che un worker non deve importare all'avvio
+DEFERRED_MODULES = ('stripe', 'requests', 'multiprocessing', 'xml.etree.ElementTree')
+
+# Tetto largo per il tempo di import all'avvio di un worker (regressioni grossolane)
+STARTUP_IMPORT_BUDGET_MS = 5000
+
+def import_times(code):
+    """
+    Esegue code in un interprete nuovo con -X importtime
+
+    Returns:
+        dict: modulo -> (tempo cumulativo in µs, True se importato al primo livello)
+    """
+    env = dict(os.environ, DATABASE_URL='sqlite://', DB_INIT_ON_STARTUP='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr[-2000:])
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(cumulative), not name[1:].startswith(' '))
+    return modules
+
+class StartupTestCase(unittest.TestCase):
+    def test_importing_the_module_does_not_build_the_app(self):
+        modules = import_times('import app')
+        self.assertNotIn('models', modules)
+        self.assertEqual([name for name in modules if name.startswith('routes.')], [])
+
+    def test_create_app_defers_heavy_modules(self):
+        modules = import_times("import app; app.create_app({'START_BACKGROUND_JOBS': False})")
+        self.assertIn('routes.payments', modules)
+        self.assertIn('routes.speed_test', modules)
+        for name in DEFERRED_MODULES:
+            self.assertNotIn(name, modules)
+
+        total_ms = sum(cumulative for cumulative, top_level in modules.values() if top_level) / 1000
+        self.assertLess(total_ms, STARTUP_IMPORT_BUDGET_MS)
+
+    def test_schema_is_created_only_on_request(self):
+        with tempfile.TemporaryDirectory() as directory:
+            url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+            app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'DB_INIT_ON_STARTUP': False,
+                              'START_BACKGROUND_JOBS': False})
+            with app.app_context():
+                self.assertEqual(inspect(db.engine).get_table_names(), [])
+
+            init_database(app)
+            with app.app_context():
+                self.assertIn('schema_migration', inspect(db.engine).get_table_names())
+                self.assertIn('user', inspect(db.engine).get_table_names())
+                db.engine.dispose()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import unittest
+
+from utils.streaming import REMOVED, EventBroadcaster, diff_snapshot, merge_delta
+
+class SnapshotDiffTestCase(unittest.TestCase):
+    def test_diff_then_merge_rebuilds_snapshot(self):
+        previous = {'cpu': {'usage': 10, 'count': 4}, 'eth0': {'rx': 1}}
+        current = {'cpu': {'usage': 25, 'count': 4}, 'eth1': {'rx': 2}}
+        delta = diff_snapshot(previous, current)
+        self.assertEqual(delta, {'cpu': {'usage': 25}, 'eth1': {'rx': 2}, REMOVED: ['eth0']})
+        self.assertEqual(merge_delta(json.loads(json.dumps(previous)), delta), current)
+
+    def test_none_is_a_value(self):
+        previous = {'freeswitch': {'running': True}, 'wan': {'speed': 1000}}
+        current = {'freeswitch': None, 'wan': {'speed': None}}
+        delta = diff_snapshot(previous, current)
+        self.assertEqual(delta, {'freeswitch': None, 'wan': {'speed': None}})
+        self.assertEqual(merge_delta(json.loads(json.dumps(previous)), delta), current)
+
+class EventBroadcasterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.value = 0
+        self.calls = 0
+        self.broadcaster = EventBroadcaster(self.produce)
+
+    def produce(self):
+        self.calls += 1
+        return {'stats': {'value': self.value, 'static': 'x'}}
+
+    def test_tick_without_subscribers_does_no_work(self):
+        self.broadcaster.tick()
+        self.assertEqual(self.calls, 0)
+
+    def test_first_event_is_full_snapshot_then_deltas(self):
+        stream = self.broadcaster.stream(heartbeat=0.01)
+        self.assertEqual(json.loads(next(stream)[len('data: '):]),
+                         {'stats': {'value': 0, 'static': 'x'}})
+        self.value = 1
+        self.broadcaster.tick()
+        self.assertEqual(next(stream), 'data: {"stats": {"value": 1}}\n\n')
+        self.assertEqual(next(stream), ': keepalive\n\n')
+        stream.close()
+        self.assertEqual(self.broadcaster.subscriber_count, 0)
+
+    def test_slow_subscriber_gets_coalesced_delta(self):
+        subscription = self.broadcaster.subscribe()
+        subscription.pop(0)
+        for value in (1, 2, 3):
+            self.value = value
+            self.broadcaster.tick()
+        self.assertEqual(subscription.pop(0), {'stats': {'value': 3}})
+        self.assertIsNone(subscription.pop(0))
+        self.broadcaster.unsubscribe(subscription)
+
+    def test_coalesced_delta_removes_then_sets(self):
+        subscription = self.broadcaster.subscribe()
+        state = merge_delta({}, subscription.pop(0))
+        for snapshot in ({'other': 1}, {'stats': {'value': 5}}):
+            self.broadcaster.producer = lambda snapshot=snapshot: snapshot
+            self.broadcaster.tick()
+        # La chiave tolta e poi rimessa torna senza i campi vecchi
+        self.assertEqual(merge_delta(state, subscription.pop(0)), {'stats': {'value': 5}})
+        self.broadcaster.unsubscribe(subscription)
+
+if __name__ == '__main__':
+    unittest.main()
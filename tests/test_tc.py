@@ -0,0 +1,87 @@
+import unittest
+from types import SimpleNamespace
+
+from utils.tc import class_rates, compile_qos
+
+def make_config(**fields):
+    values = dict(id=1, interface='eth1', upload_bandwidth=20000, download_bandwidth=100000,
+                  default_class='default', hierarchical=True)
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+def make_class(class_id, name, priority, min_bandwidth, max_bandwidth):
+    return SimpleNamespace(id=class_id, name=name, priority=priority,
+                           min_bandwidth=min_bandwidth, max_bandwidth=max_bandwidth)
+
+def make_rule(rule_id, class_id, priority=0, direction='both', **fields):
+    values = dict(source=None, destination=None, protocol='all', src_port=None, dst_port=None,
+                  dscp=None, enabled=True)
+    values.update(fields)
+    return SimpleNamespace(id=rule_id, class_id=class_id, priority=priority, direction=direction, **values)
+
+class TcCompilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.classes = [make_class(2, 'default', 4, 10, 60), make_class(1, 'voip', 1, 30, 100)]
+
+    def test_htb_tree_is_one_batch(self):
+        batch = compile_qos(make_config(download_bandwidth=None), self.classes, [])['batch'].splitlines()
+        self.assertEqual(batch, [
+            'qdisc add dev eth1 root handle 1: htb default 102',
+            'class add dev eth1 parent 1: classid 1:1 htb rate 20000kbit ceil 20000kbit quantum 1514',
+            'class add dev eth1 parent 1:1 classid 1:101 htb rate 6000kbit ceil 20000kbit prio 0 quantum 1514',
+            'qdisc add dev eth1 parent 1:101 handle 101: fq_codel',
+            'filter add dev eth1 parent 1: protocol all prio 1 handle 0x101 fw flowid 1:101',
+            'class add dev eth1 parent 1:1 classid 1:102 htb rate 2000kbit ceil 12000kbit prio 3 quantum 1514',
+            'qdisc add dev eth1 parent 1:102 handle 102: fq_codel',
+            'filter add dev eth1 parent 1: protocol all prio 1 handle 0x102 fw flowid 1:102',
+        ])
+
+    def test_fifty_classes_compile_to_a_single_batch(self):
+        classes = [make_class(i, f'c{i}', i % 7 + 1, 2, 100) for i in range(1, 51)]
+        compiled = compile_qos(make_config(default_class='c1'), classes, [])
+        # Albero di upload, redirezione in ingresso e albero di download
+        self.assertEqual(len(compiled['batch'].splitlines()), 2 * (2 + 3 * 50) + 2)
+
+    def test_download_is_shaped_on_ifb(self):
+        compiled = compile_qos(make_config(), self.classes, [])
+        self.assertEqual((compiled['devices'], compiled['ifb']), (['eth1', 'ifb4eth1'], 'ifb4eth1'))
+        batch = compiled['batch'].splitlines()
+        self.assertEqual(batch[8:10], [
+            'qdisc add dev eth1 handle ffff: ingress',
+            'filter add dev eth1 parent ffff: protocol all prio 1 matchall '
+            'action connmark action mirred egress redirect dev ifb4eth1',
+        ])
+        # Stesse classi dell'upload, con rate e ceil calcolati sulla banda di download
+        self.assertIn('class add dev ifb4eth1 parent 1:1 classid 1:101 htb rate 30000kbit ceil 100000kbit '
+                      'prio 0 quantum 1514', batch)
+        self.assertIn('filter add dev ifb4eth1 parent 1: protocol all prio 1 handle 0x102 fw flowid 1:102', batch)
+
+    def test_guaranteed_rates_never_exceed_the_link(self):
+        rates = class_rates(1000, [make_class(1, 'a', 1, 80, 100), make_class(2, 'b', 2, 80, 50)])
+        self.assertEqual((rates[1]['rate'], rates[2]['rate'], rates[2]['ceil']), (500, 500, 500))
+
+    def test_non_hierarchical_uses_cake(self):
+        batch = compile_qos(make_config(hierarchical=False), self.classes, [])['batch'].splitlines()
+        self.assertEqual(batch[0], 'qdisc add dev eth1 root cake bandwidth 20000kbit besteffort')
+        self.assertEqual(batch[-1], 'qdisc add dev ifb4eth1 root cake bandwidth 100000kbit besteffort')
+
+    def test_mark_rules_follow_priority_and_direction(self):
+        rules = [
+            make_rule(5, 2, priority=10, direction='out', protocol='tcp', dst_port='80,443'),
+            make_rule(6, 1, priority=1, protocol='udp', dst_port='5060', dscp='ef'),
+            make_rule(7, 1, enabled=False),
+        ]
+        ruleset = compile_qos(make_config(), self.classes, rules)['ruleset']
+        self.assertIn('table inet evorouter_qos {', ruleset)
+        voip = 'udp dport 5060 ip dscp ef meta mark set 0x101 ct mark set meta mark accept comment "qos:6"'
+        web = 'tcp dport { 80, 443 } meta mark set 0x102 ct mark set meta mark accept comment "qos:5"'
+        self.assertIn(f'\t\tiifname "eth1" {voip}\n\t}}', ruleset)
+        self.assertIn(f'\t\toifname "eth1" {voip}\n\t\toifname "eth1" {web}\n', ruleset)
+        self.assertNotIn('qos:7', ruleset)
+
+    def test_invalid_dscp_is_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_qos(make_config(), self.classes, [make_rule(1, 1, dscp='XX')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import fcntl
+import os
+import tempfile
+import unittest
+
+from utils.process_lock import release_lock
+from utils.timeseries import LOCK_FILENAME, BandwidthHistory, RingTier
+
+class RingTierTestCase(unittest.TestCase):
+    def test_wrapped_slot_is_reset(self):
+        tier = RingTier(resolution=60, capacity=4)
+        tier.add(0, 100, 10)
+        tier.add(4 * 60, 5, 1)  # same slot, four buckets later
+        points = tier.series(5 * 60, 4)
+        self.assertEqual([p[1] for p in points], [0.0, 0.0, 0.0, 5.0])
+
+    def test_delta_is_spread_over_the_buckets_it_covers(self):
+        tier = RingTier(resolution=1, capacity=10)
+        # Campionamento ogni 2 s su bucket da 1 s: nessun bucket vuoto
+        for timestamp in (2, 4, 6, 8):
+            tier.add(timestamp, 2000, 200, duration=2)
+        points = tier.series(8, 6)
+        self.assertEqual([p[1:] for p in points], [(1000.0, 100.0)] * 6)
+
+class BandwidthHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.history = BandwidthHistory(path=self.tmpdir.name)
+
+    def tearDown(self):
+        release_lock(os.path.join(self.tmpdir.name, LOCK_FILENAME))
+        self.tmpdir.cleanup()
+
+    def test_deltas_roll_up_into_every_tier(self):
+        base = 1700000000 - 1700000000 % 3600
+        # 60 seconds at 750 KB/s down, 125 KB/s up
+        for second in range(60):
+            self.history.record('eth1', 750000, 125000, base + second)
+
+        minute = self.history.series('eth1', '1h', now=base + 60)
+        self.assertEqual(len(minute), 60)
+        self.assertEqual(minute[-1][1:], (6.0, 1.0))
+
+        hourly = self.history.series('eth1', '24h', now=base + 3600)
+        self.assertEqual(hourly[-1][1:], (0.1, 0.017))
+
+    def test_all_sums_interfaces(self):
+        self.history.record('eth0', 1000000, 0, 120)
+        self.history.record('eth1', 1000000, 0, 120)
+        points = self.history.series('all', '1h', now=180)
+        self.assertAlmostEqual(points[-1][1], 2 * 8 / 60, places=3)
+
+    def test_history_survives_restart(self):
+        self.history.record('eth1', 600000, 60000, 120)
+        self.history.save()
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'eth1.ts')))
+
+        restored = BandwidthHistory(path=self.tmpdir.name)
+        restored.load()
+        self.assertEqual(restored.series('eth1', '1h', now=180),
+                         self.history.series('eth1', '1h', now=180))
+
+    def test_sampler_interval_is_spread(self):
+        for timestamp in range(100, 120, 2):
+            self.history.record_deltas({'eth1': {'bytes_recv': 2000, 'bytes_sent': 0}}, timestamp)
+        # 1000 B/s = 0.008 Mbit/s in ogni secondo, non 0 e 0.016 alternati
+        points = self.history.series('eth1', '5m', now=118)
+        self.assertEqual([p[1] for p in points[-17:]], [0.008] * 17)
+
+    def test_only_lock_owner_saves(self):
+        self.history.record('eth1', 600000, 60000, 120)
+        # Un altro processo (simulato da un secondo descrittore) possiede il lock
+        with open(os.path.join(self.tmpdir.name, LOCK_FILENAME), 'a') as owner:
+            fcntl.flock(owner.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.assertFalse(self.history.save())
+            self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, 'eth1.ts')))
+        # Il proprietario termina: il lock passa a questo processo
+        self.assertTrue(self.history.save())
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'eth1.ts')))
+
+    def test_interface_limit_bounds_memory(self):
+        history = BandwidthHistory(path=self.tmpdir.name, max_interfaces=2)
+        for name in ('eth0', 'eth1', 'veth0'):
+            history.record(name, 1, 1, 0)
+        self.assertEqual(history.interfaces(), ['eth0', 'eth1'])
+
+if __name__ == '__main__':
+    unittest.main()
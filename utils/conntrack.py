@@ -0,0 +1,179 @@
+"""
+Lettura in streaming della tabella conntrack dell'EvoRouter R4.
+Le connessioni vengono lette riga per riga da /proc/net/nf_conntrack (o
+dall'output di ``conntrack -L``) e restituite come tuple compatte, così anche
+tabelle con centinaia di migliaia di flussi si filtrano in un'unica passata e
+con memoria costante.
+"""
+import heapq
+import ipaddress
+import itertools
+import logging
+import os
+import subprocess
+from collections import namedtuple
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+PROC_CONNTRACK = "/proc/net/nf_conntrack"
+
+# Direzione originale del flusso; bytes/packets sommano entrambe le direzioni
+Connection = namedtuple(
+    "Connection",
+    ["protocol", "source", "sport", "destination", "dport", "state", "packets", "bytes"]
+)
+
+# Flag conntrack mostrati come stato per i protocolli senza stato (UDP, ICMP)
+FLAG_STATES = ("[UNREPLIED]", "[ASSURED]")
+
+
+def parse_conntrack_line(line: str) -> Optional[Connection]:
+    """
+    Converte una riga conntrack in una Connection
+
+    Supporta sia il formato di ``conntrack -L``
+    (``tcp 6 431999 ESTABLISHED src=... dst=...``) sia quello di
+    /proc/net/nf_conntrack, che antepone famiglia e numero L3
+    (``ipv4 2 tcp 6 ...``).
+    """
+    tokens = line.split()
+    if len(tokens) < 4:
+        return None
+    if tokens[0] in ("ipv4", "ipv6"):
+        tokens = tokens[2:]
+
+    protocol = tokens[0]
+    # tokens[1] = numero di protocollo, tokens[2] = timeout
+    state = ""
+    source = destination = None
+    sport = dport = 0
+    packets = nbytes = 0
+    for token in tokens[3:]:
+        key, sep, value = token.partition("=")
+        if not sep:
+            if not state and (token in FLAG_STATES or not token.startswith("[")):
+                state = token.strip("[]")
+            continue
+        # Le chiavi src/dst/sport/dport compaiono due volte: vale la prima (originale)
+        if key == "src":
+            if source is None:
+                source = value
+        elif key == "dst":
+            if destination is None:
+                destination = value
+        elif key == "sport":
+            if not sport:
+                sport = int(value)
+        elif key == "dport":
+            if not dport:
+                dport = int(value)
+        elif key == "packets":
+            packets += int(value)
+        elif key == "bytes":
+            nbytes += int(value)
+
+    if source is None or destination is None:
+        return None
+    if ":" in source:
+        # /proc/net/nf_conntrack riporta gli indirizzi IPv6 in forma estesa
+        source = str(ipaddress.ip_address(source))
+        destination = str(ipaddress.ip_address(destination))
+    return Connection(protocol, source, sport, destination, dport, state, packets, nbytes)
+
+
+def iter_conntrack_lines() -> Iterator[str]:
+    """
+    Legge le righe della tabella conntrack senza caricarla tutta in memoria
+
+    Usa /proc/net/nf_conntrack se disponibile, altrimenti ``conntrack -L``.
+    """
+    if os.access(PROC_CONNTRACK, os.R_OK):
+        with open(PROC_CONNTRACK, "r") as f:
+            yield from f
+        return
+
+    try:
+        process = subprocess.Popen(["conntrack", "-L"], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True)
+    except OSError as e:
+        logger.error(f"Cannot read conntrack table: {str(e)}")
+        return
+    try:
+        yield from process.stdout
+    finally:
+        # Il chiamante può interrompere la lettura (es. paginazione)
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+def iter_connections(lines: Optional[Iterable[str]] = None) -> Iterator[Connection]:
+    """Restituisce una alla volta le connessioni della tabella conntrack"""
+    for line in lines if lines is not None else iter_conntrack_lines():
+        try:
+            connection = parse_conntrack_line(line)
+        except ValueError:
+            logger.debug(f"Skipping malformed conntrack line: {line.strip()}")
+            continue
+        if connection is not None:
+            yield connection
+
+
+def connection_filter(protocol: Optional[str] = None, address: Optional[str] = None,
+                      port: Optional[int] = None, state: Optional[str] = None):
+    """Crea un predicato per filtrare le connessioni (None = nessun filtro)"""
+    protocol = protocol.lower() if protocol else None
+    state = state.upper() if state else None
+    if address and ":" in address:
+        address = str(ipaddress.ip_address(address))
+
+    def matches(connection: Connection) -> bool:
+        if protocol and connection.protocol != protocol:
+            return False
+        if address and address not in (connection.source, connection.destination):
+            return False
+        if port and port not in (connection.sport, connection.dport):
+            return False
+        if state and connection.state != state:
+            return False
+        return True
+
+    return matches
+
+
+def query_connections(connections: Iterable[Connection], protocol: Optional[str] = None,
+                      address: Optional[str] = None, port: Optional[int] = None,
+                      state: Optional[str] = None, sort: Optional[str] = None,
+                      offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+    """
+    Filtra, ordina e pagina le connessioni in un'unica passata
+
+    Con ``sort='bytes'`` vengono mantenute in memoria solo le prime
+    offset + limit connessioni (heap), altrimenti solo la pagina richiesta.
+
+    Returns:
+        Dizionario con total (connessioni filtrate) e connections (pagina)
+    """
+    matches = connection_filter(protocol, address, port, state)
+    total = 0
+
+    def counted() -> Iterator[Connection]:
+        nonlocal total
+        for connection in connections:
+            if matches(connection):
+                total += 1
+                yield connection
+
+    filtered = counted()
+    if sort == "bytes":
+        page = heapq.nlargest(offset + limit, filtered, key=lambda c: c.bytes)[offset:]
+    else:
+        page = list(itertools.islice(filtered, offset, offset + limit))
+        # Completa il conteggio senza conservare le connessioni
+        for _ in filtered:
+            pass
+
+    return {"total": total, "connections": page}
@@ -0,0 +1,186 @@
+"""
+Engine settings for the application database.
+
+SQLite is the default store on the router. With the default rollback journal
+a writer blocks every reader, so the speed-test thread, the firewall log
+ingestion and UI requests serialise on a single file lock. For SQLite the
+engine runs in WAL mode (readers never wait for the writer) with NORMAL
+sync, a memory-mapped read path, a larger page cache and a busy timeout, and
+skips the pre-ping round trip that only makes sense for network databases.
+benchmark_concurrency() measures both profiles on a scratch file:
+
+    python -m utils.database
+"""
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+
+from config import (SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE,
+                    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE)
+
+# Options used before the SQLite profile (and still used for other databases)
+DEFAULT_ENGINE_OPTIONS = {
+    "pool_recycle": 300,
+    "pool_pre_ping": True,
+}
+
+
+def is_sqlite(database_url):
+    """Check whether a SQLAlchemy URL points to SQLite"""
+    return database_url.startswith("sqlite:")
+
+
+def engine_options(database_url):
+    """
+    Get the SQLALCHEMY_ENGINE_OPTIONS for a database URL
+
+    SQLite connections are local file handles: there is nothing to ping or
+    recycle, and the driver timeout doubles as the busy timeout.
+
+    Args:
+        database_url: SQLAlchemy database URL
+
+    Returns:
+        dict: Engine options
+    """
+    if not is_sqlite(database_url):
+        return dict(DEFAULT_ENGINE_OPTIONS)
+    return {
+        "pool_pre_ping": False,
+        "connect_args": {"timeout": SQLITE_BUSY_TIMEOUT / 1000},
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """Apply the tuning pragmas to a new SQLite connection (engine 'connect' event)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        # journal_mode is stored in the file; in-memory databases keep "memory"
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT)}")
+        cursor.execute(f"PRAGMA cache_size={int(SQLITE_CACHE_SIZE)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas(engine):
+    """
+    Tune every connection the engine opens, if it is a SQLite engine
+
+    Returns:
+        bool: True if the pragmas were installed
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    if not event.contains(engine, "connect", set_sqlite_pragmas):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return True
+
+
+def create_benchmark_engine(path, tuned):
+    """Engine on a SQLite file with the tuned profile or the previous defaults"""
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, **(engine_options(url) if tuned else DEFAULT_ENGINE_OPTIONS))
+    if tuned:
+        install_sqlite_pragmas(engine)
+    return engine
+
+
+def benchmark_concurrency(path, tuned, writers=2, readers=4, duration=3.0):
+    """
+    Measure concurrent read/write throughput on a SQLite file
+
+    Writers insert one row per transaction (like log ingestion and UI saves);
+    readers page through the newest rows (like the log and dashboard pages).
+
+    Args:
+        path: Scratch database file (created or truncated)
+        tuned: Use the tuned profile instead of the previous defaults
+        writers: Number of writer threads
+        readers: Number of reader threads
+        duration: Seconds to run
+
+    Returns:
+        dict: journal_mode, reads, writes, reads_per_second,
+              writes_per_second and errors (e.g. "database is locked")
+    """
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    engine = create_benchmark_engine(path, tuned)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE bench (id INTEGER PRIMARY KEY, source TEXT, payload TEXT)"))
+        journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def run(operation):
+        done = errors = 0
+        with engine.connect() as conn:
+            while not stop.is_set():
+                try:
+                    operation(conn)
+                    done += 1
+                except Exception:
+                    conn.rollback()
+                    errors += 1
+        return done, errors
+
+    def writer(index):
+        def operation(conn):
+            conn.execute(text("INSERT INTO bench (source, payload) VALUES (:source, :payload)"),
+                         {"source": f"writer-{index}", "payload": "x" * 200})
+            conn.commit()
+        done, errors = run(operation)
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    def reader():
+        def operation(conn):
+            conn.execute(text("SELECT id, source, payload FROM bench ORDER BY id DESC LIMIT 50")).fetchall()
+            conn.rollback()
+        done, errors = run(operation)
+        with lock:
+            counts["reads"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+
+    return {
+        "journal_mode": journal_mode,
+        "reads": counts["reads"],
+        "writes": counts["writes"],
+        "reads_per_second": counts["reads"] / elapsed,
+        "writes_per_second": counts["writes"] / elapsed,
+        "errors": counts["errors"],
+    }
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        print(f"{'profile':<10}{'journal':>10}{'reads/s':>12}{'writes/s':>12}{'errors':>8}")
+        for name, tuned in (("default", False), ("tuned", True)):
+            result = benchmark_concurrency(path, tuned)
+            print(f"{name:<10}{result['journal_mode']:>10}{result['reads_per_second']:>12.0f}"
+                  f"{result['writes_per_second']:>12.0f}{result['errors']:>8}")
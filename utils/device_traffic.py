@@ -0,0 +1,254 @@
+"""
+Per-device bandwidth accounting on the LAN.
+
+Forwarded LAN <-> WAN packets update per-host counters in dynamic nftables
+sets (table inet evorouter_acct, see utils.nftables.compile_accounting). A
+collection pass is a single "nft -j list table" whatever the number of hosts;
+byte deltas between passes become per-device rates (IPv4 and IPv6 addresses
+of the same device are summed through the device inventory), the top talkers
+are kept in a bounded in-memory history, and the rates are published into the
+device list.
+"""
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+
+from config import (DEFAULT_LAN_INTERFACE, DEFAULT_WIFI_INTERFACE, DEFAULT_WAN_INTERFACE,
+                    DEVICE_ACCOUNTING_ENABLED, DEVICE_TRAFFIC_INTERVAL, DEVICE_TRAFFIC_HISTORY,
+                    DEVICE_TOP_TALKERS, DEVICE_ACCOUNTING_SET_SIZE, DEVICE_ACCOUNTING_TIMEOUT)
+from models import FirewallZone, NetworkConfig
+from utils.devices import get_device_inventory
+from utils.metrics import get_sampler
+from utils.nftables import ACCOUNTING_TABLE, TABLE_FAMILY, compile_accounting, parse_accounting, zone_interfaces
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+
+def _run_nft(arguments, script=None):
+    """Run nft quietly (the accounting is optional: a missing nft is not an error)"""
+    try:
+        return subprocess.run(["nft"] + arguments, input=script, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug(f"nft not available: {str(e)}")
+        return None
+
+
+def read_host_counters():
+    """
+    Read every per-host counter with one nft command
+
+    Returns:
+        dict: address -> (download bytes, upload bytes), None if the table is missing
+    """
+    result = _run_nft(["-j", "list", "table", TABLE_FAMILY, ACCOUNTING_TABLE])
+    if result is None or result.returncode != 0:
+        return None
+    try:
+        return parse_accounting(result.stdout)
+    except (ValueError, KeyError) as e:
+        logger.error(f"Error parsing accounting counters: {str(e)}")
+        return None
+
+
+def accounting_interfaces():
+    """
+    LAN and WAN interfaces to account traffic between (needs an app context)
+
+    The WAN is made of the interfaces of the masqueraded firewall zones and the
+    LAN of those of every other zone, so bridges such as br-lan are followed.
+    Without such zones the NetworkConfig rows are used (wan vs lan/wifi), and
+    without those the configured default interfaces.
+
+    Returns:
+        tuple: (LAN interface names, WAN interface names)
+    """
+    lan, wan = [], []
+    try:
+        for zone in FirewallZone.query.order_by(FirewallZone.priority, FirewallZone.id).all():
+            target = wan if zone.masquerade else lan
+            target.extend(name for name in zone_interfaces(zone) if name not in target)
+        if not (lan and wan):
+            lan, wan = [], []
+            for row in NetworkConfig.query.order_by(NetworkConfig.id).all():
+                target = wan if row.interface_type == "wan" else lan
+                if row.interface_name not in target:
+                    target.append(row.interface_name)
+    except Exception as e:
+        logger.warning(f"Cannot read the configured interfaces: {str(e)}")
+        lan, wan = [], []
+    if not (lan and wan):
+        return [DEFAULT_LAN_INTERFACE, DEFAULT_WIFI_INTERFACE], [DEFAULT_WAN_INTERFACE]
+    return lan, wan
+
+
+def install_accounting(lan_interfaces, wan_interfaces):
+    """
+    Create the accounting table for the given LAN and WAN interfaces
+
+    Returns:
+        bool: True if nft accepted the table
+    """
+    script = compile_accounting(lan_interfaces, wan_interfaces,
+                                size=DEVICE_ACCOUNTING_SET_SIZE, timeout=DEVICE_ACCOUNTING_TIMEOUT)
+    result = _run_nft(["-f", "-"], script)
+    if result is None or result.returncode != 0:
+        if result is not None:
+            logger.warning(f"Cannot install the accounting table: {result.stderr.strip()}")
+        return False
+    logger.info(f"Per-device accounting table installed (LAN {', '.join(lan_interfaces)}, "
+                f"WAN {', '.join(wan_interfaces)})")
+    return True
+
+
+def _mbps(bytes_per_second):
+    return round(bytes_per_second * 8 / 1_000_000, 3)
+
+
+class DeviceTrafficCollector:
+    """
+    Turns the per-host counters into per-device rates, top talkers and history
+
+    Args:
+        interval: Minimum seconds between counter reads
+        history: Seconds of top-talker history to keep
+        top: Devices kept in the top-talker list and per history sample
+        reader: Callable returning address -> (download, upload) bytes, or None
+        installer: Callable creating the counters when the reader finds none
+            (called once; None to never install)
+        resolve: Callable mapping an address to a device key (MAC), or None
+        clock: Monotonic time source, overridable in tests
+        wallclock: Time source for history timestamps
+    """
+
+    def __init__(self, interval=DEVICE_TRAFFIC_INTERVAL, history=DEVICE_TRAFFIC_HISTORY, top=DEVICE_TOP_TALKERS,
+                 reader=read_host_counters, installer=None, resolve=None, clock=time.monotonic,
+                 wallclock=time.time):
+        self.interval = interval
+        self.top = top
+        self.reader = reader
+        self.installer = installer
+        self.resolve = resolve
+        self._clock = clock
+        self._wallclock = wallclock
+        self._lock = threading.Lock()
+        self._counters = None
+        self._sampled_at = None
+        self._install_attempted = False
+        # Published views: replaced, never mutated
+        self._rates = {}
+        self._top_talkers = []
+        self._history = deque(maxlen=max(1, int(history // interval)))
+
+    def maybe_sample(self):
+        """
+        Sample if at least interval seconds have passed since the last read
+
+        Returns:
+            bool: True if new rates were published
+        """
+        if self._sampled_at is None or self._clock() - self._sampled_at >= self.interval:
+            return self.sample()
+        return False
+
+    def sample(self):
+        """
+        Read the counters once and publish the new rates
+
+        Returns:
+            bool: True if new rates were published
+        """
+        with self._lock:
+            counters = self.reader()
+            if counters is None:
+                if self.installer is not None and not self._install_attempted:
+                    self._install_attempted = True
+                    self.installer()
+                # Table missing or recreated: the next read is a new baseline
+                self._counters = None
+                self._sampled_at = self._clock()
+                return False
+
+            now = self._clock()
+            previous_counters = self._counters
+            elapsed = now - self._sampled_at if self._sampled_at is not None else None
+            self._counters = counters
+            self._sampled_at = now
+            if previous_counters is None or not elapsed:
+                return False
+
+            totals = {}
+            for address, (download, upload) in counters.items():
+                previous = previous_counters.get(address)
+                if previous is None:
+                    # Host added to the set since the last read
+                    delta = (download, upload)
+                else:
+                    # An expired and re-added host restarts from zero
+                    delta = (download - previous[0] if download >= previous[0] else download,
+                             upload - previous[1] if upload >= previous[1] else upload)
+                key = (self.resolve(address) if self.resolve else None) or address
+                total = totals.setdefault(key, [0, 0])
+                total[0] += delta[0]
+                total[1] += delta[1]
+
+            rates = {key: {"download": _mbps(download / elapsed), "upload": _mbps(upload / elapsed)}
+                     for key, (download, upload) in totals.items() if download or upload}
+            ranked = sorted(rates.items(), key=lambda item: item[1]["download"] + item[1]["upload"],
+                            reverse=True)[:self.top]
+            top_talkers = [dict(key=key, **rate) for key, rate in ranked]
+
+            self._rates = rates
+            self._top_talkers = top_talkers
+            self._history.append({"timestamp": int(self._wallclock()), "devices": top_talkers})
+            return True
+
+    def rates(self):
+        """Current rates (Mbps) per device key (read-only)"""
+        return self._rates
+
+    def top_talkers(self):
+        """Devices with the highest current traffic, busiest first (read-only)"""
+        return self._top_talkers
+
+    def history(self):
+        """Top talkers of every sample in the history window, oldest first"""
+        return list(self._history)
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_device_traffic():
+    """
+    Get the process-wide per-device traffic collector
+
+    The collector is driven by the metrics sampler and publishes its rates
+    into the device inventory, so the device list needs no work per request.
+    The first call must run in an app context: it reads the LAN and WAN
+    interfaces the accounting table is installed for.
+
+    Returns:
+        DeviceTrafficCollector: The shared collector
+    """
+    global _collector
+    if _collector is None:
+        with _collector_lock:
+            if _collector is None:
+                inventory = get_device_inventory()
+                installer = None
+                if DEVICE_ACCOUNTING_ENABLED:
+                    lan, wan = accounting_interfaces()
+                    installer = lambda: install_accounting(lan, wan)
+                collector = DeviceTrafficCollector(installer=installer, resolve=inventory.lookup_ip)
+
+                def on_sample(stats, usage, deltas):
+                    if collector.maybe_sample():
+                        inventory.set_traffic(collector.rates())
+
+                get_sampler().add_listener(on_sample)
+                _collector = collector
+    return _collector
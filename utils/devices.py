@@ -0,0 +1,307 @@
+"""
+Inventory of the devices connected to the LAN.
+
+Devices are discovered from the kernel neighbour tables (/proc/net/arp for
+IPv4, "ip -j -6 neigh" for IPv6) and from the DHCP leases, merged by MAC
+address. The tables are re-read in the background by the metrics sampler and
+diffed against the previous state; a new snapshot is published (by reference
+swap, like the metrics snapshots) only when something changed or new traffic
+rates arrive (utils.device_traffic), so serving the device list is a
+constant-time read however many clients are on the LAN.
+"""
+import json
+import logging
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from config import (DEFAULT_WAN_INTERFACE, DEVICE_INVENTORY_INTERVAL, DEVICE_INVENTORY_PUBLISH_INTERVAL,
+                    DEVICE_FORGET_AFTER)
+from utils.dhcp_leases import get_lease_database
+from utils.metrics import get_sampler
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+PROC_ARP = "/proc/net/arp"
+
+# /proc/net/arp flags
+ATF_COM = 0x02  # Completed entry (hardware address known)
+
+# IPv6 neighbour states with a usable link-layer address
+NEIGH_PRESENT_STATES = {"REACHABLE", "STALE", "DELAY", "PROBE", "PERMANENT"}
+
+# Interface name prefixes of wireless devices
+WIRELESS_PREFIXES = ("wlan", "wl", "ath", "phy", "wifi")
+
+EMPTY_MAC = "00:00:00:00:00:00"
+
+
+def parse_proc_arp(text):
+    """
+    Parse /proc/net/arp
+
+    Returns:
+        list: Neighbours as dicts with ip, mac, interface
+    """
+    neighbours = []
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        ip, _, flags, mac, _, interface = fields[:6]
+        if not int(flags, 16) & ATF_COM or mac == EMPTY_MAC:
+            continue
+        neighbours.append({"ip": ip, "mac": mac.upper(), "interface": interface})
+    return neighbours
+
+
+def parse_ip_neigh(output):
+    """
+    Parse the JSON output of "ip -j neigh show"
+
+    Returns:
+        list: Neighbours with a link-layer address, as dicts with ip, mac, interface
+    """
+    neighbours = []
+    for entry in json.loads(output or "[]"):
+        mac = entry.get("lladdr")
+        if not mac or not NEIGH_PRESENT_STATES.intersection(entry.get("state", [])):
+            continue
+        neighbours.append({"ip": entry["dst"], "mac": mac.upper(), "interface": entry.get("dev")})
+    return neighbours
+
+
+def read_arp_table(path=PROC_ARP):
+    """Read the IPv4 neighbour table"""
+    try:
+        with open(path) as f:
+            return parse_proc_arp(f.read())
+    except OSError as e:
+        logger.debug(f"Cannot read {path}: {str(e)}")
+        return []
+
+
+def read_ipv6_neighbours():
+    """Read the IPv6 neighbour table through iproute2"""
+    try:
+        result = subprocess.run(["ip", "-j", "-6", "neigh", "show"], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug(f"Cannot read the IPv6 neighbour table: {str(e)}")
+        return []
+    if result.returncode != 0:
+        return []
+    return parse_ip_neigh(result.stdout)
+
+
+def read_dhcp_leases():
+    """Read the active IPv4 DHCP leases (files are parsed again only when they change)"""
+    return [lease for lease in get_lease_database().active() if lease["mac"]]
+
+
+def _is_link_local(ip):
+    return ip.lower().startswith("fe80:")
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class DeviceInventory:
+    """
+    Devices seen on the LAN, keyed by MAC address
+
+    Args:
+        arp_reader: Callable returning the IPv4 neighbours
+        neigh_reader: Callable returning the IPv6 neighbours
+        lease_reader: Callable returning the DHCP leases
+        interval: Minimum seconds between refreshes
+        publish_interval: Republish the snapshot at least this often, so that
+            last_seen of online devices stays current
+        forget_after: Seconds after which an offline device without a lease
+            is removed
+        clock: Time source (epoch seconds), overridable in tests
+    """
+
+    def __init__(self, arp_reader=read_arp_table, neigh_reader=read_ipv6_neighbours,
+                 lease_reader=read_dhcp_leases, interval=DEVICE_INVENTORY_INTERVAL,
+                 publish_interval=DEVICE_INVENTORY_PUBLISH_INTERVAL, forget_after=DEVICE_FORGET_AFTER,
+                 exclude_interfaces=(DEFAULT_WAN_INTERFACE,), clock=time.time):
+        self.arp_reader = arp_reader
+        self.neigh_reader = neigh_reader
+        self.lease_reader = lease_reader
+        self.interval = interval
+        self.publish_interval = publish_interval
+        self.forget_after = forget_after
+        self.exclude_interfaces = set(exclude_interfaces)
+        self._clock = clock
+        self._lock = threading.Lock()
+        # mac -> internal record (only touched under the lock)
+        self._devices = {}
+        self._last_refresh = None
+        self._last_publish = None
+        # mac -> {"download", "upload"} in Mbps, set by the traffic collector
+        self._traffic = {}
+        # Published views: replaced, never mutated
+        self._snapshot = []
+        self._by_ip = {}
+        self._by_mac = {}
+
+    def snapshot(self):
+        """
+        Get the published device list
+
+        Returns:
+            list: Device dicts (read-only)
+        """
+        return self._snapshot
+
+    def lookup_ip(self, ip):
+        """MAC address of the device using an IP address, or None"""
+        return self._by_ip.get(ip)
+
+    def device(self, mac):
+        """Published entry of a device, or None"""
+        return self._by_mac.get(mac)
+
+    def set_traffic(self, traffic):
+        """
+        Publish new per-device rates
+
+        Args:
+            traffic: Dict mac -> {"download", "upload"} (Mbps); devices not
+                listed have no traffic
+        """
+        with self._lock:
+            self._traffic = traffic
+            self._publish(self._clock())
+
+    def maybe_refresh(self):
+        """Refresh if at least interval seconds have passed since the last refresh"""
+        if self._last_refresh is None or self._clock() - self._last_refresh >= self.interval:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Re-read the neighbour tables and leases and apply the differences
+
+        Returns:
+            bool: True if a new snapshot was published
+        """
+        now = self._clock()
+        observed = {}
+        for neighbour in self.arp_reader() + self.neigh_reader():
+            if neighbour["interface"] in self.exclude_interfaces:
+                continue
+            entry = observed.setdefault(neighbour["mac"], {"ipv4": set(), "ipv6": set(),
+                                                           "interface": neighbour["interface"]})
+            entry["ipv6" if ":" in neighbour["ip"] else "ipv4"].add(neighbour["ip"])
+        leases = {lease["mac"]: lease for lease in self.lease_reader()
+                  if not lease["expiry"] or lease["expiry"] > now}
+
+        with self._lock:
+            self._last_refresh = now
+            changed = False
+            for mac in set(observed) | set(leases) | set(self._devices):
+                record = self._devices.get(mac)
+                before = None if record is None else record["state"]
+                record = self._update(mac, record, observed.get(mac), leases.get(mac), now)
+                if record is None:
+                    changed = changed or before is not None
+                    self._devices.pop(mac, None)
+                    continue
+                self._devices[mac] = record
+                changed = changed or record["state"] != before
+
+            if changed or self._last_publish is None or now - self._last_publish >= self.publish_interval:
+                self._publish(now)
+                return True
+        return False
+
+    def _update(self, mac, record, neighbour, lease, now):
+        """Merge one MAC's observations into its record; None to forget the device"""
+        if record is None:
+            if neighbour is None and lease is None:
+                return None
+            record = {"mac": mac, "first_seen": now, "last_seen": now, "interface": None,
+                      "ipv4": (), "ipv6": (), "state": None}
+
+        online = neighbour is not None
+        if online:
+            record["last_seen"] = now
+            record["interface"] = neighbour["interface"]
+            record["ipv4"] = tuple(sorted(neighbour["ipv4"]))
+            record["ipv6"] = tuple(sorted(neighbour["ipv6"], key=lambda ip: (_is_link_local(ip), ip)))
+        elif lease is None and now - record["last_seen"] >= self.forget_after:
+            return None
+
+        hostname = lease["hostname"] if lease else None
+        lease_ip = lease["ip"] if lease else None
+        # Everything shown in the list except last_seen: a change triggers a republish
+        record["state"] = (online, record["interface"], record["ipv4"], record["ipv6"], hostname, lease_ip,
+                           lease["expiry"] if lease else None)
+        return record
+
+    def _publish(self, now):
+        devices = []
+        by_ip = {}
+        by_mac = {}
+        for mac, record in self._devices.items():
+            online, interface, ipv4, ipv6, hostname, lease_ip, expiry = record["state"]
+            ipv4_address = ipv4[0] if ipv4 else lease_ip
+            ipv6_address = ipv6[0] if ipv6 else None
+            for ip in ipv4 + ipv6 + ((lease_ip,) if lease_ip else ()):
+                by_ip[ip] = mac
+            wireless = bool(interface) and interface.startswith(WIRELESS_PREFIXES)
+            traffic = self._traffic.get(mac, {})
+            device = {
+                "name": hostname or ipv4_address or mac,
+                "hostname": hostname,
+                "ipv4_address": ipv4_address,
+                "ipv6_address": ipv6_address,
+                "ipv6_addresses": list(ipv6),
+                "ipv6_enabled": bool(ipv6),
+                "mac": mac,
+                "interface": interface,
+                "connection": "Wireless" if wireless else "Cablata",
+                "status": "Online" if online else "Offline",
+                "last_seen": _format_time(now if online else record["last_seen"]),
+                "lease_expiry": _format_time(expiry) if expiry else None,
+                "download": traffic.get("download", 0),
+                "upload": traffic.get("upload", 0),
+            }
+            devices.append(device)
+            by_mac[mac] = device
+        devices.sort(key=lambda device: (device["status"] != "Online", device["name"].lower()))
+
+        # Publish by reference swap: readers never see a half-built list
+        self._snapshot = devices
+        self._by_ip = by_ip
+        self._by_mac = by_mac
+        self._last_publish = now
+
+
+_inventory = DeviceInventory()
+_inventory_listener_registered = False
+_inventory_lock = threading.Lock()
+
+
+def get_device_inventory():
+    """
+    Get the process-wide device inventory
+
+    The first call reads the tables synchronously, so callers always find a
+    populated snapshot; afterwards the metrics sampler keeps it current.
+
+    Returns:
+        DeviceInventory: The shared inventory
+    """
+    global _inventory_listener_registered
+    if not _inventory_listener_registered:
+        with _inventory_lock:
+            if not _inventory_listener_registered:
+                _inventory.refresh()
+                get_sampler().add_listener(lambda stats, usage, deltas: _inventory.maybe_refresh())
+                _inventory_listener_registered = True
+    return _inventory
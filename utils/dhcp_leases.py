@@ -0,0 +1,346 @@
+"""
+DHCP lease database.
+
+Reads the leases of dnsmasq ("expiry mac ip hostname client-id" per line) and
+of the ISC DHCP server (dhcpd.leases, an append-only journal of "lease ip {
+... }" blocks where the last block of an address wins). Each file is stat()ed
+on access and parsed again only when it changed: dnsmasq rewrites its file,
+so a change means a full parse; dhcpd appends, so only the bytes after the
+last complete block are parsed, and a new inode (dhcpd periodically rewrites
+the journal into a fresh file) or a shorter file triggers a full parse. The
+active leases and the indexes by MAC, IP and hostname are published by
+reference swap and rebuilt only when a file changed or a lease expired.
+"""
+import calendar
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+
+from config import DHCP_LEASE_FILES
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+FORMAT_DNSMASQ = "dnsmasq"
+FORMAT_ISC = "isc"
+
+# Quoted strings are blanked before counting braces (a hostname may contain one)
+QUOTED = re.compile(r'"(?:[^"\\]|\\.)*"')
+
+
+def parse_dnsmasq_leases(text):
+    """
+    Parse a dnsmasq lease file ("expiry mac ip hostname client-id" per line)
+
+    The IPv6 leases follow the "duid" line and carry an IAID instead of the
+    MAC address: their mac is None.
+
+    Returns:
+        list: Leases as dicts with mac, ip, hostname, expiry (epoch, 0 = infinite)
+    """
+    leases = []
+    ipv6 = False
+    for line in text.splitlines():
+        fields = line.split()
+        if fields[:1] == ["duid"]:
+            ipv6 = True
+            continue
+        if len(fields) < 4:
+            continue
+        leases.append({
+            "mac": None if ipv6 else fields[1].upper(),
+            "ip": fields[2],
+            "hostname": None if fields[3] == "*" else fields[3],
+            "expiry": int(fields[0]),
+        })
+    return leases
+
+
+def _parse_isc_time(value):
+    """Epoch seconds of an ISC date ("4 2026/10/15 08:00:00" in UTC, "epoch N", "never" = 0)"""
+    fields = value.split()
+    if not fields or fields[0] == "never":
+        return 0
+    if fields[0] == "epoch":
+        return int(fields[1])
+    # Split by hand: strptime dominates the parse time of large journals
+    year, month, day = fields[1].split("/")
+    hour, minute, second = fields[2].split(":")
+    return calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+
+
+def parse_isc_leases(data):
+    """
+    Parse the complete blocks of an ISC dhcpd.leases journal
+
+    Blocks other than IPv4 leases (server-duid, failover state, IPv6 ia-na)
+    are skipped; a trailing incomplete block is left for the next call.
+
+    Args:
+        data: File content (bytes), possibly starting at a previous offset
+
+    Returns:
+        tuple: (leases in file order as dicts with mac, ip, hostname, starts,
+                expiry and state, number of bytes consumed)
+    """
+    leases = []
+    consumed = 0
+    position = 0
+    depth = 0
+    lease = None
+    for raw in data.splitlines(keepends=True):
+        position += len(raw)
+        if not raw.endswith(b"\n"):
+            # Line still being written
+            break
+        line = raw.decode("utf-8", errors="replace").strip()
+        if not line or line.startswith("#"):
+            if depth == 0:
+                consumed = position
+            continue
+
+        statement = line.rstrip(";")
+        if depth == 0 and statement.startswith("lease ") and statement.endswith("{"):
+            lease = {"mac": None, "ip": statement.split()[1], "hostname": None,
+                     "starts": None, "expiry": 0, "state": None}
+        elif depth == 1 and lease is not None:
+            if statement.startswith("starts "):
+                lease["starts"] = _parse_isc_time(statement[len("starts "):])
+            elif statement.startswith("ends "):
+                lease["expiry"] = _parse_isc_time(statement[len("ends "):])
+            elif statement.startswith("hardware ethernet "):
+                lease["mac"] = statement.split()[2].upper()
+            elif statement.startswith("client-hostname "):
+                lease["hostname"] = statement.split(None, 1)[1].strip('"') or None
+            elif statement.startswith("binding state "):
+                lease["state"] = statement.split()[2]
+
+        braces = QUOTED.sub('""', line)
+        depth += braces.count("{") - braces.count("}")
+        if depth <= 0:
+            depth = 0
+            if lease is not None and "}" in braces:
+                leases.append(lease)
+                lease = None
+            consumed = position
+    return leases, consumed
+
+
+def detect_format(data):
+    """
+    Detect the lease file format from its first statement
+
+    Returns:
+        str: FORMAT_DNSMASQ, FORMAT_ISC, or None for an empty file
+    """
+    for raw in data.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line[:1].isdigit() or line.startswith(b"duid "):
+            return FORMAT_DNSMASQ
+        return FORMAT_ISC
+    return None
+
+
+def _ip_sort_key(lease):
+    address = ipaddress.ip_address(lease["ip"])
+    return address.version, int(address)
+
+
+def is_active(lease, now):
+    """Check whether a lease is bound and not expired"""
+    if lease.get("state") not in (None, "active"):
+        return False
+    return not lease["expiry"] or lease["expiry"] > now
+
+
+class LeaseFile:
+    """
+    One lease file and its current leases by IP address
+
+    Args:
+        path: Path of the lease file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = None
+        self.leases = {}
+        self._identity = None
+        self._signature = None
+        self._offset = 0
+
+    def reset(self):
+        """Forget the file state (the next update is a full parse)"""
+        self.format = None
+        self.leases = {}
+        self._identity = None
+        self._signature = None
+        self._offset = 0
+
+    def update(self):
+        """
+        Re-read the file if it changed since the last call
+
+        Returns:
+            bool: True if the leases changed
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self._identity is None:
+                return False
+            self.reset()
+            return True
+
+        identity = (stat.st_dev, stat.st_ino)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if identity == self._identity and signature == self._signature:
+            return False
+
+        incremental = (self.format == FORMAT_ISC and identity == self._identity
+                       and stat.st_size >= self._offset)
+        try:
+            with open(self.path, "rb") as f:
+                if incremental:
+                    f.seek(self._offset)
+                data = f.read()
+        except OSError as e:
+            logger.warning(f"Cannot read {self.path}: {str(e)}")
+            return False
+
+        self._identity = identity
+        self._signature = signature
+        if not incremental:
+            self.format = detect_format(data)
+            self.leases = {}
+            self._offset = 0
+
+        if self.format == FORMAT_ISC:
+            leases, consumed = parse_isc_leases(data)
+            self._offset += consumed
+            # Journal order: the last block of an address wins
+            for lease in leases:
+                self.leases[lease["ip"]] = lease
+            return bool(leases) or not incremental
+        if self.format == FORMAT_DNSMASQ:
+            self.leases = {lease["ip"]: lease for lease in parse_dnsmasq_leases(data.decode("utf-8", "replace"))}
+        return True
+
+
+class LeaseDatabase:
+    """
+    Leases of all the configured files with indexes by MAC, IP and hostname
+
+    Args:
+        paths: Lease files (dnsmasq or ISC, detected from the content)
+        clock: Time source (epoch seconds), overridable in tests
+    """
+
+    def __init__(self, paths=None, clock=time.time):
+        self.files = [LeaseFile(path) for path in (DHCP_LEASE_FILES if paths is None else paths)]
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_expiry = None
+        self._published = False
+        # Published views: replaced, never mutated
+        self._active = []
+        self._by_mac = {}
+        self._by_ip = {}
+        self._by_hostname = {}
+
+    def refresh(self):
+        """
+        Check the files and republish if a file changed or a lease expired
+
+        Returns:
+            bool: True if new views were published
+        """
+        with self._lock:
+            now = self._clock()
+            changed = False
+            for lease_file in self.files:
+                changed = lease_file.update() or changed
+            expired = self._next_expiry is not None and now >= self._next_expiry
+            if not changed and not expired and self._published:
+                return False
+            self._publish(now)
+            return True
+
+    def active(self):
+        """
+        Active leases, refreshing first if needed
+
+        Returns:
+            list: Lease dicts sorted by IP address (read-only)
+        """
+        self.refresh()
+        return self._active
+
+    def lookup_mac(self, mac):
+        """Active lease of a MAC address, or None"""
+        self.refresh()
+        return self._by_mac.get(mac.upper())
+
+    def lookup_ip(self, ip):
+        """Active lease of an IP address, or None"""
+        self.refresh()
+        return self._by_ip.get(ip)
+
+    def lookup_hostname(self, hostname):
+        """Active lease of a hostname (case-insensitive), or None"""
+        self.refresh()
+        return self._by_hostname.get(hostname.lower())
+
+    def _publish(self, now):
+        active = []
+        next_expiry = None
+        for lease_file in self.files:
+            for lease in lease_file.leases.values():
+                if not is_active(lease, now):
+                    continue
+                active.append(lease)
+                if lease["expiry"] and (next_expiry is None or lease["expiry"] < next_expiry):
+                    next_expiry = lease["expiry"]
+        active.sort(key=_ip_sort_key)
+
+        by_mac = {}
+        by_ip = {}
+        by_hostname = {}
+        for lease in active:
+            by_ip[lease["ip"]] = lease
+            if lease["mac"]:
+                by_mac[lease["mac"]] = lease
+            if lease["hostname"]:
+                by_hostname[lease["hostname"].lower()] = lease
+
+        # Publish by reference swap: readers never see a half-built index
+        self._active = active
+        self._by_mac = by_mac
+        self._by_ip = by_ip
+        self._by_hostname = by_hostname
+        self._next_expiry = next_expiry
+        self._published = True
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_lease_database():
+    """
+    Get the process-wide lease database
+
+    Returns:
+        LeaseDatabase: The shared database for DHCP_LEASE_FILES
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = LeaseDatabase()
+    return _database
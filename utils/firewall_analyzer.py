@@ -0,0 +1,358 @@
+"""
+Analisi delle regole del firewall: regole oscurate, ridondanti e accorpabili.
+Ogni regola viene convertita nello spazio dei pacchetti che descrive
+(protocolli, intervalli di indirizzi sorgente/destinazione e di porte), così
+il contenimento tra due regole si verifica dimensione per dimensione con una
+scansione lineare degli intervalli ordinati.
+
+Le regole vengono valutate nell'ordine del compilatore (zona, priorità, id).
+Un indice per porta di destinazione, indirizzo sorgente e indirizzo di
+destinazione restituisce solo le regole che possono contenere o intersecare
+una regola data, quindi l'analisi resta quasi lineare anche con molte regole,
+con o senza porte. Il contenimento da parte dell'unione di più regole non
+viene rilevato.
+"""
+import heapq
+import ipaddress
+import logging
+from collections import namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.nftables import IPSET_TYPES, collapse_networks, is_any, iter_json_strings, split_list
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+# Gli indirizzi IPv6 vengono spostati oltre lo spazio IPv4: un solo asse per entrambe le famiglie
+IPV6_OFFSET = 2 ** 32
+
+# Dimensioni (porte o indirizzi) più ampie di questo non vengono espanse nell'indice
+INDEX_RANGE_LIMIT = 256
+
+# Dimensioni indicizzate, dalla più selettiva di solito
+INDEX_DIMENSIONS = ("dport", "source", "destination")
+
+# Spazio dei pacchetti di una regola. Ogni dimensione vale None (qualsiasi),
+# una tupla ordinata di intervalli (inizio, fine) disgiunti, un frozenset di
+# protocolli oppure, per IP set con porte e gruppi di servizi, il riferimento
+# "@nome" confrontabile solo per uguaglianza.
+RuleSpace = namedtuple("RuleSpace", ["protocols", "source", "destination", "sport", "dport"])
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> Tuple[Tuple[int, int], ...]:
+    """Ordina e unisce intervalli sovrapposti o adiacenti"""
+    merged: List[List[int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+
+def intervals_cover(outer: Tuple[Tuple[int, int], ...], inner: Tuple[Tuple[int, int], ...]) -> bool:
+    """Verifica che ogni intervallo di inner sia contenuto in un intervallo di outer"""
+    i = 0
+    for start, end in inner:
+        while i < len(outer) and outer[i][1] < start:
+            i += 1
+        if i == len(outer) or outer[i][0] > start or outer[i][1] < end:
+            return False
+    return True
+
+
+def intervals_overlap(a: Tuple[Tuple[int, int], ...], b: Tuple[Tuple[int, int], ...]) -> bool:
+    """Verifica se due insiemi di intervalli ordinati si intersecano"""
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i][1] < b[j][0]:
+            i += 1
+        elif b[j][1] < a[i][0]:
+            j += 1
+        else:
+            return True
+    return False
+
+
+def dimension_covers(outer: Any, inner: Any) -> bool:
+    """Contenimento su una singola dimensione"""
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    if isinstance(outer, str) or isinstance(inner, str):
+        return outer == inner
+    if isinstance(outer, frozenset):
+        return inner <= outer
+    return intervals_cover(outer, inner)
+
+
+def dimension_overlaps(a: Any, b: Any) -> bool:
+    """Intersezione su una singola dimensione (i riferimenti sono considerati sovrapposti)"""
+    if a is None or b is None or isinstance(a, str) or isinstance(b, str):
+        return True
+    if isinstance(a, frozenset):
+        return bool(a & b)
+    return intervals_overlap(a, b)
+
+
+def space_covers(outer: RuleSpace, inner: RuleSpace) -> bool:
+    """Verifica che ogni pacchetto di inner appartenga anche a outer"""
+    return all(dimension_covers(o, i) for o, i in zip(outer, inner))
+
+
+def space_overlaps(a: RuleSpace, b: RuleSpace) -> bool:
+    """Verifica se esiste un pacchetto che corrisponde a entrambe le regole"""
+    return all(dimension_overlaps(x, y) for x, y in zip(a, b))
+
+
+def network_interval(value: str) -> Tuple[int, int]:
+    """Converte un indirizzo o una rete nell'intervallo corrispondente sull'asse degli indirizzi"""
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    offset = IPV6_OFFSET if network.version == 6 else 0
+    return (int(network.network_address) + offset, int(network.broadcast_address) + offset)
+
+
+def parse_addresses(value: Optional[str], ipsets: Dict[str, Any]) -> Any:
+    """Dimensione indirizzi di un campo source/destination"""
+    if is_any(value):
+        return None
+    value = value.strip()
+    if value.startswith("@"):
+        ipset = ipsets.get(value[1:])
+        if ipset is None or IPSET_TYPES.get(ipset.type or "hash:ip") is not False:
+            return value
+        _, elements = collapse_networks(iter_json_strings(ipset.addresses), ipset.name)
+        return merge_intervals(network_interval(element) for element in elements)
+    return merge_intervals([network_interval(value)])
+
+
+def parse_ports(value: Optional[str]) -> Any:
+    """Dimensione porte di un campo src_port/dst_port ('80', '1000-2000', '80,443')"""
+    if is_any(value):
+        return None
+    value = value.strip()
+    if value.startswith("@"):
+        return value
+    intervals = []
+    for item in split_list(value):
+        start, _, end = item.replace(" ", "").partition("-")
+        intervals.append((int(start), int(end or start)))
+    return merge_intervals(intervals)
+
+
+def rule_space(rule: Any, ipsets: Dict[str, Any]) -> RuleSpace:
+    """
+    Spazio dei pacchetti di un FirewallRule, con la stessa semantica del compilatore
+
+    Le porte vengono ignorate se il protocollo è 'all' o solo ICMP, come in l4_match.
+    """
+    protocols = frozenset(p.lower() for p in split_list(rule.protocol) if p.lower() != "all")
+    if not protocols or protocols == {"icmp"}:
+        sport = dport = None
+    else:
+        sport = parse_ports(rule.src_port)
+        dport = parse_ports(rule.dst_port)
+    return RuleSpace(
+        protocols or None,
+        parse_addresses(rule.source, ipsets),
+        parse_addresses(rule.destination, ipsets),
+        sport,
+        dport
+    )
+
+
+def _index_keys(value: Any) -> Optional[List[int]]:
+    """Valori espansi di una dimensione per l'indice (None se qualsiasi, riferimento o troppo ampia)"""
+    if value is None or isinstance(value, str):
+        return None
+    if sum(end - start + 1 for start, end in value) > INDEX_RANGE_LIMIT:
+        return None
+    return [point for start, end in value for point in range(start, end + 1)]
+
+
+IndexEntry = Tuple[int, Any, RuleSpace]
+
+
+class RuleIndex:
+    """
+    Indice delle regole di una zona per porta di destinazione e indirizzi
+
+    Ogni regola viene registrata sulla prima dimensione di INDEX_DIMENSIONS
+    abbastanza ristretta da essere espansa (porte o indirizzi singoli, piccole
+    reti); se nessuna lo è, nell'elenco "ampio" della prima dimensione
+    specificata, e solo se non ne specifica nessuna tra le regole jolly. Le
+    regole jolly di una zona sono poche: una seconda con gli stessi protocolli
+    sarebbe ridondante.
+    """
+
+    def __init__(self):
+        self.keyed: Dict[str, Dict[int, List[IndexEntry]]] = {d: {} for d in INDEX_DIMENSIONS}
+        self.levels: Dict[str, List[IndexEntry]] = {d: [] for d in INDEX_DIMENSIONS}
+        self.wide: Dict[str, List[IndexEntry]] = {d: [] for d in INDEX_DIMENSIONS}
+        self.wildcard: List[IndexEntry] = []
+
+    def add(self, position: int, rule: Any, space: RuleSpace) -> None:
+        entry = (position, rule, space)
+        for dimension in INDEX_DIMENSIONS:
+            keys = _index_keys(getattr(space, dimension))
+            if keys is not None:
+                for key in keys:
+                    self.keyed[dimension].setdefault(key, []).append(entry)
+                self.levels[dimension].append(entry)
+                return
+        for dimension in INDEX_DIMENSIONS:
+            if getattr(space, dimension) is not None:
+                self.wide[dimension].append(entry)
+                return
+        self.wildcard.append(entry)
+
+    def candidates(self, space: RuleSpace) -> List[IndexEntry]:
+        """Regole che possono contenere space, in ordine di valutazione"""
+        found = list(self.wildcard)
+        for dimension in INDEX_DIMENSIONS:
+            value = getattr(space, dimension)
+            # Una regola che specifica questa dimensione non contiene "qualsiasi"
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                # Chi contiene space ne contiene anche il valore più basso
+                found.extend(self.keyed[dimension].get(value[0][0], ()))
+            found.extend(entry for entry in self.wide[dimension]
+                         if dimension_covers(getattr(entry[2], dimension), value))
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+    def overlapping(self, space: RuleSpace) -> List[IndexEntry]:
+        """Regole che possono intersecare space (ognuna una sola volta)"""
+        found = {entry[0]: entry for entry in self.wildcard}
+        for dimension in INDEX_DIMENSIONS:
+            value = getattr(space, dimension)
+            keys = _index_keys(value)
+            if value is None:
+                matches: Iterable[IndexEntry] = self.levels[dimension] + self.wide[dimension]
+            elif keys is not None:
+                matches = [entry for key in keys for entry in self.keyed[dimension].get(key, ())]
+                matches.extend(entry for entry in self.wide[dimension]
+                               if dimension_overlaps(getattr(entry[2], dimension), value))
+            else:
+                matches = (entry for entry in self.levels[dimension] + self.wide[dimension]
+                           if dimension_overlaps(getattr(entry[2], dimension), value))
+            for entry in matches:
+                found[entry[0]] = entry
+        return list(found.values())
+
+
+def _merge_candidate(a: Tuple[Any, RuleSpace], b: Tuple[Any, RuleSpace]) -> Optional[str]:
+    """Restituisce la dimensione accorpabile se due regole differiscono solo per porte o protocolli"""
+    rule_a, space_a = a
+    rule_b, space_b = b
+    if (rule_a.action or "").lower() != (rule_b.action or "").lower() or bool(rule_a.log) != bool(rule_b.log):
+        return None
+    different = [field for field in RuleSpace._fields
+                 if getattr(space_a, field) != getattr(space_b, field)]
+    if len(different) != 1 or different[0] not in ("protocols", "sport", "dport"):
+        return None
+    values = (getattr(space_a, different[0]), getattr(space_b, different[0]))
+    # "qualsiasi" o i gruppi di servizi non si possono unire in un elenco
+    if any(value is None or isinstance(value, str) for value in values):
+        return None
+    return different[0]
+
+
+def optimized_order(entries: List[Tuple[Any, RuleSpace]], hits: Dict[int, Dict[str, Any]]) -> List[int]:
+    """
+    Ordina le regole di una zona dalla più usata mantenendone la semantica
+
+    Due regole che si sovrappongono con azione o log diversi mantengono
+    l'ordine relativo; le altre possono scambiarsi. Le regole vengono
+    inserite nell'indice dall'ultima alla prima, così per ognuna l'indice
+    restituisce solo le regole successive che possono intersecarla.
+
+    Returns:
+        Id delle regole nel nuovo ordine
+    """
+    count = len(entries)
+    index = RuleIndex()
+    successors: List[List[int]] = [[] for _ in range(count)]
+    pending = [0] * count
+    for i in range(count - 1, -1, -1):
+        rule_i, space_i = entries[i]
+        for j, rule_j, space_j in index.overlapping(space_i):
+            same = ((rule_i.action or "").lower() == (rule_j.action or "").lower()
+                    and bool(rule_i.log) == bool(rule_j.log))
+            if not same and space_overlaps(space_i, space_j):
+                successors[i].append(j)
+                pending[j] += 1
+        index.add(i, rule_i, space_i)
+
+    def weight(position: int) -> Tuple[float, int, int]:
+        stats = hits.get(entries[position][0].id) or {}
+        return (-(stats.get("pps") or 0), -(stats.get("packets") or 0), position)
+
+    ready = [weight(i) for i in range(count) if not pending[i]]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        position = heapq.heappop(ready)[2]
+        order.append(entries[position][0].id)
+        for successor in successors[position]:
+            pending[successor] -= 1
+            if not pending[successor]:
+                heapq.heappush(ready, weight(successor))
+    return order
+
+
+def analyze_rules(rules: Iterable[Any], ipsets: Iterable[Any] = (),
+                  hits: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Analizza le regole attive zona per zona
+
+    Args:
+        rules: Oggetti FirewallRule (o equivalenti)
+        ipsets: Oggetti FirewallIPSet, per risolvere i riferimenti '@nome'
+        hits: Contatori per id di regola, per ordinare le regole più usate per prime
+
+    Returns:
+        Dizionario con shadowed (oscurate da una regola con azione diversa),
+        redundant (contenute in una regola precedente con la stessa azione),
+        mergeable (coppie consecutive accorpabili), invalid (regole non
+        interpretabili) e order (id per zona nell'ordinamento ottimizzato)
+    """
+    ipsets_by_name = {ipset.name: ipset for ipset in ipsets}
+    result: Dict[str, Any] = {"shadowed": [], "redundant": [], "mergeable": [], "invalid": [], "order": {}}
+
+    zones: Dict[int, List[Any]] = {}
+    # Stesso ordine di valutazione del compilatore
+    for rule in sorted(rules, key=lambda r: (r.zone_id or 0, r.priority or 0, r.id or 0)):
+        if rule.enabled:
+            zones.setdefault(rule.zone_id, []).append(rule)
+
+    for zone_id, zone_rules in zones.items():
+        index = RuleIndex()
+        effective: List[Tuple[Any, RuleSpace]] = []
+        for position, rule in enumerate(zone_rules):
+            try:
+                space = rule_space(rule, ipsets_by_name)
+            except ValueError as e:
+                result["invalid"].append({"rule_id": rule.id, "zone_id": zone_id, "error": str(e)})
+                continue
+
+            cover = next((entry for entry in index.candidates(space) if space_covers(entry[2], space)), None)
+            if cover is not None:
+                covering = cover[1]
+                same = (covering.action or "").lower() == (rule.action or "").lower()
+                result["redundant" if same else "shadowed"].append(
+                    {"rule_id": rule.id, "zone_id": zone_id, "by": covering.id})
+                continue
+
+            if effective:
+                field = _merge_candidate(effective[-1], (rule, space))
+                if field:
+                    result["mergeable"].append(
+                        {"rule_id": rule.id, "zone_id": zone_id, "with": effective[-1][0].id, "field": field})
+            index.add(position, rule, space)
+            effective.append((rule, space))
+
+        result["order"][zone_id] = optimized_order(effective, hits or {})
+    return result
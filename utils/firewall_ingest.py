@@ -0,0 +1,362 @@
+"""
+Acquisizione dei log del firewall nella tabella FirewallLog.
+Le regole con log attivo scrivono nel log del kernel righe con prefisso
+``evorouter rule=<id> <azione>``; il demone segue il file (es. /var/log/kern.log)
+come uno stream, interpreta le righe senza espressioni regolari, accorpa i
+flussi identici della stessa ora in un'unica riga con i contatori
+packets/bytes e scrive su database a blocchi, in un'unica transazione per
+blocco. L'orario di ogni riga è quello dell'intestazione syslog, così anche un
+log catturato e reimportato mantiene le date originali. Con più worker
+gunicorn il file viene seguito da un solo processo, quello che detiene il lock
+FIREWALL_LOG_INGESTION_LOCK: ogni evento è inserito una volta sola.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy import insert
+
+from app import db
+from config import (FIREWALL_LOG_SOURCE, FIREWALL_LOG_BATCH_SIZE, FIREWALL_LOG_BATCH_INTERVAL,
+                    FIREWALL_LOG_INGESTION_LOCK, FIREWALL_LOG_LOCK_RETRY_INTERVAL)
+from models import FirewallLog
+from utils.process_lock import acquire_lock
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+LOG_PREFIX = "evorouter rule="
+
+# Mesi dell'intestazione syslog tradizionale ("Oct 18 10:00:01")
+SYSLOG_MONTHS = {name: index for index, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1)}
+
+# Chiave di accorpamento: eventi con gli stessi campi diventano una sola riga
+LogEvent = namedtuple(
+    "LogEvent",
+    ["rule_id", "action", "interface", "protocol", "source_ip", "source_port",
+     "destination_ip", "destination_port", "length"]
+)
+
+
+def parse_log_line(line: str) -> Optional[LogEvent]:
+    """
+    Converte una riga del log del kernel in un LogEvent
+
+    Formato atteso (dopo l'intestazione syslog):
+    ``evorouter rule=12 drop IN=eth1 OUT= SRC=... DST=... LEN=60 ... PROTO=TCP SPT=... DPT=...``
+
+    Returns:
+        LogEvent, oppure None se la riga non è generata dal firewall
+    """
+    start = line.find(LOG_PREFIX)
+    if start < 0:
+        return None
+    tokens = line[start + len(LOG_PREFIX):].split()
+    if len(tokens) < 2:
+        return None
+    try:
+        rule_id = int(tokens[0])
+    except ValueError:
+        return None
+    action = tokens[1]
+
+    fields = {}
+    for token in tokens[2:]:
+        key, sep, value = token.partition("=")
+        # LEN compare anche nell'header TCP/UDP: vale il primo (lunghezza IP)
+        if sep and key not in fields:
+            fields[key] = value
+
+    source = fields.get("SRC")
+    destination = fields.get("DST")
+    if not source or not destination:
+        return None
+    interface = fields.get("IN") or fields.get("OUT") or None
+    return LogEvent(
+        rule_id, action, interface, fields.get("PROTO", "").lower() or None,
+        source, _number(fields.get("SPT")), destination, _number(fields.get("DPT")),
+        _number(fields.get("LEN")) or 0
+    )
+
+
+def parse_log_timestamp(line: str, now: Optional[float] = None) -> Optional[datetime]:
+    """
+    Data dell'intestazione syslog di una riga, in UTC come le righe di FirewallLog
+
+    Sono riconosciuti il formato tradizionale ("Oct 18 10:00:01", ora locale
+    senza anno: si assume l'anno corrente, o il precedente se la data cadrebbe
+    nel futuro) e quello RFC 3339 ("2026-10-18T10:00:01.123456+02:00").
+
+    Args:
+        line: Riga del log
+        now: Istante attuale (epoch), per dedurre l'anno
+
+    Returns:
+        datetime senza fuso orario, oppure None se l'intestazione non è riconosciuta
+    """
+    fields = line.split(None, 3)
+    if not fields:
+        return None
+    try:
+        if fields[0][:1].isdigit():
+            parsed = datetime.fromisoformat(fields[0])
+            if parsed.tzinfo is None:
+                return datetime.fromtimestamp(parsed.timestamp(), timezone.utc).replace(tzinfo=None)
+            return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        month = SYSLOG_MONTHS.get(fields[0])
+        if month is None or len(fields) < 3:
+            return None
+        hour, minute, second = fields[2].split(":")
+        now = time.time() if now is None else now
+        year = datetime.fromtimestamp(now).year
+        epoch = datetime(year, month, int(fields[1]), int(hour), int(minute), int(second)).timestamp()
+        if epoch > now + 86400:
+            epoch = datetime(year - 1, month, int(fields[1]), int(hour), int(minute), int(second)).timestamp()
+    except ValueError:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def _number(value: Optional[str]) -> Optional[int]:
+    """Converte un campo numerico opzionale (porte, lunghezza)"""
+    if not value or not value.isdigit():
+        return None
+    return int(value)
+
+
+class LogIngestor:
+    """
+    Accumula eventi, accorpa i flussi ripetuti e li scrive a blocchi
+
+    Un blocco viene scritto quando raggiunge ``batch_size`` righe distinte o
+    quando sono passati ``interval`` secondi dalla scrittura precedente. Gli
+    eventi sono accorpati per flusso e per ora, come nel riepilogo orario di
+    utils.firewall_log: uno stesso flusso in ore diverse resta su righe diverse.
+    """
+
+    def __init__(self, batch_size: int = FIREWALL_LOG_BATCH_SIZE,
+                 interval: float = FIREWALL_LOG_BATCH_INTERVAL, clock=time.monotonic):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._clock = clock
+        self._pending: Dict[Tuple[LogEvent, datetime], Dict[str, Any]] = {}
+        self._last_flush = clock()
+        self.events = 0
+        self.rows = 0
+
+    def feed(self, event: LogEvent, timestamp: Optional[datetime] = None) -> None:
+        """Aggiunge un evento (con la data del log, in UTC) al blocco corrente"""
+        self.events += 1
+        timestamp = timestamp or datetime.utcnow()
+        key = (event, timestamp.replace(minute=0, second=0, microsecond=0))
+        row = self._pending.get(key)
+        if row is None:
+            self._pending[key] = {
+                'timestamp': timestamp,
+                'rule_id': event.rule_id,
+                'action': event.action,
+                'interface': event.interface,
+                'protocol': event.protocol,
+                'source_ip': event.source_ip,
+                'source_port': event.source_port,
+                'destination_ip': event.destination_ip,
+                'destination_port': event.destination_port,
+                'packets': 1,
+                'bytes': event.length,
+            }
+        else:
+            row['packets'] += 1
+            row['bytes'] += event.length
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        else:
+            self.flush_due()
+
+    def flush_due(self) -> bool:
+        """Scrive il blocco corrente se è scaduto l'intervallo"""
+        if self._clock() - self._last_flush < self.interval:
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> int:
+        """
+        Scrive il blocco corrente in un'unica transazione
+
+        Se la transazione fallisce (es. database occupato) il blocco resta in
+        memoria e viene riscritto alla scrittura successiva.
+
+        Returns:
+            Numero di righe inserite
+        """
+        self._last_flush = self._clock()
+        if not self._pending:
+            return 0
+        rows = list(self._pending.values())
+        try:
+            db.session.execute(insert(FirewallLog), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self._pending = {}
+        self.rows += len(rows)
+        return len(rows)
+
+
+def ingest_lines(lines: Iterable[str], ingestor: LogIngestor) -> int:
+    """
+    Interpreta e accoda le righe del firewall, ignorando le altre
+
+    Returns:
+        Numero di righe lette
+    """
+    count = 0
+    for line in lines:
+        count += 1
+        event = parse_log_line(line)
+        if event is not None:
+            ingestor.feed(event, parse_log_timestamp(line))
+    return count
+
+
+def replay_log_file(path: str, batch_size: int = FIREWALL_LOG_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Importa un file di log catturato e misura la velocità di acquisizione
+
+    Returns:
+        Dizionario con lines, events, rows, seconds e rate (righe lette al secondo)
+    """
+    ingestor = LogIngestor(batch_size=batch_size)
+    started = time.perf_counter()
+    with open(path, "r", errors="replace") as f:
+        lines = ingest_lines(f, ingestor)
+    ingestor.flush()
+    seconds = time.perf_counter() - started
+    return {
+        'lines': lines,
+        'events': ingestor.events,
+        'rows': ingestor.rows,
+        'seconds': seconds,
+        'rate': lines / seconds if seconds > 0 else 0.0
+    }
+
+
+def follow_file(path: str, stop_event: threading.Event, poll: float = 0.5) -> Iterator[Optional[str]]:
+    """
+    Segue un file di log come ``tail -F``, riaprendolo dopo una rotazione
+
+    Restituisce None quando non ci sono righe nuove, così il chiamante può
+    scrivere i blocchi scaduti anche quando il log è fermo.
+    """
+    f = None
+    inode = None
+    # All'avvio si parte dalla fine del file; dopo una rotazione dall'inizio
+    from_start = False
+    try:
+        while not stop_event.is_set():
+            if f is None:
+                try:
+                    f = open(path, "r", errors="replace")
+                except OSError:
+                    from_start = True
+                    yield None
+                    stop_event.wait(poll)
+                    continue
+                inode = os.fstat(f.fileno()).st_ino
+                if not from_start:
+                    f.seek(0, os.SEEK_END)
+            line = f.readline()
+            if line:
+                yield line
+                continue
+            yield None
+            try:
+                current = os.stat(path)
+                rotated = current.st_ino != inode or current.st_size < f.tell()
+            except OSError:
+                rotated = True
+            if rotated:
+                f.close()
+                f = None
+                from_start = True
+                continue
+            stop_event.wait(poll)
+    finally:
+        if f is not None:
+            f.close()
+
+
+class LogIngestionJob:
+    """
+    Segue il log del kernel in un thread in background
+
+    Il thread attende di ottenere il lock ``lock_path`` prima di aprire il
+    file: negli altri worker resta in attesa e subentra se il detentore termina.
+    """
+
+    def __init__(self, app, path: str = FIREWALL_LOG_SOURCE,
+                 lock_path: str = FIREWALL_LOG_INGESTION_LOCK,
+                 retry_interval: float = FIREWALL_LOG_LOCK_RETRY_INTERVAL):
+        self.app = app
+        self.path = path
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Avvia il thread (idempotente)"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="firewall-log-ingestion")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Ferma il thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not acquire_lock(self.lock_path):
+            if self._stop_event.wait(self.retry_interval):
+                return
+        ingestor = LogIngestor()
+        with self.app.app_context():
+            for line in follow_file(self.path, self._stop_event):
+                try:
+                    if line is None:
+                        ingestor.flush_due()
+                    else:
+                        ingest_lines((line,), ingestor)
+                except Exception as e:
+                    logger.error(f"Error ingesting firewall log: {str(e)}")
+            try:
+                ingestor.flush()
+            except Exception as e:
+                logger.error(f"Error ingesting firewall log: {str(e)}")
+
+
+_ingestion_job = None
+
+
+def start_log_ingestion(app) -> LogIngestionJob:
+    """Avvia (una sola volta per processo) il demone di acquisizione dei log"""
+    global _ingestion_job
+    if _ingestion_job is None:
+        _ingestion_job = LogIngestionJob(app)
+    _ingestion_job.start()
+    return _ingestion_job
@@ -0,0 +1,206 @@
+"""
+Consultazione e retention dei log del firewall.
+Le pagine vengono lette con paginazione keyset su (timestamp, id), che usa
+l'indice invece di ordinare e scartare le righe come farebbe un OFFSET. Un job
+in background accorpa le righe più vecchie della retention in aggregati orari;
+con più worker gunicorn lo esegue solo il processo che detiene il lock
+FIREWALL_LOG_RETENTION_LOCK, così due passate non accorpano la stessa ora.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, literal, or_, select
+
+from app import db
+from config import (FIREWALL_LOG_RETENTION_DAYS, FIREWALL_LOG_RETENTION_INTERVAL,
+                    FIREWALL_LOG_AGGREGATE_DAYS, FIREWALL_LOG_RETENTION_LOCK)
+from models import FirewallLog, FirewallLogHourly
+from utils.process_lock import acquire_lock
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+def encode_cursor(log: FirewallLog) -> str:
+    """Cursore della pagina successiva a partire dall'ultima riga restituita"""
+    return f"{log.timestamp.isoformat()}_{log.id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decodifica un cursore (solleva ValueError se non valido)"""
+    timestamp, _, log_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+def log_to_dict(log: FirewallLog) -> Dict[str, Any]:
+    """Serializza una riga di log per le API"""
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'source_ip': log.source_ip,
+        'destination_ip': log.destination_ip,
+        'source_port': log.source_port,
+        'destination_port': log.destination_port,
+        'protocol': log.protocol,
+        'action': log.action,
+        'rule_id': log.rule_id,
+        'interface': log.interface,
+        'packets': log.packets,
+        'bytes': log.bytes
+    }
+
+def get_logs_page(ip: Optional[str] = None, port: Optional[int] = None,
+                  action: Optional[str] = None, rule_id: Optional[int] = None,
+                  before: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+    """
+    Restituisce una pagina di log dal più recente, con filtri opzionali
+    
+    Args:
+        ip: Indirizzo sorgente o destinazione
+        port: Porta di destinazione
+        action: accept, drop o reject
+        rule_id: ID della regola che ha generato il log
+        before: Cursore restituito dalla pagina precedente
+        limit: Righe per pagina
+    
+    Returns:
+        Dizionario con logs (righe FirewallLog) e next_cursor (None se è l'ultima pagina)
+    """
+    query = FirewallLog.query
+    if ip:
+        query = query.filter(or_(FirewallLog.source_ip == ip, FirewallLog.destination_ip == ip))
+    if port:
+        query = query.filter(FirewallLog.destination_port == port)
+    if action:
+        query = query.filter(FirewallLog.action == action)
+    if rule_id:
+        query = query.filter(FirewallLog.rule_id == rule_id)
+    if before:
+        timestamp, log_id = decode_cursor(before)
+        query = query.filter(or_(
+            FirewallLog.timestamp < timestamp,
+            and_(FirewallLog.timestamp == timestamp, FirewallLog.id < log_id)
+        ))
+    
+    # Una riga in più indica se esiste una pagina successiva
+    logs = (query.order_by(FirewallLog.timestamp.desc(), FirewallLog.id.desc())
+            .limit(limit + 1).all())
+    next_cursor = encode_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return {'logs': logs[:limit], 'next_cursor': next_cursor}
+
+def roll_up_hour(hour: datetime) -> int:
+    """
+    Accorpa le righe di un'ora in FirewallLogHourly e le elimina
+    
+    Aggregazione ed eliminazione avvengono nella stessa transazione, quindi
+    un'interruzione non può contare due volte le stesse righe.
+    
+    Returns:
+        Numero di righe eliminate
+    """
+    in_hour = and_(FirewallLog.timestamp >= hour, FirewallLog.timestamp < hour + timedelta(hours=1))
+    groups = (FirewallLog.source_ip, FirewallLog.destination_port, FirewallLog.protocol,
+              FirewallLog.action, FirewallLog.rule_id)
+    aggregates = select(
+        literal(hour, db.DateTime), *groups,
+        func.count(FirewallLog.id),
+        func.coalesce(func.sum(FirewallLog.packets), 0),
+        func.coalesce(func.sum(FirewallLog.bytes), 0)
+    ).where(in_hour).group_by(*groups)
+    
+    try:
+        db.session.execute(insert(FirewallLogHourly).from_select(
+            ['hour', 'source_ip', 'destination_port', 'protocol', 'action', 'rule_id',
+             'events', 'packets', 'bytes'],
+            aggregates
+        ))
+        deleted = FirewallLog.query.filter(in_hour).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+    except Exception:
+        db.session.rollback()
+        raise
+
+def apply_log_retention(retention_days: int = FIREWALL_LOG_RETENTION_DAYS,
+                        aggregate_days: int = FIREWALL_LOG_AGGREGATE_DAYS,
+                        now: Optional[datetime] = None) -> int:
+    """
+    Accorpa in aggregati orari i log più vecchi della retention, un'ora alla volta
+    
+    Returns:
+        Numero di righe di log accorpate
+    """
+    now = now or datetime.utcnow()
+    # Solo ore complete: l'ora a cavallo del limite resta per intero nei log
+    cutoff = (now - timedelta(days=retention_days)).replace(minute=0, second=0, microsecond=0)
+    
+    total = 0
+    while True:
+        oldest = db.session.query(func.min(FirewallLog.timestamp)).scalar()
+        if oldest is None or oldest >= cutoff:
+            break
+        total += roll_up_hour(oldest.replace(minute=0, second=0, microsecond=0))
+    
+    FirewallLogHourly.query.filter(
+        FirewallLogHourly.hour < now - timedelta(days=aggregate_days)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    
+    if total:
+        logger.info(f"Rolled up {total} firewall log rows older than {cutoff}")
+    return total
+
+class LogRetentionJob:
+    """
+    Esegue periodicamente apply_log_retention in un thread in background
+    
+    Ogni passata parte solo se il processo detiene il lock ``lock_path``: gli
+    altri worker saltano il turno e subentrano se il detentore termina.
+    """
+    
+    def __init__(self, app, interval: int = FIREWALL_LOG_RETENTION_INTERVAL,
+                 lock_path: str = FIREWALL_LOG_RETENTION_LOCK):
+        self.app = app
+        self.interval = interval
+        self.lock_path = lock_path
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self) -> None:
+        """Avvia il thread (idempotente)"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="firewall-log-retention")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """Ferma il thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+    
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            if not acquire_lock(self.lock_path):
+                continue
+            try:
+                with self.app.app_context():
+                    apply_log_retention()
+            except Exception as e:
+                logger.error(f"Error applying firewall log retention: {str(e)}")
+
+_retention_job = None
+
+def start_log_retention(app) -> LogRetentionJob:
+    """Avvia (una sola volta per processo) il job di retention dei log"""
+    global _retention_job
+    if _retention_job is None:
+        _retention_job = LogRetentionJob(app)
+    _retention_job.start()
+    return _retention_job
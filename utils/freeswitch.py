@@ -2,10 +2,8 @@ import logging
 import subprocess
 import os
 import re
-import psutil
 import time
 import socket
-import xml.etree.ElementTree as ET
 from config import (
     FREESWITCH_PATH, FREESWITCH_CONFIG_PATH, 
     FREESWITCH_LOG_PATH, FREESWITCH_DEFAULT_PORT
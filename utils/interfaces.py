@@ -0,0 +1,332 @@
+"""
+State of the network interfaces.
+
+Link attributes and counters are read from sysfs (/sys/class/net/<nic>/
+operstate, speed, address, statistics/*) and the addresses of every NIC come
+from one getifaddrs() call (a single netlink dump), so a refresh is one pass
+over all interfaces without spawning any process. The metrics sampler drives
+the refreshes. Change detection compares link and address attributes only:
+the views served to the dashboard, the network pages and the speed-test page
+are rebuilt (and changes logged) only when those change, while the traffic
+counters, which move on every refresh, are published separately and merged
+into the cached views. Everything is published by reference swap, so a request
+just returns the latest list.
+"""
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+
+import psutil
+
+from config import DEFAULT_WAN_INTERFACE, INTERFACE_STATUS_INTERVAL
+from utils.metrics import get_sampler
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+SYS_CLASS_NET = "/sys/class/net"
+
+# Counters read from statistics/, named as in sysfs
+STATISTICS = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+              "rx_errors", "tx_errors", "rx_dropped", "tx_dropped")
+
+# ARPHRD_LOOPBACK in /sys/class/net/<nic>/type
+ARPHRD_LOOPBACK = 772
+
+# Interfaces hidden from the status list (IFB devices used by the QoS ingress shaping)
+STATUS_EXCLUDED_PREFIXES = ("ifb",)
+
+# Interfaces hidden from the speed-test page (as before: loopback, containers, libvirt)
+SPEED_TEST_EXCLUDED_PREFIXES = ("lo", "docker")
+
+
+def _read_attribute(path):
+    """Content of a sysfs attribute, None if missing or unreadable (e.g. speed of a down link)"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _read_int(path):
+    value = _read_attribute(path)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_sysfs_interfaces(root=SYS_CLASS_NET):
+    """
+    Read link state and counters of every interface in one pass over sysfs
+
+    Returns:
+        dict: name -> dict with operstate, speed (Mb/s or None), mac, loopback,
+              wireless and the STATISTICS counters
+    """
+    interfaces = {}
+    try:
+        names = sorted(os.listdir(root))
+    except OSError as e:
+        logger.debug(f"Cannot list {root}: {str(e)}")
+        return interfaces
+
+    for name in names:
+        path = os.path.join(root, name)
+        speed = _read_int(os.path.join(path, "speed"))
+        mac = _read_attribute(os.path.join(path, "address"))
+        interface = {
+            "operstate": _read_attribute(os.path.join(path, "operstate")) or "unknown",
+            "speed": speed if speed is not None and speed > 0 else None,
+            "mac": mac.upper() if mac else None,
+            "loopback": _read_int(os.path.join(path, "type")) == ARPHRD_LOOPBACK,
+            "wireless": os.path.isdir(os.path.join(path, "wireless")),
+        }
+        for counter in STATISTICS:
+            interface[counter] = _read_int(os.path.join(path, "statistics", counter)) or 0
+        interfaces[name] = interface
+    return interfaces
+
+
+def _prefix_length(netmask):
+    """Prefix length of a dotted or colon netmask"""
+    try:
+        return bin(int(ipaddress.ip_address(netmask))).count("1")
+    except ValueError:
+        return None
+
+
+def read_addresses():
+    """
+    Read the addresses of every interface with a single getifaddrs() dump
+
+    Returns:
+        dict: name -> {"ipv4": [(address, netmask)], "ipv6": [(address, prefix)]}
+    """
+    addresses = {}
+    for name, entries in psutil.net_if_addrs().items():
+        interface = addresses.setdefault(name, {"ipv4": [], "ipv6": []})
+        for entry in entries:
+            if entry.family == socket.AF_INET:
+                interface["ipv4"].append((entry.address, entry.netmask))
+            elif entry.family == socket.AF_INET6:
+                # Link-local addresses carry the scope ("fe80::1%eth0")
+                address = entry.address.split("%", 1)[0]
+                interface["ipv6"].append((address, _prefix_length(entry.netmask) if entry.netmask else None))
+    return addresses
+
+
+def _format_speed(speed):
+    if speed is None:
+        return "N/A"
+    if speed >= 1000:
+        return f"{speed / 1000:g} Gbps"
+    return f"{speed} Mbps"
+
+
+def _is_link_local(address):
+    return address.lower().startswith("fe80:")
+
+
+class InterfaceMonitor:
+    """
+    Cached state of the network interfaces
+
+    Args:
+        sysfs_reader: Callable returning the sysfs state per interface
+        address_reader: Callable returning the addresses per interface
+        interval: Minimum seconds between refreshes
+        wan_interface: Name of the WAN interface (type "WAN" in the status)
+        clock: Monotonic time source, overridable in tests
+    """
+
+    def __init__(self, sysfs_reader=read_sysfs_interfaces, address_reader=read_addresses,
+                 interval=INTERFACE_STATUS_INTERVAL, wan_interface=DEFAULT_WAN_INTERFACE, clock=time.monotonic):
+        self.sysfs_reader = sysfs_reader
+        self.address_reader = address_reader
+        self.interval = interval
+        self.wan_interface = wan_interface
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = None
+        self._last_refresh = None
+        # Views without counters, rebuilt only when the state changes
+        self._status_base = []
+        self._speed_test_base = []
+        # Published views: replaced, never mutated
+        self._counters = {}
+        self._status = []
+        self._speed_test = []
+
+    def status(self):
+        """
+        Interface list for the dashboard and the network pages
+
+        Returns:
+            list: Interface dicts (read-only)
+        """
+        return self._status
+
+    def speed_test_interfaces(self):
+        """
+        Interface list for the speed-test page (addresses and counters)
+
+        Returns:
+            list: Interface dicts (read-only)
+        """
+        return self._speed_test
+
+    def counters(self):
+        """
+        Traffic counters per interface, updated on every refresh
+
+        Returns:
+            dict: name -> STATISTICS counters (read-only)
+        """
+        return self._counters
+
+    def maybe_refresh(self):
+        """Refresh if at least interval seconds have passed since the last refresh"""
+        if self._last_refresh is None or self._clock() - self._last_refresh >= self.interval:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Read sysfs and the addresses once and publish what changed
+
+        Returns:
+            bool: True if link or address attributes changed (counters do not count)
+        """
+        links = self.sysfs_reader()
+        addresses = self.address_reader()
+        state = {}
+        counters = {}
+        for name, link in links.items():
+            interface = {key: value for key, value in link.items() if key not in STATISTICS}
+            counters[name] = {counter: link.get(counter, 0) for counter in STATISTICS}
+            interface_addresses = addresses.get(name, {})
+            interface["ipv4"] = tuple(interface_addresses.get("ipv4", ()))
+            interface["ipv6"] = tuple(sorted(interface_addresses.get("ipv6", ()),
+                                             key=lambda entry: (_is_link_local(entry[0]), entry[0])))
+            state[name] = interface
+
+        with self._lock:
+            self._last_refresh = self._clock()
+            previous = self._state
+            changed = state != previous
+            if changed:
+                self._log_changes(previous or {}, state)
+                self._state = state
+                self._build_views(state)
+            if changed or counters != self._counters:
+                self._publish(counters)
+            return changed
+
+    def _log_changes(self, previous, state):
+        for name in sorted(set(previous) | set(state)):
+            before = previous.get(name)
+            after = state.get(name)
+            if before is None or after is None:
+                if previous:
+                    logger.info(f"Interface {name} {'added' if before is None else 'removed'}")
+            elif before["operstate"] != after["operstate"]:
+                logger.info(f"Interface {name}: {before['operstate']} -> {after['operstate']}")
+            elif before["ipv4"] != after["ipv4"] or before["ipv6"] != after["ipv6"]:
+                logger.info(f"Interface {name}: addresses changed")
+
+    def _interface_type(self, name, interface):
+        if name == self.wan_interface:
+            return "WAN"
+        return "WiFi" if interface["wireless"] else "LAN"
+
+    def _build_views(self, state):
+        status = []
+        speed_test = []
+        for name, interface in state.items():
+            if interface["loopback"] or name.startswith(STATUS_EXCLUDED_PREFIXES):
+                continue
+            ipv4 = interface["ipv4"]
+            ipv6 = interface["ipv6"]
+            up = interface["operstate"] == "up"
+            status.append({
+                "name": name,
+                "type": self._interface_type(name, interface),
+                "state": interface["operstate"].upper(),
+                "status": "up" if up else "down",
+                "speed": _format_speed(interface["speed"]),
+                # IPv4 info
+                "ipv4_enabled": bool(ipv4),
+                "ipv4_address": ipv4[0][0] if ipv4 else "N/A",
+                "ipv4_subnet": ipv4[0][1] if ipv4 else "N/A",
+                "ip_address": ipv4[0][0] if ipv4 else "",
+                # IPv6 info
+                "ipv6_enabled": bool(ipv6),
+                "ipv6_address": ipv6[0][0] if ipv6 else "N/A",
+                "ipv6_prefix": str(ipv6[0][1]) if ipv6 and ipv6[0][1] is not None else "N/A",
+                "mac": interface["mac"] or "N/A",
+                "mac_address": interface["mac"] or "N/A",
+            })
+
+            if name.startswith(SPEED_TEST_EXCLUDED_PREFIXES) or "vir" in name:
+                continue
+            speed_test.append({
+                "name": name,
+                "addresses": [{"type": "ipv4", "address": address, "netmask": netmask}
+                              for address, netmask in ipv4] +
+                             [{"type": "ipv6", "address": address} for address, _ in ipv6],
+            })
+
+        self._status_base = status
+        self._speed_test_base = speed_test
+
+    def _publish(self, counters):
+        status = [dict(interface, rx_bytes=counters[interface["name"]]["rx_bytes"],
+                       tx_bytes=counters[interface["name"]]["tx_bytes"])
+                  for interface in self._status_base]
+        speed_test = []
+        for interface in self._speed_test_base:
+            interface_counters = counters[interface["name"]]
+            speed_test.append(dict(interface, stats={
+                "bytes_sent": interface_counters["tx_bytes"],
+                "bytes_recv": interface_counters["rx_bytes"],
+                "packets_sent": interface_counters["tx_packets"],
+                "packets_recv": interface_counters["rx_packets"],
+                "errin": interface_counters["rx_errors"],
+                "errout": interface_counters["tx_errors"],
+                "dropin": interface_counters["rx_dropped"],
+                "dropout": interface_counters["tx_dropped"],
+            }))
+
+        # Publish by reference swap: readers never see a half-built list
+        self._counters = counters
+        self._status = status
+        self._speed_test = speed_test
+
+
+_monitor = InterfaceMonitor()
+_monitor_listener_registered = False
+_monitor_lock = threading.Lock()
+
+
+def get_interface_monitor():
+    """
+    Get the process-wide interface monitor
+
+    The first call reads the interfaces synchronously, so callers always find
+    populated views; afterwards the metrics sampler keeps them current.
+
+    Returns:
+        InterfaceMonitor: The shared monitor
+    """
+    global _monitor_listener_registered
+    if not _monitor_listener_registered:
+        with _monitor_lock:
+            if not _monitor_listener_registered:
+                _monitor.refresh()
+                get_sampler().add_listener(lambda stats, usage, deltas: _monitor.maybe_refresh())
+                _monitor_listener_registered = True
+    return _monitor
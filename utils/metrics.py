@@ -0,0 +1,311 @@
+"""
+Background sampler for system metrics.
+
+A single daemon thread per process samples CPU, memory, disk, temperature and
+per-NIC counters on a fixed cadence and publishes an immutable snapshot.
+Request handlers only read the latest snapshot, so they never block on psutil.
+"""
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import psutil
+
+from config import METRICS_SAMPLE_INTERVAL
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+
+def _read_system_info():
+    """
+    Read static system information (OS name, kernel, hostname)
+
+    These values do not change while the process is running, so they are
+    read once when the sampler starts instead of on every sample.
+
+    Returns:
+        dict: Dictionary with os_name, kernel and hostname
+    """
+    info = {}
+
+    try:
+        with open('/etc/os-release', 'r') as f:
+            os_info = {}
+            for line in f:
+                if '=' in line:
+                    key, value = line.rstrip().split('=', 1)
+                    os_info[key] = value.strip('"')
+        info['os_name'] = os_info.get('PRETTY_NAME', 'Unknown')
+    except Exception:
+        info['os_name'] = 'EvoRouter R4 OS'
+
+    try:
+        info['kernel'] = subprocess.run(['uname', '-r'],
+                                        capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        info['kernel'] = 'Unknown'
+
+    try:
+        info['hostname'] = subprocess.run(['hostname'],
+                                          capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        info['hostname'] = 'bpi-r4-router'
+
+    return info
+
+
+def _read_temperatures():
+    """
+    Read CPU/system temperatures if the platform exposes them
+
+    Returns:
+        dict: Dictionary with optional 'cpu' and 'system' keys
+    """
+    temperature = {}
+    if not hasattr(psutil, "sensors_temperatures"):
+        return temperature
+
+    temps = psutil.sensors_temperatures()
+    if not temps:
+        return temperature
+
+    for chip, sensors in temps.items():
+        for sensor in sensors:
+            label = sensor.label.lower()
+            if any(x in label for x in ['cpu', 'core', 'package']):
+                temperature['cpu'] = sensor.current
+            elif 'sys' in label:
+                temperature['system'] = sensor.current
+    return temperature
+
+
+class MetricsSampler:
+    """
+    Periodically samples system metrics into a shared in-memory snapshot
+
+    The snapshot dictionaries are replaced, never mutated, so readers can use
+    them without locking. Callers must treat returned snapshots as read-only.
+    """
+
+    def __init__(self, interval=METRICS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._system_info = None
+        self._last_counters = None
+        self._last_time = None
+        self._stats = {}
+        self._network_usage = {}
+        self._listeners = []
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start the sampling thread (idempotent)
+
+        The first sample is taken synchronously so that callers always find a
+        populated snapshot.
+        """
+        with self._lock:
+            if self.running:
+                return
+            self._stop_event.clear()
+            self._system_info = _read_system_info()
+            # Prime psutil's CPU counters so the next non-blocking call has a baseline
+            psutil.cpu_percent(interval=None)
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name="metrics-sampler")
+            self._thread.daemon = True
+            self._thread.start()
+            logger.info(f"Metrics sampler started (interval {self.interval}s)")
+
+    def add_listener(self, callback):
+        """
+        Register a callback invoked after every sample
+
+        Args:
+            callback: Callable (stats, network_usage, deltas) where deltas maps
+                each interface to the bytes_recv/bytes_sent since the last sample
+        """
+        self._listeners.append(callback)
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.interval + 1)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Error sampling system metrics: {str(e)}")
+
+    def sample(self):
+        """
+        Take one sample and publish a new snapshot
+
+        Returns:
+            dict: The newly published system stats snapshot
+        """
+        now = time.monotonic()
+        counters = psutil.net_io_counters(pernic=True)
+
+        stats = {}
+        stats['timestamp'] = time.time()
+
+        cpu_freq = psutil.cpu_freq()
+        stats['cpu'] = {
+            'usage': psutil.cpu_percent(interval=None),
+            'count': psutil.cpu_count(),
+            'frequency': cpu_freq.current if cpu_freq else 'N/A'
+        }
+
+        memory = psutil.virtual_memory()
+        stats['memory'] = {
+            'total': memory.total,
+            'available': memory.available,
+            'used': memory.used,
+            'percent': memory.percent
+        }
+
+        disk = psutil.disk_usage('/')
+        stats['disk'] = {
+            'total': disk.total,
+            'free': disk.free,
+            'used': disk.used,
+            'percent': disk.percent
+        }
+
+        stats['load_avg'] = os.getloadavg()
+
+        uptime_seconds = time.time() - psutil.boot_time()
+        stats['uptime'] = {
+            'days': int(uptime_seconds // (60*60*24)),
+            'hours': int((uptime_seconds % (60*60*24)) // (60*60)),
+            'minutes': int((uptime_seconds % (60*60)) // 60),
+            'seconds': int(uptime_seconds % 60)
+        }
+
+        try:
+            stats['temperature'] = _read_temperatures()
+        except Exception as e:
+            logger.debug(f"Temperature sensors unavailable: {str(e)}")
+            stats['temperature'] = {}
+
+        network = {}
+        total_bytes_sent = 0
+        total_bytes_recv = 0
+        for interface, data in counters.items():
+            if interface == 'lo':  # Skip loopback
+                continue
+            network[interface] = {
+                'bytes_sent': data.bytes_sent,
+                'bytes_recv': data.bytes_recv,
+                'packets_sent': data.packets_sent,
+                'packets_recv': data.packets_recv,
+                'errin': data.errin,
+                'errout': data.errout,
+                'dropin': data.dropin,
+                'dropout': data.dropout
+            }
+            total_bytes_sent += data.bytes_sent
+            total_bytes_recv += data.bytes_recv
+        network['total'] = {
+            'bytes_sent': total_bytes_sent,
+            'bytes_recv': total_bytes_recv
+        }
+        stats['network'] = network
+
+        stats['system'] = dict(self._system_info or {})
+
+        # Per-interface rates from the delta with the previous sample
+        usage = {}
+        deltas = {}
+        if self._last_counters is not None and now > self._last_time:
+            elapsed = now - self._last_time
+            for interface, data in counters.items():
+                previous = self._last_counters.get(interface)
+                if interface == 'lo' or previous is None:
+                    continue
+                # Counters can go backwards when a NIC is reset
+                deltas[interface] = {
+                    'bytes_sent': max(data.bytes_sent - previous.bytes_sent, 0),
+                    'bytes_recv': max(data.bytes_recv - previous.bytes_recv, 0)
+                }
+                bytes_sent = deltas[interface]['bytes_sent'] / elapsed
+                bytes_recv = deltas[interface]['bytes_recv'] / elapsed
+                usage[interface] = {
+                    'bytes_sent': bytes_sent,
+                    'bytes_recv': bytes_recv,
+                    'mbits_sent': bytes_sent * 8 / 1000000,
+                    'mbits_recv': bytes_recv * 8 / 1000000
+                }
+
+        self._last_counters = counters
+        self._last_time = now
+
+        # Publish by reference swap: readers never see a half-built snapshot
+        self._stats = stats
+        self._network_usage = usage
+
+        for callback in self._listeners:
+            try:
+                callback(stats, usage, deltas)
+            except Exception as e:
+                logger.error(f"Error in metrics listener {callback!r}: {str(e)}")
+        return stats
+
+    def get_stats(self):
+        """
+        Get the latest system stats snapshot
+
+        Returns:
+            dict: System stats (read-only)
+        """
+        return self._stats
+
+    def get_network_usage(self):
+        """
+        Get the latest per-interface network rates (bytes/sec)
+
+        Returns:
+            dict: Network usage per interface (read-only)
+        """
+        return self._network_usage
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """
+    Get the process-wide metrics sampler, starting it on first use
+
+    Returns:
+        MetricsSampler: The running sampler
+    """
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                from utils.timeseries import get_bandwidth_history
+                sampler = MetricsSampler()
+                history = get_bandwidth_history()
+                sampler.add_listener(
+                    lambda stats, usage, deltas: history.record_deltas(deltas, stats['timestamp']))
+                _sampler = sampler
+    if not _sampler.running:
+        _sampler.start()
+    return _sampler
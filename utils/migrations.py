@@ -0,0 +1,98 @@
+"""
+Migrazioni dello schema del database.
+db.create_all() crea solo le tabelle mancanti: su un database già esistente non
+aggiunge colonne né indici. Ogni migrazione ha un numero di versione crescente
+e viene eseguita una sola volta; le versioni applicate sono registrate nella
+tabella schema_migration. Gli indici sono dichiarati nei modelli (così un
+database nuovo li riceve da create_all) e le migrazioni li creano, se mancano,
+sui database esistenti.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, insert, select
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+# Tabella delle versioni applicate (metadati propri, non fa parte dei modelli)
+schema_metadata = MetaData()
+schema_migration = Table(
+    'schema_migration', schema_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(64), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+def find_index(metadata, name):
+    """Cerca un indice dichiarato nei modelli (solleva KeyError se non esiste)"""
+    for table in metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"Indice {name} non dichiarato nei modelli")
+
+def create_indexes(*names):
+    """Migrazione che crea gli indici indicati, se non esistono già"""
+    def upgrade(conn, metadata):
+        for name in names:
+            find_index(metadata, name).create(conn, checkfirst=True)
+    return upgrade
+
+# (versione, nome, funzione upgrade(conn, metadata)) in ordine di applicazione
+MIGRATIONS = [
+    (1, 'firewall_log_indexes', create_indexes(
+        'ix_firewall_log_timestamp_id',
+        'ix_firewall_log_source_ip_timestamp',
+        'ix_firewall_log_destination_ip_timestamp',
+        'ix_firewall_log_destination_port_timestamp',
+        'ix_firewall_log_action_timestamp',
+        'ix_firewall_log_rule_id_timestamp',
+        'ix_firewall_log_hourly_hour',
+    )),
+    (2, 'hot_lookup_indexes', create_indexes(
+        'ix_system_log_log_type_timestamp',
+        'ix_system_log_timestamp',
+        'ix_call_recording_start_time',
+        'ix_call_recording_caller_start_time',
+        'ix_call_recording_callee_start_time',
+        'ix_voicemail_message_extension_id_listened_received_at',
+        'ix_inbound_route_did_number',
+        'ix_outbound_route_enabled_priority',
+        'ix_upnp_port_mapping_external_port_protocol',
+        'ix_qos_rule_class_id_priority',
+    )),
+]
+
+def applied_versions(engine):
+    """Versioni già applicate al database"""
+    schema_migration.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migration.c.version)).scalars())
+
+def run_migrations(engine, metadata, migrations=None):
+    """
+    Applica le migrazioni mancanti, ciascuna nella propria transazione
+
+    Args:
+        engine: Engine SQLAlchemy del database
+        metadata: Metadati dei modelli (db.metadata)
+        migrations: Elenco delle migrazioni (predefinito MIGRATIONS)
+
+    Returns:
+        list: Versioni applicate in questa esecuzione
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    applied = applied_versions(engine)
+
+    executed = []
+    for version, name, upgrade in sorted(migrations, key=lambda migration: migration[0]):
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            upgrade(conn, metadata)
+            conn.execute(insert(schema_migration).values(
+                version=version, name=name, applied_at=datetime.utcnow()))
+        logger.info(f"Migrazione {version} ({name}) applicata")
+        executed.append(version)
+    return executed
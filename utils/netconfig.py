@@ -0,0 +1,243 @@
+"""
+Compilatore della configurazione di rete dell'EvoRouter R4.
+Confronta lo stato desiderato (righe NetworkConfig) con lo stato letto dal
+kernel (``ip -j address`` e ``ip -j route``) e produce solo i comandi per le
+differenze: indirizzi da aggiungere o togliere, route di default da sostituire
+e interfacce da attivare o disattivare. Le route di default del router sono
+create con ``proto static``, così si distinguono da quelle dei client DHCP e
+PPPoE. I comandi vengono eseguiti con un solo
+``ip -batch``; per ogni passo è registrato il comando inverso, così se il
+batch si interrompe vengono annullati esattamente i passi già eseguiti.
+Le interfacce non modificate non ricevono alcun comando.
+
+Come utils.nftables e utils.tc, le funzioni di questo modulo non accedono al
+database né al sistema e ricevono oggetti con gli attributi dei modelli.
+"""
+import ipaddress
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Famiglie di indirizzi gestite ("4" e "6", come le chiavi JSON dello stato)
+FAMILIES = ("4", "6")
+
+# Prefisso predefinito se la maschera non è indicata
+DEFAULT_IPV4_NETMASK = "255.255.255.0"
+DEFAULT_IPV6_PREFIX = 64
+
+# Modalità IPv4 in cui indirizzo e route appartengono a un client (dhclient o pppd)
+CLIENT_MODES = ("dhcp", "pppoe")
+
+# Riga fallita riportata da ``ip -batch`` ("Command failed -:3")
+BATCH_FAILURE = re.compile(r"Command failed \S*:(\d+)")
+
+# Passo del piano: (comando, comandi che lo annullano)
+Step = Tuple[str, List[str]]
+
+
+def normalize_address(address: str, prefix: Any) -> str:
+    """Indirizzo con prefisso in forma canonica (es. "fd00::1/64")"""
+    return ipaddress.ip_interface(f"{address}/{prefix}").with_prefixlen
+
+
+def interface_state(config: Any) -> Dict[str, Any]:
+    """
+    Stato desiderato di un'interfaccia a partire da una riga NetworkConfig
+
+    Con DHCP, PPPoE o autoconfigurazione (famiglie dynamic) indirizzi e route
+    appartengono al client corrispondente: vengono tolti solo gli indirizzi
+    non dinamici e la route statica rimasti da una configurazione statica.
+    Una famiglia disabilitata perde tutti gli indirizzi non dinamici e la
+    route di default.
+
+    Returns:
+        Dizionario con up e families (famiglia -> addresses, gateway, dynamic)
+    """
+    families: Dict[str, Dict[str, Any]] = {}
+    if not config.ipv4_enabled:
+        families["4"] = {"addresses": [], "gateway": None, "dynamic": False}
+    elif config.ipv4_mode != "static":
+        families["4"] = {"addresses": [], "gateway": None, "dynamic": True}
+    elif config.ipv4_address:
+        netmask = config.ipv4_subnet_mask or DEFAULT_IPV4_NETMASK
+        families["4"] = {"addresses": [normalize_address(config.ipv4_address, netmask)],
+                         "gateway": config.ipv4_gateway or None, "dynamic": False}
+    if not config.ipv6_enabled:
+        families["6"] = {"addresses": [], "gateway": None, "dynamic": False}
+    elif config.ipv6_mode != "static":
+        families["6"] = {"addresses": [], "gateway": None, "dynamic": True}
+    elif config.ipv6_address:
+        families["6"] = {"addresses": [normalize_address(config.ipv6_address,
+                                                         config.ipv6_prefix_length or DEFAULT_IPV6_PREFIX)],
+                         "gateway": config.ipv6_gateway or None, "dynamic": False}
+    return {"up": bool(config.is_active), "families": families}
+
+
+def parse_links(output: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Stato delle interfacce dall'output di ``ip -j address show``
+
+    Sono considerati solo gli indirizzi globali non dinamici: quelli assegnati
+    da DHCP o SLAAC (dynamic) e i link-local non sono gestiti dal router.
+
+    Returns:
+        Dizionario nome -> up, addresses (famiglia -> insieme), gateways e
+        static_gateways (vuoti)
+    """
+    links = {}
+    for link in json.loads(output or "[]"):
+        addresses: Dict[str, set] = {family: set() for family in FAMILIES}
+        for info in link.get("addr_info", []):
+            if info.get("scope") != "global" or info.get("dynamic"):
+                continue
+            family = "6" if info.get("family") == "inet6" else "4"
+            addresses[family].add(normalize_address(info["local"], info["prefixlen"]))
+        links[link["ifname"]] = {"up": "UP" in link.get("flags", []),
+                                 "addresses": addresses, "gateways": {}, "static_gateways": {}}
+    return links
+
+
+def parse_default_routes(output: str, family: str, links: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Aggiunge a links i gateway di default letti da ``ip -j route show default``
+
+    In static_gateways finiscono solo le route create dal router (proto static).
+    """
+    for route in json.loads(output or "[]"):
+        link = links.get(route.get("dev"))
+        if link is not None and route.get("gateway"):
+            link["gateways"].setdefault(family, route["gateway"])
+            if route.get("protocol") == "static":
+                link["static_gateways"].setdefault(family, route["gateway"])
+
+
+def plan_interface(name: str, desired: Dict[str, Any], live: Optional[Dict[str, Any]]) -> List[Step]:
+    """
+    Passi necessari per portare un'interfaccia dallo stato live a quello desiderato
+
+    Gli indirizzi vengono tolti prima di essere aggiunti (un nuovo indirizzo
+    nella stessa rete diventerebbe secondario e verrebbe rimosso con il
+    primario) e la route di default viene reimpostata dopo, perché il kernel
+    la elimina insieme all'indirizzo che la rende raggiungibile. In una
+    famiglia dynamic si toglie solo la route creata dal router: quella del
+    client DHCP o PPPoE resta.
+
+    Raises:
+        ValueError: Se l'interfaccia non esiste
+    """
+    if live is None:
+        raise ValueError(f"Interfaccia {name} inesistente")
+
+    steps: List[Step] = []
+    if desired["up"] and not live["up"]:
+        steps.append((f"link set dev {name} up", [f"link set dev {name} down"]))
+
+    for family, target in sorted(desired["families"].items()):
+        current = live["addresses"].get(family, set())
+        wanted = set(target["addresses"])
+        old_gateway = live["static_gateways" if target["dynamic"] else "gateways"].get(family)
+        new_gateway = target["gateway"]
+        removed = sorted(current - wanted)
+        added = sorted(wanted - current)
+
+        if old_gateway and not new_gateway:
+            steps.append((f"route del default via {old_gateway} dev {name}",
+                          [f"route replace default via {old_gateway} dev {name} proto static"]))
+        for index, address in enumerate(removed):
+            undo = [f"address add {address} dev {name}"]
+            if index == 0 and old_gateway and new_gateway:
+                # Annullato per ultimo: la route torna dopo tutti gli indirizzi
+                undo.append(f"route replace default via {old_gateway} dev {name} proto static")
+            steps.append((f"address del {address} dev {name}", undo))
+        for address in added:
+            steps.append((f"address add {address} dev {name}", [f"address del {address} dev {name}"]))
+        if new_gateway and (new_gateway != live["static_gateways"].get(family) or removed):
+            undo = ([f"route replace default via {old_gateway} dev {name} proto static"] if old_gateway
+                    else [f"route del default via {new_gateway} dev {name}"])
+            steps.append((f"route replace default via {new_gateway} dev {name} proto static", undo))
+
+    if not desired["up"] and live["up"]:
+        steps.append((f"link set dev {name} down", [f"link set dev {name} up"]))
+    return steps
+
+
+def plan_network(desired: Dict[str, Dict[str, Any]], live: Dict[str, Dict[str, Any]],
+                 interfaces: Optional[List[str]] = None) -> List[Step]:
+    """
+    Passi per tutte le interfacce configurate (o solo per quelle indicate)
+
+    Raises:
+        ValueError: Se un'interfaccia configurata non esiste
+    """
+    steps: List[Step] = []
+    for name in sorted(desired):
+        if interfaces is not None and name not in interfaces:
+            continue
+        steps.extend(plan_interface(name, desired[name], live.get(name)))
+    return steps
+
+
+def render_batch(steps: List[Step]) -> str:
+    """File per ``ip -batch`` con un comando per riga"""
+    return "".join(f"{command}\n" for command, _ in steps)
+
+
+def applied_steps(steps: List[Step], error: str) -> int:
+    """
+    Numero di passi eseguiti prima dell'errore di ``ip -batch``
+
+    Se la riga fallita non è riconoscibile si considerano eseguiti tutti i
+    passi: annullare un passo non eseguito fallisce senza effetti (con -force).
+    """
+    match = BATCH_FAILURE.search(error or "")
+    if match is None:
+        return len(steps)
+    return min(len(steps), int(match.group(1)) - 1)
+
+
+def render_rollback(steps: List[Step], applied: int) -> str:
+    """File per ``ip -force -batch`` che annulla i primi applied passi, dall'ultimo al primo"""
+    lines = []
+    for _, undo in reversed(steps[:applied]):
+        lines.extend(undo)
+    return "".join(f"{line}\n" for line in lines)
+
+
+def pppoe_peer_name(interface: str) -> str:
+    """Nome del file in /etc/ppp/peers (e linkname di pppd) della connessione PPPoE"""
+    return f"evorouter-{interface}"
+
+
+def _pppd_string(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def compile_pppoe_peer(interface: str, username: str, password: str, service_name: Optional[str] = None) -> str:
+    """
+    File di opzioni pppd per la connessione PPPoE su un'interfaccia
+
+    Le credenziali restano in questo file (da scrivere con permessi 0600):
+    pppd imposta indirizzo, route di default e DNS ricevuti dal provider.
+    """
+    lines = ["# Generato da EvoRouter: le modifiche manuali verranno sovrascritte",
+             "plugin pppoe.so", f"nic-{interface}"]
+    if service_name:
+        lines.append(f"rp_pppoe_service {_pppd_string(service_name)}")
+    lines.extend([f"user {_pppd_string(username)}", f"password {_pppd_string(password)}", "hide-password",
+                  "noauth", "noipdefault", "defaultroute", "usepeerdns", "persist", "maxfail 0",
+                  f"linkname {pppoe_peer_name(interface)}"])
+    return "\n".join(lines) + "\n"
+
+
+def compile_dhcp_range(interface: str, enabled: bool, start_ip: Optional[str], end_ip: Optional[str],
+                       lease_hours: int) -> str:
+    """Frammento di configurazione dnsmasq con il range DHCP della LAN"""
+    lines = ["# Generato da EvoRouter: le modifiche manuali verranno sovrascritte"]
+    if enabled:
+        lines.append(f"dhcp-range=interface:{interface},{start_ip},{end_ip},{int(lease_hours)}h")
+    return "\n".join(lines) + "\n"
+
+
+def compile_dns_servers(servers: List[Optional[str]]) -> str:
+    """File resolv con i server DNS a cui dnsmasq inoltra le richieste"""
+    return "".join(f"nameserver {server}\n" for server in servers if server)
@@ -4,89 +4,41 @@ import re
 import subprocess
 import json
 import random
-from datetime import datetime, timedelta
-from config import DEFAULT_LAN_INTERFACE, DEFAULT_WAN_INTERFACE
+from datetime import datetime
+from config import (DEFAULT_LAN_INTERFACE, DEFAULT_WAN_INTERFACE, DEFAULT_WIFI_INTERFACE, DNSMASQ_CONFIG_PATH,
+                    DNSMASQ_SERVICE, DNS_UPSTREAM_PATH, PPPOE_PEERS_PATH)
+from utils.netconfig import (CLIENT_MODES, FAMILIES, applied_steps, compile_dhcp_range, compile_dns_servers,
+                             compile_pppoe_peer, interface_state, parse_default_routes, parse_links, plan_network,
+                             pppoe_peer_name, render_batch, render_rollback)
 
 # Create logger
 logger = logging.getLogger(__name__)
 
+IP_PATH = "ip"
+DHCP_CLIENT_PATH = "dhclient"
+PPPD_PATH = "pppd"
+POFF_PATH = "poff"
+
+# Pid file of the DHCP client of an interface
+DHCP_CLIENT_PID_FILE = "/run/dhclient-{}.pid"
+
+# Files written in DNSMASQ_CONFIG_PATH
+DHCP_RANGE_FILE = "evorouter-dhcp.conf"
+DNS_RESOLV_FILE = "evorouter-dns.conf"
+
 def get_connected_devices():
     """
     Get list of devices connected to the network
     
     Returns:
         list: List of device dictionaries with ip, mac, hostname, etc.
+              (shared snapshot of the device inventory, read-only)
     """
     try:
-        # In Replit environment, we'll create simulated data
-        devices = []
-        
-        # Simulate 8-12 devices
-        device_count = random.randint(8, 12)
-        
-        # Common device names
-        device_names = [
-            "Router", "Desktop-PC", "Laptop-Admin", "Smartphone-Mario", 
-            "Tablet-Lucia", "Smart-TV-Soggiorno", "Stampante-Ufficio", 
-            "NAS-Storage", "Termostato-Smart", "Alexa-Cucina", 
-            "Raspberry-Pi", "Camera-Ingresso", "Media-Player"
-        ]
-        
-        # Interfaces
-        interfaces = ["LAN", "WiFi", "WiFi", "WiFi", "LAN", "LAN"]
-        
-        # Connection types
-        connection_types = ["Cablata", "Wireless", "Wireless", "Wireless", "Cablata", "Cablata"]
-        
-        # Generate random devices
-        for i in range(device_count):
-            # Generate MAC address
-            mac = ":".join([f"{random.randint(0, 255):02x}" for _ in range(6)]).upper()
-            
-            # Generate IPv4
-            ipv4 = f"192.168.1.{random.randint(2, 250)}"
-            
-            # Determine if this device has IPv6
-            has_ipv6 = random.random() > 0.3  # 70% chance of having IPv6
-            ipv6 = f"fd00::{random.randint(100, 999):x}" if has_ipv6 else None
-            
-            # Random device name
-            device_name = device_names[random.randint(0, len(device_names) - 1)]
-            if i > 0 and i < len(device_names):
-                device_name = device_names[i]
-            
-            # Interface
-            interface_idx = random.randint(0, len(interfaces) - 1)
-            interface = interfaces[interface_idx]
-            connection = connection_types[interface_idx]
-            
-            # Status (80% online)
-            status = "Online" if random.random() < 0.8 else "Offline"
-            
-            # Last seen
-            last_seen = datetime.now().strftime("%Y-%m-%d %H:%M:%S") if status == "Online" else (
-                datetime.now().strftime("%Y-%m-%d ") + f"{random.randint(0, 23):02d}:{random.randint(0, 59):02d}:{random.randint(0, 59):02d}"
-            )
-            
-            # Traffic
-            download = round(random.uniform(0, 10), 2) if status == "Online" else 0
-            upload = round(random.uniform(0, 2), 2) if status == "Online" else 0
-            
-            devices.append({
-                "name": device_name,
-                "ipv4_address": ipv4,
-                "ipv6_address": ipv6,
-                "ipv6_enabled": has_ipv6,
-                "mac": mac,
-                "interface": interface,
-                "connection": connection,
-                "status": status,
-                "last_seen": last_seen,
-                "download": download,
-                "upload": upload
-            })
-        
-        return devices
+        from utils.devices import get_device_inventory
+        from utils.device_traffic import get_device_traffic
+        get_device_traffic()
+        return get_device_inventory().snapshot()
     except Exception as e:
         logger.error(f"Error getting connected devices: {str(e)}")
         return []
@@ -97,81 +49,11 @@ def get_interfaces_status():
     
     Returns:
         list: List of interface dictionaries with name, state, etc.
+              (shared snapshot of the interface monitor, read-only)
     """
     try:
-        # In Replit environment, we'll create simulated data
-        interfaces = [
-            {
-                "name": "eth0",
-                "type": "LAN",
-                "state": "UP",
-                "speed": "1 Gbps",
-                # IPv4 info
-                "ipv4_enabled": True,
-                "ipv4_address": "192.168.1.1",
-                "ipv4_subnet": "255.255.255.0",
-                # IPv6 info
-                "ipv6_enabled": True,
-                "ipv6_address": "fd00::1",
-                "ipv6_prefix": "64",
-                "mac": "AA:BB:CC:11:22:33",
-                "rx_bytes": random.randint(1000000, 100000000),
-                "tx_bytes": random.randint(100000, 10000000)
-            },
-            {
-                "name": "eth1",
-                "type": "WAN",
-                "state": "UP",
-                "speed": "1 Gbps",
-                # IPv4 info
-                "ipv4_enabled": True,
-                "ipv4_address": "203.0.113.10",
-                "ipv4_subnet": "255.255.255.0",
-                # IPv6 info
-                "ipv6_enabled": True,
-                "ipv6_address": f"2001:db8::1:{random.randint(1, 999):x}",
-                "ipv6_prefix": "64",
-                "mac": "AA:BB:CC:11:22:34",
-                "rx_bytes": random.randint(100000000, 1000000000),
-                "tx_bytes": random.randint(10000000, 100000000)
-            },
-            {
-                "name": "wlan0",
-                "type": "WiFi",
-                "state": "UP",
-                "speed": "300 Mbps",
-                # IPv4 info
-                "ipv4_enabled": True,
-                "ipv4_address": "192.168.1.1",
-                "ipv4_subnet": "255.255.255.0",
-                # IPv6 info
-                "ipv6_enabled": True,
-                "ipv6_address": "fd00::1",
-                "ipv6_prefix": "64",
-                "mac": "AA:BB:CC:11:22:35",
-                "rx_bytes": random.randint(10000000, 100000000),
-                "tx_bytes": random.randint(1000000, 10000000)
-            },
-            {
-                "name": "wlan1",
-                "type": "WiFi",
-                "state": "DOWN",
-                "speed": "N/A",
-                # IPv4 info
-                "ipv4_enabled": False,
-                "ipv4_address": "N/A",
-                "ipv4_subnet": "N/A",
-                # IPv6 info
-                "ipv6_enabled": False,
-                "ipv6_address": "N/A",
-                "ipv6_prefix": "N/A",
-                "mac": "AA:BB:CC:11:22:36",
-                "rx_bytes": 0,
-                "tx_bytes": 0
-            }
-        ]
-        
-        return interfaces
+        from utils.interfaces import get_interface_monitor
+        return get_interface_monitor().status()
     except Exception as e:
         logger.error(f"Error getting interface status: {str(e)}")
         return []
@@ -435,44 +317,31 @@ def get_bandwidth_usage(interface="all", period="1h"):
     """
     Get bandwidth usage data
     
+    Points are read from the pre-aggregated tier of the bandwidth history
+    store that matches the requested period.
+    
     Args:
         interface: Interface name or 'all' for all interfaces
-        period: Time period (1h, 6h, 24h, 7d)
+        period: Time period (5m, 1h, 6h, 24h, 7d)
         
     Returns:
         dict: Bandwidth usage information
     """
     try:
-        # In Replit environment, we'll create simulated data
-        from datetime import datetime, timedelta
+        from utils.timeseries import get_bandwidth_history, format_bucket_time
         
-        # Generate 30 points
-        now = datetime.now()
-        timestamps = [(now - timedelta(minutes=i)).strftime('%H:%M:%S') for i in range(30, 0, -1)]
+        points = get_bandwidth_history().series(interface, period)
         
-        # Randomize download/upload data
-        base_download = random.uniform(10, 40)
-        base_upload = random.uniform(2, 10)
-        
-        download = []
-        upload = []
-        
-        for i in range(30):
-            # Add some variation
-            download.append(round(base_download + random.uniform(-5, 10), 1))
-            upload.append(round(base_upload + random.uniform(-2, 5), 1))
-            
-            # Occasionally add a spike
-            if random.random() > 0.9:
-                download[-1] *= 1.5
-                upload[-1] *= 1.2
+        timestamps = [format_bucket_time(start, period) for start, _, _ in points]
+        download = [rx for _, rx, _ in points]
+        upload = [tx for _, _, tx in points]
         
         data = {
             "timestamps": timestamps,
             "download": download,
             "upload": upload,
-            "current_download": download[-1],
-            "current_upload": upload[-1],
+            "current_download": download[-1] if download else 0,
+            "current_upload": upload[-1] if upload else 0,
             "interface": interface,
             "period": period
         }
@@ -567,32 +436,211 @@ def get_vpn_status():
         logger.error(f"Error getting VPN status: {str(e)}")
         return {"error": str(e)}
 
-def configure_interface(interface_name, config):
+def _run_command(command, input_data=None):
+    """Run a command, returning the CompletedProcess or None if it cannot be started"""
+    try:
+        return subprocess.run(command, input=input_data, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"Cannot run {' '.join(command)}: {str(e)}")
+        return None
+
+def read_network_state():
+    """
+    Read links, static addresses and default routes of every interface
+    
+    Three dumps (addresses, IPv4 and IPv6 default routes), whatever the
+    number of interfaces.
+    
+    Returns:
+        dict: Interface name -> live state (see utils.netconfig.parse_links),
+              None if iproute2 is not available
+    """
+    result = _run_command([IP_PATH, "-j", "address", "show"])
+    if result is None or result.returncode != 0:
+        return None
+    links = parse_links(result.stdout)
+    for family in FAMILIES:
+        routes = _run_command([IP_PATH, "-j", f"-{family}", "route", "show", "default"])
+        if routes is not None and routes.returncode == 0:
+            parse_default_routes(routes.stdout, family, links)
+    return links
+
+def apply_network_steps(steps):
+    """
+    Run the planned steps in a single ip -batch
+    
+    If the batch stops on an error, the steps already executed are undone
+    (in reverse order, with -force so that one failing undo does not stop
+    the others) and the interfaces are left as they were.
+    
+    Returns:
+        tuple: (success, error message or None)
+    """
+    if not steps:
+        return True, None
+    result = _run_command([IP_PATH, "-batch", "-"], render_batch(steps))
+    if result is not None and result.returncode == 0:
+        return True, None
+    
+    error = result.stderr.strip() if result is not None else "iproute2 not available"
+    rollback = render_rollback(steps, applied_steps(steps, error) if result is not None else 0)
+    if rollback:
+        undo = _run_command([IP_PATH, "-force", "-batch", "-"], rollback)
+        if undo is None or undo.returncode != 0:
+            logger.error(f"Network rollback incomplete: {undo.stderr.strip() if undo else 'ip not available'}")
+        else:
+            logger.warning("Network changes rolled back")
+    return False, error
+
+def apply_network_config(interfaces=None):
+    """
+    Apply the NetworkConfig rows, changing only what differs from the live state
+    
+    Args:
+        interfaces: Names of the interfaces to reconcile (default: all configured)
+        
+    Returns:
+        dict: Result with success, message and changes (number of commands)
+    """
+    from models import NetworkConfig
+    
+    live = read_network_state()
+    if live is None:
+        return {"success": False, "message": "Cannot read the network state", "changes": 0}
+    
+    desired = {}
+    for config in NetworkConfig.query.order_by(NetworkConfig.id).all():
+        desired[config.interface_name] = interface_state(config)
+    try:
+        steps = plan_network(desired, live, interfaces)
+    except ValueError as e:
+        return {"success": False, "message": str(e), "changes": 0}
+    
+    if not steps:
+        return {"success": True, "message": "Network configuration unchanged", "changes": 0}
+    
+    logger.info(f"Applying {len(steps)} network changes: {'; '.join(command for command, _ in steps)}")
+    success, error = apply_network_steps(steps)
+    if not success:
+        return {"success": False, "message": f"Error applying network changes: {error}", "changes": 0}
+    return {"success": True, "message": "Network configuration applied", "changes": len(steps)}
+
+def _interface_type(interface_name):
+    if interface_name == DEFAULT_WAN_INTERFACE:
+        return "wan"
+    if interface_name == DEFAULT_WIFI_INTERFACE or interface_name.startswith("wlan"):
+        return "wifi"
+    return "lan"
+
+def _client_command(interface_name, mode, start):
+    if mode == "dhcp":
+        pid_file = DHCP_CLIENT_PID_FILE.format(interface_name)
+        return [DHCP_CLIENT_PATH, "-nw" if start else "-r", "-pf", pid_file, interface_name]
+    peer = pppoe_peer_name(interface_name)
+    return [PPPD_PATH, "call", peer] if start else [POFF_PATH, peer]
+
+def _start_client(interface_name, mode):
+    """Start the DHCP or PPPoE client of an interface (nothing to do in the other modes)"""
+    if mode not in CLIENT_MODES:
+        return True
+    result = _run_command(_client_command(interface_name, mode, True))
+    if result is None or result.returncode != 0:
+        logger.error(f"Error starting the {mode} client of {interface_name}: "
+                     f"{result.stderr.strip() if result else 'client not available'}")
+        return False
+    return True
+
+def _stop_client(interface_name, mode):
+    """Stop the DHCP or PPPoE client of an interface, releasing its address"""
+    if mode not in CLIENT_MODES:
+        return
+    result = _run_command(_client_command(interface_name, mode, False))
+    if result is None or result.returncode != 0:
+        # Typically not running (e.g. after a reboot): there is nothing to release
+        logger.warning(f"Cannot stop the {mode} client of {interface_name}: "
+                       f"{result.stderr.strip() if result else 'client not available'}")
+
+def configure_interface(interface_name, ip_mode="dhcp", ip_address=None, subnet_mask=None, gateway=None,
+                        dns_servers=None, **pppoe):
     """
     Configure a network interface
     
+    The NetworkConfig row is saved only if the changes could be applied; the
+    other interfaces are not touched. Leaving static mode removes the static
+    address and default route; when the mode (or the PPPoE options) changes,
+    the client of the old mode is stopped and the one of the new mode started.
+    PPPoE credentials (pppoe_username, pppoe_password, pppoe_service_name) are
+    written to the pppd options of the interface, not to the database, and
+    the options are removed when the interface leaves PPPoE mode. On failure
+    the previous row, options and client are restored.
+    
     Args:
         interface_name: Name of the interface to configure
-        config: Dictionary with interface configuration
+        ip_mode: dhcp, static or pppoe
+        ip_address: Static IPv4 address
+        subnet_mask: Static IPv4 netmask
+        gateway: Default gateway (static mode)
+        dns_servers: DNS servers of the interface
         
     Returns:
         dict: Result of the configuration
     """
-    try:
-        # In Replit environment, we'll simulate success
-        logger.info(f"Configuring interface {interface_name} with {config}")
-        
-        # Simulate a brief delay
-        import time
-        time.sleep(0.5)
-        
+    from app import db
+    from models import NetworkConfig
+    
+    if ip_mode == "pppoe" and not (pppoe.get("pppoe_username") and pppoe.get("pppoe_password")):
         return {
-            "success": True,
-            "message": f"Interface {interface_name} configured successfully",
-            "interface": interface_name,
-            "config": config
+            "success": False,
+            "message": "PPPoE username and password are required",
+            "interface": interface_name
         }
+    
+    peer_path = os.path.join(PPPOE_PEERS_PATH, pppoe_peer_name(interface_name))
+    try:
+        config = (NetworkConfig.query.filter_by(interface_name=interface_name)
+                  .order_by(NetworkConfig.id.desc()).first())
+        previous_mode = config.ipv4_mode if config is not None and config.ipv4_enabled else None
+        if config is None:
+            config = NetworkConfig(interface_name=interface_name, interface_type=_interface_type(interface_name))
+            db.session.add(config)
+        config.ipv4_enabled = True
+        config.ipv4_mode = ip_mode
+        if ip_mode == "static":
+            config.ipv4_address = ip_address
+            config.ipv4_subnet_mask = subnet_mask
+            config.ipv4_gateway = gateway or None
+        config.ipv4_dns_servers = dns_servers
+        db.session.flush()
+        
+        if ip_mode == "pppoe":
+            peer = compile_pppoe_peer(interface_name, pppoe["pppoe_username"], pppoe["pppoe_password"],
+                                      pppoe.get("pppoe_service_name"))
+            peer_changed, peer_previous = _write_if_changed(peer_path, peer, mode=0o600)
+        else:
+            # The credentials do not stay on disk once PPPoE is no longer used
+            peer_changed, peer_previous = _remove_file(peer_path)
+        restart = ip_mode != previous_mode or (ip_mode == "pppoe" and peer_changed)
+        if restart:
+            _stop_client(interface_name, previous_mode)
+        
+        result = apply_network_config([interface_name])
+        if result["success"] and restart and not _start_client(interface_name, ip_mode):
+            result = {"success": False, "message": f"Cannot start the {ip_mode} client", "changes": 0}
+        if result["success"]:
+            db.session.commit()
+            logger.info(f"Interface {interface_name} configured ({result['changes']} changes)")
+        else:
+            db.session.rollback()
+            if peer_changed:
+                _restore_file(peer_path, peer_previous, mode=0o600)
+            if restart:
+                # Back to the saved row, with the client of the previous mode
+                apply_network_config([interface_name])
+                _start_client(interface_name, previous_mode)
+        result["interface"] = interface_name
+        return result
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error configuring interface {interface_name}: {str(e)}")
         return {
             "success": False,
@@ -600,27 +648,99 @@ def configure_interface(interface_name, config):
             "interface": interface_name
         }
 
-def set_dhcp_config(config):
+def _write_if_changed(path, content, mode=None):
+    """
+    Atomically replace a file if its content differs
+    
+    Args:
+        path: File to write
+        content: New content
+        mode: Permissions of the file, set before the content is written
+    
+    Returns:
+        tuple: (changed, previous content or None if the file did not exist)
+    """
+    try:
+        with open(path) as f:
+            previous = f.read()
+    except FileNotFoundError:
+        previous = None
+    if previous == content:
+        return False, previous
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True, previous
+
+def _remove_file(path):
+    """
+    Remove a file if it exists
+    
+    Returns:
+        tuple: (removed, previous content or None if the file did not exist)
+    """
+    try:
+        with open(path) as f:
+            previous = f.read()
+    except FileNotFoundError:
+        return False, None
+    os.remove(path)
+    return True, previous
+
+def _restore_file(path, previous, mode=None):
+    if previous is None:
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        _write_if_changed(path, previous, mode)
+
+def _restart_dnsmasq():
+    result = _run_command(["systemctl", "restart", DNSMASQ_SERVICE])
+    if result is None or result.returncode != 0:
+        logger.error(f"Error restarting {DNSMASQ_SERVICE}: {result.stderr.strip() if result else 'systemctl not available'}")
+        return False
+    return True
+
+def _apply_dnsmasq_file(path, content):
+    """Write a dnsmasq configuration file and restart only dnsmasq, restoring the file on failure"""
+    changed, previous = _write_if_changed(path, content)
+    if not changed:
+        return True, False
+    if _restart_dnsmasq():
+        return True, True
+    _restore_file(path, previous)
+    _restart_dnsmasq()
+    return False, True
+
+def set_dhcp_config(enabled=True, start_ip=None, end_ip=None, lease_time=24):
     """
     Configure DHCP server
     
+    Only dnsmasq is restarted, and only if the range or the lease time changed:
+    the interfaces stay up and the leases are kept in the lease file.
+    
     Args:
-        config: Dictionary with DHCP configuration
+        enabled: Serve DHCP on the LAN
+        start_ip: First address of the range
+        end_ip: Last address of the range
+        lease_time: Lease time in hours
         
     Returns:
         dict: Result of the configuration
     """
+    config = {"enabled": enabled, "start_ip": start_ip, "end_ip": end_ip, "lease_time": lease_time}
     try:
-        # In Replit environment, we'll simulate success
-        logger.info(f"Configuring DHCP server with {config}")
-        
-        # Simulate a brief delay
-        import time
-        time.sleep(0.5)
-        
+        content = compile_dhcp_range(DEFAULT_LAN_INTERFACE, enabled, start_ip, end_ip, lease_time)
+        success, changed = _apply_dnsmasq_file(os.path.join(DNSMASQ_CONFIG_PATH, DHCP_RANGE_FILE), content)
+        if not success:
+            return {"success": False, "message": "Error restarting the DHCP server", "config": config}
         return {
             "success": True,
-            "message": "DHCP server configured successfully",
+            "message": "DHCP server configured successfully" if changed else "DHCP configuration unchanged",
             "config": config
         }
     except Exception as e:
@@ -632,78 +752,62 @@ def set_dhcp_config(config):
 
 def restart_network():
     """
-    Restart network services
+    Re-apply the saved network configuration
+    
+    Instead of restarting the network services (which drops every client and
+    the PBX trunks), the NetworkConfig rows of all interfaces are compared with
+    the live state and only the differences are applied.
     
     Returns:
-        dict: Result of the restart
+        dict: Result of the apply
     """
     try:
-        # In Replit environment, we'll simulate success
-        logger.info("Restarting network services")
-        
-        # Simulate a brief delay
-        import time
-        time.sleep(1.5)
-        
-        return {
-            "success": True,
-            "message": "Network services restarted successfully"
-        }
+        return apply_network_config()
     except Exception as e:
-        logger.error(f"Error restarting network services: {str(e)}")
+        logger.error(f"Error applying network configuration: {str(e)}")
         return {
             "success": False,
-            "message": f"Error restarting network services: {str(e)}"
+            "message": f"Error applying network configuration: {str(e)}"
         }
 
+_lease_view = ([], [])
+
 def get_dhcp_leases():
     """
     Get DHCP leases
     
     Returns:
-        list: List of DHCP leases
+        list: List of active DHCP leases (shared, read-only; rebuilt only
+              when the lease database publishes new leases)
     """
+    global _lease_view
     try:
-        # In Replit environment, we'll create simulated data
-        leases = []
-        
-        # Generate 5-10 leases
-        lease_count = random.randint(5, 10)
-        
-        for i in range(lease_count):
-            # Generate MAC address
-            mac = ":".join([f"{random.randint(0, 255):02x}" for _ in range(6)]).upper()
-            
-            # Generate IP
-            ipv4 = f"192.168.1.{random.randint(100, 200)}"
-            
-            # Determine if this device has IPv6
-            has_ipv6 = random.random() > 0.3  # 70% chance of having IPv6
-            ipv6 = f"fd00::{random.randint(100, 999):x}" if has_ipv6 else None
-            
-            # Generate hostname
-            hostnames = ["desktop-pc", "laptop-mario", "iphone-lucia", "android-giovanni", 
-                         "smart-tv", "printer", "raspberry-pi", "gaming-console", 
-                         "tablet-marco", "media-player", "thermostat", "security-camera"]
-            
-            hostname = hostnames[random.randint(0, len(hostnames) - 1)]
-            if i < len(hostnames):
-                hostname = hostnames[i]
-                
-            # Generate lease time information
-            expiry = datetime.now() + timedelta(hours=random.randint(1, 24))
-            
-            leases.append({
-                "ipv4_address": ipv4,
-                "ipv6_address": ipv6,
-                "ipv6_enabled": has_ipv6,
-                "mac": mac,
-                "hostname": hostname,
-                "expiry": expiry.strftime("%Y-%m-%d %H:%M:%S"),
-                "permanent": random.random() > 0.8  # 20% chance of being permanent
+        from utils.dhcp_leases import get_lease_database
+        active = get_lease_database().active()
+        source, view = _lease_view
+        if active is source:
+            return view
+        
+        view = []
+        for lease in active:
+            ipv6 = ":" in lease["ip"]
+            expiry = (datetime.fromtimestamp(lease["expiry"]).strftime("%Y-%m-%d %H:%M:%S")
+                      if lease["expiry"] else "Mai")
+            view.append({
+                "ipv4_address": None if ipv6 else lease["ip"],
+                "ipv6_address": lease["ip"] if ipv6 else None,
+                "ipv6_enabled": ipv6,
+                "mac": lease["mac"],
+                "hostname": lease["hostname"] or "*",
+                "expiry": expiry,
+                "permanent": not lease["expiry"],
+                # Fields used by the network page
+                "ip_address": lease["ip"],
+                "mac_address": lease["mac"] or "N/A",
+                "end_time": expiry
             })
-        
-        return leases
+        _lease_view = (active, view)
+        return view
     except Exception as e:
         logger.error(f"Error getting DHCP leases: {str(e)}")
         return []
@@ -744,24 +848,29 @@ def get_dns_settings():
         logger.error(f"Error getting DNS settings: {str(e)}")
         return {}
 
-def set_dns_settings(settings):
+def set_dns_settings(primary_dns=None, secondary_dns=None):
     """
     Configure DNS settings
     
+    The upstream servers go to the resolv file that dnsmasq polls, so a change
+    needs no restart; dnsmasq is restarted only the first time, when the
+    configuration pointing it to that file is written.
+    
     Args:
-        settings: Dictionary with DNS settings
+        primary_dns: Primary upstream DNS server
+        secondary_dns: Secondary upstream DNS server
         
     Returns:
         dict: Result of the configuration
     """
+    settings = {"primary_dns": primary_dns, "secondary_dns": secondary_dns}
     try:
-        # In Replit environment, we'll simulate success
-        logger.info(f"Configuring DNS settings with {settings}")
-        
-        # Simulate a brief delay
-        import time
-        time.sleep(0.5)
-        
+        _, previous = _write_if_changed(DNS_UPSTREAM_PATH, compile_dns_servers([primary_dns, secondary_dns]))
+        success, _ = _apply_dnsmasq_file(os.path.join(DNSMASQ_CONFIG_PATH, DNS_RESOLV_FILE),
+                                         f"resolv-file={DNS_UPSTREAM_PATH}\n")
+        if not success:
+            _restore_file(DNS_UPSTREAM_PATH, previous)
+            return {"success": False, "message": "Error restarting the DNS server", "settings": settings}
         return {
             "success": True,
             "message": "DNS settings configured successfully",
@@ -772,4 +881,4 @@ def set_dns_settings(settings):
         return {
             "success": False,
             "message": f"Error configuring DNS settings: {str(e)}"
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,778 @@
+"""
+Compilatore del ruleset nftables dell'EvoRouter R4.
+Trasforma zone, regole, port forwarding, IP set e gruppi di servizi in un unico
+script nftables che viene applicato in modo atomico con una sola chiamata a nft.
+
+Le funzioni di questo modulo non accedono al database né al sistema: ricevono
+oggetti con gli attributi dei modelli (istanze ORM o equivalenti) e restituiscono
+testo, così il ruleset generato è verificabile offline.
+
+Nei campi source/destination delle regole si può indicare un IP set con
+``@nome``; nei campi src_port/dst_port un gruppo di servizi con ``@nome``.
+"""
+import bisect
+import hashlib
+import json
+import ipaddress
+import logging
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+TABLE_FAMILY = "inet"
+TABLE_NAME = "evorouter"
+
+VERDICTS = ("accept", "drop", "reject")
+
+# Elementi per comando "add element" negli aggiornamenti incrementali dei set
+SET_ELEMENT_CHUNK = 4096
+
+# Tipi ipset supportati -> True se gli elementi includono protocollo e porta
+IPSET_TYPES = {
+    "hash:ip": False,
+    "hash:net": False,
+    "hash:ip,port": True,
+    "hash:net,port": True,
+}
+
+
+def identifier(name: str) -> str:
+    """Converte un nome arbitrario in un identificatore nftables valido"""
+    ident = re.sub(r"[^A-Za-z0-9_]", "_", name or "")
+    if not ident or not ident[0].isalpha():
+        ident = "_" + ident
+    return ident
+
+
+def quote(value: str) -> str:
+    """Restituisce una stringa tra virgolette per nftables"""
+    return '"' + str(value).replace('"', "") + '"'
+
+
+def anonymous_set(items: List[str]) -> str:
+    """Restituisce un singolo valore o un set anonimo nftables"""
+    if len(items) == 1:
+        return items[0]
+    return "{ " + ", ".join(items) + " }"
+
+
+def split_list(value: Optional[str]) -> List[str]:
+    """Divide un elenco separato da virgole ignorando gli spazi"""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def is_any(value: Optional[str]) -> bool:
+    """Verifica se un campo indica 'qualsiasi valore'"""
+    return not value or value.strip().lower() in ("any", "all")
+
+
+def zone_interfaces(zone: Any) -> List[str]:
+    """Restituisce le interfacce di una zona"""
+    return split_list(zone.interfaces)
+
+
+def interface_match(direction: str, interfaces: List[str]) -> str:
+    """Espressione di match sulle interfacce (direction: iifname/oifname)"""
+    return f"{direction} {anonymous_set([quote(i) for i in interfaces])}"
+
+
+def port_expression(ports: str) -> str:
+    """Converte '80', '1000-2000' o '80,443' in un'espressione nftables"""
+    items = [p.replace(" ", "") for p in split_list(ports)]
+    return anonymous_set(items)
+
+
+def address_family(address: str) -> str:
+    """Restituisce 'ip' o 'ip6' per un indirizzo o una rete"""
+    return "ip6" if ipaddress.ip_network(address.strip(), strict=False).version == 6 else "ip"
+
+
+def address_expression(address: str) -> str:
+    """Normalizza un indirizzo o una rete per nftables"""
+    network = ipaddress.ip_network(address.strip(), strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def parse_service(service: str) -> Optional[Tuple[str, str]]:
+    """Converte 'tcp:80' o 'udp:1000-2000' in (protocollo, porte)"""
+    if ":" not in service:
+        return None
+    protocol, ports = service.split(":", 1)
+    protocol = protocol.strip().lower()
+    ports = ports.strip().replace(" ", "")
+    if protocol not in ("tcp", "udp", "sctp") or not re.fullmatch(r"\d+(-\d+)?", ports):
+        return None
+    return protocol, ports
+
+
+def iter_json_strings(value: Optional[str]) -> Iterator[str]:
+    """
+    Restituisce le stringhe non vuote di un elenco JSON (es. FirewallIPSet.addresses)
+
+    Un valore che non è un elenco JSON valido viene ignorato per intero.
+    """
+    if not value:
+        return
+    try:
+        items = json.loads(value)
+    except ValueError:
+        logger.warning("Ignoring malformed JSON list")
+        return
+    if not isinstance(items, list):
+        logger.warning("Ignoring JSON value that is not a list")
+        return
+    for item in items:
+        item = str(item).strip()
+        if item:
+            yield item
+
+
+def iter_lines(text: Optional[str]) -> Iterator[str]:
+    """Restituisce una alla volta le righe non vuote di un testo"""
+    for match in re.finditer(r"[^\r\n]+", text or ""):
+        line = match.group(0).strip()
+        if line:
+            yield line
+
+
+def collapse_networks(entries: Iterable[str], name: str = "") -> Tuple[Optional[str], List[str]]:
+    """
+    Aggrega indirizzi e reti adiacenti o sovrapposti (ipaddress.collapse_addresses)
+
+    Un set nftables contiene una sola famiglia di indirizzi: viene usata quella
+    della prima voce valida e le altre vengono scartate.
+
+    Returns:
+        Tupla (famiglia 'ip'/'ip6' o None se vuoto, elementi nftables)
+    """
+    family = None
+    networks = []
+    invalid = mixed = 0
+    for entry in entries:
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            invalid += 1
+            continue
+        entry_family = "ip6" if network.version == 6 else "ip"
+        if family is None:
+            family = entry_family
+        elif entry_family != family:
+            mixed += 1
+            continue
+        networks.append(network)
+    if invalid or mixed:
+        logger.warning(f"IPSet {name}: skipped {invalid} invalid and {mixed} mixed-family entries")
+
+    elements = []
+    for network in ipaddress.collapse_addresses(networks):
+        if network.prefixlen == network.max_prefixlen:
+            elements.append(str(network.network_address))
+        else:
+            elements.append(str(network))
+    return family, elements
+
+
+def compile_ipset(ipset: Any) -> Optional[Dict[str, Any]]:
+    """
+    Compila un FirewallIPSet in un set nftables
+
+    Returns:
+        Dizionario con name, family, with_port, type, interval ed elements,
+        o None se il tipo non è supportato
+    """
+    with_port = IPSET_TYPES.get(ipset.type or "hash:ip")
+    if with_port is None:
+        logger.warning(f"Unsupported IPSet type {ipset.type} for {ipset.name}")
+        return None
+
+    if with_port:
+        family = None
+        interval = False
+        elements = []
+        for entry in iter_json_strings(ipset.addresses):
+            address, _, service = entry.partition(",")
+            parsed = parse_service(service if ":" in service else f"tcp:{service}")
+            try:
+                entry_family = address_family(address)
+                element = address_expression(address)
+            except ValueError:
+                parsed = None
+            if parsed is None or (family is not None and entry_family != family):
+                logger.warning(f"Skipping {entry} in IPSet {ipset.name}")
+                continue
+            family = entry_family
+            protocol, ports = parsed
+            interval = interval or "/" in element or "-" in ports
+            elements.append(f"{element} . {protocol} . {ports}")
+    else:
+        family, elements = collapse_networks(iter_json_strings(ipset.addresses), ipset.name)
+        interval = any("/" in element for element in elements)
+
+    family = family or "ip"
+    element_type = "ipv6_addr" if family == "ip6" else "ipv4_addr"
+    if with_port:
+        element_type += " . inet_proto . inet_service"
+
+    return {"name": identifier(ipset.name), "family": family, "with_port": with_port,
+            "type": element_type, "interval": interval, "elements": elements}
+
+
+def compile_service_group(group: Any) -> Dict[str, Any]:
+    """Compila un FirewallServiceGroup in un set nftables (protocollo . porta)"""
+    elements = []
+    interval = False
+    for service in iter_json_strings(group.services):
+        parsed = parse_service(service)
+        if parsed is None:
+            logger.warning(f"Skipping invalid service {service} in group {group.name}")
+            continue
+        protocol, ports = parsed
+        interval = interval or "-" in ports
+        elements.append(f"{protocol} . {ports}")
+
+    return {"name": "svc_" + identifier(group.name).lstrip("_"), "type": "inet_proto . inet_service",
+            "interval": interval, "elements": elements}
+
+
+def address_match(direction: str, value: Optional[str], ipsets: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """
+    Espressione di match su indirizzo sorgente/destinazione
+
+    Args:
+        direction: 'saddr' o 'daddr'
+        value: Indirizzo, rete, 'any' o riferimento '@ipset'
+        ipsets: Set compilati indicizzati per nome originale
+    """
+    if is_any(value):
+        return None
+    value = value.strip()
+    if value.startswith("@"):
+        ipset = ipsets.get(value[1:])
+        if ipset is None:
+            raise ValueError(f"Unknown IPSet {value}")
+        if ipset["with_port"]:
+            port = "dport" if direction == "daddr" else "sport"
+            return f"{ipset['family']} {direction} . meta l4proto . th {port} @{ipset['name']}"
+        return f"{ipset['family']} {direction} @{ipset['name']}"
+    return f"{address_family(value)} {direction} {address_expression(value)}"
+
+
+def l4_match(protocol: Optional[str], src_port: Optional[str], dst_port: Optional[str],
+             service_groups: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Espressioni di match su protocollo e porte"""
+    protocols = [p.lower() for p in split_list(protocol) if p.lower() != "all"]
+    if not protocols:
+        return []
+    if protocols == ["icmp"]:
+        return ["meta l4proto { icmp, ipv6-icmp }"]
+
+    matches = []
+    ports = [("sport", src_port), ("dport", dst_port)]
+    single = len(protocols) == 1 and protocols[0] in ("tcp", "udp")
+    # "tcp dport 80" implica già il protocollo; i gruppi di servizi no
+    plain_ports = any(not is_any(value) and not value.strip().startswith("@") for _, value in ports)
+    if not single or not plain_ports:
+        matches.append(f"meta l4proto {anonymous_set(protocols)}")
+
+    for port, value in ports:
+        if is_any(value):
+            continue
+        value = value.strip()
+        if value.startswith("@"):
+            group = service_groups.get(value[1:])
+            if group is None:
+                raise ValueError(f"Unknown service group {value}")
+            matches.append(f"meta l4proto . th {port} @{group['name']}")
+        else:
+            prefix = protocols[0] if single else "th"
+            matches.append(f"{prefix} {port} {port_expression(value)}")
+    return matches
+
+
+def compile_rule(rule: Any, ipsets: Dict[str, Dict[str, Any]],
+                 service_groups: Dict[str, Dict[str, Any]]) -> str:
+    """Compila un FirewallRule in una riga nftables"""
+    action = (rule.action or "drop").lower()
+    if action not in VERDICTS:
+        raise ValueError(f"Invalid action {rule.action} for rule {rule.id}")
+
+    parts = [
+        address_match("saddr", rule.source, ipsets),
+        address_match("daddr", rule.destination, ipsets),
+    ]
+    parts.extend(l4_match(rule.protocol, rule.src_port, rule.dst_port, service_groups))
+    # Contatori per regola, letti da parse_rule_counters
+    parts.append("counter")
+    if rule.log:
+        # Il prefisso è interpretato da utils.firewall_ingest
+        parts.append(f"log prefix {quote(f'evorouter rule={rule.id} {action} ')}")
+    parts.append(action)
+    parts.append(f"comment {quote(f'rule:{rule.id}')}")
+    return " ".join(part for part in parts if part)
+
+
+def compile_port_forwarding(forward: Any, zones_by_name: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Compila un FirewallPortForwarding
+
+    Returns:
+        Tupla (regola DNAT per prerouting, regola di accept per forward)
+    """
+    protocols = [p.lower() for p in split_list(forward.protocol)] or ["tcp"]
+    family = address_family(forward.dest_ip)
+    dest_ip = address_expression(forward.dest_ip)
+    dest_port = port_expression(forward.dest_port)
+    single = len(protocols) == 1
+    comment = f"comment {quote(f'forward:{forward.id}')}"
+
+    dnat = []
+    zone = zones_by_name.get(forward.source_zone)
+    if zone is not None and zone_interfaces(zone):
+        dnat.append(interface_match("iifname", zone_interfaces(zone)))
+    if forward.src_dip and not is_any(forward.src_dip):
+        dnat.append(f"{address_family(forward.src_dip)} daddr {address_expression(forward.src_dip)}")
+    if single:
+        dnat.append(f"{protocols[0]} dport {port_expression(forward.src_port)}")
+    else:
+        dnat.append(f"meta l4proto {anonymous_set(protocols)} th dport {port_expression(forward.src_port)}")
+    target = f"[{dest_ip}]" if family == "ip6" else dest_ip
+    dnat.append(f"dnat {family} to {target}:{forward.dest_port.replace(' ', '')}")
+    dnat.append(comment)
+
+    accept = [f"{family} daddr {dest_ip}"]
+    if single:
+        accept.append(f"{protocols[0]} dport {dest_port}")
+    else:
+        accept.append(f"meta l4proto {anonymous_set(protocols)} th dport {dest_port}")
+    accept.extend(["ct status dnat accept", comment])
+    return " ".join(dnat), " ".join(accept)
+
+
+def _ordered(items: Iterable[Any], *keys: str) -> List[Any]:
+    """Ordina gli oggetti per gli attributi indicati (None = 0) e per id"""
+    return sorted(items, key=lambda item: tuple(getattr(item, k) or 0 for k in keys) + (item.id or 0,))
+
+
+def rule_key(text: str) -> str:
+    """
+    Chiave stabile di una riga di una catena
+
+    Le righe generate da un oggetto del DB sono identificate dal commento
+    (es. 'rule:7'), le altre dal testo stesso.
+    """
+    match = re.search(r'comment "([^"]*)"', text)
+    return match.group(1) if match else text
+
+
+class Ruleset:
+    """
+    Ruleset nftables strutturato: set, intestazioni e righe delle catene
+
+    La struttura permette sia di generare lo script completo sia di calcolare
+    le differenze rispetto al ruleset applicato in precedenza.
+    """
+
+    def __init__(self, name: str = TABLE_NAME):
+        self.name = name
+        self.sets: Dict[str, Dict[str, Any]] = {}
+        self.chains: Dict[str, Dict[str, List[str]]] = {}
+
+    def add_set(self, name: str, element_type: str, interval: bool, elements: List[str]) -> None:
+        """Aggiunge un set con i suoi elementi"""
+        self.sets[name] = {"type": element_type, "interval": interval, "elements": elements}
+
+    def set_header(self, name: str) -> List[str]:
+        """Dichiarazione del set senza elementi"""
+        header = [f"type {self.sets[name]['type']}"]
+        if self.sets[name]["interval"]:
+            header.append("flags interval")
+        return header
+
+    def add_chain(self, name: str, header: Iterable[str] = ()) -> None:
+        """Aggiunge una catena (l'ordine di inserimento è quello dello script)"""
+        self.chains[name] = {"header": list(header), "rules": []}
+
+    def add(self, chain: str, text: str) -> None:
+        """Aggiunge una riga in coda a una catena"""
+        self.chains[chain]["rules"].append(text)
+
+    def skeleton(self) -> str:
+        """Parte del ruleset che non può essere modificata riga per riga"""
+        parts = []
+        for name in self.sets:
+            parts.append(f"set {name}")
+            parts.extend(self.set_header(name))
+        for name, chain in self.chains.items():
+            parts.append(f"chain {name}")
+            parts.extend(chain["header"])
+        return "\n".join(parts)
+
+    def render(self) -> str:
+        """Script completo che ricrea la tabella in un'unica transazione"""
+        lines = [
+            f"table {TABLE_FAMILY} {self.name}",
+            f"delete table {TABLE_FAMILY} {self.name}",
+            f"table {TABLE_FAMILY} {self.name} {{",
+        ]
+        for name, spec in self.sets.items():
+            lines.append(f"\tset {name} {{")
+            lines.extend(f"\t\t{line}" for line in self.set_header(name))
+            if spec["elements"]:
+                lines.append(f"\t\telements = {{ {', '.join(spec['elements'])} }}")
+            lines.append("\t}")
+        for name, chain in self.chains.items():
+            lines.append(f"\tchain {name} {{")
+            lines.extend(f"\t\t{line}" for line in chain["header"] + chain["rules"])
+            lines.append("\t}")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def fingerprint(self) -> str:
+        """Impronta SHA-256 dello script completo"""
+        return hashlib.sha256(self.render().encode("utf-8")).hexdigest()
+
+    def to_state(self) -> Dict[str, Any]:
+        """Stato serializzabile in JSON del ruleset applicato"""
+        return {
+            "fingerprint": self.fingerprint(),
+            "skeleton": hashlib.sha256(self.skeleton().encode("utf-8")).hexdigest(),
+            "sets": {name: hashlib.sha256("\n".join(spec["elements"]).encode("utf-8")).hexdigest()
+                     for name, spec in self.sets.items()},
+            "chains": {name: chain["rules"] for name, chain in self.chains.items()},
+        }
+
+
+def _longest_increasing(values: List[int]) -> set:
+    """Indici della più lunga sottosequenza crescente (O(n log n))"""
+    tails: List[int] = []
+    tails_idx: List[int] = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        pos = bisect.bisect_left(tails, value)
+        if pos == len(tails):
+            tails.append(value)
+            tails_idx.append(i)
+        else:
+            tails[pos] = value
+            tails_idx[pos] = i
+        previous[i] = tails_idx[pos - 1] if pos > 0 else -1
+    result = set()
+    i = tails_idx[-1] if tails_idx else -1
+    while i != -1:
+        result.add(i)
+        i = previous[i]
+    return result
+
+
+def diff_chain(chain: str, old: List[str], new: List[str], handles: List[int]) -> Optional[List[str]]:
+    """
+    Calcola i comandi minimi per trasformare una catena da old a new
+
+    Le righe presenti in entrambe le versioni e nello stesso ordine relativo
+    restano al loro posto (sostituite con ``replace`` se il testo cambia);
+    le altre vengono eliminate o inserite per handle.
+
+    Args:
+        chain: Nome della catena
+        old: Righe applicate in precedenza
+        new: Righe desiderate
+        handles: Handle nftables delle righe old, nello stesso ordine
+
+    Returns:
+        Lista di comandi nft, o None se le chiavi non sono univoche
+    """
+    old_keys = [rule_key(text) for text in old]
+    new_keys = [rule_key(text) for text in new]
+    if len(set(old_keys)) != len(old_keys) or len(set(new_keys)) != len(new_keys):
+        return None
+
+    old_pos = {key: i for i, key in enumerate(old_keys)}
+    common = [key for key in new_keys if key in old_pos]
+    kept = {common[i] for i in _longest_increasing([old_pos[key] for key in common])}
+
+    prefix = f"{TABLE_FAMILY} {TABLE_NAME} {chain}"
+    commands = [f"delete rule {prefix} handle {handles[i]}"
+                for i, key in enumerate(old_keys) if key not in kept]
+
+    anchor = None
+    inserts = []
+    for key, text in reversed(list(zip(new_keys, new))):
+        if key in kept:
+            anchor = handles[old_pos[key]]
+            if old[old_pos[key]] != text:
+                commands.append(f"replace rule {prefix} handle {anchor} {text}")
+        elif anchor is not None:
+            inserts.append(f"insert rule {prefix} position {anchor} {text}")
+        else:
+            inserts.append(f"add rule {prefix} {text}")
+    # Inseriti in ordine: più righe prima dello stesso anchor mantengono la sequenza
+    commands.extend(reversed(inserts))
+    return commands
+
+
+def diff_ruleset(state: Dict[str, Any], ruleset: Ruleset,
+                 handles: Dict[str, List[Tuple[int, Optional[str]]]]) -> Optional[List[str]]:
+    """
+    Calcola i comandi per passare dal ruleset applicato a quello desiderato
+
+    Args:
+        state: Stato salvato con Ruleset.to_state() all'ultima applicazione
+        ruleset: Ruleset desiderato
+        handles: (handle, commento) delle righe caricate, per catena (parse_handles)
+
+    Returns:
+        Lista di comandi nft (vuota se non cambia nulla), o None se serve
+        ricreare l'intera tabella (set o catene modificati, stato non allineato)
+    """
+    target = ruleset.to_state()
+    if state.get("skeleton") != target["skeleton"]:
+        return None
+    if state.get("fingerprint") == target["fingerprint"]:
+        return []
+
+    commands = []
+    # I set modificati vengono svuotati e ricaricati in blocco
+    for name, digest in target["sets"].items():
+        if state.get("sets", {}).get(name) == digest:
+            continue
+        commands.append(f"flush set {TABLE_FAMILY} {TABLE_NAME} {name}")
+        elements = ruleset.sets[name]["elements"]
+        for i in range(0, len(elements), SET_ELEMENT_CHUNK):
+            chunk = ", ".join(elements[i:i + SET_ELEMENT_CHUNK])
+            commands.append(f"add element {TABLE_FAMILY} {TABLE_NAME} {name} {{ {chunk} }}")
+
+    for name, rules in target["chains"].items():
+        old = state["chains"].get(name, [])
+        if old == rules:
+            continue
+        live = handles.get(name, [])
+        if len(live) != len(old):
+            return None
+        # Il ruleset caricato deve corrispondere allo stato salvato
+        for text, (_, comment) in zip(old, live):
+            key = rule_key(text)
+            if key != text and key != comment:
+                return None
+        chain_commands = diff_chain(name, old, rules, [handle for handle, _ in live])
+        if chain_commands is None:
+            return None
+        commands.extend(chain_commands)
+    return commands
+
+
+def build_ruleset(zones: Iterable[Any], rules: Iterable[Any], port_forwardings: Iterable[Any],
+                  ipsets: Iterable[Any] = (), service_groups: Iterable[Any] = ()) -> Ruleset:
+    """Compila la configurazione del firewall in un Ruleset strutturato"""
+    zones = _ordered(zones, "priority")
+    zones_by_id = {zone.id: zone for zone in zones}
+    zones_by_name = {zone.name: zone for zone in zones}
+
+    compiled_ipsets = {}
+    for ipset in sorted(ipsets, key=lambda s: s.name):
+        compiled = compile_ipset(ipset)
+        if compiled is not None:
+            compiled_ipsets[ipset.name] = compiled
+    compiled_groups = {group.name: compile_service_group(group)
+                       for group in sorted(service_groups, key=lambda g: g.name)}
+
+    rules_by_zone: Dict[int, List[Any]] = {zone.id: [] for zone in zones}
+    for rule in _ordered(rules, "priority"):
+        if not rule.enabled:
+            continue
+        if rule.zone_id not in zones_by_id:
+            logger.warning(f"Skipping firewall rule {rule.id}: unknown zone {rule.zone_id}")
+            continue
+        rules_by_zone[rule.zone_id].append(rule)
+
+    forwards = [f for f in sorted(port_forwardings, key=lambda f: f.id or 0) if f.enabled]
+    compiled_forwards = [compile_port_forwarding(f, zones_by_name) for f in forwards]
+
+    ruleset = Ruleset()
+    for compiled in list(compiled_ipsets.values()) + list(compiled_groups.values()):
+        ruleset.add_set(compiled["name"], compiled["type"], compiled["interval"], compiled["elements"])
+
+    # Catene di zona: regole in ordine di priorità seguite dalla policy della zona
+    for zone in zones:
+        name = identifier(zone.name)
+        policy = (zone.default_policy or "drop").lower()
+        if policy not in VERDICTS:
+            policy = "drop"
+        ruleset.add_chain(f"input_{name}")
+        ruleset.add(f"input_{name}", policy)
+        ruleset.add_chain(f"forward_{name}")
+        for rule in rules_by_zone[zone.id]:
+            ruleset.add(f"forward_{name}", compile_rule(rule, compiled_ipsets, compiled_groups))
+        ruleset.add(f"forward_{name}", policy)
+
+    ruleset.add_chain("input", ["type filter hook input priority filter; policy accept;"])
+    ruleset.add("input", "ct state established,related accept")
+    ruleset.add("input", "ct state invalid drop")
+    ruleset.add("input", 'iifname "lo" accept')
+    for zone in zones:
+        if zone_interfaces(zone):
+            ruleset.add("input", f"{interface_match('iifname', zone_interfaces(zone))} "
+                                 f"jump input_{identifier(zone.name)}")
+
+    ruleset.add_chain("forward", ["type filter hook forward priority filter; policy accept;"])
+    for zone in zones:
+        if zone.mss_clamping and zone_interfaces(zone):
+            ruleset.add("forward", f"{interface_match('oifname', zone_interfaces(zone))} "
+                                   "tcp flags syn tcp option maxseg size set rt mtu")
+    ruleset.add("forward", "ct state established,related accept")
+    ruleset.add("forward", "ct state invalid drop")
+    for _, accept in compiled_forwards:
+        ruleset.add("forward", accept)
+    for zone in zones:
+        if zone_interfaces(zone):
+            ruleset.add("forward", f"{interface_match('iifname', zone_interfaces(zone))} "
+                                   f"jump forward_{identifier(zone.name)}")
+
+    ruleset.add_chain("prerouting", ["type nat hook prerouting priority dstnat; policy accept;"])
+    for dnat, _ in compiled_forwards:
+        ruleset.add("prerouting", dnat)
+
+    ruleset.add_chain("postrouting", ["type nat hook postrouting priority srcnat; policy accept;"])
+    for zone in zones:
+        if zone.masquerade and zone_interfaces(zone):
+            ruleset.add("postrouting", f"{interface_match('oifname', zone_interfaces(zone))} masquerade "
+                                       f"comment {quote(f'zone:{zone.id}')}")
+    return ruleset
+
+
+def compile_ruleset(zones: Iterable[Any], rules: Iterable[Any], port_forwardings: Iterable[Any],
+                    ipsets: Iterable[Any] = (), service_groups: Iterable[Any] = ()) -> str:
+    """
+    Compila la configurazione del firewall in uno script nftables
+
+    Lo script ricrea la tabella ``inet evorouter`` all'interno di un'unica
+    transazione: o viene applicato tutto, o non cambia nulla.
+
+    Returns:
+        Testo da passare a ``nft -f``
+    """
+    return build_ruleset(zones, rules, port_forwardings, ipsets, service_groups).render()
+
+
+def parse_handles(output: str) -> Dict[str, List[Tuple[int, Optional[str]]]]:
+    """
+    Estrae handle e commenti delle regole da ``nft -a -j list table``
+
+    Returns:
+        Dizionario catena -> (handle, commento) nell'ordine della catena
+    """
+    handles: Dict[str, List[Tuple[int, Optional[str]]]] = {}
+    for item in json.loads(output).get("nftables", []):
+        if "chain" in item:
+            handles.setdefault(item["chain"]["name"], [])
+        elif "rule" in item:
+            rule = item["rule"]
+            handles.setdefault(rule["chain"], []).append((rule["handle"], rule.get("comment")))
+    return handles
+
+
+def parse_rule_counters(output: str) -> Dict[int, Tuple[int, int]]:
+    """
+    Estrae in un'unica passata i contatori delle regole da ``nft -j list table``
+
+    Returns:
+        Dizionario id FirewallRule -> (pacchetti, byte)
+    """
+    counters: Dict[int, Tuple[int, int]] = {}
+    for item in json.loads(output).get("nftables", []):
+        rule = item.get("rule")
+        if not rule:
+            continue
+        kind, _, rule_id = (rule.get("comment") or "").partition(":")
+        if kind != "rule" or not rule_id.isdigit():
+            continue
+        for expression in rule.get("expr", []):
+            counter = expression.get("counter") if isinstance(expression, dict) else None
+            if counter:
+                packets, nbytes = counters.get(int(rule_id), (0, 0))
+                counters[int(rule_id)] = (packets + counter.get("packets", 0),
+                                          nbytes + counter.get("bytes", 0))
+                break
+    return counters
+
+
+def compile_flush(name: str = TABLE_NAME) -> str:
+    """Script nftables che rimuove una tabella dell'EvoRouter"""
+    return (f"table {TABLE_FAMILY} {name}\n"
+            f"delete table {TABLE_FAMILY} {name}\n")
+
+
+# Contabilità del traffico per host: tabella separata, così l'applicazione del
+# firewall (che ricrea "inet evorouter") non azzera i contatori
+ACCOUNTING_TABLE = "evorouter_acct"
+
+# Set dinamici con contatore per elemento: (nome, tipo, match sull'indirizzo, direzione)
+ACCOUNTING_SETS = (
+    ("acct_tx4", "ipv4_addr", "ip saddr", "upload"),
+    ("acct_rx4", "ipv4_addr", "ip daddr", "download"),
+    ("acct_tx6", "ipv6_addr", "ip6 saddr", "upload"),
+    ("acct_rx6", "ipv6_addr", "ip6 daddr", "download"),
+)
+
+
+def compile_accounting(lan_interfaces: List[str], wan_interfaces: List[str],
+                       size: int = 4096, timeout: int = 3600) -> str:
+    """
+    Compila la tabella di contabilità del traffico LAN <-> WAN per host
+
+    Ogni pacchetto inoltrato aggiorna il contatore dell'host LAN in un set
+    dinamico; gli host inattivi escono dal set dopo ``timeout`` secondi.
+    Tutti i contatori si leggono con un solo ``nft -j list table``.
+
+    Returns:
+        Testo da passare a ``nft -f``
+    """
+    lan = interface_match("iifname", lan_interfaces)
+    wan = interface_match("oifname", wan_interfaces)
+    lines = [f"table {TABLE_FAMILY} {ACCOUNTING_TABLE}",
+             f"delete table {TABLE_FAMILY} {ACCOUNTING_TABLE}",
+             f"table {TABLE_FAMILY} {ACCOUNTING_TABLE} {{"]
+    for name, set_type, _, _ in ACCOUNTING_SETS:
+        lines += [f"    set {name} {{",
+                  f"        type {set_type}; flags dynamic, timeout; timeout {timeout}s; size {size};",
+                  "    }"]
+    lines += ["    chain forward {",
+              "        type filter hook forward priority -150; policy accept;"]
+    for name, _, address, direction in ACCOUNTING_SETS:
+        if direction == "upload":
+            match = f"{lan} {wan}"
+        else:
+            match = (f"{interface_match('iifname', wan_interfaces)} "
+                     f"{interface_match('oifname', lan_interfaces)}")
+        lines.append(f"        {match} update @{name} {{ {address} counter }}")
+    lines += ["    }", "}"]
+    return "\n".join(lines) + "\n"
+
+
+def parse_accounting(output: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Estrae in un'unica passata i contatori per host da ``nft -j list table``
+
+    Returns:
+        Dizionario indirizzo -> (byte in download, byte in upload)
+    """
+    directions = {name: direction for name, _, _, direction in ACCOUNTING_SETS}
+    counters: Dict[str, Tuple[int, int]] = {}
+    for item in json.loads(output).get("nftables", []):
+        nft_set = item.get("set")
+        if not nft_set or nft_set.get("name") not in directions:
+            continue
+        upload = directions[nft_set["name"]] == "upload"
+        for element in nft_set.get("elem", []):
+            element = element.get("elem", element) if isinstance(element, dict) else element
+            if not isinstance(element, dict) or not isinstance(element.get("val"), str):
+                continue
+            nbytes = element.get("counter", {}).get("bytes", 0)
+            download_bytes, upload_bytes = counters.get(element["val"], (0, 0))
+            counters[element["val"]] = ((download_bytes, upload_bytes + nbytes) if upload
+                                        else (download_bytes + nbytes, upload_bytes))
+    return counters
@@ -0,0 +1,59 @@
+"""
+Host-wide exclusive locks for work that must run in a single process.
+
+Gunicorn runs several worker processes and each one starts the background
+samplers and jobs. Work that must happen once per host (writing the bandwidth
+history files, tailing the kernel log, rolling up old firewall logs) is
+guarded by a non-blocking flock() on a lock file: exactly one process holds
+it, and when that process exits the kernel releases the lock, so another
+process can take the work over on its next attempt.
+"""
+import fcntl
+import logging
+import os
+import threading
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+# Lock file path -> open file holding the lock (kept open for the process lifetime)
+_held = {}
+_held_lock = threading.Lock()
+
+
+def acquire_lock(path):
+    """
+    Try to take the exclusive lock on a file, without waiting
+
+    Args:
+        path: Lock file (created if missing)
+
+    Returns:
+        bool: True if this process holds the lock (now or from an earlier call)
+    """
+    with _held_lock:
+        if path in _held:
+            return True
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            f = open(path, "a")
+        except OSError as e:
+            logger.error(f"Cannot open lock file {path}: {str(e)}")
+            return False
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        _held[path] = f
+        logger.info(f"Process {os.getpid()} acquired {path}")
+        return True
+
+
+def release_lock(path):
+    """Release a lock taken with acquire_lock (no-op if not held)"""
+    with _held_lock:
+        f = _held.pop(path, None)
+    if f is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
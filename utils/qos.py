@@ -1,52 +1,45 @@
 """
 Utilities per gestire il Quality of Service (QoS) sul router.
 Questo modulo fornisce funzioni per configurare e gestire il QoS
-usando tc (Traffic Control) e iptables per la marcatura dei pacchetti.
+usando tc (Traffic Control) e nftables per la marcatura dei pacchetti.
 """
 import logging
 import json
+import os
 import subprocess
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
 from typing import List, Dict, Tuple, Optional, Any, Union
 
+from sqlalchemy import func, select
+
+from app import db
+from config import QOS_STATE_PATH, QOS_STATS_INTERVAL, QOS_STATS_HISTORY
+from models import QoSConfig, QoSClass, QoSRule
+from utils.firewall import load_applied_state, save_applied_state
+from utils.metrics import get_sampler
+from utils.nftables import compile_flush
+from utils.tc import QOS_TABLE_NAME, compile_qos, ifb_device, parse_class_stats
+
 # Configurazione del logger
 logger = logging.getLogger(__name__)
 
 # Costanti per tc
 TC_PATH = "/sbin/tc"
 IP_PATH = "/sbin/ip"
-IPTABLES_PATH = "/sbin/iptables"
-
-# DSCP mappings (Differentiated Services Code Point)
-DSCP_VALUES = {
-    "CS0": "0x00",  # Default
-    "CS1": "0x08",  # Priority
-    "AF11": "0x0A", # Priority data 1
-    "AF12": "0x0C", # Priority data 2
-    "AF13": "0x0E", # Priority data 3
-    "CS2": "0x10",  # Immediate
-    "AF21": "0x12", # Immediate data 1
-    "AF22": "0x14", # Immediate data 2
-    "AF23": "0x16", # Immediate data 3
-    "CS3": "0x18",  # Flash
-    "AF31": "0x1A", # Flash data 1
-    "AF32": "0x1C", # Flash data 2
-    "AF33": "0x1E", # Flash data 3
-    "CS4": "0x20",  # Flash Override
-    "AF41": "0x22", # Flash override data 1
-    "AF42": "0x24", # Flash override data 2
-    "AF43": "0x26", # Flash override data 3
-    "CS5": "0x28",  # Critical
-    "EF": "0x2E",   # Voice Admit (Expedited Forwarding)
-    "CS6": "0x30",  # Internetwork Control
-    "CS7": "0x38"   # Network Control
-}
+NFT_PATH = "nft"
 
-def execute_command(command: List[str]) -> Tuple[bool, str]:
+def execute_command(command: List[str], input_data: Optional[str] = None,
+                    quiet: bool = False) -> Tuple[bool, str]:
     """
     Esegue un comando di sistema e ne restituisce l'output.
     
     Args:
         command: Lista di stringhe che rappresentano il comando da eseguire
+        input_data: Testo da inviare sullo standard input (opzionale)
+        quiet: Non registrare come errore un'uscita con codice diverso da zero
         
     Returns:
         Tupla con stato di successo e output del comando
@@ -55,6 +48,7 @@ def execute_command(command: List[str]) -> Tuple[bool, str]:
         # Esecuzione del comando
         result = subprocess.run(
             command,
+            input=input_data,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True,
@@ -62,7 +56,8 @@ def execute_command(command: List[str]) -> Tuple[bool, str]:
         )
         return True, result.stdout
     except subprocess.CalledProcessError as e:
-        logger.error(f"Errore nell'esecuzione del comando {' '.join(command)}: {e}")
+        if not quiet:
+            logger.error(f"Errore nell'esecuzione del comando {' '.join(command)}: {e.stderr.strip()}")
         return False, e.stderr
     except Exception as e:
         logger.error(f"Eccezione durante l'esecuzione del comando {' '.join(command)}: {str(e)}")
@@ -84,240 +79,326 @@ def get_interfaces() -> List[Dict[str, str]]:
     ]
     return interfaces
 
-def get_bandwidth_usage(interface: str) -> Dict[str, Any]:
+def read_class_stats(device: str, hierarchical: bool) -> Optional[Dict[Any, Dict[str, int]]]:
+    """Legge i contatori delle classi di un dispositivo con un solo comando tc (None se non disponibile)"""
+    if hierarchical:
+        command = [TC_PATH, "-s", "-j", "class", "show", "dev", device]
+    else:
+        command = [TC_PATH, "-s", "-j", "qdisc", "show", "dev", device, "root"]
+    success, output = execute_command(command, quiet=True)
+    if not success:
+        return None
+    try:
+        return parse_class_stats(output)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Errore nella lettura delle statistiche QoS di {device}: {str(e)}")
+        return None
+
+class QoSStatsCollector:
     """
-    Ottiene l'utilizzo di banda attuale per un'interfaccia.
+    Statistiche per classe calcolate dai contatori di tc, condivise da tutti i chiamanti
     
-    Args:
-        interface: Nome dell'interfaccia
-        
-    Returns:
-        Dizionario con dati sull'utilizzo di banda
+    I contatori vengono letti al massimo una volta ogni ``interval`` secondi
+    (un comando per dispositivo, qualunque sia il numero di pagine, chiamate
+    API e stream aperti); banda, drop e overlimit sono calcolati dalla
+    differenza con la lettura precedente. Le ultime ``history`` secondi di
+    banda per classe restano in memoria per il grafico della pagina QoS.
     """
-    # In un sistema reale questa funzione utilizzerebbe comandi come 'tc -s class show dev <interface>'
-    # oppure 'iftop' o altri strumenti per monitorare il traffico in tempo reale
-    # Per esempio: execute_command([TC_PATH, "-s", "class", "show", "dev", interface])
     
-    # Per ora restituiamo dati di esempio
-    return {
-        "interface": interface,
-        "download": {
-            "current": 1024,  # kbps
-            "peak": 2048,     # kbps
-            "total": 15000    # KB trasferiti
-        },
-        "upload": {
-            "current": 256,   # kbps
-            "peak": 512,      # kbps
-            "total": 5000     # KB trasferiti
-        },
-        "classes": {
-            "high": {
-                "download": 512,
-                "upload": 128
-            },
-            "default": {
-                "download": 256,
-                "upload": 64
+    def __init__(self, interval: float = QOS_STATS_INTERVAL, history: float = QOS_STATS_HISTORY,
+                 reader=read_class_stats, clock=time.monotonic, wallclock=time.time):
+        self.interval = interval
+        self.history_seconds = history
+        self.reader = reader
+        self._clock = clock
+        self._wallclock = wallclock
+        self._lock = threading.Lock()
+        self._target = None
+        self._reset()
+    
+    def _reset(self) -> None:
+        self._sampled_at = None
+        self._counters: Dict[str, Dict[Any, Dict[str, int]]] = {}
+        self._snapshot = None
+        self._history = deque(maxlen=max(int(self.history_seconds // self.interval), 1))
+    
+    @property
+    def interface(self) -> Optional[str]:
+        return self._target["interface"] if self._target else None
+    
+    def configure(self, interface: str, ifb: Optional[str], hierarchical: bool,
+                  class_names: Dict[int, str]) -> None:
+        """Imposta i dispositivi e le classi da osservare (lo storico riparte se cambiano)"""
+        target = {
+            "interface": interface,
+            "devices": (("upload", interface), ("download", ifb)),
+            "hierarchical": hierarchical,
+            "names": dict(class_names),
+        }
+        with self._lock:
+            if target != self._target:
+                self._target = target
+                self._reset()
+    
+    def clear(self) -> None:
+        """Smette di leggere i contatori (QoS disabilitato)"""
+        with self._lock:
+            self._target = None
+            self._reset()
+    
+    def get(self) -> Optional[Dict[str, Any]]:
+        """
+        Restituisce le statistiche più recenti, rileggendo i contatori se scadute
+        
+        Returns:
+            Dizionario con interface, status, download, upload (current, peak,
+            total, backlog, drops, overlimits) e classes (download, upload,
+            backlog, drops, overlimits per nome di classe); None se non configurato
+        """
+        with self._lock:
+            if self._target is None:
+                return None
+            now = self._clock()
+            if self._sampled_at is None or now - self._sampled_at >= self.interval:
+                self._sample(now)
+            return self._snapshot
+    
+    def history(self) -> Dict[str, Any]:
+        """Banda (kbps) nell'ultima ora, totale e per classe, in serie pronte per il grafico"""
+        with self._lock:
+            entries = list(self._history)
+            names = sorted(set(self._target["names"].values())) if self._target else []
+        if entries:
+            cutoff = entries[-1][0] - self.history_seconds
+            entries = [entry for entry in entries if entry[0] >= cutoff]
+        return {
+            "interval": self.interval,
+            "timestamps": [entry[0] for entry in entries],
+            "download": [entry[1]["download"] for entry in entries],
+            "upload": [entry[1]["upload"] for entry in entries],
+            "classes": {
+                name: {
+                    direction: [entry[1]["classes"].get(name, {}).get(direction) for entry in entries]
+                    for direction in ("download", "upload")
+                }
+                for name in names
             },
-            "low": {
-                "download": 128,
-                "upload": 32
-            }
         }
-    }
-
-def setup_qos(config_id: int, interface: str, download_bandwidth: int, upload_bandwidth: int, 
-             default_class: str, hierarchical: bool = True) -> bool:
-    """
-    Configura il QoS su un'interfaccia.
     
-    Args:
-        config_id: ID della configurazione QoS nel database
-        interface: Nome dell'interfaccia
-        download_bandwidth: Banda massima in download (kbps)
-        upload_bandwidth: Banda massima in upload (kbps)
-        default_class: Nome della classe predefinita
-        hierarchical: Se usare HTB (hierarchical token bucket)
+    def _sample(self, now: float) -> None:
+        elapsed = now - self._sampled_at if self._sampled_at is not None else None
+        target = self._target
+        names = target["names"]
+        snapshot = {"interface": target["interface"], "status": "running", "classes": {}}
+        for name in names.values():
+            snapshot["classes"][name] = {"download": 0, "upload": 0, "backlog": 0, "drops": 0.0,
+                                         "overlimits": 0.0}
         
-    Returns:
-        True se la configurazione è avvenuta con successo, False altrimenti
+        counters = {}
+        for direction, device in target["devices"]:
+            totals = {"current": 0, "peak": 0, "total": 0, "backlog": 0, "drops": 0.0, "overlimits": 0.0}
+            snapshot[direction] = totals
+            if device is None:
+                continue
+            current = self.reader(device, target["hierarchical"])
+            if current is None:
+                snapshot["status"] = "error"
+                continue
+            counters[device] = current
+            previous = self._counters.get(device, {})
+            for key, values in current.items():
+                rates = self._rates(values, previous.get(key), elapsed)
+                if key == "total":
+                    totals.update(current=rates["rate"], total=values["bytes"] // 1024,
+                                  backlog=values["backlog"], drops=rates["drops"],
+                                  overlimits=rates["overlimits"])
+                elif key in names:
+                    usage = snapshot["classes"][names[key]]
+                    usage[direction] = rates["rate"]
+                    usage["backlog"] += values["backlog"]
+                    usage["drops"] = round(usage["drops"] + rates["drops"], 2)
+                    usage["overlimits"] = round(usage["overlimits"] + rates["overlimits"], 2)
+        
+        if elapsed:
+            self._history.append((self._wallclock(), {
+                "download": snapshot["download"]["current"],
+                "upload": snapshot["upload"]["current"],
+                "classes": {name: {"download": usage["download"], "upload": usage["upload"]}
+                            for name, usage in snapshot["classes"].items()},
+            }))
+        for direction in ("download", "upload"):
+            snapshot[direction]["peak"] = max([entry[1][direction] for entry in self._history]
+                                              + [snapshot[direction]["current"]])
+        
+        self._counters = counters
+        self._snapshot = snapshot
+        self._sampled_at = now
+    
+    @staticmethod
+    def _rates(values: Dict[str, int], previous: Optional[Dict[str, int]],
+               elapsed: Optional[float]) -> Dict[str, Any]:
+        """Banda (kbps), drop e overlimit al secondo tra due letture"""
+        if not elapsed or previous is None:
+            return {"rate": 0, "drops": 0.0, "overlimits": 0.0}
+        # Una classe ricreata riparte da zero
+        if values["bytes"] < previous["bytes"]:
+            previous = dict.fromkeys(previous, 0)
+        return {
+            "rate": int((values["bytes"] - previous["bytes"]) * 8 / elapsed / 1000),
+            "drops": round(max(values["drops"] - previous["drops"], 0) / elapsed, 2),
+            "overlimits": round(max(values["overlimits"] - previous["overlimits"], 0) / elapsed, 2),
+        }
+
+_stats_collector = QoSStatsCollector()
+_stats_listener_registered = False
+
+def watch_qos_config(qos_config: QoSConfig) -> None:
     """
-    logger.info(f"Configurazione QoS su {interface}: download={download_bandwidth}kbps, upload={upload_bandwidth}kbps")
-    
-    # In un sistema reale, questa funzione eseguirebbe comandi tc per impostare il QoS
-    # Ad esempio:
-    
-    # 1. Eliminazione delle vecchie configurazioni
-    # execute_command([TC_PATH, "qdisc", "del", "dev", interface, "root"])
-    
-    # 2. Creazione della disciplina di accodamento root (HTB o altro)
-    # Esempio per HTB:
-    # execute_command([
-    #     TC_PATH, "qdisc", "add", "dev", interface, "root", "handle", "1:", 
-    #     "htb", "default", "10"
-    # ])
+    Fa osservare al collettore di statistiche la configurazione QoS applicata
     
-    # 3. Creazione della classe principale con la larghezza di banda massima
-    # execute_command([
-    #     TC_PATH, "class", "add", "dev", interface, "parent", "1:", "classid", "1:1", 
-    #     "htb", "rate", f"{upload_bandwidth}kbit", "ceil", f"{upload_bandwidth}kbit"
-    # ])
-    
-    # 4. Creazione delle classi per i diversi tipi di traffico
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("QoS configurato con successo (simulazione)")
-    return True
+    Le classi vengono rilette dal database solo quando cambia l'interfaccia;
+    il campionatore delle metriche aggiorna poi statistiche e storico in
+    background, anche senza pagine aperte.
+    """
+    global _stats_listener_registered
+    if _stats_collector.interface != qos_config.interface:
+        configure_stats_collector(qos_config)
+    if not _stats_listener_registered:
+        _stats_listener_registered = True
+        get_sampler().add_listener(lambda stats, usage, deltas: _stats_collector.get())
+
+def configure_stats_collector(qos_config: QoSConfig) -> None:
+    """Imposta dispositivi e nomi delle classi osservati dal collettore"""
+    classes = QoSClass.query.filter_by(config_id=qos_config.id).all()
+    _stats_collector.configure(
+        qos_config.interface,
+        ifb_device(qos_config.interface) if qos_config.download_bandwidth else None,
+        bool(qos_config.hierarchical and classes),
+        {c.id: c.name for c in classes}
+    )
 
-def add_qos_class(config_id: int, class_id: int, name: str, priority: int, 
-                min_bandwidth: int, max_bandwidth: int) -> bool:
+def get_bandwidth_usage(interface: str) -> Dict[str, Any]:
     """
-    Aggiunge una classe di traffico QoS.
+    Ottiene l'utilizzo di banda attuale per un'interfaccia.
     
     Args:
-        config_id: ID della configurazione QoS nel database
-        class_id: ID della classe QoS nel database
-        name: Nome della classe
-        priority: Priorità (1-7, dove 1 è la priorità più alta)
-        min_bandwidth: Percentuale minima di banda garantita
-        max_bandwidth: Percentuale massima di banda utilizzabile
+        interface: Nome dell'interfaccia
         
     Returns:
-        True se la classe è stata aggiunta con successo, False altrimenti
+        Dizionario con dati sull'utilizzo di banda (dalla cache condivisa)
     """
-    logger.info(f"Aggiunta classe QoS {name} con priorità {priority}")
-    
-    # In un sistema reale, questa funzione eseguirebbe comandi tc per aggiungere la classe
-    # Ad esempio:
-    
-    # Ottenere la configurazione QoS
-    # from app import db
-    # from models import QoSConfig
-    # qos_config = db.session.get(QoSConfig, config_id)
-    
-    # Calcolare la banda in base alle percentuali
-    # min_rate = (qos_config.upload_bandwidth * min_bandwidth) // 100
-    # max_rate = (qos_config.upload_bandwidth * max_bandwidth) // 100
-    
-    # Aggiungere la classe
-    # tc_priority = 8 - priority  # Convertire in priorità tc (7 = più bassa, 1 = più alta)
-    # execute_command([
-    #     TC_PATH, "class", "add", "dev", qos_config.interface, 
-    #     "parent", "1:1", "classid", f"1:{10+class_id}", 
-    #     "htb", "rate", f"{min_rate}kbit", "ceil", f"{max_rate}kbit", "prio", str(tc_priority)
-    # ])
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("Classe QoS aggiunta con successo (simulazione)")
-    return True
+    usage = _stats_collector.get() if _stats_collector.interface == interface else None
+    if usage is None:
+        empty = {"current": 0, "peak": 0, "total": 0, "backlog": 0, "drops": 0.0, "overlimits": 0.0}
+        return {"interface": interface, "status": "stopped", "download": dict(empty),
+                "upload": dict(empty), "classes": {}}
+    return usage
 
-def add_qos_rule(rule_id: int, class_id: int, source: Optional[str], destination: Optional[str],
-               protocol: str, src_port: Optional[str], dst_port: Optional[str],
-               dscp: Optional[str], direction: str) -> bool:
+def get_bandwidth_history() -> Dict[str, Any]:
+    """Banda totale e per classe dell'ultima ora (per il grafico della pagina QoS)"""
+    return _stats_collector.history()
+
+def clear_device(device: str) -> None:
+    """Rimuove le qdisc radice e di ingresso di un dispositivo (non è un errore se non esistono)"""
+    execute_command([TC_PATH, "qdisc", "del", "dev", device, "root"], quiet=True)
+    execute_command([TC_PATH, "qdisc", "del", "dev", device, "ingress"], quiet=True)
+
+def teardown_interface(interface: str) -> None:
     """
-    Aggiunge una regola per la classificazione del traffico QoS.
-    
-    Args:
-        rule_id: ID della regola QoS nel database
-        class_id: ID della classe QoS associata
-        source: IP o rete sorgente (opzionale)
-        destination: IP o rete destinazione (opzionale)
-        protocol: Protocollo (tcp, udp, icmp, all)
-        src_port: Porta o range di porte sorgente (opzionale)
-        dst_port: Porta o range di porte destinazione (opzionale)
-        dscp: Differentiated Services Code Point (opzionale)
-        direction: Direzione del traffico (in, out, both)
-        
-    Returns:
-        True se la regola è stata aggiunta con successo, False altrimenti
+    Rimuove lo shaping di un'interfaccia: qdisc, redirect in ingresso e dispositivo IFB
+
+    Da usare quando il QoS viene disattivato o spostato su un'altra interfaccia.
     """
-    logger.info(f"Aggiunta regola QoS per classe {class_id}")
-    
-    # In un sistema reale, questa funzione eseguirebbe comandi iptables per marcare i pacchetti
-    # e tc filter per classificarli
-    # Ad esempio:
-    
-    # Ottenere la classe QoS
-    # from app import db
-    # from models import QoSClass, QoSConfig
-    # qos_class = db.session.get(QoSClass, class_id)
-    # qos_config = db.session.get(QoSConfig, qos_class.config_id)
-    
-    # Costruire il comando iptables per marcare i pacchetti
-    # mark_value = 10 + class_id
-    # cmd = [IPTABLES_PATH, "-t", "mangle", "-A", "POSTROUTING"]
-    
-    # if direction in ["out", "both"]:
-    #     if source:
-    #         cmd.extend(["-s", source])
-    #     if destination:
-    #         cmd.extend(["-d", destination])
-    #     if protocol != "all":
-    #         cmd.extend(["-p", protocol])
-    #     if src_port and protocol in ["tcp", "udp"]:
-    #         cmd.extend(["--sport", src_port])
-    #     if dst_port and protocol in ["tcp", "udp"]:
-    #         cmd.extend(["--dport", dst_port])
-    #     if dscp and dscp in DSCP_VALUES:
-    #         cmd.extend(["-m", "dscp", "--dscp-class", dscp])
-    #     
-    #     cmd.extend(["-j", "MARK", "--set-mark", str(mark_value)])
-    #     execute_command(cmd)
-    
-    # Aggiungere il filtro tc
-    # execute_command([
-    #     TC_PATH, "filter", "add", "dev", qos_config.interface, 
-    #     "parent", "1:", "protocol", "ip", "prio", "1", "handle", str(mark_value), "fw", 
-    #     "flowid", f"1:{mark_value}"
-    # ])
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("Regola QoS aggiunta con successo (simulazione)")
-    return True
+    clear_device(interface)
+    ifb = ifb_device(interface)
+    if os.path.exists(f"/sys/class/net/{ifb}"):
+        execute_command([IP_PATH, "link", "del", "dev", ifb])
+
+def ensure_ifb(device: str) -> bool:
+    """Crea (se necessario) e attiva il dispositivo IFB per lo shaping in download"""
+    if not os.path.exists(f"/sys/class/net/{device}"):
+        success, _ = execute_command([IP_PATH, "link", "add", "name", device, "type", "ifb"])
+        if not success:
+            return False
+    success, _ = execute_command([IP_PATH, "link", "set", "dev", device, "up"])
+    return success
 
-def remove_qos_rule(rule_id: int) -> bool:
+def compile_qos_config(qos_config: QoSConfig, **overrides: Any) -> Dict[str, Any]:
     """
-    Rimuove una regola QoS.
+    Compila la configurazione QoS salvata nel DB (batch tc e ruleset di marcatura)
     
-    Args:
-        rule_id: ID della regola QoS nel database
-        
-    Returns:
-        True se la regola è stata rimossa con successo, False altrimenti
+    Gli argomenti aggiuntivi (es. upload_bandwidth) sostituiscono i valori salvati
+    senza modificare il modello.
     """
-    logger.info(f"Rimozione regola QoS {rule_id}")
-    
-    # In un sistema reale, questa funzione eseguirebbe comandi per rimuovere la regola
-    # Esempio:
-    # execute_command([IPTABLES_PATH, "-t", "mangle", "-D", "POSTROUTING", "-m", "comment", 
-    #                 "--comment", f"QoSRule{rule_id}", "-j", "MARK", "--set-mark", str(mark_value)])
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("Regola QoS rimossa con successo (simulazione)")
-    return True
+    classes = QoSClass.query.filter_by(config_id=qos_config.id).all()
+    rules = QoSRule.query.join(QoSClass).filter(QoSClass.config_id == qos_config.id).all()
+    if overrides:
+        settings = {column: getattr(qos_config, column) for column in
+                    ("id", "interface", "download_bandwidth", "upload_bandwidth", "default_class", "hierarchical")}
+        settings.update(overrides)
+        qos_config = SimpleNamespace(**settings)
+    return compile_qos(qos_config, classes, rules)
 
-def remove_qos_class(class_id: int) -> bool:
+def restore_qos(compiled: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> bool:
     """
-    Rimuove una classe QoS.
+    Ripristina lo shaper applicato l'ultima volta dopo un'applicazione fallita
     
-    Args:
-        class_id: ID della classe QoS nel database
-        
-    Returns:
-        True se la classe è stata rimossa con successo, False altrimenti
+    ``tc -batch`` non è atomico: i dispositivi toccati dalla nuova
+    configurazione vengono ripuliti e il batch precedente riapplicato. Senza
+    un batch precedente i dispositivi restano senza shaper.
     """
-    logger.info(f"Rimozione classe QoS {class_id}")
+    devices = set(compiled["devices"]) | set(previous["devices"] if previous else ())
+    for device in devices:
+        clear_device(device)
+    if previous is None:
+        return False
+    if previous["ifb"] and not ensure_ifb(previous["ifb"]):
+        return False
+    success, _ = execute_command([TC_PATH, "-batch", "-"], input_data=previous["batch"])
+    if success:
+        logger.info("Configurazione QoS precedente ripristinata")
+    return success
+
+def apply_qos_config(qos_config: QoSConfig, **overrides: Any) -> bool:
+    """
+    Applica l'intera configurazione QoS
     
-    # In un sistema reale, questa funzione eseguirebbe comandi per rimuovere la classe
-    # Esempio:
-    # from app import db
-    # from models import QoSClass
-    # qos_class = db.session.get(QoSClass, class_id)
-    # execute_command([TC_PATH, "class", "del", "dev", interface, "classid", f"1:{10+class_id}"])
+    Lo shaper viene ricreato con un solo ``tc -batch`` e le regole di
+    marcatura con un solo ``nft -f``, qualunque sia il numero di classi.
+    Bande passate come argomenti (upload_bandwidth, download_bandwidth)
+    vengono applicate al posto di quelle salvate, come durante la calibrazione.
+    Se uno dei due passi fallisce viene ripristinato lo shaper applicato
+    l'ultima volta (salvato in QOS_STATE_PATH); il ruleset di marcatura
+    precedente resta caricato, perché ``nft -f`` è atomico.
     
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("Classe QoS rimossa con successo (simulazione)")
+    Returns:
+        True se la configurazione è stata applicata con successo, False altrimenti
+    """
+    try:
+        compiled = compile_qos_config(qos_config, **overrides)
+    except ValueError as e:
+        logger.error(f"Configurazione QoS non valida: {str(e)}")
+        return False
+    
+    download = overrides.get("download_bandwidth", qos_config.download_bandwidth)
+    upload = overrides.get("upload_bandwidth", qos_config.upload_bandwidth)
+    logger.info(f"Applicazione QoS su {qos_config.interface}: download={download}kbps, upload={upload}kbps")
+    
+    if compiled["ifb"] and not ensure_ifb(compiled["ifb"]):
+        return False
+    previous = load_applied_state(QOS_STATE_PATH)
+    for device in compiled["devices"]:
+        clear_device(device)
+    success, _ = execute_command([TC_PATH, "-batch", "-"], input_data=compiled["batch"])
+    if success:
+        success, _ = execute_command([NFT_PATH, "-f", "-"], input_data=compiled["ruleset"])
+    if not success:
+        logger.error(f"Applicazione QoS su {qos_config.interface} fallita, ripristino della configurazione precedente")
+        restore_qos(compiled, previous)
+        return False
+    save_applied_state(compiled, QOS_STATE_PATH)
+    # Classi e dispositivi possono essere cambiati: il collettore segue la nuova configurazione
+    configure_stats_collector(qos_config)
     return True
 
 def disable_qos(config_id: int) -> bool:
@@ -331,18 +412,15 @@ def disable_qos(config_id: int) -> bool:
         True se il QoS è stato disabilitato con successo, False altrimenti
     """
     logger.info(f"Disabilitazione QoS per config {config_id}")
-    
-    # In un sistema reale, questa funzione eseguirebbe comandi per rimuovere tutte le configurazioni QoS
-    # Esempio:
-    # from app import db
-    # from models import QoSConfig
-    # qos_config = db.session.get(QoSConfig, config_id)
-    # execute_command([TC_PATH, "qdisc", "del", "dev", qos_config.interface, "root"])
-    # execute_command([IPTABLES_PATH, "-t", "mangle", "-F", "POSTROUTING"])
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("QoS disabilitato con successo (simulazione)")
-    return True
+    _stats_collector.clear()
+    
+    save_applied_state(None, QOS_STATE_PATH)
+    qos_config = QoSConfig.query.get(config_id)
+    if qos_config:
+        teardown_interface(qos_config.interface)
+    # Lo script di rimozione funziona anche se la tabella di marcatura non esiste
+    success, _ = execute_command([NFT_PATH, "-f", "-"], input_data=compile_flush(QOS_TABLE_NAME))
+    return success
 
 def get_qos_status(config_id: int) -> Dict[str, Any]:
     """
@@ -354,22 +432,29 @@ def get_qos_status(config_id: int) -> Dict[str, Any]:
     Returns:
         Dizionario con informazioni sullo stato del QoS
     """
-    # In un sistema reale, questa funzione eseguirebbe comandi per ottenere lo stato del QoS
-    # Ad esempio:
-    # from app import db
-    # from models import QoSConfig
-    # qos_config = db.session.get(QoSConfig, config_id)
-    # tc_output = execute_command([TC_PATH, "-s", "qdisc", "show", "dev", qos_config.interface])[1]
-    
-    # Per ora, restituiamo dati di esempio
+    qos_config = QoSConfig.query.get(config_id)
+    if not qos_config:
+        return {"enabled": False, "status": "not_configured"}
+    
+    if not qos_config.enabled:
+        status = "disabled"
+    else:
+        watch_qos_config(qos_config)
+        status = get_bandwidth_usage(qos_config.interface)["status"]
+    # Entrambi i conteggi in un'unica query
+    active_classes, active_rules = db.session.query(
+        select(func.count(QoSClass.id)).where(QoSClass.config_id == qos_config.id).scalar_subquery(),
+        select(func.count(QoSRule.id)).join(QoSClass).where(
+            QoSClass.config_id == qos_config.id, QoSRule.enabled.is_(True)).scalar_subquery()
+    ).one()
     return {
-        "enabled": True,
-        "interface": "eth0",
-        "download_bandwidth": 10000,
-        "upload_bandwidth": 1000,
-        "active_classes": 3,
-        "active_rules": 5,
-        "status": "running"
+        "enabled": qos_config.enabled,
+        "interface": qos_config.interface,
+        "download_bandwidth": qos_config.download_bandwidth,
+        "upload_bandwidth": qos_config.upload_bandwidth,
+        "active_classes": active_classes,
+        "active_rules": active_rules,
+        "status": status
     }
 
 def apply_all_qos_rules() -> bool:
@@ -381,33 +466,9 @@ def apply_all_qos_rules() -> bool:
     """
     logger.info("Applicazione di tutte le regole QoS")
     
-    # In un sistema reale, questa funzione otterrebbe tutte le configurazioni dal database
-    # e le applicherebbe usando le funzioni definite sopra
-    # Ad esempio:
-    # from app import db
-    # from models import QoSConfig, QoSClass, QoSRule
-    # 
-    # Pulisci tutte le configurazioni esistenti
-    # execute_command([TC_PATH, "qdisc", "del", "dev", "eth0", "root"])
-    # execute_command([IPTABLES_PATH, "-t", "mangle", "-F", "POSTROUTING"])
-    # 
-    # Per ogni configurazione attiva
-    # for config in QoSConfig.query.filter_by(enabled=True).all():
-    #     setup_qos(config.id, config.interface, config.download_bandwidth, 
-    #               config.upload_bandwidth, config.default_class, config.hierarchical)
-    #     
-    #     # Per ogni classe
-    #     for qos_class in config.classes:
-    #         add_qos_class(config.id, qos_class.id, qos_class.name, qos_class.priority,
-    #                        qos_class.min_bandwidth, qos_class.max_bandwidth)
-    #         
-    #         # Per ogni regola della classe
-    #         for rule in qos_class.rules:
-    #             if rule.enabled:
-    #                 add_qos_rule(rule.id, qos_class.id, rule.source, rule.destination,
-    #                              rule.protocol, rule.src_port, rule.dst_port,
-    #                              rule.dscp, rule.direction)
-    
-    # Per ora, simuliamo il successo dell'operazione
-    logger.info("Tutte le regole QoS applicate con successo (simulazione)")
-    return True
\ No newline at end of file
+    qos_config = QoSConfig.query.first()
+    if not qos_config:
+        return True
+    if not qos_config.enabled:
+        return disable_qos(qos_config.id)
+    return apply_qos_config(qos_config)
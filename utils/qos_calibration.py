@@ -0,0 +1,168 @@
+"""
+Calibrazione automatica della banda dello shaper QoS.
+Misura la latenza a riposo e la capacità del collegamento senza shaper, poi
+cerca per bisezione la banda più alta che mantiene la latenza sotto carico
+entro ``target`` millisecondi oltre quella a riposo, separatamente per upload
+e download. Le misure passano da un oggetto "sonda": SpeedTestProbe usa
+utils.speed_test e lo shaper reale, i test usano un modello simulato del
+collegamento con la stessa interfaccia.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from config import (QOS_CALIBRATION_TARGET_MS, QOS_CALIBRATION_STEPS, QOS_CALIBRATION_MIN_FRACTION,
+                    QOS_CALIBRATION_PING_HOST)
+from models import QoSConfig
+from utils.qos import apply_qos_config, clear_device
+from utils.speed_test import get_ping_stats, run_speed_test
+from utils.tc import ifb_device
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ("upload", "download")
+
+# Secondi di carico prima di misurare la latenza (le code devono riempirsi)
+LOAD_RAMP_UP = 3
+
+# Funzione di avanzamento: (percentuale, messaggio)
+ProgressCallback = Callable[[int, str], None]
+
+
+def _no_progress(progress: int, message: str) -> None:
+    pass
+
+
+def bisect_rate(loaded_latency: Callable[[int], float], capacity: int, baseline: float,
+                target: float = QOS_CALIBRATION_TARGET_MS, steps: int = QOS_CALIBRATION_STEPS,
+                min_fraction: float = QOS_CALIBRATION_MIN_FRACTION,
+                on_step: Optional[Callable[[int, int, float], None]] = None) -> Dict[str, Any]:
+    """
+    Cerca la banda più alta (kbit/s) la cui latenza sotto carico resta nel limite
+
+    La ricerca avviene tra ``min_fraction`` della capacità e la capacità;
+    se nemmeno il limite inferiore rispetta l'obiettivo viene proposto
+    comunque, con within_target False.
+
+    Returns:
+        Dizionario con rate, latency (ms sotto carico), within_target e
+        measurements (rate, latency di ogni passo)
+    """
+    low, high = max(int(capacity * min_fraction), 1), int(capacity)
+    measurements = []
+    best = None
+
+    def measure(rate: int) -> bool:
+        latency = loaded_latency(rate)
+        measurements.append({"rate": rate, "latency": latency})
+        if on_step:
+            on_step(len(measurements), rate, latency)
+        return latency - baseline <= target
+
+    # Il limite superiore si prova per primo: un collegamento senza bufferbloat non va ridotto
+    if measure(high):
+        best = high
+    else:
+        for _ in range(steps):
+            if high - low <= 1:
+                break
+            rate = (low + high) // 2
+            if measure(rate):
+                best = low = rate
+            else:
+                high = rate
+        if best is None and measure(low):
+            best = low
+
+    latency = next((m["latency"] for m in reversed(measurements) if m["rate"] == best), None)
+    return {
+        "rate": best if best is not None else low,
+        "latency": latency if latency is not None else measurements[-1]["latency"],
+        "within_target": best is not None,
+        "measurements": measurements,
+    }
+
+
+def calibrate(probe: Any, directions: Iterable[str] = DIRECTIONS, target: float = QOS_CALIBRATION_TARGET_MS,
+              steps: int = QOS_CALIBRATION_STEPS, progress: ProgressCallback = _no_progress) -> Dict[str, Any]:
+    """
+    Calibra le direzioni richieste con una sonda
+
+    La sonda deve fornire idle_latency() -> ms, capacity(direction) -> kbit/s
+    e loaded_latency(direction, rate) -> ms con lo shaper impostato a ``rate``.
+
+    Returns:
+        Dizionario con baseline (ms) e, per direzione, capacity, rate,
+        latency, within_target e measurements
+    """
+    directions = list(directions)
+    # Misure previste: latenza a riposo, poi per direzione capacità + limite superiore + passi + limite inferiore
+    total = 1 + len(directions) * (steps + 3)
+    done = [0]
+
+    def advance(message: str) -> None:
+        done[0] += 1
+        progress(min(int(done[0] * 100 / total), 99), message)
+
+    progress(0, "Misurazione latenza a riposo...")
+    baseline = probe.idle_latency()
+    advance(f"Latenza a riposo: {baseline:.1f} ms")
+    result = {"baseline": baseline, "target": target}
+
+    for direction in directions:
+        capacity = probe.capacity(direction)
+        advance(f"Capacità {direction}: {capacity} kbps")
+        if not capacity:
+            raise RuntimeError(f"Impossibile misurare la capacità in {direction}")
+
+        def on_step(step: int, rate: int, latency: float) -> None:
+            advance(f"{direction.capitalize()} a {rate} kbps: latenza {latency:.1f} ms")
+
+        calibrated = bisect_rate(lambda rate: probe.loaded_latency(direction, rate), capacity, baseline,
+                                 target=target, steps=steps, on_step=on_step)
+        calibrated["capacity"] = capacity
+        result[direction] = calibrated
+    progress(100, "Calibrazione completata")
+    return result
+
+
+class SpeedTestProbe:
+    """
+    Sonda reale: speedtest-cli genera il carico, ping misura la latenza
+
+    Lo shaper viene applicato con la configurazione salvata e la sola banda
+    della direzione in calibrazione sostituita.
+    """
+
+    def __init__(self, qos_config: QoSConfig, host: str = QOS_CALIBRATION_PING_HOST):
+        self.qos_config = qos_config
+        self.host = host
+
+    def idle_latency(self) -> float:
+        stats = get_ping_stats(self.host, count=10)
+        if not stats["success"]:
+            raise RuntimeError(stats.get("error", "Ping non riuscito"))
+        return stats["avg"]
+
+    def capacity(self, direction: str) -> int:
+        # La capacità del collegamento si misura senza shaper
+        clear_device(self.qos_config.interface)
+        clear_device(ifb_device(self.qos_config.interface))
+        result = run_speed_test(direction=direction)
+        if not result["success"]:
+            raise RuntimeError(result.get("error", "Test di velocità non riuscito"))
+        return int(result[direction] * 1000)
+
+    def loaded_latency(self, direction: str, rate: int) -> float:
+        if not apply_qos_config(self.qos_config, **{f"{direction}_bandwidth": rate}):
+            raise RuntimeError("Impossibile applicare lo shaper di prova")
+        load = threading.Thread(target=run_speed_test, kwargs={"direction": direction}, daemon=True)
+        load.start()
+        time.sleep(LOAD_RAMP_UP)
+        stats = get_ping_stats(self.host, count=10)
+        load.join()
+        if not stats["success"]:
+            raise RuntimeError(stats.get("error", "Ping non riuscito"))
+        return stats["avg"]
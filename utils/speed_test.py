@@ -7,11 +7,7 @@ import subprocess
 import json
 import re
 import time
-import socket
-import multiprocessing
-import requests
 from datetime import datetime
-import psutil
 import logging
 
 # Configurazione del logger
@@ -98,12 +94,13 @@ def get_ping_stats(host="8.8.8.8", count=10):
             "packet_loss": 100
         }
 
-def run_speed_test(servers=None):
+def run_speed_test(servers=None, direction=None):
     """
     Esegue un test di velocità della rete usando speedtest-cli.
     
     Args:
         servers (list): Lista opzionale di server ID da utilizzare per il test
+        direction (str): "download" o "upload" per misurare una sola direzione
         
     Returns:
         dict: Risultati del test di velocità inclusi download, upload e ping
@@ -115,6 +112,10 @@ def run_speed_test(servers=None):
         if servers:
             servers_str = ",".join(map(str, servers))
             cmd.extend(["--server", servers_str])
+        if direction == "download":
+            cmd.append("--no-upload")
+        elif direction == "upload":
+            cmd.append("--no-download")
         
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
         
@@ -254,52 +255,11 @@ def get_network_interfaces():
     
     Returns:
         list: Lista di dizionari contenenti informazioni sulle interfacce
+              (snapshot condiviso del monitor delle interfacce, sola lettura)
     """
     try:
-        interfaces = []
-        
-        for iface, addrs in psutil.net_if_addrs().items():
-            # Ignora interfacce non fisiche o di loopback
-            if iface.startswith('lo') or iface.startswith('docker') or 'vir' in iface:
-                continue
-                
-            interface_info = {
-                "name": iface,
-                "addresses": [],
-                "stats": {}
-            }
-            
-            # Aggiungi indirizzi IP
-            for addr in addrs:
-                if addr.family == socket.AF_INET:  # IPv4
-                    interface_info["addresses"].append({
-                        "type": "ipv4",
-                        "address": addr.address,
-                        "netmask": addr.netmask
-                    })
-                elif addr.family == socket.AF_INET6:  # IPv6
-                    interface_info["addresses"].append({
-                        "type": "ipv6",
-                        "address": addr.address
-                    })
-            
-            # Aggiungi statistiche se disponibili
-            if iface in psutil.net_io_counters(pernic=True):
-                stats = psutil.net_io_counters(pernic=True)[iface]
-                interface_info["stats"] = {
-                    "bytes_sent": stats.bytes_sent,
-                    "bytes_recv": stats.bytes_recv,
-                    "packets_sent": stats.packets_sent,
-                    "packets_recv": stats.packets_recv,
-                    "errin": stats.errin,
-                    "errout": stats.errout,
-                    "dropin": stats.dropin,
-                    "dropout": stats.dropout
-                }
-            
-            interfaces.append(interface_info)
-            
-        return interfaces
+        from utils.interfaces import get_interface_monitor
+        return get_interface_monitor().speed_test_interfaces()
     except Exception as e:
         logger.error(f"Errore durante il recupero delle interfacce di rete: {str(e)}")
         return []
@@ -367,6 +327,9 @@ def check_internet_connectivity():
         "https://www.amazon.com"
     ]
     
+    # Importato qui: requests pesa sull'avvio di ogni worker e serve solo a questo test
+    import requests
+    
     results = []
     
     for target in targets:
@@ -408,6 +371,8 @@ def run_background_test(callback=None):
     Returns:
         multiprocessing.Process: Il processo in esecuzione
     """
+    import multiprocessing
+    
     def worker():
         results = run_comprehensive_test()
         if callback:
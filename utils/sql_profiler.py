@@ -0,0 +1,205 @@
+"""
+Request-scoped SQL profiler.
+
+When enabled, SQLAlchemy engine events time every statement and Flask
+before_request/after_request hooks attribute them to the endpoint being
+served. Per-endpoint totals (requests, statements, DB time and the slowest
+statements) are kept in memory for the admin endpoint, and statements slower
+than a threshold are appended to a rotating slow-query log.
+"""
+import heapq
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from config import SQL_SLOW_QUERY_MS, SQL_SLOW_QUERY_LOG, SQL_PROFILER_TOP_STATEMENTS
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+# Statements are logged on one line and truncated, parameters are never logged
+MAX_STATEMENT_LENGTH = 500
+
+# Endpoint used for statements run outside a request (background jobs)
+BACKGROUND_ENDPOINT = "<background>"
+
+# Endpoint for requests that matched no route (keeps the table bounded)
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+
+def _normalize(statement):
+    """Collapse a SQL statement on one line, truncated to MAX_STATEMENT_LENGTH"""
+    statement = " ".join(statement.split())
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        statement = statement[:MAX_STATEMENT_LENGTH] + "..."
+    return statement
+
+
+def _endpoint_name():
+    """Endpoint of the current request; unmatched URLs share one bucket"""
+    return request.endpoint or UNMATCHED_ENDPOINT
+
+
+class EndpointProfile:
+    """Accumulated SQL cost of one endpoint"""
+
+    def __init__(self, top=SQL_PROFILER_TOP_STATEMENTS):
+        self.top = top
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.max_queries = 0
+        self.max_db_time = 0.0
+        # Min-heap of (duration, statement): the root is the fastest of the slowest
+        self._slowest = []
+
+    def add_statement(self, duration, statement):
+        self.queries += 1
+        self.db_time += duration
+        entry = (duration, statement)
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, entry)
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def add_request(self, queries, db_time):
+        self.requests += 1
+        self.max_queries = max(self.max_queries, queries)
+        self.max_db_time = max(self.max_db_time, db_time)
+
+    def to_dict(self):
+        # Background statements have no request: averages are per statement
+        requests = self.requests or self.queries or 1
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'avg_queries': round(self.queries / requests, 2),
+            'max_queries': self.max_queries,
+            'db_time_ms': round(self.db_time * 1000, 3),
+            'avg_db_time_ms': round(self.db_time * 1000 / requests, 3),
+            'max_db_time_ms': round(self.max_db_time * 1000, 3),
+            'slowest': [{'duration_ms': round(duration * 1000, 3), 'statement': statement}
+                        for duration, statement in sorted(self._slowest, reverse=True)]
+        }
+
+
+class SQLProfiler:
+    """
+    Collects per-endpoint SQL statistics for one Flask app and engine
+
+    Args:
+        app: Flask application (hooks are registered on it)
+        engine: SQLAlchemy engine to instrument
+        slow_query_ms: Statements at or above this duration are logged
+        slow_query_log: Path of the slow-query log (None to disable the file)
+        top: Number of slowest statements kept per endpoint
+        clock: Time source, overridable in tests
+    """
+
+    def __init__(self, app, engine, slow_query_ms=SQL_SLOW_QUERY_MS, slow_query_log=SQL_SLOW_QUERY_LOG,
+                 top=SQL_PROFILER_TOP_STATEMENTS, clock=time.perf_counter):
+        self.engine = engine
+        self.slow_query_ms = slow_query_ms
+        self.top = top
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._started = time.time()
+        self.slow_log = self._open_slow_log(slow_query_log)
+
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.extensions['sql_profiler'] = self
+
+    @staticmethod
+    def _open_slow_log(path):
+        """Dedicated logger writing to a small rotating file (the box has little storage)"""
+        slow_log = logging.getLogger(f"{__name__}.slow")
+        if path is None or any(getattr(h, 'baseFilename', None) == os.path.abspath(path)
+                               for h in slow_log.handlers):
+            return slow_log
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=1024 * 1024, backupCount=3)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.INFO)
+        return slow_log
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('sql_profiler_start', []).append(self._clock())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = self._clock() - conn.info['sql_profiler_start'].pop()
+        if has_request_context():
+            endpoint = _endpoint_name()
+            if 'sql_profile' in g:
+                g.sql_profile['queries'] += 1
+                g.sql_profile['db_time'] += duration
+        else:
+            endpoint = BACKGROUND_ENDPOINT
+
+        statement = _normalize(statement)
+        with self._lock:
+            self._endpoint(endpoint).add_statement(duration, statement)
+
+        if duration * 1000 >= self.slow_query_ms:
+            self.slow_log.warning(f"{duration * 1000:.1f}ms endpoint={endpoint} {statement}")
+
+    def _endpoint(self, endpoint):
+        profile = self._endpoints.get(endpoint)
+        if profile is None:
+            profile = self._endpoints[endpoint] = EndpointProfile(self.top)
+        return profile
+
+    def _before_request(self):
+        g.sql_profile = {'queries': 0, 'db_time': 0.0}
+
+    def _after_request(self, response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+        with self._lock:
+            self._endpoint(_endpoint_name()).add_request(profile['queries'], profile['db_time'])
+        # Visible in the browser developer tools, next to the request timings
+        response.headers['Server-Timing'] = (
+            f'db;dur={profile["db_time"] * 1000:.1f};desc="{profile["queries"]} queries"')
+        return response
+
+    def snapshot(self):
+        """
+        Get the per-endpoint statistics
+
+        Returns:
+            dict: since (epoch seconds), slow_query_ms and endpoints (sorted by
+                  total DB time, most expensive first)
+        """
+        with self._lock:
+            endpoints = [dict(endpoint=name, **profile.to_dict())
+                         for name, profile in self._endpoints.items()]
+        endpoints.sort(key=lambda e: e['db_time_ms'], reverse=True)
+        return {'since': self._started, 'slow_query_ms': self.slow_query_ms, 'endpoints': endpoints}
+
+    def reset(self):
+        """Discard the collected statistics"""
+        with self._lock:
+            self._endpoints = {}
+            self._started = time.time()
+
+
+def get_sql_profiler(app):
+    """
+    Get the profiler installed on an app
+
+    Returns:
+        SQLProfiler or None if profiling is disabled
+    """
+    return app.extensions.get('sql_profiler')
@@ -0,0 +1,226 @@
+"""
+Server-Sent Events fan-out for live statistics.
+
+An EventBroadcaster is ticked by the shared metrics sampler. While it has
+subscribers it builds one snapshot per tick, diffs it against the previous
+one and hands the delta to every subscriber, so N open browser tabs cost a
+single sampling pass instead of N polling loops.
+"""
+import json
+import logging
+import threading
+
+from config import STREAM_HEARTBEAT_INTERVAL
+from utils.metrics import get_sampler
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+
+# Key of a delta level listing the keys removed at that level (None is a value)
+REMOVED = "__removed__"
+
+
+def diff_snapshot(previous, current):
+    """
+    Compute the changes between two nested snapshots
+
+    Args:
+        previous: Previous snapshot (dict)
+        current: Current snapshot (dict)
+
+    Returns:
+        dict: Changed keys only; removed keys are listed under REMOVED
+    """
+    delta = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            sub = diff_snapshot(old, value)
+            if sub:
+                delta[key] = sub
+        elif key not in previous or old != value:
+            delta[key] = value
+    removed = [key for key in previous if key not in current]
+    if removed:
+        delta[REMOVED] = removed
+    return delta
+
+
+def merge_delta(target, delta):
+    """Apply a delta produced by diff_snapshot to target in place (removals first)"""
+    for key in delta.get(REMOVED, ()):
+        target.pop(key, None)
+    for key, value in delta.items():
+        if key == REMOVED:
+            continue
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_delta(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def _merge_pending(target, delta):
+    """
+    Merge a delta into a pending one
+
+    A key removed and then set again stays in the removed list: the client
+    applies removals first, so it drops the stale value before the new one.
+    """
+    for key in delta.get(REMOVED, ()):
+        target.pop(key, None)
+        removed = target.setdefault(REMOVED, [])
+        if key not in removed:
+            removed.append(key)
+    for key, value in delta.items():
+        if key == REMOVED:
+            continue
+        if isinstance(value, dict):
+            existing = target.get(key)
+            if not isinstance(existing, dict):
+                existing = target[key] = {}
+            _merge_pending(existing, value)
+        else:
+            target[key] = value
+
+
+class Subscription:
+    """
+    One connected client
+
+    Deltas that arrive while the client is still sending the previous event
+    are merged into a single pending delta, so a slow client never makes the
+    backlog grow.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def push(self, delta):
+        with self._cond:
+            _merge_pending(self._pending, delta)
+            self._cond.notify()
+
+    def pop(self, timeout):
+        """
+        Wait for the next delta
+
+        Returns:
+            dict: Pending delta, or None on timeout
+        """
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            pending, self._pending = self._pending, {}
+        return pending or None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+class EventBroadcaster:
+    """
+    Builds snapshots with ``producer`` and fans out deltas to subscribers
+
+    Args:
+        producer: Callable returning a JSON-serialisable dict snapshot
+        name: Name used in log messages
+    """
+
+    def __init__(self, producer, name='stream'):
+        self.producer = producer
+        self.name = name
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """
+        Register a new client and queue the full current snapshot for it
+
+        Returns:
+            Subscription: The new subscription
+        """
+        subscription = Subscription()
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self.producer()
+            subscription.push(self._snapshot)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                # Drop the baseline so the next subscriber gets fresh data
+                self._snapshot = None
+
+    def tick(self):
+        """Produce a new snapshot and push its delta (no-op without subscribers)"""
+        if not self._subscribers:
+            return
+        try:
+            snapshot = self.producer()
+        except Exception as e:
+            logger.error(f"Error producing {self.name} snapshot: {str(e)}")
+            return
+        with self._lock:
+            delta = diff_snapshot(self._snapshot or {}, snapshot)
+            self._snapshot = snapshot
+            subscribers = list(self._subscribers)
+        if delta:
+            for subscription in subscribers:
+                subscription.push(delta)
+
+    def stream(self, heartbeat=STREAM_HEARTBEAT_INTERVAL):
+        """
+        Generator of SSE-formatted events for a new subscriber
+
+        The first event carries the full snapshot, the following ones only
+        the changed fields. A comment line is sent as keep-alive.
+        """
+        subscription = self.subscribe()
+        try:
+            while not subscription.closed:
+                delta = subscription.pop(heartbeat)
+                if delta is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"data: {json.dumps(delta)}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def get_broadcaster(name, producer):
+    """
+    Get (or create) a named broadcaster ticked by the shared metrics sampler
+
+    Args:
+        name: Unique broadcaster name (e.g. 'dashboard', 'qos:eth1')
+        producer: Callable returning the snapshot; used only on creation
+
+    Returns:
+        EventBroadcaster: The shared broadcaster
+    """
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(name)
+        if broadcaster is None:
+            broadcaster = EventBroadcaster(producer, name=name)
+            get_sampler().add_listener(lambda stats, usage, deltas: broadcaster.tick())
+            _broadcasters[name] = broadcaster
+    return broadcaster
@@ -1,14 +1,12 @@
 import logging
-import subprocess
 import os
 import re
-import psutil
-import time
 from datetime import datetime, timedelta
 from config import (
     SYSTEM_LOG_PATH, DIAGNOSTIC_TOOLS,
     DEFAULT_LAN_INTERFACE, DEFAULT_WAN_INTERFACE
 )
+from utils.metrics import get_sampler
 
 # Create logger
 logger = logging.getLogger(__name__)
@@ -17,120 +15,14 @@ def get_system_stats():
     """
     Get system statistics
     
+    Values come from the background metrics sampler, so this call never
+    blocks on CPU or network measurements.
+    
     Returns:
-        dict: Dictionary with system statistics
+        dict: Dictionary with system statistics (read-only snapshot)
     """
-    stats = {}
-    
     try:
-        # CPU information
-        stats['cpu'] = {}
-        stats['cpu']['usage'] = psutil.cpu_percent(interval=0.1)
-        stats['cpu']['count'] = psutil.cpu_count()
-        stats['cpu']['frequency'] = psutil.cpu_freq().current if psutil.cpu_freq() else 'N/A'
-        
-        # Memory information
-        memory = psutil.virtual_memory()
-        stats['memory'] = {}
-        stats['memory']['total'] = memory.total
-        stats['memory']['available'] = memory.available
-        stats['memory']['used'] = memory.used
-        stats['memory']['percent'] = memory.percent
-        
-        # Disk information
-        disk = psutil.disk_usage('/')
-        stats['disk'] = {}
-        stats['disk']['total'] = disk.total
-        stats['disk']['free'] = disk.free
-        stats['disk']['used'] = disk.used
-        stats['disk']['percent'] = disk.percent
-        
-        # System load
-        stats['load_avg'] = os.getloadavg()
-        
-        # System uptime
-        uptime_seconds = time.time() - psutil.boot_time()
-        stats['uptime'] = {
-            'days': int(uptime_seconds // (60*60*24)),
-            'hours': int((uptime_seconds % (60*60*24)) // (60*60)),
-            'minutes': int((uptime_seconds % (60*60)) // 60),
-            'seconds': int(uptime_seconds % 60)
-        }
-        
-        # System temperature (if available)
-        stats['temperature'] = {}
-        if hasattr(psutil, "sensors_temperatures"):
-            temps = psutil.sensors_temperatures()
-            if temps:
-                # Extract CPU temperature on different systems
-                for chip, sensors in temps.items():
-                    for sensor in sensors:
-                        if any(x in sensor.label.lower() for x in ['cpu', 'core', 'package']):
-                            stats['temperature']['cpu'] = sensor.current
-                        elif 'sys' in sensor.label.lower():
-                            stats['temperature']['system'] = sensor.current
-        
-        # Network usage information
-        network = psutil.net_io_counters(pernic=True)
-        stats['network'] = {}
-        
-        # Get total bytes sent/received across all interfaces
-        total_bytes_sent = 0
-        total_bytes_recv = 0
-        
-        for interface, data in network.items():
-            if interface != 'lo':  # Skip loopback
-                stats['network'][interface] = {
-                    'bytes_sent': data.bytes_sent,
-                    'bytes_recv': data.bytes_recv,
-                    'packets_sent': data.packets_sent,
-                    'packets_recv': data.packets_recv,
-                    'errin': data.errin,
-                    'errout': data.errout,
-                    'dropin': data.dropin,
-                    'dropout': data.dropout
-                }
-                total_bytes_sent += data.bytes_sent
-                total_bytes_recv += data.bytes_recv
-        
-        stats['network']['total'] = {
-            'bytes_sent': total_bytes_sent,
-            'bytes_recv': total_bytes_recv
-        }
-        
-        # System information
-        stats['system'] = {}
-        
-        try:
-            # Get OS information
-            with open('/etc/os-release', 'r') as f:
-                os_info = {}
-                for line in f:
-                    if '=' in line:
-                        key, value = line.rstrip().split('=', 1)
-                        os_info[key] = value.strip('"')
-            
-            stats['system']['os_name'] = os_info.get('PRETTY_NAME', 'Unknown')
-        except:
-            stats['system']['os_name'] = 'EvoRouter R4 OS'
-        
-        # Get kernel version
-        try:
-            kernel_version = subprocess.run(['uname', '-r'], 
-                                       capture_output=True, text=True, check=True).stdout.strip()
-            stats['system']['kernel'] = kernel_version
-        except:
-            stats['system']['kernel'] = 'Unknown'
-        
-        # Get hostname
-        try:
-            hostname = subprocess.run(['hostname'], 
-                                 capture_output=True, text=True, check=True).stdout.strip()
-            stats['system']['hostname'] = hostname
-        except:
-            stats['system']['hostname'] = 'bpi-r4-router'
-        
-        return stats
+        return get_sampler().get_stats()
     except Exception as e:
         logger.error(f"Error getting system stats: {str(e)}")
         return {'error': str(e)}
@@ -139,38 +31,14 @@ def get_network_usage():
     """
     Get current network usage (real-time)
     
+    Rates are computed by the background metrics sampler from the counter
+    delta between its last two samples.
+    
     Returns:
         dict: Dictionary with network usage information
     """
     try:
-        # Get initial counters
-        network_1 = psutil.net_io_counters(pernic=True)
-        
-        # Wait for a short time
-        time.sleep(1)
-        
-        # Get counters again
-        network_2 = psutil.net_io_counters(pernic=True)
-        
-        # Calculate usage
-        usage = {}
-        
-        for interface, data_2 in network_2.items():
-            if interface != 'lo' and interface in network_1:  # Skip loopback
-                data_1 = network_1[interface]
-                
-                # Calculate bytes/sec
-                bytes_sent = data_2.bytes_sent - data_1.bytes_sent
-                bytes_recv = data_2.bytes_recv - data_1.bytes_recv
-                
-                usage[interface] = {
-                    'bytes_sent': bytes_sent,
-                    'bytes_recv': bytes_recv,
-                    'mbits_sent': bytes_sent * 8 / 1000000,
-                    'mbits_recv': bytes_recv * 8 / 1000000
-                }
-        
-        return usage
+        return get_sampler().get_network_usage()
     except Exception as e:
         logger.error(f"Error getting network usage: {str(e)}")
         return {'error': str(e)}
@@ -514,50 +382,6 @@ def run_diagnostic(tool, parameters=''):
         logger.error(f"Error running diagnostic tool {tool}: {str(e)}")
         return f"Error: {str(e)}"
 
-def get_network_usage():
-    """
-    Get network usage statistics
-    
-    Returns:
-        dict: Dictionary with network usage statistics
-    """
-    try:
-        # In Replit environment, we'll create simulated data
-        import random
-        
-        # Generate random usage data
-        usage = {
-            "total_rx": random.randint(1000000000, 10000000000),  # Total received bytes
-            "total_tx": random.randint(500000000, 5000000000),    # Total transmitted bytes
-            "current_rx": random.randint(50000, 5000000),         # Current receive rate (bytes/sec)
-            "current_tx": random.randint(10000, 1000000),         # Current transmit rate (bytes/sec)
-            "interfaces": {
-                "eth0": {
-                    "rx": random.randint(500000000, 5000000000),
-                    "tx": random.randint(100000000, 1000000000),
-                    "rx_rate": random.randint(10000, 1000000),
-                    "tx_rate": random.randint(5000, 500000)
-                },
-                "eth1": {
-                    "rx": random.randint(500000000, 5000000000),
-                    "tx": random.randint(100000000, 1000000000),
-                    "rx_rate": random.randint(10000, 1000000),
-                    "tx_rate": random.randint(5000, 500000)
-                },
-                "wlan0": {
-                    "rx": random.randint(100000000, 1000000000),
-                    "tx": random.randint(50000000, 500000000),
-                    "rx_rate": random.randint(5000, 500000),
-                    "tx_rate": random.randint(1000, 100000)
-                }
-            }
-        }
-        
-        return usage
-    except Exception as e:
-        logger.error(f"Error getting network usage: {str(e)}")
-        return {}
-
 def get_installed_packages():
     """
     Get list of installed packages
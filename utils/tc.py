@@ -0,0 +1,288 @@
+"""
+Compilatore della configurazione QoS dell'EvoRouter R4.
+Trasforma QoSConfig, QoSClass e QoSRule in un file per ``tc -batch`` (albero
+HTB con foglie fq_codel, o un singolo shaper CAKE in modalità non gerarchica,
+sulla WAN per l'upload e su un dispositivo IFB per il download) e in uno
+script nftables che marca i pacchetti nella tabella dedicata al QoS.
+Tutto viene applicato con due soli processi, indipendentemente dal numero di
+classi e regole.
+
+Come utils.nftables, le funzioni di questo modulo non accedono al database né
+al sistema e ricevono oggetti con gli attributi dei modelli.
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from utils.nftables import (Ruleset, address_family, address_match, interface_match,
+                            is_any, l4_match, quote)
+
+# Configurazione del logger
+logger = logging.getLogger(__name__)
+
+# Tabella nftables con le regole di marcatura (separata da quella del firewall)
+QOS_TABLE_NAME = "evorouter_qos"
+
+# Handle della qdisc radice e della classe che limita la banda totale
+ROOT_HANDLE = 1
+ROOT_CLASS = 1
+
+# Handle della qdisc di ingresso e prefisso del dispositivo IFB per il download
+INGRESS_HANDLE = "ffff:"
+IFB_PREFIX = "ifb4"
+
+# Minor delle classi e marche dei pacchetti: base + id di QoSClass
+CLASS_MINOR_BASE = 0x100
+
+# Banda minima assegnata a una classe (kbit/s)
+MIN_CLASS_RATE = 8
+
+# Quantum HTB: almeno un pacchetto Ethernet completo
+HTB_QUANTUM = 1514
+
+# Qdisc usata sulle foglie dell'albero HTB
+LEAF_QDISC = "fq_codel"
+
+# Contatori letti da ``tc -s -j`` per ogni classe
+STAT_FIELDS = ("bytes", "packets", "drops", "overlimits", "backlog", "qlen")
+
+# DSCP mappings (Differentiated Services Code Point)
+DSCP_VALUES = {
+    "CS0": "0x00",  # Default
+    "CS1": "0x08",  # Priority
+    "AF11": "0x0A", # Priority data 1
+    "AF12": "0x0C", # Priority data 2
+    "AF13": "0x0E", # Priority data 3
+    "CS2": "0x10",  # Immediate
+    "AF21": "0x12", # Immediate data 1
+    "AF22": "0x14", # Immediate data 2
+    "AF23": "0x16", # Immediate data 3
+    "CS3": "0x18",  # Flash
+    "AF31": "0x1A", # Flash data 1
+    "AF32": "0x1C", # Flash data 2
+    "AF33": "0x1E", # Flash data 3
+    "CS4": "0x20",  # Flash Override
+    "AF41": "0x22", # Flash override data 1
+    "AF42": "0x24", # Flash override data 2
+    "AF43": "0x26", # Flash override data 3
+    "CS5": "0x28",  # Critical
+    "EF": "0x2E",   # Voice Admit (Expedited Forwarding)
+    "CS6": "0x30",  # Internetwork Control
+    "CS7": "0x38"   # Network Control
+}
+
+
+def class_minor(class_id: int) -> int:
+    """Minor tc (e marca dei pacchetti) di una QoSClass"""
+    return CLASS_MINOR_BASE + class_id
+
+
+def class_handle(class_id: int) -> str:
+    """Classid tc di una QoSClass (il minor è esadecimale)"""
+    return f"{ROOT_HANDLE:x}:{class_minor(class_id):x}"
+
+
+def class_rates(bandwidth: int, classes: Iterable[Any]) -> Dict[int, Dict[str, int]]:
+    """
+    Calcola rate e ceil (kbit/s) delle classi dalle percentuali della banda totale
+
+    Se la somma delle bande minime supera il 100% vengono ridotte in proporzione,
+    così la somma delle bande garantite non supera mai quella del collegamento.
+
+    Returns:
+        Dizionario id classe -> rate, ceil e prio (0 = più alta)
+    """
+    classes = list(classes)
+    total = sum(max(c.min_bandwidth or 0, 0) for c in classes)
+    scale = 100.0 / total if total > 100 else 1.0
+
+    rates = {}
+    for qos_class in classes:
+        rate = max(int(bandwidth * max(qos_class.min_bandwidth or 0, 0) * scale / 100), MIN_CLASS_RATE)
+        ceil = int(bandwidth * min(max(qos_class.max_bandwidth or 100, 1), 100) / 100)
+        rates[qos_class.id] = {
+            "rate": rate,
+            "ceil": max(ceil, rate),
+            "prio": min(max((qos_class.priority or 4) - 1, 0), 7),
+        }
+    return rates
+
+
+def default_class_id(config: Any, classes: List[Any]) -> Optional[int]:
+    """Classe del traffico non classificato (la predefinita o quella a priorità più bassa)"""
+    for qos_class in classes:
+        if qos_class.name == config.default_class:
+            return qos_class.id
+    if classes:
+        logger.warning(f"Default QoS class {config.default_class} not found, using the lowest priority one")
+        return max(classes, key=lambda c: (c.priority or 0, c.id)).id
+    return None
+
+
+def compile_shaper(device: str, bandwidth: int, classes: List[Any], default_id: Optional[int],
+                   hierarchical: bool = True) -> List[str]:
+    """
+    Comandi ``tc -batch`` che creano lo shaper di un dispositivo
+
+    La qdisc radice esistente deve essere già stata rimossa.
+    """
+    if not hierarchical or not classes:
+        # Un unico shaper con code per flusso al posto dell'albero di classi
+        return [f"qdisc add dev {device} root cake bandwidth {bandwidth}kbit besteffort"]
+
+    root = f"{ROOT_HANDLE:x}:"
+    default_minor = class_minor(default_id) if default_id is not None else 0
+    commands = [
+        f"qdisc add dev {device} root handle {root} htb default {default_minor:x}",
+        f"class add dev {device} parent {root} classid {root}{ROOT_CLASS:x} htb "
+        f"rate {bandwidth}kbit ceil {bandwidth}kbit quantum {HTB_QUANTUM}",
+    ]
+    rates = class_rates(bandwidth, classes)
+    for qos_class in sorted(classes, key=lambda c: (c.priority or 0, c.id)):
+        spec = rates[qos_class.id]
+        minor = class_minor(qos_class.id)
+        commands.append(
+            f"class add dev {device} parent {root}{ROOT_CLASS:x} classid {class_handle(qos_class.id)} htb "
+            f"rate {spec['rate']}kbit ceil {spec['ceil']}kbit prio {spec['prio']} quantum {HTB_QUANTUM}"
+        )
+        commands.append(f"qdisc add dev {device} parent {class_handle(qos_class.id)} handle {minor:x}: {LEAF_QDISC}")
+        commands.append(f"filter add dev {device} parent {root} protocol all prio 1 "
+                        f"handle {minor:#x} fw flowid {class_handle(qos_class.id)}")
+    return commands
+
+
+def ifb_device(interface: str) -> str:
+    """Nome del dispositivo IFB che riceve il traffico in ingresso di un'interfaccia"""
+    # I nomi delle interfacce sono limitati a 15 caratteri
+    return (IFB_PREFIX + interface)[:15]
+
+
+def compile_ingress_redirect(interface: str, ifb: str) -> List[str]:
+    """
+    Comandi ``tc -batch`` che redirigono il traffico in ingresso verso l'IFB
+
+    Il traffico in ingresso attraversa tc prima di netfilter: l'azione
+    connmark copia nel pacchetto la marca salvata nella connessione, così i
+    filtri fw dell'IFB lo assegnano alla stessa classe dell'upload.
+    """
+    return [
+        f"qdisc add dev {interface} handle {INGRESS_HANDLE} ingress",
+        f"filter add dev {interface} parent {INGRESS_HANDLE} protocol all prio 1 matchall "
+        f"action connmark action mirred egress redirect dev {ifb}",
+    ]
+
+
+def compile_mark_rule(rule: Any, interface_expression: str) -> str:
+    """Compila una QoSRule in una regola nftables che marca pacchetto e connessione"""
+    parts = [interface_expression,
+             address_match("saddr", rule.source, {}),
+             address_match("daddr", rule.destination, {})]
+    parts.extend(l4_match(rule.protocol, rule.src_port, rule.dst_port, {}))
+    if rule.dscp and not is_any(rule.dscp):
+        dscp = rule.dscp.strip().upper()
+        if dscp not in DSCP_VALUES:
+            raise ValueError(f"Invalid DSCP {rule.dscp} for QoS rule {rule.id}")
+        family = "ip"
+        for address in (rule.source, rule.destination):
+            if not is_any(address):
+                family = address_family(address)
+        parts.append(f"{family} dscp {dscp.lower()}")
+    mark = class_minor(rule.class_id)
+    # La marca salvata nella connessione classifica anche i pacchetti successivi
+    parts.append(f"meta mark set {mark:#x} ct mark set meta mark accept")
+    parts.append(f"comment {quote(f'qos:{rule.id}')}")
+    return " ".join(part for part in parts if part)
+
+
+def build_mark_ruleset(config: Any, rules: Iterable[Any]) -> Ruleset:
+    """
+    Ruleset nftables che assegna ai pacchetti la marca della loro classe
+
+    Le regole vengono valutate per priorità e la prima che corrisponde vince;
+    i pacchetti di connessioni già classificate riprendono la marca salvata
+    nel conntrack senza attraversare le regole.
+    """
+    ruleset = Ruleset(QOS_TABLE_NAME)
+    wan = [config.interface]
+    chains = (
+        ("prerouting", "in", interface_match("iifname", wan)),
+        ("postrouting", "out", interface_match("oifname", wan)),
+    )
+    ordered = sorted((r for r in rules if r.enabled), key=lambda r: (r.priority or 0, r.id))
+    for chain, direction, interface_expression in chains:
+        ruleset.add_chain(chain, [f"type filter hook {chain} priority mangle; policy accept;"])
+        ruleset.add(chain, "ct mark != 0 meta mark set ct mark accept")
+        for rule in ordered:
+            if (rule.direction or "both") in (direction, "both"):
+                ruleset.add(chain, compile_mark_rule(rule, interface_expression))
+    return ruleset
+
+
+def parse_class_stats(output: str) -> Dict[Any, Dict[str, int]]:
+    """
+    Estrae i contatori dall'output di ``tc -s -j class show`` o ``tc -s -j qdisc show``
+
+    Le classi sono riconosciute dal minor del classid; la classe che limita la
+    banda totale (o la qdisc radice in modalità non gerarchica) ha chiave "total".
+
+    Returns:
+        Dizionario id QoSClass (o "total") -> bytes, packets, drops, overlimits,
+        backlog e qlen
+    """
+    stats = {}
+    for entry in json.loads(output or "[]"):
+        if "class" in entry:
+            major, _, minor = entry.get("handle", "").partition(":")
+            try:
+                major, minor = int(major, 16), int(minor, 16)
+            except ValueError:
+                continue
+            if major != ROOT_HANDLE:
+                continue
+            if minor == ROOT_CLASS:
+                key = "total"
+            elif minor > CLASS_MINOR_BASE:
+                key = minor - CLASS_MINOR_BASE
+            else:
+                continue
+        elif entry.get("root"):
+            key = "total"
+        else:
+            continue
+        # Le versioni di iproute2 che raggruppano i contatori usano l'oggetto "stats"
+        counters = entry.get("stats", entry)
+        stats[key] = {field: int(counters.get(field) or 0) for field in STAT_FIELDS}
+    return stats
+
+
+def compile_qos(config: Any, classes: Iterable[Any], rules: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Compila l'intera configurazione QoS
+
+    L'upload viene limitato sull'interfaccia WAN, il download su un IFB che
+    riceve il traffico in ingresso della WAN, con le stesse classi.
+
+    Returns:
+        Dizionario con devices (dispositivi da ripulire), ifb (dispositivo IFB
+        da creare, None senza limite in download), batch (file per
+        ``tc -batch``) e ruleset (script nftables di marcatura)
+    """
+    classes = list(classes)
+    default_id = default_class_id(config, classes)
+    devices = [config.interface]
+    commands = compile_shaper(config.interface, config.upload_bandwidth, classes, default_id,
+                              config.hierarchical)
+
+    ifb = None
+    if config.download_bandwidth:
+        ifb = ifb_device(config.interface)
+        devices.append(ifb)
+        commands.extend(compile_ingress_redirect(config.interface, ifb))
+        commands.extend(compile_shaper(ifb, config.download_bandwidth, classes, default_id,
+                                       config.hierarchical))
+    return {
+        "devices": devices,
+        "ifb": ifb,
+        "batch": "\n".join(commands) + "\n",
+        "ruleset": build_mark_ruleset(config, rules).render(),
+    }
@@ -0,0 +1,341 @@
+"""
+Compact time-series store for interface bandwidth history.
+
+Every interface owns a set of fixed-size ring buffers (tiers) at increasing
+resolutions (1s -> 1m -> 1h). Each byte-counter delta is added to the current
+bucket of every tier at write time, so longer periods are read from the
+pre-aggregated coarse tiers instead of scanning fine-grained samples.
+A delta covers the time since the previous sample and is spread over every
+bucket of that interval, so a tier finer than the sampling interval does not
+alternate between empty and doubled buckets. Memory is bounded by the tier
+capacities and the interface limit, and the buffers are periodically written
+to disk so history survives restarts; with several worker processes only the
+one holding the history lock writes the files.
+"""
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from config import (
+    BANDWIDTH_HISTORY_DAYS, BANDWIDTH_HISTORY_PATH,
+    BANDWIDTH_HISTORY_FLUSH_INTERVAL, BANDWIDTH_HISTORY_MAX_INTERFACES
+)
+from utils.process_lock import acquire_lock
+
+# Create logger
+logger = logging.getLogger(__name__)
+
+# Lock file (inside the history directory) held by the process that persists the history
+LOCK_FILENAME = '.lock'
+
+# (resolution in seconds, number of buckets)
+TIERS = (
+    (1, 600),                              # 10 minutes at 1s
+    (60, 24 * 60),                         # 24 hours at 1m
+    (3600, 24 * BANDWIDTH_HISTORY_DAYS),   # BANDWIDTH_HISTORY_DAYS at 1h
+)
+
+# Period -> (tier resolution, number of points)
+PERIODS = {
+    '5m': (1, 300),
+    '1h': (60, 60),
+    '6h': (60, 360),
+    '24h': (3600, 24),
+    '7d': (3600, 24 * 7),
+}
+
+_FILE_MAGIC = b'EVTS'
+_FILE_VERSION = 1
+_HEADER = struct.Struct('<4sHH')
+_TIER_HEADER = struct.Struct('<II')
+
+
+class RingTier:
+    """
+    Fixed-size ring of time buckets holding received/sent byte totals
+
+    A bucket is identified by ``int(timestamp // resolution)``; the slot it
+    maps to is reused once the ring wraps, which is detected by comparing the
+    stored bucket number.
+    """
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.buckets = array('q', [-1]) * capacity
+        self.rx = array('d', [0.0]) * capacity
+        self.tx = array('d', [0.0]) * capacity
+
+    def add(self, timestamp, rx_bytes, tx_bytes, duration=0):
+        """
+        Add bytes transferred during the ``duration`` seconds ending at ``timestamp``
+
+        The bytes are split across the buckets of that interval in proportion
+        to their overlap (only the last ``capacity`` buckets are kept anyway).
+        """
+        last = int(timestamp // self.resolution)
+        start = timestamp - duration
+        first = int(start // self.resolution)
+        if duration <= 0 or first == last:
+            self._add(last, rx_bytes, tx_bytes)
+            return
+        for bucket in range(max(first, last - self.capacity + 1), last + 1):
+            overlap = (min(timestamp, (bucket + 1) * self.resolution)
+                       - max(start, bucket * self.resolution))
+            if overlap > 0:
+                share = overlap / duration
+                self._add(bucket, rx_bytes * share, tx_bytes * share)
+
+    def _add(self, bucket, rx_bytes, tx_bytes):
+        slot = bucket % self.capacity
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            self.rx[slot] = 0.0
+            self.tx[slot] = 0.0
+        self.rx[slot] += rx_bytes
+        self.tx[slot] += tx_bytes
+
+    def series(self, end_timestamp, count):
+        """
+        Get the last ``count`` completed buckets ending before ``end_timestamp``
+
+        Returns:
+            list: Tuples (bucket_start, rx_bytes, tx_bytes); empty buckets are zero
+        """
+        count = min(count, self.capacity)
+        last = int(end_timestamp // self.resolution) - 1
+        points = []
+        for bucket in range(last - count + 1, last + 1):
+            slot = bucket % self.capacity
+            if self.buckets[slot] == bucket:
+                points.append((bucket * self.resolution, self.rx[slot], self.tx[slot]))
+            else:
+                points.append((bucket * self.resolution, 0.0, 0.0))
+        return points
+
+    def write(self, f):
+        f.write(_TIER_HEADER.pack(self.resolution, self.capacity))
+        self.buckets.tofile(f)
+        self.rx.tofile(f)
+        self.tx.tofile(f)
+
+    def read(self, f):
+        resolution, capacity = _TIER_HEADER.unpack(f.read(_TIER_HEADER.size))
+        if (resolution, capacity) != (self.resolution, self.capacity):
+            raise ValueError(f"tier layout changed ({resolution}s x {capacity})")
+        buckets, rx, tx = array('q'), array('d'), array('d')
+        buckets.fromfile(f, capacity)
+        rx.fromfile(f, capacity)
+        tx.fromfile(f, capacity)
+        self.buckets, self.rx, self.tx = buckets, rx, tx
+
+
+class InterfaceHistory:
+    """All tiers for a single interface"""
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = [RingTier(resolution, capacity) for resolution, capacity in tiers]
+
+    def add(self, timestamp, rx_bytes, tx_bytes, duration=0):
+        for tier in self.tiers:
+            tier.add(timestamp, rx_bytes, tx_bytes, duration)
+
+    def tier(self, resolution):
+        return next(t for t in self.tiers if t.resolution == resolution)
+
+    def write(self, f):
+        f.write(_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, len(self.tiers)))
+        for tier in self.tiers:
+            tier.write(f)
+
+    def read(self, f):
+        magic, version, tier_count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _FILE_MAGIC or version != _FILE_VERSION or tier_count != len(self.tiers):
+            raise ValueError("unsupported history file")
+        for tier in self.tiers:
+            tier.read(f)
+
+
+class BandwidthHistory:
+    """
+    Bandwidth history for all interfaces, persisted under ``path``
+
+    Writes come from the metrics sampler thread; reads come from requests.
+    A lock guards the interface map and the bucket updates. Every process
+    keeps its own history (each runs a sampler), but save() only writes when
+    this process holds the lock file in ``path``.
+    """
+
+    def __init__(self, path=BANDWIDTH_HISTORY_PATH, tiers=TIERS,
+                 max_interfaces=BANDWIDTH_HISTORY_MAX_INTERFACES,
+                 flush_interval=BANDWIDTH_HISTORY_FLUSH_INTERVAL):
+        self.path = path
+        self.tier_layout = tiers
+        self.max_interfaces = max_interfaces
+        self.flush_interval = flush_interval
+        self._interfaces = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_timestamp = None
+
+    def _file_for(self, interface):
+        return os.path.join(self.path, f"{interface}.ts")
+
+    def load(self):
+        """Load persisted history for every interface found on disk"""
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            if not filename.endswith('.ts'):
+                continue
+            interface = filename[:-3]
+            history = InterfaceHistory(self.tier_layout)
+            try:
+                with open(os.path.join(self.path, filename), 'rb') as f:
+                    history.read(f)
+            except Exception as e:
+                logger.warning(f"Ignoring bandwidth history for {interface}: {str(e)}")
+                continue
+            with self._lock:
+                if len(self._interfaces) < self.max_interfaces:
+                    self._interfaces[interface] = history
+
+    def save(self):
+        """
+        Write every interface history to disk atomically
+
+        Returns:
+            bool: True if written, False if another process owns the files
+        """
+        try:
+            if not acquire_lock(os.path.join(self.path, LOCK_FILENAME)):
+                self._last_flush = time.monotonic()
+                return False
+            with self._lock:
+                for interface, history in self._interfaces.items():
+                    target = self._file_for(interface)
+                    tmp = target + '.tmp'
+                    with open(tmp, 'wb') as f:
+                        history.write(f)
+                    os.replace(tmp, target)
+            self._last_flush = time.monotonic()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving bandwidth history: {str(e)}")
+            return False
+
+    def record(self, interface, rx_bytes, tx_bytes, timestamp=None, duration=0):
+        """
+        Add a counter delta for an interface
+
+        Args:
+            interface: Interface name
+            rx_bytes: Bytes received since the previous sample
+            tx_bytes: Bytes sent since the previous sample
+            timestamp: Sample time (defaults to now)
+            duration: Seconds covered by the delta (0 = a single instant)
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            history = self._interfaces.get(interface)
+            if history is None:
+                if len(self._interfaces) >= self.max_interfaces:
+                    return
+                history = self._interfaces[interface] = InterfaceHistory(self.tier_layout)
+            history.add(timestamp, rx_bytes, tx_bytes, duration)
+
+    def record_deltas(self, deltas, timestamp=None):
+        """
+        Record one sampler pass and flush to disk when due
+
+        The deltas cover the time since the previous pass, over which they are
+        spread.
+
+        Args:
+            deltas: Dictionary {interface: {'bytes_recv': n, 'bytes_sent': n}}
+            timestamp: Sample time (defaults to now)
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        previous, self._last_timestamp = self._last_timestamp, timestamp
+        duration = timestamp - previous if previous is not None and timestamp > previous else 0
+        for interface, delta in deltas.items():
+            self.record(interface, delta['bytes_recv'], delta['bytes_sent'], timestamp, duration)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.save()
+
+    def interfaces(self):
+        with self._lock:
+            return sorted(self._interfaces)
+
+    def series(self, interface='all', period='1h', now=None):
+        """
+        Get download/upload rates for a period from the matching tier
+
+        Args:
+            interface: Interface name or 'all' to sum every interface
+            period: One of PERIODS (5m, 1h, 6h, 24h, 7d)
+            now: Reference time (defaults to now)
+
+        Returns:
+            list: Tuples (bucket_start, download_mbps, upload_mbps)
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unsupported period: {period}")
+        resolution, count = PERIODS[period]
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if interface == 'all':
+                histories = list(self._interfaces.values())
+            else:
+                histories = [self._interfaces[interface]] if interface in self._interfaces else []
+            per_interface = [h.tier(resolution).series(now, count) for h in histories]
+
+        points = []
+        first = int(now // resolution) - count
+        scale = 8 / 1000000 / resolution  # bytes per bucket -> Mbps
+        for i in range(count):
+            start = (first + i) * resolution
+            rx = tx = 0.0
+            for series in per_interface:
+                rx += series[i][1]
+                tx += series[i][2]
+            points.append((start, round(rx * scale, 3), round(tx * scale, 3)))
+        return points
+
+
+def format_bucket_time(timestamp, period):
+    """Format a bucket start time as a chart label for the given period"""
+    moment = datetime.fromtimestamp(timestamp)
+    if period == '7d':
+        return moment.strftime('%d/%m %H:%M')
+    if period == '5m':
+        return moment.strftime('%H:%M:%S')
+    return moment.strftime('%H:%M')
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_bandwidth_history():
+    """
+    Get the process-wide bandwidth history, loading it from disk on first use
+
+    Returns:
+        BandwidthHistory: The shared history store
+    """
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                history = BandwidthHistory()
+                history.load()
+                atexit.register(history.save)
+                _history = history
+    return _history